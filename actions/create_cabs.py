@@ -1,55 +1,220 @@
 from core.action import InstallerAction
+from core.cab import (CabinetWriter, CabEntry, CabinetError, folder_size_for, plan_cabinets, cabinet_name,
+                      DEFAULT_MAX_CABINET_SIZE, COMPRESS_NONE)
+from core.compress_policy import CompressionPolicy
+from core.cab_cache import CompressionCache, DEFAULT_CACHE_SIZE
+from core.staging import Stager
+from core.fingerprint import BuildFingerprint, code_version, changed_outputs
+from db.file_manifest import file_key
+from db.hashing import hash_files
+from collections import namedtuple
 import logging
 import os
 import shutil
-import tempfile
 
 logger = logging.getLogger("installer.actions.create_cabs")
 
+# One disk of the install: a Media table row and the cabinet it stores
+MediaInfo = namedtuple('MediaInfo', ['disk_id', 'last_sequence', 'cabinet', 'path'])
+
+def payload_sequences(files, duplicates=None):
+    """File key -> File.Sequence as do() numbers them: the stored files in manifest order."""
+    sequences = {}
+    for f in files:
+        if not (duplicates and duplicates.is_duplicate(f)):
+            sequences[file_key(f)] = len(sequences) + 1
+    return sequences
+
+def cabinet_digest(settings, entries, hashes, stored):
+    """Digest of what a cabinet is written from: the settings, and each entry's source as it is now."""
+    fingerprint = BuildFingerprint()
+    fingerprint.add('settings', settings)
+    def rows():
+        for entry in entries:
+            st = os.stat(entry.source)
+            yield (entry.name, st.st_size, st.st_mtime_ns, hashes.get(entry.source), entry.digest,
+                   entry.source in stored)
+    fingerprint.add_rows('entries', rows())
+    return fingerprint.hexdigest()
+
 class CreateCabsAction(InstallerAction):
     name = 'create_cabs'
 
     def do(self, state):
         logging.info("Creating CAB file...")
-        
+
         # Get output directory from options
         output_dir = getattr(state.library.options, 'output_dir', os.path.abspath('out'))
         os.makedirs(output_dir, exist_ok=True)
-        
+        compression = getattr(state.library.options, 'cab_compression', None) or 'mszip'
+        workers = getattr(state.library.options, 'cab_workers', None) or os.cpu_count() or 1
+        max_size = getattr(state.library.options, 'cab_max_size', None) or DEFAULT_MAX_CABINET_SIZE
+        cache_dir = getattr(state.library.options, 'cab_cache_dir', None)
+        cache_size = getattr(state.library.options, 'cab_cache_size', None) or DEFAULT_CACHE_SIZE
+        use_policy = getattr(state.library.options, 'cab_compression_policy', True) and compression != 'none'
+        stage_dir = getattr(state.library.options, 'stage_dir', None)
+
         # Check if we have files from query_db action
         if not hasattr(state.library, 'files') or not state.library.files:
             logging.warning("No files found to include in CAB. Check query_db action.")
-            print(f"DEBUG: state.library.files = {getattr(state.library, 'files', None)}")
             return
 
-        # Prepare CAB directory
-        cab_dir = os.path.abspath('build_cab_temp')
-        os.makedirs(cab_dir, exist_ok=True)
-
-        # Copy files to the CAB directory
+        # Files are streamed from root_path into the cabinets, or from a snapshot
+        # staged without copying their bytes where the file system allows, so the
+        # tree can change while the cabinets are written; duplicates are installed
+        # from their canonical copy
+        stager = None
+        if stage_dir:
+            stage_root = os.path.join(stage_dir, state.library.project_name)
+            shutil.rmtree(stage_root, ignore_errors=True)
+            stager = Stager()
+        items = []
+        hashes = {}
+        duplicates = getattr(state.library, 'duplicates', None)
         for f in state.library.files:
+            if duplicates and duplicates.is_duplicate(f):
+                logging.info(f"Skipped duplicate {f.path} (same content as {duplicates.canonical(f).path})")
+                continue
             src = os.path.join(state.library.root_path, f.path)
-            dst = os.path.join(cab_dir, f.path)
-            os.makedirs(os.path.dirname(dst), exist_ok=True)
-            shutil.copy2(src, dst)
-            logging.info(f"Copied {src} to {dst}")
-
-        cab_name = f"{state.library.project_name}.cab"
-        cab_path = os.path.join(output_dir, cab_name)
-        print("Files in build_cab_temp:", os.listdir(r"E:\proj\mkInstaller\build_cab_temp"))
-        # Create CAB file using makecab
-        cmd = f'makecab /D CompressionType=LZX /D CompressionMemory=21 /D CabinetName1={cab_name} /D DiskDirectory1={output_dir} {cab_dir}\\*.*'
-        result = os.system(cmd)
-        
-        if result != 0:
-            logging.error(f"Failed to create CAB file with command: {cmd}")
-            shutil.rmtree(cab_dir)
+            try:
+                if stager is not None:
+                    staged = os.path.join(stage_root, f.path)
+                    os.makedirs(os.path.dirname(staged), exist_ok=True)
+                    logging.info(f"Staged {f.path} by {stager.stage(src, staged)}")
+                    src = staged
+                size = os.path.getsize(src)
+            except OSError as e:
+                logging.error(f"Failed to create CAB file: {e}")
+                return
+            items.append((CabEntry(src, file_key(f)), size))
+            hashes[src] = f.hash
+
+        if stager is not None:
+            logging.info(f"Staging: {stager.stats}")
+
+        # Unchanged folders are spliced in from the cache; the keys come from
+        # hashing the files now, the hashes of the last scan may be stale
+        cache = None
+        if cache_dir:
+            cache = CompressionCache(cache_dir, cache_size)
+            digests = hash_files([entry.source for entry, _ in items], workers=workers)
+            items = [(entry._replace(digest=digests[entry.source]), size) for entry, size in items]
+
+        # Files that will not compress (already compressed formats) go to stored folders
+        stored = set()
+        policy = None
+        if use_policy:
+            policy = CompressionPolicy(history=self.load_extension_stats(state))
+            stored = {entry.source for entry, size in items if policy.should_store(entry.source, size)}
+
+        def compression_for(entry):
+            return COMPRESS_NONE if entry.source in stored else None
+
+        # Cabinets hold consecutive files, so File.Sequence is numbered in
+        # cabinet order and each Media row covers a contiguous range
+        media = []
+        sequences = {}
+        sequence = 0
+        cabinets = plan_cabinets(items, max_size)
+        sizes = {entry.source: size for entry, size in items}
+        # An incremental build keeps the cabinets of the last one whose entries did not change
+        timestamp = getattr(state.library, 'build_timestamp', None)
+        code = code_version(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ('core',))
+        previous = getattr(state.library, 'previous_build', None) or {}
+        incremental = getattr(state.library.options, 'incremental', False)
+        digests = {}
+        reused = 0
+        for disk_id, entries in enumerate(cabinets, 1):
+            cab_name = cabinet_name(state.library.project_name, disk_id)
+            cab_path = os.path.join(output_dir, cab_name)
+            digest = digests[cab_name] = cabinet_digest([compression, timestamp, cache is not None, disk_id, code],
+                                                        entries, hashes, stored)
+            recorded = previous.get('outputs', {}).get(os.path.abspath(cab_path))
+            if (incremental and recorded and previous.get('cabinets', {}).get(cab_name) == digest
+                    and not changed_outputs({os.path.abspath(cab_path): recorded})):
+                reused += 1
+                logging.info(f"CAB file {cab_path} is up to date, reused")
+            else:
+                writer = CabinetWriter(cab_path, compression=compression, index=disk_id - 1, workers=workers,
+                                       cache=cache, timestamp=timestamp)
+                try:
+                    if cache is not None:
+                        # Folder boundaries that survive changes elsewhere, so keys repeat across builds
+                        writer.add_files_by_content(entries, compression_for=compression_for)
+                    else:
+                        # Several folders so the workers can compress them concurrently
+                        writer.add_files(entries, folder_size_for(sum(sizes[e.source] for e in entries)),
+                                         compression_for=compression_for)
+                    stats = writer.close()
+                except (OSError, CabinetError) as e:
+                    logging.error(f"Failed to create CAB file {cab_path}: {e}")
+                    return
+                logging.info(f"CAB file created at: {cab_path} ({stats}, {workers} workers)")
+            for entry in entries:
+                sequence += 1
+                sequences[entry.name] = sequence
+            media.append(MediaInfo(disk_id, sequence, cab_name, cab_path))
+
+        # Store CAB paths in state for MSI action to use
+        state.library.media = media
+        state.library.file_sequences = sequences
+        state.library.cab_path = media[0].path
+        state.library.cab_name = media[0].cabinet
+        state.library.cabinet_digests = digests
+        # Cabinets of the last plan that this one does not have would be left behind
+        for cab_name in sorted(self.save_media(state, media) - {m.cabinet for m in media}):
+            cab_path = os.path.join(output_dir, cab_name)
+            if os.path.exists(cab_path):
+                os.remove(cab_path)
+                logging.info(f"Removed {cab_path}, no longer part of the payload")
+        if incremental:
+            logging.info(f"Incremental build: {reused} of {len(media)} cabinets reused")
+
+        if policy is not None:
+            logging.info(f"Compression policy: {policy.report}")
+            self.save_extension_stats(state, policy.history)
+        if cache is not None:
+            logging.info(f"Compression cache: {cache.stats}")
+        if len(media) > 1:
+            logging.info(f"Payload spans {len(media)} cabinets of at most {max_size} bytes")
+
+    def load_extension_stats(self, state):
+        """Per-extension compression history from earlier builds (database-backed builds only)."""
+        if not getattr(state.library, 'product_info', None):
+            return {}
+        from db.session import Session
+        from db.build_records import load_extension_stats
+
+        session = Session()
+        try:
+            return load_extension_stats(session)
+        finally:
+            session.close()
+
+    def save_extension_stats(self, state, history):
+        if not getattr(state.library, 'product_info', None):
             return
-            
-        shutil.rmtree(cab_dir)
-        
-        # Store CAB path in state for MSI action to use
-        state.library.cab_path = os.path.join(output_dir, cab_name)
-        state.library.cab_name = cab_name
-        
-        logging.info(f"CAB file created at: {state.library.cab_path}")
+        from db.session import Session
+        from db.build_records import save_extension_stats
+
+        session = Session()
+        try:
+            save_extension_stats(session, history)
+        finally:
+            session.close()
+
+    def save_media(self, state, media):
+        """Record the Media rows of the product in the database; returns the cabinets of the rows replaced."""
+        product_info = getattr(state.library, 'product_info', None)
+        if not product_info:
+            return set()
+        from db.session import Session
+        from db.build_records import load_media, replace_media
+
+        session = Session()
+        try:
+            previous = {cabinet for _, _, cabinet in load_media(session, product_info['id'])}
+            replace_media(session, product_info['id'], [(m.disk_id, m.last_sequence, m.cabinet) for m in media])
+            return previous
+        finally:
+            session.close()
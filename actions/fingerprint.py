@@ -0,0 +1,135 @@
+from core.action import InstallerAction
+from core.fingerprint import BuildFingerprint, code_version, option_values, describe_outputs, changed_outputs
+from actions.create_cabs import MediaInfo, payload_sequences
+import datetime
+import logging
+import os
+
+logger = logging.getLogger("installer.actions.fingerprint")
+
+# Goals whose outputs are reused when the inputs did not change
+UP_TO_DATE_GOALS = ('create_cabs', 'buildmsi', 'make_pfw')
+# Bumped when the record or what the fingerprint covers changes
+RECORD_VERSION = 1
+
+def record_key(state):
+    """InstallerMeta key of the last build of the project into the output directory."""
+    output_dir = getattr(state.library.options, 'output_dir', os.path.abspath('out'))
+    return f"build:{state.library.project_name}:{os.path.abspath(output_dir)}"
+
+def compute_fingerprint(state):
+    """Fingerprint of the product's rows, the payload, the code and the options of this build."""
+    from db.session import Session
+    from db.product_graph import load_product_graph
+    from db.build_records import load_component_guids
+
+    product_info = state.library.product_info
+    files = state.library.files
+    fingerprint = BuildFingerprint()
+    fingerprint.add('version', RECORD_VERSION)
+    fingerprint.add('product', product_info)
+    fingerprint.add('feature', getattr(state.library, 'feature_info', None))
+    session = Session()
+    try:
+        graph = load_product_graph(session.connection(), product_info['id'], {f.component_id for f in files})
+        guids = load_component_guids(session, product_info['id'])
+    finally:
+        session.close()
+    # The compression history is left out: it is only reported, files are stored by their content
+    for label, nodes in (('features', graph.features), ('components', graph.components),
+                         ('directories', graph.directories)):
+        fingerprint.add_rows(label, (nodes[key] for key in sorted(nodes)))
+    fingerprint.add_rows('registry', graph.registry)
+    fingerprint.add_rows('component_guids', sorted(guids.items()))
+    fingerprint.add_files(state.library.root_path, files)
+    fingerprint.add('code', code_version(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+    fingerprint.add('options', option_values(state.library.options))
+    fingerprint.add('library', {name: getattr(state.library, name, None)
+                                for name in ('project_name', 'root_path', 'cpu', 'build_timestamp')})
+    return fingerprint.hexdigest()
+
+class BuildFingerprintAction(InstallerAction):
+    name = 'fingerprint'
+
+    def do(self, state):
+        state.library.up_to_date_goals = ()
+        state.library.build_fingerprint = None
+        state.library.previous_build = None
+        if not getattr(state.library, 'files', None) or not getattr(state.library, 'product_info', None):
+            logging.warning("No product or files loaded, the build cannot be fingerprinted")
+            return
+
+        fingerprint = compute_fingerprint(state)
+        state.library.build_fingerprint = fingerprint
+        if getattr(state.library.options, 'force_rebuild', False):
+            logging.info(f"Build fingerprint {fingerprint[:16]}, rebuild forced")
+            return
+        record = self.load_record(state)
+        if record is None or record.get('version') != RECORD_VERSION:
+            logging.info(f"Build fingerprint {fingerprint[:16]}, no earlier build recorded")
+            return
+        # What an incremental build starts from
+        state.library.previous_build = record
+        if record.get('fingerprint') != fingerprint:
+            logging.info(f"Build fingerprint {fingerprint[:16]}, inputs changed since the last build "
+                         f"({record.get('fingerprint', '')[:16]})")
+            return
+        changed = changed_outputs(record['outputs'])
+        if changed:
+            logging.info(f"Build fingerprint {fingerprint[:16]} unchanged, but {len(changed)} outputs are missing "
+                         f"or were modified ({changed[0]}): rebuilding")
+            return
+
+        # What the skipped goals would have left in the library for the ones that still run
+        media = [MediaInfo(*m) for m in record['media']]
+        state.library.media = media
+        state.library.cab_path = media[0].path
+        state.library.cab_name = media[0].cabinet
+        state.library.file_sequences = payload_sequences(state.library.files,
+                                                         getattr(state.library, 'duplicates', None))
+        state.library.msi_path = record['msi_path']
+        state.library.pfw_path = record.get('pfw_path')
+        state.library.up_to_date_goals = UP_TO_DATE_GOALS
+        logging.warning(f"Build fingerprint {fingerprint[:16]} unchanged since {record.get('recorded')}: "
+                        f"reusing {len(record['outputs'])} outputs, skipping {', '.join(UP_TO_DATE_GOALS)}")
+
+    def load_record(self, state):
+        from db.session import Session
+        from db.build_records import load_build_record
+
+        session = Session()
+        try:
+            return load_build_record(session, record_key(state))
+        finally:
+            session.close()
+
+class RecordBuildAction(InstallerAction):
+    name = 'record_build'
+
+    def do(self, state):
+        if getattr(state.library, 'up_to_date_goals', None) or not getattr(state.library, 'build_fingerprint', None):
+            return
+        msi_path = getattr(state.library, 'msi_path', None)
+        media = getattr(state.library, 'media', None)
+        pfw_path = getattr(state.library, 'pfw_path', None)
+        if not msi_path or not media or not os.path.exists(msi_path):
+            logging.warning("The build did not write an MSI and its cabinets, its outputs are not recorded")
+            return
+        paths = [msi_path] + [m.path for m in media] + ([pfw_path] if pfw_path else [])
+
+        # buildmsi recorded ComponentIds: the next build starts from the rows as this one left them
+        fingerprint = compute_fingerprint(state)
+        record = {'version': RECORD_VERSION, 'fingerprint': fingerprint, 'outputs': describe_outputs(paths),
+                  'media': [list(m) for m in media], 'msi_path': msi_path, 'pfw_path': pfw_path,
+                  'msi_structure': getattr(state.library, 'msi_structure', None),
+                  'cabinets': getattr(state.library, 'cabinet_digests', None) or {},
+                  'recorded': datetime.datetime.now().isoformat(timespec='seconds')}
+        from db.session import Session
+        from db.build_records import save_build_record
+
+        session = Session()
+        try:
+            save_build_record(session, record_key(state), record)
+        finally:
+            session.close()
+        logging.info(f"Recorded build fingerprint {fingerprint[:16]} with {len(paths)} outputs")
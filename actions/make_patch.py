@@ -0,0 +1,78 @@
+from core.action import InstallerAction
+from core.patch import (write_build_manifest, load_build_manifest, create_patch, PatchError,
+                        BUILD_MANIFEST_SUFFIX)
+from db.file_manifest import file_key
+from db.hashing import hash_files
+from bisect import bisect_left
+import logging
+import os
+
+logger = logging.getLogger("installer.actions.make_patch")
+
+class InstallerMakePatchAction(InstallerAction):
+    name = 'make_patch'
+
+    def do(self, state):
+        output_dir = getattr(state.library.options, 'output_dir', os.path.abspath('out'))
+        baseline_dir = getattr(state.library.options, 'patch_baseline', None)
+        workers = getattr(state.library.options, 'cab_workers', None) or os.cpu_count() or 1
+        project_name = state.library.project_name
+
+        media = getattr(state.library, 'media', None)
+        if not getattr(state.library, 'files', None) or not media:
+            logging.warning("No cabinets were built, no build manifest or patch to write")
+            return
+
+        # Every build records what it shipped, so a later build can patch from it
+        current = self.build_manifest(state, media, workers)
+        manifest_path = os.path.join(output_dir, f"{project_name}{BUILD_MANIFEST_SUFFIX}")
+        baseline = None
+        if baseline_dir:
+            if os.path.abspath(baseline_dir) == os.path.abspath(output_dir):
+                logging.error("The patch baseline must be a copy of an earlier output directory, "
+                              "this build has overwritten its cabinets")
+                return
+            try:
+                baseline = load_build_manifest(os.path.join(baseline_dir, f"{project_name}{BUILD_MANIFEST_SUFFIX}"))
+            except PatchError as e:
+                logging.error(f"Failed to create patch: {e}")
+                return
+        write_build_manifest(manifest_path, project_name, current['product_version'],
+                             list(current['files'].values()))
+        logging.info(f"Build manifest written to: {manifest_path}")
+        if baseline is None:
+            return
+
+        patch_path = os.path.join(output_dir, f"{project_name}.patch")
+        try:
+            stats = create_patch(patch_path, baseline_dir, baseline, current, state.library.root_path, workers,
+                                 timestamp=getattr(state.library, 'build_timestamp', None))
+        except (OSError, PatchError) as e:
+            logging.error(f"Failed to create patch: {e}")
+            return
+        state.library.patch_path = patch_path
+        logging.info(f"Patch from {baseline.get('product_version')} created at: {patch_path} ({stats})")
+
+    def build_manifest(self, state, media, workers):
+        """The current build manifest, hashes taken from the scan."""
+        sequences = state.library.file_sequences
+        last_sequences = [m.last_sequence for m in media]
+        duplicates = getattr(state.library, 'duplicates', None)
+        files = {}
+        for f in state.library.files:
+            stored = duplicates.canonical(f) if duplicates and duplicates.is_duplicate(f) else f
+            name = file_key(stored)
+            cabinet = media[bisect_left(last_sequences, sequences[name])].cabinet
+            path = f.path.replace('\\', '/')
+            files[path] = {'path': path, 'size': f.size, 'hash': f.hash, 'cabinet': cabinet, 'name': name}
+
+        # Files the scan did not hash are the only ones read here
+        unhashed = [os.path.join(state.library.root_path, path) for path, r in files.items() if not r['hash']]
+        if unhashed:
+            digests = hash_files(unhashed, workers=workers)
+            for path, record in files.items():
+                if not record['hash']:
+                    record['hash'] = digests[os.path.join(state.library.root_path, path)]
+        product_info = getattr(state.library, 'product_info', None) or {}
+        return {'product': state.library.project_name, 'product_version': product_info.get('version'),
+                'files': files}
@@ -1,4 +1,6 @@
 from core.action import InstallerAction
+from core.sfx import SfxWriter, SfxError
+from core.compress_policy import CompressionPolicy
 import logging
 import os
 
@@ -11,28 +13,39 @@ class InstallerMakePFWAction(InstallerAction):
         # Get output directory from options
         output_dir = getattr(state.library.options, 'output_dir', os.path.abspath('out'))
         os.makedirs(output_dir, exist_ok=True)
-        
-        # Example: create a self-extracting archive using generic pfw logic
-        # This would use a compression utility or custom logic
+        stub = getattr(state.library.options, 'pfw_stub', None)
+        method = getattr(state.library.options, 'pfw_compression', None) or 'deflate'
+        workers = getattr(state.library.options, 'cab_workers', None) or os.cpu_count() or 1
+
         logging.info("Creating self-extracting archive (pfw)...")
-        
+
         # Get MSI path if it exists
         msi_path = getattr(state.library, 'msi_path', None)
-        
+
         if msi_path and os.path.exists(msi_path):
-            # Create a self-extracting archive (this is a placeholder)
             pfw_name = f"{state.library.project_name}_setup.exe"
             pfw_path = os.path.join(output_dir, pfw_name)
-            
-            # Here you would actually create the self-extracting archive
-            # For now, we'll just simulate it by copying the MSI
-            import shutil
+
+            # The MSI and the external cabinets it references; both are mostly
+            # compressed already, the policy stores what would not shrink
+            writer = SfxWriter(pfw_path, stub=stub, method=method, workers=workers,
+                               policy=CompressionPolicy(),
+                               metadata={'run': os.path.basename(msi_path)},
+                               timestamp=getattr(state.library, 'build_timestamp', None))
+            writer.add(msi_path)
+            for media in getattr(state.library, 'media', None) or []:
+                writer.add(media.path, media.cabinet)
             try:
-                shutil.copy2(msi_path, pfw_path)
-                state.library.pfw_path = pfw_path
-                logging.info(f"Self-extracting archive created at: {state.library.pfw_path}")
-            except Exception as e:
+                stats = writer.close()
+            except (OSError, SfxError) as e:
                 logging.error(f"Failed to create self-extracting archive: {e}")
+                state.library.pfw_path = None
+                return
+            state.library.pfw_path = pfw_path
+            if not stub:
+                logging.warning("No pfw_stub configured: the package can only be extracted with core/sfx.py")
+            logging.info(f"Packed {stats}")
+            logging.info(f"Self-extracting archive created at: {state.library.pfw_path}")
         else:
             logging.warning("No MSI file found to package into self-extracting archive")
             state.library.pfw_path = None
@@ -1,113 +1,252 @@
 from core.action import InstallerAction
+from core.msidb import MsiWriter, MsiError
+from core.msi_update import MsiUpdate
+from core.fingerprint import BuildFingerprint, code_version, changed_outputs
+from core.msi_schema import create_table, add_sequences
+from core.msi_tables import MsiTables, product_namespace
+from core.staging import Stager, STRATEGIES
+from db.file_manifest import file_key
 import logging
 import os
-import shutil
-import tempfile
+import time
+import uuid
 
 logger = logging.getLogger("installer.actions.buildmsi")
 
+def _guid(value):
+    """A GUID in the braced upper case form of MSI."""
+    return f"{{{str(value).strip('{}').upper()}}}"
+
+def msi_structure(graph, guids, files, duplicates, settings, changed_guids=None):
+    """
+    Digest of what the MSI's tables are made of, but for the File columns the
+    payload changes (size, version, attributes, sequence) and the Property,
+    Media and summary values: two builds with the same structure only differ
+    in those, and the second can update the first's database.
+
+    changed_guids (component id -> GUID) replaces the GUIDs of the component
+    rows, as save_component_guids() stores them.
+    """
+    changed_guids = changed_guids or {}
+    components = {key: node._replace(guid=changed_guids[key]) if key in changed_guids else node
+                  for key, node in graph.components.items()}
+    fingerprint = BuildFingerprint()
+    fingerprint.add('settings', settings)
+    for label, nodes in (('features', graph.features), ('components', components),
+                         ('directories', graph.directories)):
+        fingerprint.add_rows(label, (nodes[key] for key in sorted(nodes)))
+    fingerprint.add_rows('registry', graph.registry)
+    fingerprint.add_rows('component_guids', sorted(guids.items()))
+    fingerprint.add_rows('files', ((f.id, f.path, f.component_id,
+                                    duplicates.canonical(f).id if duplicates and duplicates.is_duplicate(f) else None)
+                                   for f in files))
+    fingerprint.add('code', code_version(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ('core',)))
+    return fingerprint.hexdigest()
+
 class InstallerBuildMSIAction(InstallerAction):
     name = 'buildmsi'
 
     def do(self, state):
-        import msilib
-        from msilib import schema, sequence
-        from msilib import Directory, Feature, CAB, add_data
-        
-        logging.info("Building installer with msilib...")
-        
+        logging.info("Building installer database...")
+
         # Get output directory from options
         output_dir = getattr(state.library.options, 'output_dir', os.path.abspath('out'))
         os.makedirs(output_dir, exist_ok=True)
-        
+
         # Check if we have files from query_db action
         if not hasattr(state.library, 'files') or not state.library.files:
             logging.warning("No files found to include in MSI. Check query_db action.")
             return
-            
-        # Prepare a real temp directory for CAB/MSI source
-        temp_root = tempfile.mkdtemp(prefix='msi_build_')
-        temp_installdir = os.path.join(temp_root, 'INSTALLDIR')
-        os.makedirs(temp_installdir, exist_ok=True)
-        
-        copied_files = []
-        for f in state.library.files:
-            src = os.path.join(state.library.root_path, f.path)
-            fname = os.path.basename(f.path)
-            dst = os.path.join(temp_installdir, fname)
-            if os.path.exists(src):
-                shutil.copy2(src, dst)
-                copied_files.append(fname)
-                logging.info(f"Copied {src} to {dst}")
-        
-        if not copied_files:
-            logging.error("No files were copied to the temporary directory")
-            shutil.rmtree(temp_root)
-            return
-            
+
         # Check if CAB was created by create_cabs action
-        if not hasattr(state.library, 'cab_name') or not hasattr(state.library, 'cab_path'):
+        if not getattr(state.library, 'media', None) or not hasattr(state.library, 'file_sequences'):
             logging.error("CAB file not found. Make sure create_cabs action ran successfully.")
-            shutil.rmtree(temp_root)
             return
-            
-        cab_name = state.library.cab_name
-        
-        # Create MSI (fix Directory args, ensure _logical is not None)
+
+        product_info = getattr(state.library, 'product_info', None) or {}
+        if not product_info.get('id'):
+            logging.error("No product loaded from the database. Make sure query_db action ran successfully.")
+            return
+        graph = self.load_graph(product_info['id'], state.library.files)
+        guids = self.load_component_guids(product_info['id'])
+
+        product_name = product_info.get('name') or state.library.project_name
+        manufacturer = product_info.get('manufacturer') or 'Example Manufacturer'
+        language = product_info.get('language') or '1033'
+        platform = 'x64' if getattr(state.library.options, 'cpu', 'x86') == 'x64' else 'Intel'
+        # Codes missing from the database and the ComponentIds are derived, not random
+        namespace = product_namespace(product_info.get('upgrade_code'), product_name)
+        build_timestamp = getattr(state.library, 'build_timestamp', None)
+
         msi_name = f"{state.library.project_name}.msi"
         msi_path = os.path.join(output_dir, msi_name)
-        
-        db = msilib.init_database(
-            msi_path, 
-            schema, 
-            state.library.project_name, 
-            msilib.gen_uuid(), 
-            state.library.product_info.get('version', '1.0.0'), 
-            'Example Manufacturer'
-        )
-        
-        msilib.add_tables(db, sequence)
-        
-        # Use msilib Directory correctly
-        cab = CAB(state.library.project_name)
-        
-        # Root directory: basedir must be None for TARGETDIR
-        rootdir = Directory(db, cab, None, 'TARGETDIR', 'TARGETDIR', 'TARGETDIR')
-        installdir = Directory(db, cab, rootdir, 'INSTALLDIR', 'INSTALLDIR', 'Install Folder')
-        
-        # Create feature
-        feature_obj = Feature(db, 'DefaultFeature', 'Default Feature', 'Everything', 1)
-        feature_obj.set_current()
-        
-        # Add files to CAB and MSI
-        for fname in copied_files:
-            file_path = os.path.join(temp_installdir, fname)
-            cabfile = os.path.basename(file_path)
-            
-            # Add file to CAB
-            _, component = cab.append(file_path, cabfile)
-            
-            # Add file to MSI
-            installdir.add_file(
-                cabfile,
-                src=file_path,
-                version=None,
-                language=None
-            )
-            
-        # Commit the CAB file
-        cab.commit(db)
-        
-        # Add Media table entry
-        add_data(db, 'Media', [(1, cab_name, None, None, None, None)])
-        
-        # Commit the database
-        db.Commit()
-        
+        program_files = 'ProgramFiles64Folder' if platform == 'x64' else 'ProgramFilesFolder'
+        default_feature_id = (getattr(state.library, 'feature_info', None) or {}).get('id')
+        duplicates = getattr(state.library, 'duplicates', None)
+        settings = [product_name, program_files, default_feature_id]
+        structure = msi_structure(graph, guids, state.library.files, duplicates, settings)
+        properties = [
+            ('ProductCode', _guid(product_info.get('product_code') or uuid.uuid5(namespace, 'ProductCode'))),
+            ('ProductName', product_name),
+            ('ProductVersion', product_info.get('version') or '1.0.0'),
+            ('Manufacturer', manufacturer),
+            ('ProductLanguage', language),
+            ('UpgradeCode', _guid(namespace)),
+        ]
+        summary = dict(title='Installation Database', subject=product_name, author=manufacturer,
+                       keywords='Installer', comments=product_info.get('description'),
+                       template=f"{platform};{language}", created=build_timestamp, saved=build_timestamp,
+                       app_name='Installer Builder')
+
+        started = time.perf_counter()
+        tables = None
+        counts = None
+        if getattr(state.library.options, 'incremental', False):
+            counts = self.update_msi(state, msi_path, structure, properties, summary)
+        if counts is None:
+            writer = MsiWriter(msi_path)
+            try:
+                create_table(writer, 'Property').extend(properties)
+
+                # Directory, Component, Feature and file tables from the product graph
+                tables = MsiTables(graph, state.library.files, state.library.file_sequences,
+                                   duplicates=duplicates, install_dir_name=product_name,
+                                   program_files=program_files, default_feature_id=default_feature_id,
+                                   guid_namespace=namespace, guids=guids)
+                counts = tables.write(writer)
+
+                self.write_media(writer, state.library.media)
+                add_sequences(writer)
+                self.write_summary(writer, state.library.files, summary)
+                writer.close()
+            except BaseException:
+                writer.abort()
+                raise
+            self.save_component_guids(product_info['id'], tables)
+            logging.info(f"Package code {writer.package_code}, {len(tables.new_guids)} new ComponentIds")
+            # What the next build loads: the ComponentIds and Component rows as saved
+            structure = msi_structure(graph, tables.guids, state.library.files, duplicates, settings,
+                                      tables.changed_guids)
+        state.library.msi_structure = structure
+
         # Store MSI path in state
         state.library.msi_path = msi_path
-        
-        # Clean up
-        shutil.rmtree(temp_root)
-        
-        logging.info(f"Installer built at: {state.library.msi_path}")
+
+        logging.info(f"Installer built at: {state.library.msi_path} ({os.path.getsize(msi_path)} bytes "
+                     f"in {time.perf_counter() - started:.2f}s)")
+        logging.info("MSI rows: " + ', '.join(f"{name} {count}" for name, count in counts.items()))
+
+    def write_media(self, writer, media):
+        """One Media row per cabinet, each covering the sequences stored in it."""
+        create_table(writer, 'Media').extend((m.disk_id, m.last_sequence, None, m.cabinet, None, None)
+                                             for m in media)
+
+    def write_summary(self, writer, files, summary):
+        # The package code is derived from the tables and the payload in the cabinets,
+        # dates are the build timestamp (none without one): same inputs, same bytes
+        for f in files:
+            writer.add_package_input(f"{file_key(f)}\t{f.size}\t{f.hash}\n".encode('utf-8'))
+        writer.summary(**summary)
+
+    def update_msi(self, state, msi_path, structure, properties, summary):
+        """
+        Rewrite the File rows that changed in the MSI of the last build, when
+        nothing else but the payload did; returns the changed row counts, or
+        None when the database has to be built in full.
+        """
+        record = getattr(state.library, 'previous_build', None) or {}
+        previous = record.get('outputs', {}).get(os.path.abspath(msi_path))
+        if record.get('msi_structure') != structure or previous is None:
+            logging.info("Incremental MSI update not possible: no earlier build with the same tables")
+            return None
+        if changed_outputs({os.path.abspath(msi_path): previous}):
+            logging.info(f"Incremental MSI update not possible: {msi_path} changed since the last build")
+            return None
+
+        # The previous database is read from a staged snapshot while the new one
+        # is written next to it and renamed over msi_path, which stays the old
+        # database until then.  Windows cannot rename over a file that is open
+        # under another name, so the snapshot is not a hard link there.
+        previous_path = msi_path + '.prev'
+        stager = Stager([s for s in STRATEGIES if not (os.name == 'nt' and s == 'hardlink')])
+        strategy = stager.stage(msi_path, previous_path)
+        logging.info(f"Previous database staged by {strategy}")
+        try:
+            update = MsiUpdate(msi_path, previous_path)
+            try:
+                changed = self.update_file_rows(update.edit('File'), state.library.files,
+                                                state.library.file_sequences,
+                                                getattr(state.library, 'duplicates', None))
+                if changed is None:
+                    update.abort()
+                    logging.info("Incremental MSI update not possible: the File rows do not match the manifest")
+                    return None
+                create_table(update, 'Property').extend(properties)
+                self.write_media(update, state.library.media)
+                self.write_summary(update, state.library.files, summary)
+                update.close()
+            except MsiError as e:
+                update.abort()
+                logging.info(f"Incremental MSI update not possible: {e}")
+                return None
+            except BaseException:
+                update.abort()
+                raise
+        finally:
+            os.remove(previous_path)
+        logging.info(f"Updated {changed} File rows of {msi_path}, package code {update.package_code}")
+        return {'File': changed, 'Property': len(properties), 'Media': len(state.library.media)}
+
+    def update_file_rows(self, files_table, files, sequences, duplicates):
+        """Replace the File rows whose size, version, attributes or sequence changed; None if rows differ."""
+        rows = []
+        for f in files:
+            if duplicates and duplicates.is_duplicate(f):
+                continue
+            key = file_key(f)
+            sequence = sequences.get(key)
+            if sequence is not None:
+                rows.append((key, (f.size, f.version, f.attributes or None, sequence)))
+        # FileSize, Version, Attributes and Sequence
+        changed, missing = files_table.diff(rows, (3, 4, 6, 7))
+        if missing or len(rows) != len(files_table):
+            return None
+        for key, (size, version, attributes, sequence) in changed:
+            row = files_table.get(key)
+            files_table.replace(row[:3] + (size, version, row[5], attributes, sequence))
+        return len(changed)
+
+    def load_graph(self, product_id, files):
+        """Features, components, directories and registry values of the product."""
+        from db.session import Session
+        from db.product_graph import load_product_graph
+
+        session = Session()
+        try:
+            return load_product_graph(session.connection(), product_id, {f.component_id for f in files})
+        finally:
+            session.close()
+
+    def load_component_guids(self, product_id):
+        """ComponentIds recorded by earlier builds, by component identity."""
+        from db.session import Session
+        from db.build_records import load_component_guids
+
+        session = Session()
+        try:
+            return load_component_guids(session, product_id)
+        finally:
+            session.close()
+
+    def save_component_guids(self, product_id, tables):
+        """Record new ComponentIds, and the GUIDs the Component rows now carry."""
+        if not tables.new_guids and not tables.changed_guids:
+            return
+        from db.session import Session
+        from db.build_records import save_component_guids
+
+        session = Session()
+        try:
+            save_component_guids(session, product_id, tables.new_guids, tables.changed_guids)
+        finally:
+            session.close()
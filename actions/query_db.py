@@ -9,44 +9,62 @@ class QueryDBAction(InstallerAction):
 
     def do(self, state):
         logging.info("Querying database for information...")
-        from db.session import Session
-        from db.models import Product, Feature, File
+        from db.session import Session, ensure_schema
+        from db.models import Product, Feature
+        from db.file_manifest import load_file_manifest
         
         session = Session()
-        product = session.query(Product).filter_by(name=state.library.project_name).first()
-        
-        if not product:
-            raise Exception(f"Product '{state.library.project_name}' not found in database")
+        try:
+            # Databases created before the build's tables and columns existed are brought up to date
+            ensure_schema(session.get_bind())
+            product = session.query(Product).filter_by(name=state.library.project_name).first()
             
-        feature = session.query(Feature).filter_by(product=product).first()
-        
-        if not feature:
-            raise Exception(f"No feature found for product '{state.library.project_name}'")
+            if not product:
+                raise Exception(f"Product '{state.library.project_name}' not found in database")
+                
+            feature = session.query(Feature).filter_by(product=product).first()
             
-        files = session.query(File).filter_by(feature=feature).all()
-        
-        # Store query results in state
-        state.library.product_info = {
-            'id': product.id,
-            'name': product.name,
-            'version': product.version,
-            'description': product.description
-        }
-        
-        state.library.feature_info = {
-            'id': feature.id,
-            'name': feature.name,
-            'description': feature.description
-        }
-        
-        # Validate file paths
-        valid_files = []
-        for file in files:
-            src_path = os.path.join(state.library.root_path, file.path)
-            if os.path.exists(src_path):
-                valid_files.append(file)
-            else:
+            if not feature:
+                raise Exception(f"No feature found for product '{state.library.project_name}'")
+            
+            # Store query results in state
+            state.library.product_info = {
+                'id': product.id,
+                'name': product.name,
+                'version': product.version,
+                'description': product.description,
+                'manufacturer': product.manufacturer,
+                'language': product.language,
+                'product_code': product.product_code,
+                'upgrade_code': product.upgrade_code
+            }
+            
+            state.library.feature_info = {
+                'id': feature.id,
+                'name': feature.name,
+                'description': feature.description
+            }
+            
+            # Validate file paths while the compact manifest is loaded
+            def exists(file):
+                src_path = os.path.join(state.library.root_path, file.path)
+                if os.path.exists(src_path):
+                    return True
                 logging.warning(f"File {src_path} does not exist and will be skipped")
+                return False
+            
+            valid_files = load_file_manifest(session.connection(), feature.id, keep=exists)
+        finally:
+            # Nothing handed to later actions is attached to the session
+            session.close()
         
         state.library.files = valid_files
-        logging.info(f"Found {len(valid_files)} valid files for product '{state.library.project_name}'")
+        logging.info(f"Found {len(valid_files)} valid files for product '{state.library.project_name}' "
+                     f"({valid_files.nbytes // 1024} KB in memory)")
+        
+        # Identical payloads (by content hash) only need to be stored once
+        from db.hashing import DuplicateIndex
+        state.library.duplicates = DuplicateIndex(valid_files)
+        if state.library.duplicates.duplicate_count:
+            logging.info(f"Found {state.library.duplicates.duplicate_count} duplicate files "
+                         f"({state.library.duplicates.saved_bytes} bytes stored once)")
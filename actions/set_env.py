@@ -46,6 +46,12 @@ class SetEnvVariables(InstallerAction):
         state.library.media = []
         state.library.new_components = []
         state.library.targetbin = getattr(state.library.options, 'targetbin', None) or os.path.join(state.library.root_path, state.library.bindirname)
+        # Fixed date stamped into the outputs (MSI summary, cabinet and package entries), so
+        # rebuilding the same sources gives the same bytes; SOURCE_DATE_EPOCH as in reproducible builds
+        build_timestamp = getattr(state.library.options, 'build_timestamp', None)
+        if build_timestamp is None:
+            build_timestamp = os.environ.get('SOURCE_DATE_EPOCH') or None
+        state.library.build_timestamp = int(build_timestamp) if build_timestamp is not None else None
         # Add more generic setup as needed
 
     def validate_queried_data(self, state):
@@ -0,0 +1,269 @@
+import unittest
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+from sqlalchemy import create_engine
+from db.session import Session, engine, ensure_schema
+from db.models import Product, Feature
+from db.bulk import SessionWriter
+from db.pipeline import scan_pipeline
+from db.scan_directory import populate_directories, rescan_directory, get_file_version
+from core.state import InstallerState
+from core.msi_reader import MsiReader
+from actions.set_env import SetEnvVariables
+from actions.query_db import QueryDBAction
+from actions.fingerprint import BuildFingerprintAction, RecordBuildAction, UP_TO_DATE_GOALS
+from actions.create_cabs import CreateCabsAction
+from actions.msi import InstallerBuildMSIAction
+from actions.validate_msi import ValidateMSIAction
+from core.verify import VerificationError
+
+GOAL_MAP = {
+    'setenv': SetEnvVariables,
+    'query_db': QueryDBAction,
+    'fingerprint': BuildFingerprintAction,
+    'create_cabs': CreateCabsAction,
+    'buildmsi': InstallerBuildMSIAction,
+    'validate_msi': ValidateMSIAction,
+    'record_build': RecordBuildAction,
+}
+GOALS = ['setenv', 'query_db', 'fingerprint', 'create_cabs', 'buildmsi', 'validate_msi', 'record_build']
+
+class BuildTestCase(unittest.TestCase):
+    """A product scanned into its own database, built with the goals of run_installer_build.py."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='build_test_')
+        self.tree = os.path.join(self.tmpdir, 'src')
+        self.output_dir = os.path.join(self.tmpdir, 'out')
+        for rel_path, data in [
+            ('a.txt', b'a' * 100),
+            ('bin/app.exe', b'x' * 100),
+            ('docs/readme.txt', b'z' * 100),
+        ]:
+            self.write(rel_path, data)
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.tmpdir, 'installer.db')}")
+        ensure_schema(self.engine)
+        Session.configure(bind=self.engine)
+        session = Session()
+        try:
+            feature = Feature(name='MainFeature', product=Product(name='BuildTest', version='1.0.0',
+                                                                  manufacturer='Test', installation_location='TARGET'))
+            session.add(feature)
+            session.commit()
+            populate_directories(SessionWriter(session),
+                                 scan_pipeline(self.tree, hash_algorithm='sha256', get_version=get_file_version),
+                                 'TARGET', feature.id, product_id=feature.product_id)
+            session.commit()
+        finally:
+            session.close()
+
+    def tearDown(self):
+        Session.configure(bind=engine)
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, rel_path, data):
+        path = os.path.join(self.tree, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def rescan(self):
+        session = Session()
+        try:
+            product = session.query(Product).filter_by(name='BuildTest').one()
+            rescan_directory(session, product, self.tree, None, {}, hash_algorithm='sha256')
+            session.commit()
+        finally:
+            session.close()
+
+    def build(self, goals=GOALS, **options):
+        """Run the goals; returns the state."""
+        values = dict(root_path=self.tree, project_name='BuildTest', project_bin=self.tree, targetbin=self.tree,
+                      output_dir=self.output_dir, cab_workers=1, build_timestamp=1700000000)
+        values.update(options)
+        state = InstallerState(SimpleNamespace(**values), [], None)
+        state.goals = list(goals)
+        state.goal_map = GOAL_MAP
+        state.finalize_goals()
+        while state.has_more_goals():
+            state.next_action()
+        return state
+
+    def cabinets(self):
+        return sorted(name for name in os.listdir(self.output_dir) if name.endswith('.cab'))
+
+class TestBuildTimestamp(unittest.TestCase):
+    def timestamp(self, option, epoch=None):
+        """The build timestamp set_env() picks with the option and SOURCE_DATE_EPOCH."""
+        state = SimpleNamespace(library=SimpleNamespace(options=SimpleNamespace(build_timestamp=option)))
+        with mock.patch.dict(os.environ):
+            os.environ.pop('SOURCE_DATE_EPOCH', None)
+            if epoch is not None:
+                os.environ['SOURCE_DATE_EPOCH'] = epoch
+            SetEnvVariables().set_env(state)
+        return state.library.build_timestamp
+
+    def test_option_then_source_date_epoch(self):
+        self.assertEqual(self.timestamp(1700000000, '5'), 1700000000)
+        # The epoch itself is a timestamp, not a missing one
+        self.assertEqual(self.timestamp(0, '5'), 0)
+        self.assertEqual(self.timestamp(None, '0'), 0)
+        self.assertEqual(self.timestamp(None, ''), None)
+        self.assertEqual(self.timestamp(None), None)
+
+class TestUpToDate(BuildTestCase):
+    def rebuilt(self, **options):
+        """Build; returns which of create_cabs and buildmsi ran, and the state."""
+        with mock.patch.object(CreateCabsAction, 'do', autospec=True, side_effect=CreateCabsAction.do) as cabs, \
+                mock.patch.object(InstallerBuildMSIAction, 'do', autospec=True,
+                                  side_effect=InstallerBuildMSIAction.do) as msi:
+            state = self.build(**options)
+        self.assertTrue(state.library.validation.ok)
+        return [name for name, action in (('create_cabs', cabs), ('buildmsi', msi)) if action.called], state
+
+    def test_unchanged_build_is_skipped(self):
+        self.assertEqual(self.rebuilt()[0], ['create_cabs', 'buildmsi'])
+        outputs = {name: os.stat(os.path.join(self.output_dir, name)).st_mtime_ns
+                   for name in os.listdir(self.output_dir)}
+        goals, state = self.rebuilt()
+        self.assertEqual(goals, [])
+        self.assertEqual(state.library.up_to_date_goals, UP_TO_DATE_GOALS)
+        self.assertEqual(state.library.msi_path, os.path.join(self.output_dir, 'BuildTest.msi'))
+        self.assertEqual({name: os.stat(os.path.join(self.output_dir, name)).st_mtime_ns
+                          for name in os.listdir(self.output_dir)}, outputs)
+        # Options that do not change an output do not force a rebuild either
+        self.assertEqual(self.rebuilt(cab_workers=2)[0], [])
+
+    def test_changed_file_rebuilds(self):
+        self.rebuilt()
+        self.write('a.txt', b'b' * 100)
+        self.rescan()
+        goals, state = self.rebuilt()
+        self.assertEqual(goals, ['create_cabs', 'buildmsi'])
+        self.assertEqual(state.library.up_to_date_goals, ())
+        self.assertEqual(self.rebuilt()[0], [])
+
+    def test_changed_option_rebuilds(self):
+        self.rebuilt()
+        self.assertEqual(self.rebuilt(cab_compression='none')[0], ['create_cabs', 'buildmsi'])
+        self.assertEqual(self.rebuilt(build_timestamp=1700000001)[0], ['create_cabs', 'buildmsi'])
+
+    def test_changed_code_rebuilds(self):
+        self.rebuilt()
+        with mock.patch('actions.fingerprint.code_version', return_value='0' * 64):
+            self.assertEqual(self.rebuilt()[0], ['create_cabs', 'buildmsi'])
+
+    def test_modified_output_rebuilds(self):
+        self.rebuilt()
+        with open(os.path.join(self.output_dir, 'BuildTest.msi'), 'ab') as f:
+            f.write(b'\0')
+        self.assertEqual(self.rebuilt()[0], ['create_cabs', 'buildmsi'])
+
+    def test_forced_rebuild(self):
+        self.rebuilt()
+        self.assertEqual(self.rebuilt(force_rebuild=True)[0], ['create_cabs', 'buildmsi'])
+
+class TestValidateMSI(BuildTestCase):
+    def setUp(self):
+        super().setUp()
+        self.state = self.build()
+
+    def rewrite(self, path, change):
+        with open(path, 'rb') as f:
+            data = bytearray(f.read())
+        with open(path, 'wb') as f:
+            f.write(change(data))
+
+    def test_built_msi_passes(self):
+        self.assertTrue(self.state.library.validation.ok)
+        ValidateMSIAction().do(self.state)
+        self.assertEqual(self.state.library.validation.problems, [])
+
+    def test_truncated_msi_fails(self):
+        self.rewrite(self.state.library.msi_path, lambda data: data[:len(data) // 2])
+        with self.assertRaises(VerificationError):
+            ValidateMSIAction().do(self.state)
+        self.assertIn('cannot be read', self.state.library.validation.problems[0])
+
+    def test_corrupted_msi_fails(self):
+        # The sector chains of the compound file no longer end
+        self.rewrite(self.state.library.msi_path, lambda data: data[:-2048] + bytes(2048))
+        with self.assertRaises(VerificationError):
+            ValidateMSIAction().do(self.state)
+
+    def test_corrupted_cabinet_fails(self):
+        def flip(data):
+            data[-10] ^= 0xff
+            return data
+        self.rewrite(self.state.library.media[0].path, flip)
+        with self.assertRaises(VerificationError):
+            ValidateMSIAction().do(self.state)
+        self.assertFalse(self.state.library.validation.ok)
+
+    def test_truncated_cabinet_fails(self):
+        self.rewrite(self.state.library.media[0].path, lambda data: data[:len(data) - 50])
+        with self.assertRaises(VerificationError):
+            ValidateMSIAction().do(self.state)
+        self.assertIn('is truncated', self.state.library.validation.problems[0])
+
+class TestIncrementalBuild(BuildTestCase):
+    def build_updates(self, **options):
+        """Build; returns the state and what each update_msi() call returned."""
+        results = []
+        original = InstallerBuildMSIAction.update_msi
+
+        def update_msi(action, *args):
+            results.append(original(action, *args))
+            return results[-1]
+        with mock.patch.object(InstallerBuildMSIAction, 'update_msi', update_msi):
+            return self.build(incremental=True, **options), results
+
+    def test_second_build_updates_the_first(self):
+        # The first build assigns every ComponentId, the second must still see the same tables
+        _, results = self.build_updates()
+        self.assertEqual(results, [None])
+        self.write('docs/readme.txt', b'z' * 120)
+        self.rescan()
+        _, results = self.build_updates()
+        self.assertEqual(results[0]['File'], 1)
+
+    def test_removes_cabinets_no_longer_planned(self):
+        self.build(cab_max_size=150)
+        self.assertEqual(self.cabinets(), ['BuildTest.cab', 'BuildTest2.cab', 'BuildTest3.cab'])
+        self.build()
+        self.assertEqual(self.cabinets(), ['BuildTest.cab'])
+
+    def test_reuses_cabinets_and_patches_file_rows(self):
+        # One file per cabinet, so only the changed file's cabinet is written again
+        state, _ = self.build_updates(cab_max_size=150)
+        self.assertEqual(len(state.library.media), 3)
+        stats = {m.cabinet: os.stat(m.path) for m in state.library.media}
+        with MsiReader(state.library.msi_path) as reader:
+            before = reader.rows('File')
+
+        self.write('docs/readme.txt', b'z' * 120)
+        self.rescan()
+        state, results = self.build_updates(cab_max_size=150)
+        self.assertEqual(results[0]['File'], 1)
+        rewritten = [cabinet for cabinet, st in stats.items()
+                     if os.stat(os.path.join(self.output_dir, cabinet)).st_mtime_ns != st.st_mtime_ns
+                     or os.stat(os.path.join(self.output_dir, cabinet)).st_ino != st.st_ino]
+        self.assertEqual(len(rewritten), 1)
+        self.assertEqual(self.cabinets(), sorted(stats))
+
+        with MsiReader(state.library.msi_path) as reader:
+            after = reader.rows('File')
+        patched = [(old, new) for old, new in zip(before, after) if old != new]
+        self.assertEqual(len(patched), 1)
+        old, new = patched[0]
+        self.assertIn('readme.txt', new[2])
+        self.assertEqual((old[3], new[3]), (100, 120))
+        self.assertEqual(old[:3] + old[4:], new[:3] + new[4:])
+        self.assertTrue(state.library.validation.ok)
+
+if __name__ == '__main__':
+    unittest.main()
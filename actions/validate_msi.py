@@ -1,17 +1,85 @@
 from core.action import InstallerAction
+from core.verify import Expected, VerificationError, verify_cabinets, check_media, check_components
+from core.msi_reader import MsiReader
+from core.msidb import MsiError
+from core.cfb import CompoundFileError
+from core.msi_checks import check_references
+from db.file_manifest import file_key
 import logging
 import os
+import time
 
 logger = logging.getLogger("installer.actions.validate_msi")
 
+# Problems listed in the log; the rest are only counted
+MAX_LOGGED_PROBLEMS = 50
+
 class ValidateMSIAction(InstallerAction):
     name = 'validate_msi'
 
     def do(self, state):
-        # Example: validate the built installer (generic)
         msi_path = getattr(state.library, 'msi_path', None)
-        if msi_path and os.path.exists(msi_path):
-            # Placeholder for validation logic
-            logging.info(f"Validated installer at: {msi_path}")
-        else:
+        if not msi_path or not os.path.exists(msi_path):
             logging.warning("No installer found to validate.")
+        media = getattr(state.library, 'media', None)
+        if not media or not getattr(state.library, 'files', None):
+            logging.warning("No cabinets found to validate.")
+            return
+        workers = getattr(state.library.options, 'cab_workers', None) or os.cpu_count() or 1
+
+        # Duplicates are not stored, their canonical copy (same hash) is checked
+        duplicates = getattr(state.library, 'duplicates', None)
+        expected = {}
+        for f in state.library.files:
+            if duplicates and duplicates.is_duplicate(f):
+                continue
+            expected[file_key(f)] = Expected(file_key(f), f.path, f.size, f.hash)
+
+        logging.info(f"Verifying {len(expected)} files in {len(media)} cabinets on {workers} workers...")
+        report = verify_cabinets([m.path for m in media], expected, workers)
+        media_rows, components = self.load_rows(state, media)
+        check_media(report, media_rows, state.library.file_sequences)
+        if components is not None:
+            check_components(report, state.library.files, components)
+        if msi_path and os.path.exists(msi_path):
+            self.check_tables(report, msi_path)
+        state.library.validation = report
+
+        for message in report.problems[:MAX_LOGGED_PROBLEMS]:
+            logging.error(message)
+        if len(report.problems) > MAX_LOGGED_PROBLEMS:
+            logging.error(f"... and {len(report.problems) - MAX_LOGGED_PROBLEMS} more problems")
+        if not report.ok:
+            raise VerificationError(f"Installer payload failed verification: {report}")
+        logging.info(f"Validated installer payload: {report}")
+
+    def check_tables(self, report, msi_path):
+        """References between the tables the MSI was written with (File -> Component -> Directory, Feature)."""
+        started = time.perf_counter()
+        try:
+            with MsiReader(msi_path) as reader:
+                problems = check_references(reader)
+                rows = sum(reader.row_count(name) for name in reader.tables)
+        except (CompoundFileError, MsiError) as e:
+            # A truncated or damaged database fails the goal like any other problem
+            report.problem(f"{os.path.basename(msi_path)} cannot be read: {e}")
+            return
+        for message in problems:
+            report.problem(f"{os.path.basename(msi_path)}: {message}")
+        logging.info(f"Checked the table references of {msi_path} ({rows} rows) in "
+                     f"{time.perf_counter() - started:.3f}s: {len(problems)} problems")
+
+    def load_rows(self, state, media):
+        """Media and Component rows from the database; the build's own Media plan without one."""
+        product_info = getattr(state.library, 'product_info', None)
+        if not product_info:
+            return [(m.disk_id, m.last_sequence, m.cabinet) for m in media], None
+        from db.session import Session
+        from db.build_records import load_media, load_components
+
+        session = Session()
+        try:
+            return (load_media(session, product_info['id']),
+                    load_components(session, {f.component_id for f in state.library.files}))
+        finally:
+            session.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Benchmark: ORM vs bulk population of directories, components and files.
+
+Builds a synthetic scan (no files are touched on disk) and populates a fresh
+SQLite database with it twice through populate_directories(): once with a
+SessionWriter (the ORM path), once with a BulkWriter.  Reports rows/sec for
+each.
+
+    python benchmarks/bench_bulk_insert.py --sizes 10000 100000 1000000
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import logging
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db.models import Base, Product, Feature
+from db.fswalk import ScannedDirectory, ScannedFile, ScanResult
+from db.bulk import BulkWriter, SessionWriter
+from db.scan_directory import populate_directories
+
+FILES_PER_DIR = 100
+DIRS_PER_DIR = 10
+
+def synthetic_scan(file_count):
+    """Build a ScanResult with file_count files spread over a nested tree."""
+    fake_stat = SimpleNamespace(st_size=4096, st_mode=0o100644, st_mtime_ns=0, st_ino=0)
+    root = ScannedDirectory('root', '/bench/root', '.', None, fake_stat)
+    queue = [root]
+    created = 0
+    index = 0
+    while created < file_count:
+        node = queue[index]
+        index += 1
+        for i in range(min(FILES_PER_DIR, file_count - created)):
+            name = f"file{i}.dll"
+            rel_path = name if node.rel_path == '.' else os.path.join(node.rel_path, name)
+            node.files.append(ScannedFile(name, os.path.join(node.path, name), rel_path, fake_stat))
+            created += 1
+        for i in range(DIRS_PER_DIR):
+            name = f"dir{i}"
+            rel_path = name if node.rel_path == '.' else os.path.join(node.rel_path, name)
+            child = ScannedDirectory(name, os.path.join(node.path, name), rel_path, node.path, fake_stat)
+            node.subdirs.append(child)
+            queue.append(child)
+    return ScanResult(root)
+
+def fresh_database(path):
+    if os.path.exists(path):
+        os.remove(path)
+    engine = create_engine(f'sqlite:///{path}')
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    feature = Feature(name='MainFeature', product=Product(name='Bench'))
+    session.add(feature)
+    session.commit()
+    return engine, session, feature
+
+def row_count(scan):
+    return scan.directory_count + sum(1 for d in scan.iter_directories() if d.files) + scan.file_count
+
+def bench_orm(path, scan):
+    engine, session, feature = fresh_database(path)
+    start = time.perf_counter()
+    populate_directories(SessionWriter(session), scan.iter_directories(), 'TARGET', feature.id)
+    session.commit()
+    elapsed = time.perf_counter() - start
+    session.close()
+    engine.dispose()
+    return elapsed
+
+def bench_bulk(path, scan, batch_size):
+    engine, session, feature = fresh_database(path)
+    feature_id = feature.id
+    session.close()
+    start = time.perf_counter()
+    populate_directories(BulkWriter(engine, batch_size=batch_size), scan.iter_directories(), 'TARGET', feature_id)
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ORM vs bulk scanner population')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000], help='File counts to benchmark')
+    parser.add_argument('--orm-limit', type=int, default=100000, help='Skip the ORM path above this many files')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Rows per bulk transaction')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    workdir = tempfile.mkdtemp(prefix='bench_bulk_')
+    path = os.path.join(workdir, 'bench.db')
+    try:
+        print(f"{'files':>10} {'rows':>10} {'orm rows/s':>12} {'bulk rows/s':>12} {'speedup':>8}")
+        for size in args.sizes:
+            scan = synthetic_scan(size)
+            rows = row_count(scan)
+            orm = bench_orm(path, scan) if size <= args.orm_limit else None
+            bulk = bench_bulk(path, scan, args.batch_size)
+            orm_rate = f"{rows / orm:12.0f}" if orm else f"{'skipped':>12}"
+            speedup = f"{orm / bulk:7.1f}x" if orm else f"{'-':>8}"
+            print(f"{size:>10} {rows:>10} {orm_rate} {rows / bulk:12.0f} {speedup}")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
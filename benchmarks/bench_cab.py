@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Benchmark: cabinet writing.
+
+Builds a tree of mixed files (compressible text, incompressible binaries)
+and writes it to a cabinet straight from the tree, per compression type,
+next to the old approach of copying the tree to a staging directory first.
+Reports MB/s of input and the compression ratio.  Then writes the tree with
+folders compressed on 1..N worker processes and reports the speedup, and
+a cold and a warm build through the compression cache.
+
+    python benchmarks/bench_cab.py --files 500 --size-kb 256 --workers 1 2 4 8 16 32
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from core.cab import CabinetWriter, CabEntry, CabinetReader, folder_size_for
+from core.cab_cache import CompressionCache
+from db.hashing import hash_files
+
+def build_tree(root, file_count, size_kb):
+    names = []
+    text = b''.join(f"line {i} of some build output\n".encode() for i in range(size_kb * 40))[:size_kb * 1024]
+    for i in range(file_count):
+        name = f"dir{i % 16}/file{i}.{'dll' if i % 2 else 'txt'}"
+        path = os.path.join(root, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size_kb * 1024) if i % 2 else text)
+        names.append(name)
+    return names
+
+def write_cab(path, root, names, compression, workers=1, folder_size=None):
+    writer = CabinetWriter(path, compression=compression, workers=workers)
+    writer.add_files((CabEntry(os.path.join(root, *name.split('/')), name) for name in names), folder_size)
+    return writer.close()
+
+def bench_workers(workdir, root, names, total_size, worker_counts):
+    print(f"{'workers':>8} {'folders':>8} {'seconds':>8} {'MB/s':>8} {'speedup':>8} {'ratio':>7}")
+    base = None
+    for workers in worker_counts:
+        cab_path = os.path.join(workdir, f"workers{workers}.cab")
+        # The same folders for every run, so only the parallelism changes
+        stats = write_cab(cab_path, root, names, 'mszip', workers,
+                          folder_size_for(total_size))
+        base = base or stats.seconds
+        print(f"{workers:>8} {stats.folders:>8} {stats.seconds:8.2f} {stats.mb_per_s:8.1f} "
+              f"{base / stats.seconds:7.2f}x {stats.ratio:7.1%}")
+        os.remove(cab_path)
+
+def bench_cache(workdir, root, names):
+    print(f"{'cache':>8} {'seconds':>8} {'MB/s':>8} {'hits':>6} {'misses':>7}")
+    cache_dir = os.path.join(workdir, 'cache')
+    for run in ('cold', 'warm'):
+        start = time.perf_counter()
+        cache = CompressionCache(cache_dir)
+        paths = [os.path.join(root, *name.split('/')) for name in names]
+        digests = hash_files(paths)
+        writer = CabinetWriter(os.path.join(workdir, 'cached.cab'), cache=cache)
+        writer.add_files_by_content(CabEntry(path, name, digests[path]) for path, name in zip(paths, names))
+        stats = writer.close()
+        seconds = time.perf_counter() - start
+        print(f"{run:>8} {seconds:8.2f} {stats.bytes_in / (1024 * 1024) / seconds:8.1f} "
+              f"{cache.stats.hits:>6} {cache.stats.misses:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size-kb', type=int, default=256)
+    parser.add_argument('--verify', action='store_true', help='Read every cabinet back')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='Worker counts for the scaling run')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_cab_')
+    try:
+        root = os.path.join(workdir, 'tree')
+        names = build_tree(root, args.files, args.size_kb)
+        total_mb = args.files * args.size_kb / 1024
+        print(f"{args.files} files, {total_mb:.1f} MB")
+        print(f"{'mode':>14} {'seconds':>8} {'MB/s':>8} {'ratio':>7}")
+        for compression in ('none', 'mszip'):
+            cab_path = os.path.join(workdir, f"{compression}.cab")
+            stats = write_cab(cab_path, root, names, compression)
+            print(f"{compression:>14} {stats.seconds:8.2f} {stats.mb_per_s:8.1f} {stats.ratio:7.1%}")
+            if args.verify:
+                assert sum(len(data) for _, data in CabinetReader(cab_path).extract_all()) == stats.bytes_in
+
+            # The old way: copy everything to a staging directory, then compress
+            start = time.perf_counter()
+            staging = os.path.join(workdir, 'staging')
+            shutil.copytree(root, staging)
+            stats = write_cab(cab_path, staging, names, compression)
+            seconds = time.perf_counter() - start
+            shutil.rmtree(staging)
+            print(f"{'staged ' + compression:>14} {seconds:8.2f} {total_mb / seconds:8.1f} {stats.ratio:7.1%}")
+        print(f"\n{os.cpu_count()} CPUs")
+        bench_workers(workdir, root, names, args.files * args.size_kb * 1024, args.workers)
+        print()
+        bench_cache(workdir, root, names)
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Benchmark: binary delta size and generation time on real file version pairs.
+
+Diffs each pair of files (two versions of the same DLL, typically) and
+reports the delta size after lzma compression (as shipped in a patch)
+against the compressed new file, and the time to make and apply the delta.
+
+    python benchmarks/bench_delta.py --pair v1/app.dll v2/app.dll
+    python benchmarks/bench_delta.py --dirs /opt/sdk/7.0.20 /opt/sdk/8.0.20 --limit 20
+    python benchmarks/bench_delta.py --synthetic 8
+
+--dirs pairs the same-named .dll/.exe files of two directories.  --synthetic
+generates pairs of the given size in MB: unrelated files, a heavily changed
+one (a quarter of its 64-byte runs rewritten, with insertions and deletions)
+and one with a few small changes; unrelated input is the worst case of the
+scan, where no anchor block matches and nothing is skipped.
+"""
+
+import os
+import sys
+import lzma
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from core.delta import make_delta, apply_delta
+
+def pairs_from_dirs(old_dir, new_dir, limit):
+    names = sorted(name for name in os.listdir(old_dir)
+                   if name.lower().endswith(('.dll', '.exe')) and os.path.isfile(os.path.join(new_dir, name)))
+    # The largest files first, they dominate patch sizes
+    names.sort(key=lambda name: -os.path.getsize(os.path.join(new_dir, name)))
+    return [(os.path.join(old_dir, name), os.path.join(new_dir, name)) for name in names[:limit]]
+
+def read_pairs(pairs):
+    """(label, old, new) of the pairs of paths."""
+    result = []
+    for old_path, new_path in pairs:
+        with open(old_path, 'rb') as f:
+            old = f.read()
+        with open(new_path, 'rb') as f:
+            new = f.read()
+        result.append((os.path.basename(new_path), old, new))
+    return result
+
+def synthetic_pairs(size):
+    """(label, old, new) of generated files of size bytes."""
+    rng = random.Random(42)
+    old = rng.randbytes(size)
+    heavy = bytearray(old)
+    for position in range(0, size, 256):
+        heavy[position:position + 64] = rng.randbytes(64)
+    for _ in range(size // 4096):
+        position = rng.randrange(len(heavy))
+        if rng.random() < 0.5:
+            heavy[position:position] = rng.randbytes(rng.randrange(1, 256))
+        else:
+            del heavy[position:position + rng.randrange(1, 256)]
+    light = bytearray(old)
+    for position in range(0, size, 65536):
+        light[position:position + 4] = rng.randbytes(4)
+    return [('unrelated', old, rng.randbytes(size)), ('heavily changed', old, bytes(heavy)),
+            ('small changes', old, bytes(light))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pair', nargs=2, action='append', default=[], metavar=('OLD', 'NEW'))
+    parser.add_argument('--dirs', nargs=2, metavar=('OLD_DIR', 'NEW_DIR'))
+    parser.add_argument('--limit', type=int, default=10, help='Files per --dirs pair')
+    parser.add_argument('--synthetic', type=int, metavar='MB', help='Generated pairs of this size')
+    args = parser.parse_args()
+    pairs = list(args.pair)
+    if args.dirs:
+        pairs += pairs_from_dirs(*args.dirs, args.limit)
+    if not pairs and not args.synthetic:
+        parser.error('give --pair, --dirs or --synthetic')
+
+    print(f"{'file':>36} {'new KB':>8} {'full KB':>8} {'delta KB':>9} {'saved':>6} {'make s':>7} {'apply s':>8}")
+    totals = [0, 0, 0.0]
+    cases = read_pairs(pairs)
+    if args.synthetic:
+        cases += synthetic_pairs(args.synthetic << 20)
+    for label, old, new in cases:
+        start = time.perf_counter()
+        delta = make_delta(old, new)
+        make_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        assert apply_delta(old, delta) == new
+        apply_seconds = time.perf_counter() - start
+        full = len(lzma.compress(new))
+        packed = len(lzma.compress(delta))
+        totals[0] += full
+        totals[1] += packed
+        totals[2] += make_seconds
+        print(f"{label[-36:]:>36} {len(new) // 1024:>8} {full // 1024:>8} {packed // 1024:>9} "
+              f"{1 - packed / full:6.1%} {make_seconds:7.2f} {apply_seconds:8.3f}")
+    print(f"{'total':>36} {'':>8} {totals[0] // 1024:>8} {totals[1] // 1024:>9} "
+          f"{1 - totals[1] / totals[0]:6.1%} {totals[2]:7.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Benchmark: writing MSI databases with large File tables.
+
+Writes a database shaped like a buildmsi output (Property, Directory,
+Component, Feature, File, Media and the sequence tables) with synthetic
+File rows, and reports the time per phase, the database size and the
+Python heap peak.
+
+    python benchmarks/bench_msi.py --files 100000 250000
+    python benchmarks/bench_msi.py --files 1000000 --no-trace
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from core.cfb import CompoundFileReader
+from core.msidb import MsiWriter, encode_stream_name
+from core.msi_schema import create_table, add_sequences, ShortNames
+
+def write_database(path, count, files_per_cab=20000):
+    timings = {}
+    start = time.perf_counter()
+    writer = MsiWriter(path)
+    properties = create_table(writer, 'Property')
+    properties.extend([('ProductCode', '{00000000-0000-0000-0000-000000000001}'), ('ProductName', 'Bench'),
+                       ('ProductVersion', '1.0.0'), ('Manufacturer', 'Bench'), ('ProductLanguage', '1033')])
+    directories = create_table(writer, 'Directory')
+    directories.extend([('TARGETDIR', None, 'SourceDir'), ('INSTALLDIR', 'TARGETDIR', 'BENCH|Bench')])
+    components = create_table(writer, 'Component')
+    components.add(('INSTALLDIR', '{00000000-0000-0000-0000-000000000002}', 'INSTALLDIR', 0, None, None))
+    features = create_table(writer, 'Feature')
+    features.add(('DefaultFeature', None, 'Default Feature', None, 1, 1, 'INSTALLDIR', 0))
+    feature_components = create_table(writer, 'FeatureComponents')
+    feature_components.add(('DefaultFeature', 'INSTALLDIR'))
+
+    names = ShortNames()
+    files = create_table(writer, 'File')
+    for number in range(1, count + 1):
+        version = f"1.0.{number % 100}.0" if number % 4 == 0 else None
+        files.add((f"F{number}", 'INSTALLDIR', names.name(f"module_{number:07d}.dll"), number * 13 % 1000000,
+                   version, None, None, number))
+    timings['rows'] = time.perf_counter() - start
+    files.finish()
+    media = create_table(writer, 'Media')
+    media.extend((disk, min(disk * files_per_cab, count), None, f"Bench{disk}.cab", None, None)
+                 for disk in range(1, (count + files_per_cab - 1) // files_per_cab + 1))
+    add_sequences(writer)
+    writer.summary(title='Installation Database', template='Intel;1033',
+                   revision='{00000000-0000-0000-0000-000000000003}', created=0, saved=0)
+    timings['spool'] = time.perf_counter() - start - timings['rows']
+    writer.close()
+    timings['write'] = time.perf_counter() - start - timings['rows'] - timings['spool']
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[100000, 250000])
+    parser.add_argument('--no-trace', action='store_true', help='Skip heap tracing (it slows the run down)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_msi_')
+    try:
+        print(f"{'files':>9} {'rows s':>7} {'spool s':>8} {'write s':>8} {'total s':>8} {'rows/s':>9} "
+              f"{'MSI MB':>7} {'peak MB':>8}")
+        for count in args.files:
+            path = os.path.join(tmpdir, f"bench{count}.msi")
+            if not args.no_trace:
+                tracemalloc.start()
+            timings = write_database(path, count)
+            peak = tracemalloc.get_traced_memory()[1] / 1e6 if not args.no_trace else float('nan')
+            tracemalloc.stop()
+            with CompoundFileReader(path) as reader:
+                assert encode_stream_name('File', table=True) in reader.streams
+            total = sum(timings.values())
+            print(f"{count:>9} {timings['rows']:>7.2f} {timings['spool']:>8.2f} {timings['write']:>8.2f} "
+                  f"{total:>8.2f} {count / total:>9.0f} {os.path.getsize(path) / 1e6:>7.1f} {peak:>8.1f}")
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Benchmark: incremental MSI update against a full rebuild after a one-file change.
+
+Writes the synthetic product of bench_msi_tables.py in full (MsiTables into
+an MsiWriter), changes the size and version of one file, then times both a
+second full build and an MsiUpdate of the first database that compares
+every File row with the manifest and rewrites the changed one, the
+Property and Media tables and the summary.  The update should cost a
+fraction of the full build and produce the same rows.
+
+    python benchmarks/bench_msi_incremental.py --files 100000
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from core.msidb import MsiWriter
+from core.msi_reader import MsiReader
+from core.msi_update import MsiUpdate
+from core.msi_tables import MsiTables
+from core.msi_schema import create_table, add_sequences
+from db.file_manifest import FileManifest, file_key
+from actions.msi import InstallerBuildMSIAction
+from benchmarks.bench_msi_tables import synthetic_product
+
+PROPERTIES = [('ProductName', 'Bench'), ('ProductVersion', '1.0.0')]
+MEDIA = [(1, 0, None, 'bench.cab', None, None)]
+
+def build(path, graph, files, sequences):
+    writer = MsiWriter(path)
+    create_table(writer, 'Property').extend(PROPERTIES)
+    MsiTables(graph, files, sequences, install_dir_name='Bench').write(writer)
+    create_table(writer, 'Media').extend(MEDIA)
+    add_sequences(writer)
+    writer.summary(title='Installation Database', template='Intel;1033', created=0, saved=0)
+    writer.close()
+
+def update(path, previous, files, sequences):
+    writer = MsiUpdate(path, previous)
+    changed = InstallerBuildMSIAction().update_file_rows(writer.edit('File'), files, sequences, None)
+    create_table(writer, 'Property').extend(PROPERTIES)
+    create_table(writer, 'Media').extend(MEDIA)
+    writer.summary(title='Installation Database', template='Intel;1033', created=0, saved=0)
+    writer.close()
+    return changed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[100000])
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_msi_incremental_')
+    try:
+        print(f"{'files':>9} {'full s':>8} {'update s':>9} {'speedup':>8} {'rows':>5}")
+        for count in args.files:
+            graph, files = synthetic_product(count)
+            sequences = {file_key(f): f.sequence for f in files}
+            previous = os.path.join(tmpdir, 'previous.msi')
+            build(previous, graph, files, sequences)
+
+            # One file of the payload changed
+            changed_id = count // 2
+            files = FileManifest.from_records([f._replace(size=f.size + 1, version='2.0.0.0')
+                                               if f.id == changed_id else f for f in files])
+            full = os.path.join(tmpdir, 'full.msi')
+            start = time.perf_counter()
+            build(full, graph, files, sequences)
+            full_seconds = time.perf_counter() - start
+
+            updated = os.path.join(tmpdir, 'updated.msi')
+            start = time.perf_counter()
+            rows = update(updated, previous, files, sequences)
+            update_seconds = time.perf_counter() - start
+
+            with MsiReader(full) as a, MsiReader(updated) as b:
+                assert sorted(a.rows('File')) == sorted(b.rows('File'))
+            print(f"{count:>9} {full_seconds:>8.2f} {update_seconds:>9.2f} "
+                  f"{full_seconds / update_seconds:>7.1f}x {rows:>5}")
+            for path in (previous, full, updated):
+                os.remove(path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
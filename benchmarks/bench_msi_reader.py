@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Benchmark: opening a large MSI database and checking its tables.
+
+Writes the synthetic product of bench_msi_tables.py into an MSI, then
+times MsiReader opening it (directory, string pool, schema), looking one
+file up by key, the references of the File table alone, and the full
+ICE-style reference check.  Opening and a one-table lookup should stay in
+milliseconds as the database grows; the checks should scale linearly.
+
+    python benchmarks/bench_msi_reader.py --files 100000 1000000
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from core.msidb import MsiWriter
+from core.msi_reader import MsiReader
+from core.msi_checks import check_references
+from core.msi_tables import MsiTables
+from core.msi_schema import create_table
+from db.file_manifest import file_key
+from benchmarks.bench_msi_tables import synthetic_product
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[100000, 1000000])
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_msi_reader_')
+    try:
+        print(f"{'files':>9} {'MB':>7} {'open ms':>8} {'find ms':>8} {'File check s':>13} {'check s':>8}")
+        for count in args.files:
+            graph, files = synthetic_product(count)
+            path = os.path.join(tmpdir, 'bench.msi')
+            with MsiWriter(path) as writer:
+                MsiTables(graph, files, {file_key(f): f.sequence for f in files}, install_dir_name='Bench').write(writer)
+                create_table(writer, 'Media').add((1, count, None, 'bench.cab', None, None))
+            size = os.path.getsize(path) / (1024 * 1024)
+
+            reader, open_seconds = _timed(lambda: MsiReader(path))
+            with reader:
+                row, find_seconds = _timed(lambda: reader.find('File', f"F{count // 2}"))
+                assert row is not None
+            with MsiReader(path) as reader:
+                problems, file_seconds = _timed(lambda: check_references(reader, ['File']))
+                assert not problems
+            with MsiReader(path) as reader:
+                problems, check_seconds = _timed(lambda: check_references(reader))
+                assert not problems
+            print(f"{count:>9} {size:>7.1f} {open_seconds * 1000:>8.1f} {find_seconds * 1000:>8.1f} "
+                  f"{file_seconds:>13.2f} {check_seconds:>8.2f}")
+            os.remove(path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Benchmark: generating the MSI product tables from a product graph.
+
+Builds a synthetic product (a directory tree with one component per
+directory, FILES_PER_DIR files each) and times MsiTables producing the
+Directory, Component, FeatureComponents, File and Registry rows.  With
+--write the rows also go through an MsiWriter into a database on disk.
+Per-file time should stay flat as the product grows.
+
+    python benchmarks/bench_msi_tables.py --files 100000 250000 1000000
+    python benchmarks/bench_msi_tables.py --files 100000 --write
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from core.msidb import MsiWriter
+from core.msi_tables import MsiTables
+from db.file_manifest import FileManifest, FileRecord
+from db.product_graph import ProductGraph, FeatureNode, ComponentNode, DirectoryNode, RegistryNode
+
+FILES_PER_DIR = 100
+DIRS_PER_DIR = 10
+
+class _CountingTable(object):
+    def __init__(self):
+        self.rows = 0
+
+    def extend(self, rows):
+        self.rows += len(rows)
+
+    def __len__(self):
+        return self.rows
+
+    def finish(self):
+        pass
+
+class _CountingWriter(object):
+    def table(self, name, columns, keys=1):
+        return _CountingTable()
+
+def synthetic_product(file_count):
+    """A ProductGraph and FileManifest with file_count files in a nested tree."""
+    directories = [DirectoryNode(1, 'root', 'root', None)]
+    components = []
+    records = []
+    paths = {1: ''}
+    index = 0
+    while len(records) < file_count:
+        directory = directories[index]
+        index += 1
+        component_id = len(components) + 1
+        components.append(ComponentNode(component_id, f"{component_id:08X}-0000-4000-8000-000000000000",
+                                        f"comp_{directory.name}", None, 1, directory.id))
+        for number in range(min(FILES_PER_DIR, file_count - len(records))):
+            file_id = len(records) + 1
+            records.append(FileRecord(file_id, f"{paths[directory.id]}module{number}.dll", 4096,
+                                      '1.0.0.0' if number % 4 == 0 else None, 0, file_id, component_id, None))
+        for number in range(DIRS_PER_DIR):
+            child = DirectoryNode(len(directories) + 1, f"dir{number}", f"dir{number}", directory.id)
+            directories.append(child)
+            paths[child.id] = f"{paths[directory.id]}{child.name}/"
+    registry = [RegistryNode(1, 'HKLM', 'Software\\Bench', 'Version', '1.0', 1)]
+    graph = ProductGraph([FeatureNode(1, 'MainFeature', 'Main', None, 1, 1, None)], components, directories,
+                         registry)
+    return graph, FileManifest.from_records(records)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, nargs='+', default=[100000, 250000, 1000000])
+    parser.add_argument('--write', action='store_true', help='Write the rows into an MSI database too')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench_msi_tables_')
+    try:
+        print(f"{'files':>9} {'dirs':>7} {'generate s':>11} {'us/file':>8}")
+        for count in args.files:
+            graph, files = synthetic_product(count)
+            sequences = {f"F{f.id}": f.sequence for f in files}
+            path = os.path.join(tmpdir, 'bench.msi')
+            writer = MsiWriter(path) if args.write else _CountingWriter()
+            start = time.perf_counter()
+            counts = MsiTables(graph, files, sequences, install_dir_name='Bench').write(writer)
+            if args.write:
+                writer.close()
+            seconds = time.perf_counter() - start
+            assert counts['File'] == count
+            print(f"{count:>9} {counts['Directory']:>7} {seconds:>11.2f} {seconds / count * 1e6:>8.2f}")
+            if os.path.exists(path):
+                os.remove(path)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    main()
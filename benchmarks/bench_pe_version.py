@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Benchmark: PE version-resource reads.
+
+Builds synthetic PE images whose .rsrc section sits at the end of a large
+(sparse) file and reports, per size, how many bytes the version reader
+examined and how long it took next to a full read of the file.  Then
+parses a batch of small images on a thread pool, uncached and cached.
+
+    python benchmarks/bench_pe_version.py --sizes-mb 16 256 2048 --files 2000
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from db.hashing import hash_file
+from db.peversion import read_pe_version, get_pe_version
+from db.test_peversion import build_pe
+
+def bench_sizes(workdir, sizes_mb, full_read):
+    print(f"{'size MB':>8} {'bytes read':>11} {'parse ms':>9} {'full read ms':>13}")
+    for size_mb in sizes_mb:
+        path = os.path.join(workdir, f"big{size_mb}.dll")
+        build_pe(path, (1, 2, 3, 4), padding=size_mb * 1024 * 1024)
+        stats = {}
+        start = time.perf_counter()
+        version = read_pe_version(path, stats)
+        parse = time.perf_counter() - start
+        assert version == '1.2.3.4', version
+        if full_read:
+            start = time.perf_counter()
+            hash_file(path, 'md5')
+            full = f"{(time.perf_counter() - start) * 1000:13.1f}"
+        else:
+            full = f"{'skipped':>13}"
+        print(f"{size_mb:>8} {stats['bytes_read']:>11} {parse * 1000:9.3f} {full}")
+        os.remove(path)
+
+def bench_batch(workdir, file_count, workers):
+    paths = []
+    for i in range(file_count):
+        path = os.path.join(workdir, f"lib{i}.dll")
+        build_pe(path, (1, 0, i % 65536, 0))
+        paths.append(path)
+    print(f"\n{'files':>8} {'workers':>8} {'uncached files/s':>17} {'cached files/s':>15}")
+    for count in sorted({1, workers}):
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            start = time.perf_counter()
+            list(pool.map(read_pe_version, paths))
+            uncached = time.perf_counter() - start
+            list(pool.map(get_pe_version, paths))  # Fill the cache
+            start = time.perf_counter()
+            list(pool.map(get_pe_version, paths))
+            cached = time.perf_counter() - start
+        print(f"{file_count:>8} {count:>8} {file_count / uncached:17.0f} {file_count / cached:15.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PE version-resource reader')
+    parser.add_argument('--sizes-mb', type=int, nargs='+', default=[16, 256, 2048], help='Image sizes in MB')
+    parser.add_argument('--files', type=int, default=2000, help='Small images parsed in the batch benchmark')
+    parser.add_argument('--workers', type=int, default=8, help='Threads for the batch benchmark')
+    parser.add_argument('--no-full-read', action='store_true', help='Skip the full-read comparison')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_pe_')
+    try:
+        bench_sizes(workdir, args.sizes_mb, not args.no_full_read)
+        bench_batch(workdir, args.files, args.workers)
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Benchmark: self-extracting package pack and unpack throughput.
+
+Packs a payload shaped like make_pfw's (a compressible MSI and an
+incompressible cabinet) per method and worker count, then extracts one
+entry by seeking to it and the whole package on 1..N threads.  Reports
+MB/s of uncompressed data and the package size.
+
+    python benchmarks/bench_sfx.py --size-mb 64 --workers 1 2 4 8
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+
+from core.sfx import SfxWriter, SfxReader
+from core.compress_policy import CompressionPolicy
+
+def build_payload(root, size_mb):
+    text = b''.join(f"row {i} of the File table\n".encode() for i in range(size_mb * 40000))
+    payload = {'Product.msi': text[:size_mb * 1024 * 1024 // 2], 'Product.cab': os.urandom(size_mb * 1024 * 1024 // 2)}
+    paths = []
+    for name, data in payload.items():
+        path = os.path.join(root, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+def pack(path, sources, method, workers):
+    writer = SfxWriter(path, method=method, workers=workers, policy=CompressionPolicy())
+    for source in sources:
+        writer.add(source)
+    return writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_sfx_')
+    try:
+        sources = build_payload(workdir, args.size_mb)
+        package = os.path.join(workdir, 'setup.exe')
+        print(f"{args.size_mb} MB payload, {os.cpu_count()} CPUs")
+        print(f"{'method':>8} {'workers':>8} {'pack s':>8} {'MB/s':>8} {'size':>7} {'unpack s':>9} {'MB/s':>8}")
+        for method in ('store', 'deflate', 'lzma'):
+            for workers in args.workers:
+                stats = pack(package, sources, method, workers)
+                dest = os.path.join(workdir, 'out')
+                with SfxReader(package) as reader:
+                    unpacked = reader.extract(dest, workers=workers)
+                shutil.rmtree(dest)
+                print(f"{method:>8} {workers:>8} {stats.seconds:8.2f} {stats.mb_per_s:8.1f} "
+                      f"{stats.bytes_out / stats.bytes_in:7.1%} {unpacked.seconds:9.2f} {unpacked.mb_per_s:8.1f}")
+
+        # Random access: only the chunks of the MSI are read
+        start = time.perf_counter()
+        with SfxReader(package) as reader:
+            size = len(reader.read('Product.msi'))
+        seconds = time.perf_counter() - start
+        print(f"\nread Product.msi alone: {seconds:.3f}s, {size / (1024 * 1024) / seconds:.1f} MB/s")
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main()
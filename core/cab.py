@@ -0,0 +1,610 @@
+"""
+Cabinet (.cab) writer and reader.
+
+A pure-Python implementation of the Microsoft cabinet format, so cabinets
+can be built on any host without makecab.  File contents are streamed from
+their source paths straight into the cabinet: no staging copy is made.
+
+Layout of a cabinet:
+
+    CFHEADER   'MSCF', sizes and counts
+    CFFOLDER   one per folder: offset of its first CFDATA, block count,
+               compression type
+    CFFILE     one per file: size, offset in its folder's uncompressed
+               stream, folder index, DOS date/time, attributes, name
+    CFDATA     the blocks of every folder: checksum, compressed and
+               uncompressed sizes, data
+
+A folder is a single compression stream over the concatenated contents of
+its files, cut into blocks of 32 KB uncompressed.  Supported compression
+types are NONE and MSZIP: each MSZIP block is 'CK' followed by a raw
+deflate stream that uses the previous block as its preset dictionary.
+LZX and Quantum are not implemented.
+
+Since the header and file table come first but depend on the compressed
+sizes, the writer reserves their space, streams the data blocks and then
+seeks back to fill them in.
+
+Folders are independent compression streams, so with workers > 1 they are
+compressed concurrently on a process pool and written in order as they
+complete.  add_files() cuts a file list into folders of about folder_size
+bytes for that; folder_size_for() picks a size that cuts a payload into
+PARALLEL_FOLDERS folders (within bounds), whatever the number of workers,
+so the cabinet comes out the same on every build host.  Memory held by
+finished folders waiting for their turn is about 2 x workers x folder size.
+
+File dates are the sources' modification times, or one fixed timestamp for
+every file (a build timestamp, stored as UTC) so the cabinet does not
+depend on when the sources were checked out.
+
+With a CompressionCache (core/cab_cache.py) folders whose files all carry
+a content hash are looked up before compressing, and spliced in from the
+cache on a hit.
+
+Payloads too large for one cabinet are spread over several: plan_cabinets()
+cuts the file list, in order, into cabinets that stay under a maximum size
+(files are never split across cabinets).
+"""
+
+import os
+import time
+import zlib
+import struct
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, Future
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_NONE = 0
+COMPRESS_MSZIP = 1
+COMPRESSION_TYPES = {'none': COMPRESS_NONE, 'mszip': COMPRESS_MSZIP}
+
+BLOCK_SIZE = 32768
+READ_SIZE = 1024 * 1024
+MAX_FILES = 0xFFFF
+MAX_FOLDER_SIZE = 0x7FFF8000  # 65535 blocks of 32 KB
+DEFAULT_MAX_CABINET_SIZE = 0x7FFFFFFF  # What Windows Installer reliably handles
+MIN_PARALLEL_FOLDER = 4 * 1024 * 1024
+MAX_PARALLEL_FOLDER = 32 * 1024 * 1024
+CONTENT_FOLDER_SIZE = 8 * 1024 * 1024
+PARALLEL_FOLDERS = 32
+
+_A_RDONLY = 0x01
+_A_ARCH = 0x20
+_A_NAME_IS_UTF = 0x80
+
+_HEADER = struct.Struct('<4sIIIIIBBHHHHH')
+_FOLDER = struct.Struct('<IHH')
+_FILE = struct.Struct('<IIHHHH')
+_DATA = struct.Struct('<IHH')
+
+
+class CabinetError(Exception):
+    """A cabinet could not be written or is malformed."""
+
+
+CabEntry = namedtuple('CabEntry', ['source', 'name', 'digest'], defaults=[None])
+CabEntry.__doc__ = """A file to store: its source path, its name inside the cabinet and its content hash."""
+
+
+class CabStats(object):
+    """What writing a cabinet took."""
+
+    def __init__(self):
+        self.files = 0
+        self.folders = 0
+        self.blocks = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    @property
+    def ratio(self):
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+    @property
+    def mb_per_s(self):
+        return self.bytes_in / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.files} files in {self.folders} folders, {self.bytes_in} -> {self.bytes_out} bytes "
+                f"({self.ratio:.1%}) in {self.seconds:.2f}s, {self.mb_per_s:.1f} MB/s")
+
+
+def checksum(data, seed=0):
+    """The cabinet checksum: XOR of the little-endian 32-bit words, odd tail bytes big-endian."""
+    end = len(data) & ~3
+    value = int.from_bytes(data[:end], 'little')
+    # Fold the words together half by half, the XOR runs in C on big ints
+    words = end >> 2
+    while words > 1:
+        low = words >> 1
+        shift = low * 32
+        value = (value >> shift) ^ (value & ((1 << shift) - 1))
+        words -= low
+    tail = 0
+    for byte in data[end:]:
+        tail = (tail << 8) | byte
+    return (seed ^ value ^ tail) & 0xFFFFFFFF
+
+
+def _dos_datetime(mtime, utc=False):
+    t = time.gmtime(mtime) if utc else time.localtime(mtime)
+    if t.tm_year < 1980:
+        return (1 << 5) | 1, 0
+    return (((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+            (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2))
+
+
+def _encode_name(name):
+    name = name.replace('/', '\\')
+    try:
+        return name.encode('ascii'), 0
+    except UnicodeEncodeError:
+        return name.encode('utf-8'), _A_NAME_IS_UTF
+
+
+def _compressor(compression, level):
+    """Return a function turning one uncompressed block into its CFDATA payload."""
+    if compression == COMPRESS_NONE:
+        return bytes
+    if compression != COMPRESS_MSZIP:
+        raise CabinetError(f"unsupported compression type {compression}")
+    previous = [None]
+
+    def compress(block):
+        if previous[0] is None:
+            c = zlib.compressobj(level, zlib.DEFLATED, -15)
+        else:
+            c = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=previous[0])
+        data = b'CK' + c.compress(block) + c.flush()
+        previous[0] = block
+        return data
+    return compress
+
+
+def iter_blocks(sources, sizes=None, read_size=READ_SIZE):
+    """Yield the concatenated contents of sources in BLOCK_SIZE pieces (the last may be shorter).
+
+    If sizes is given, each source must still have that many bytes.
+    """
+    pending = bytearray()
+    for index, source in enumerate(sources):
+        copied = 0
+        with open(source, 'rb') as f:
+            while True:
+                chunk = f.read(read_size)
+                if not chunk:
+                    break
+                copied += len(chunk)
+                pending += chunk
+                if len(pending) >= BLOCK_SIZE:
+                    end = len(pending) - len(pending) % BLOCK_SIZE
+                    with memoryview(pending) as view:
+                        blocks = [bytes(view[offset:offset + BLOCK_SIZE]) for offset in range(0, end, BLOCK_SIZE)]
+                    del pending[:end]
+                    yield from blocks
+        if sizes is not None and copied != sizes[index]:
+            raise CabinetError(f"{source} changed while it was being stored "
+                               f"({sizes[index]} bytes expected, {copied} read)")
+    if pending:
+        yield bytes(pending)
+
+
+def compress_blocks(sources, compression=COMPRESS_MSZIP, level=6, sizes=None):
+    """Yield (CFDATA record, uncompressed size) for one folder made of sources."""
+    compress = _compressor(compression, level)
+    for block in iter_blocks(sources, sizes):
+        data = compress(block)
+        sizes_field = struct.pack('<HH', len(data), len(block))
+        yield (_DATA.pack(checksum(sizes_field, checksum(data)), len(data), len(block)) + data,
+               len(block))
+
+
+def compress_folder(sources, sizes, compression, level):
+    """Compress one folder in memory; return (CFDATA records, block count, uncompressed size).
+
+    Module level so it can run in a worker process.
+    """
+    records = []
+    bytes_in = 0
+    for record, uncompressed in compress_blocks(sources, compression, level, sizes):
+        records.append(record)
+        bytes_in += uncompressed
+    return b''.join(records), len(records), bytes_in
+
+
+def folder_size_for(total_size, folders=PARALLEL_FOLDERS):
+    """
+    Folder size that spreads total_size over about `folders` folders, or None for one folder.
+
+    The size does not depend on the number of workers, so the folder layout
+    (and the cabinet bytes) are the same on every host.  Within a folder each
+    32 KB MSZIP block is primed with the previous block as its dictionary;
+    a new folder starts without one, so each extra folder costs the ratio
+    of one unprimed block, under 1% of a folder of at least 4 MB.
+    """
+    if total_size <= MIN_PARALLEL_FOLDER:
+        return None
+    return max(MIN_PARALLEL_FOLDER, min(MAX_PARALLEL_FOLDER, total_size // folders))
+
+
+def stored_size(name, size):
+    """Upper bound of the bytes a file adds to a cabinet, whatever the compression.
+
+    Its CFFILE entry, a CFFOLDER entry in case it starts a folder, and per
+    32 KB block a CFDATA header plus the worst case MSZIP overhead of
+    incompressible data ('CK' and a stored deflate block header).
+    """
+    blocks = (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+    return _FILE.size + len(_encode_name(name)[0]) + 1 + _FOLDER.size + size + blocks * (_DATA.size + 7)
+
+
+def plan_cabinets(items, max_size=DEFAULT_MAX_CABINET_SIZE):
+    """
+    Cut (entry, size) items into consecutive cabinets of at most max_size bytes.
+
+    The order of the items is kept, so sequence ranges map onto cabinets.  A
+    file larger than max_size on its own gets a cabinet of its own.  Returns
+    a list of entry lists.
+    """
+    cabinets = []
+    current = []
+    used = _HEADER.size
+    for entry, size in items:
+        needed = stored_size(entry.name, size)
+        if current and (used + needed > max_size or len(current) >= MAX_FILES):
+            cabinets.append(current)
+            current = []
+            used = _HEADER.size
+        if _HEADER.size + needed > max_size:
+            logger.warning(f"{entry.source} ({size} bytes) does not fit in a {max_size} byte cabinet, "
+                           f"storing it in a cabinet of its own")
+        current.append(entry)
+        used += needed
+    if current:
+        cabinets.append(current)
+    return cabinets
+
+
+def cabinet_name(base_name, disk_id):
+    """'<base>.cab' for the first disk, '<base><disk_id>.cab' for the others."""
+    return f"{base_name}.cab" if disk_id == 1 else f"{base_name}{disk_id}.cab"
+
+
+class CabinetWriter(object):
+    """
+    Builds one cabinet.
+
+    Usage:
+        writer = CabinetWriter(path, compression='mszip')
+        writer.add_folder([CabEntry(source, name), ...])
+        stats = writer.close()
+
+    Files are laid out in the order they are added.  Each folder is its own
+    compression stream; with workers > 1 folders are compressed in parallel.
+    Nothing is read until close().  timestamp (a Unix time) replaces the
+    sources' modification times as the date of every file.
+    """
+
+    def __init__(self, path, compression='mszip', level=6, set_id=0, index=0, workers=1, cache=None,
+                 timestamp=None):
+        if isinstance(compression, str):
+            if compression not in COMPRESSION_TYPES:
+                raise CabinetError(f"unknown compression '{compression}' "
+                                   f"(supported: {', '.join(sorted(COMPRESSION_TYPES))})")
+            compression = COMPRESSION_TYPES[compression]
+        self.path = path
+        self.compression = compression
+        self.level = level
+        self.set_id = set_id
+        self.index = index
+        self.workers = max(1, workers or 1)
+        self.cache = cache
+        self.timestamp = timestamp
+        self.folders = []
+
+    def add_folder(self, entries, compression=None):
+        """Queue a folder of CabEntry items (compression defaults to the cabinet's)."""
+        entries = list(entries)
+        if entries:
+            self.folders.append((entries, self.compression if compression is None else compression))
+
+    def _runs(self, entries, compression_for):
+        # Consecutive entries sharing a compression type; a folder has only one
+        run = []
+        run_compression = None
+        for entry in entries:
+            compression = None if compression_for is None else compression_for(entry)
+            if compression is None:
+                compression = self.compression
+            if run and compression != run_compression:
+                yield run_compression, run
+                run = []
+            run.append(entry)
+            run_compression = compression
+        if run:
+            yield run_compression, run
+
+    def add_files(self, entries, folder_size=None, compression_for=None):
+        """
+        Queue entries as consecutive folders, each closed once it reaches folder_size bytes (one folder if None).
+
+        compression_for(entry), if given, picks the compression type of each
+        file (None for the cabinet's); a change of type starts a new folder.
+        """
+        for compression, run in self._runs(entries, compression_for):
+            folder = []
+            size = 0
+            for entry in run:
+                if folder and folder_size is not None and size >= folder_size:
+                    self.add_folder(folder, compression)
+                    folder = []
+                    size = 0
+                folder.append(entry)
+                size += os.path.getsize(entry.source)
+            self.add_folder(folder, compression)
+
+    def add_files_by_content(self, entries, target_size=CONTENT_FOLDER_SIZE, compression_for=None):
+        """
+        Queue entries as folders cut at content-defined points.
+
+        A folder ends after a file with a probability of its size over
+        target_size, decided by its content hash, so folders average about
+        target_size and a changed file only moves the boundaries of its own
+        folder: the others keep their cache keys.  Folders are capped at 4 x
+        target_size.  Entries without a digest end a folder when it is full.
+        compression_for is as for add_files().
+        """
+        for compression, run in self._runs(entries, compression_for):
+            folder = []
+            size = 0
+            for entry in run:
+                folder.append(entry)
+                entry_size = os.path.getsize(entry.source)
+                size += entry_size
+                if entry.digest:
+                    cut = int(entry.digest[-8:], 16) < (entry_size << 32) // target_size
+                else:
+                    cut = size >= target_size
+                if cut or size >= 4 * target_size:
+                    self.add_folder(folder, compression)
+                    folder = []
+                    size = 0
+            self.add_folder(folder, compression)
+
+    def _layout(self):
+        """Stat the sources and build the folder and file tables."""
+        files = []
+        folders = []
+        for folder_index, (entries, compression) in enumerate(self.folders):
+            offset = 0
+            sizes = []
+            for entry in entries:
+                st = os.stat(entry.source)
+                name, name_flag = _encode_name(entry.name)
+                attributes = _A_ARCH | name_flag
+                if not st.st_mode & 0o200:
+                    attributes |= _A_RDONLY
+                if self.timestamp is None:
+                    date, dostime = _dos_datetime(st.st_mtime)
+                else:
+                    date, dostime = _dos_datetime(self.timestamp, utc=True)
+                files.append((st.st_size, offset, folder_index, date, dostime, attributes, name))
+                sizes.append(st.st_size)
+                offset += st.st_size
+            if offset > MAX_FOLDER_SIZE:
+                raise CabinetError(f"folder {folder_index} holds {offset} bytes, "
+                                   f"more than the {MAX_FOLDER_SIZE} a folder can address")
+            key = None
+            if self.cache is not None and all(entry.digest for entry in entries):
+                key = self.cache.folder_key(compression, self.level, BLOCK_SIZE,
+                                            [(entry.digest, size) for entry, size in zip(entries, sizes)])
+            folders.append(([entry.source for entry in entries], sizes, compression, key))
+        if len(files) > MAX_FILES:
+            raise CabinetError(f"{len(files)} files exceed the {MAX_FILES} a cabinet can hold")
+        return folders, files
+
+    def _tables(self, folder_records, files, cabinet_size):
+        files_offset = _HEADER.size + _FOLDER.size * len(folder_records)
+        parts = [_HEADER.pack(b'MSCF', 0, cabinet_size, 0, files_offset, 0, 3, 1,
+                              len(folder_records), len(files), 0, self.set_id, self.index)]
+        parts.extend(_FOLDER.pack(*record) for record in folder_records)
+        for size, offset, folder_index, date, dostime, attributes, name in files:
+            parts.append(_FILE.pack(size, offset, folder_index, date, dostime, attributes) + name + b'\0')
+        return b''.join(parts)
+
+    def write_folders(self, out, folders, stats):
+        """Write the CFDATA blocks of every folder; return the CFFOLDER records."""
+        if (self.workers > 1 and len(folders) > 1) or self.cache is not None:
+            return self._write_folders_pooled(out, folders, stats)
+        records = []
+        for sources, sizes, compression, _ in folders:
+            start = out.tell()
+            count = 0
+            for record, uncompressed in compress_blocks(sources, compression, self.level, sizes):
+                out.write(record)
+                count += 1
+                stats.bytes_in += uncompressed
+            records.append((start, count, compression))
+        return records
+
+    def _write_folders_pooled(self, out, folders, stats):
+        # Folders are compressed whole in memory: on worker processes, and
+        # looked up in / stored to the cache when there is one
+        records = []
+        queued = iter(folders)
+        pending = []
+        pool = None
+        if self.workers > 1 and len(folders) > 1:
+            pool = ProcessPoolExecutor(min(self.workers, len(folders)))
+
+        def submit():
+            folder = next(queued, None)
+            if folder is None:
+                return
+            sources, sizes, compression, key = folder
+            cached = self.cache.get(key, sum(sizes)) if key is not None else None
+            if cached is not None:
+                future = Future()
+                future.set_result((cached[0], cached[1], sum(sizes)))
+                key = None
+            elif pool is not None:
+                future = pool.submit(compress_folder, sources, sizes, compression, self.level)
+            else:
+                future = Future()
+                future.set_result(compress_folder(sources, sizes, compression, self.level))
+            pending.append((future, compression, key))
+
+        try:
+            # Finished folders wait in memory for their turn, the window bounds how many
+            for _ in range(2 * self.workers):
+                submit()
+            while pending:
+                future, compression, key = pending.pop(0)
+                data, count, bytes_in = future.result()
+                records.append((out.tell(), count, compression))
+                out.write(data)
+                stats.bytes_in += bytes_in
+                if key is not None:
+                    self.cache.put(key, data, count, bytes_in)
+                submit()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        return records
+
+    def close(self):
+        """Write the cabinet and return its CabStats."""
+        started = time.perf_counter()
+        stats = CabStats()
+        folders, files = self._layout()
+        stats.files = len(files)
+        stats.folders = len(folders)
+        tables_size = len(self._tables([(0, 0, 0)] * len(folders), files, 0))
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as out:
+                out.seek(tables_size)
+                records = self.write_folders(out, folders, stats)
+                size = out.tell()
+                if size > 0xFFFFFFFF:
+                    raise CabinetError(f"cabinet {self.path} is larger than 4 GB")
+                out.seek(0)
+                out.write(self._tables(records, files, size))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        stats.blocks = sum(record[1] for record in records)
+        stats.bytes_out = size
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+
+CabFile = namedtuple('CabFile', ['name', 'size', 'folder', 'offset', 'date', 'time', 'attributes'])
+
+
+def iter_folder(path, folder_index, start, count, compression):
+    """
+    Yield the uncompressed blocks of the folder of a cabinet whose CFFOLDER
+    entry is (start, count, compression), checking block checksums.
+
+    Module level so a worker process can read a folder without parsing the
+    cabinet's file table again.
+    """
+    previous = None
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for _ in range(count):
+            header = f.read(_DATA.size)
+            if len(header) < _DATA.size:
+                raise CabinetError(f"{path}: folder {folder_index} is truncated")
+            csum, compressed_size, uncompressed_size = _DATA.unpack(header)
+            data = f.read(compressed_size)
+            if len(data) < compressed_size:
+                raise CabinetError(f"{path}: folder {folder_index} is truncated")
+            if csum and checksum(struct.pack('<HH', compressed_size, uncompressed_size),
+                                 checksum(data)) != csum:
+                raise CabinetError(f"{path}: checksum mismatch in folder {folder_index}")
+            if compression == COMPRESS_NONE:
+                block = data
+            elif compression == COMPRESS_MSZIP:
+                if data[:2] != b'CK':
+                    raise CabinetError(f"{path}: bad MSZIP block signature")
+                if previous is None:
+                    d = zlib.decompressobj(-15)
+                else:
+                    d = zlib.decompressobj(-15, zdict=previous)
+                try:
+                    block = d.decompress(data[2:]) + d.flush()
+                except zlib.error as e:
+                    raise CabinetError(f"{path}: corrupted MSZIP block in folder {folder_index}: {e}") from None
+            else:
+                raise CabinetError(f"{path}: unsupported compression type {compression}")
+            if len(block) != uncompressed_size:
+                raise CabinetError(f"{path}: block decompressed to {len(block)} bytes, "
+                                   f"expected {uncompressed_size}")
+            previous = block
+            yield block
+
+
+class CabinetReader(object):
+    """
+    Minimal cabinet reader (NONE and MSZIP folders), for verification and tests.
+
+    Data blocks are checked against their checksums when extracted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size or header[:4] != b'MSCF':
+                raise CabinetError(f"{path} is not a cabinet")
+            (_, _, self.size, _, files_offset, _, minor, major, folder_count, file_count,
+             flags, self.set_id, self.index) = _HEADER.unpack(header)
+            if flags & 0x0004:
+                raise CabinetError(f"{path}: reserved areas are not supported")
+            self.folders = [_FOLDER.unpack(self._read(f, _FOLDER.size)) for _ in range(folder_count)]
+            f.seek(files_offset)
+            self.files = []
+            for _ in range(file_count):
+                size, offset, folder, date, dostime, attributes = _FILE.unpack(self._read(f, _FILE.size))
+                name = bytearray()
+                while True:
+                    c = f.read(1)
+                    if not c or c == b'\0':
+                        break
+                    name += c
+                encoding = 'utf-8' if attributes & _A_NAME_IS_UTF else 'latin-1'
+                self.files.append(CabFile(name.decode(encoding), size, folder, offset, date, dostime,
+                                          attributes))
+
+    def _read(self, f, size):
+        data = f.read(size)
+        if len(data) < size:
+            raise CabinetError(f"{self.path} is truncated in its file entries")
+        return data
+
+    def folder_data(self, folder_index):
+        """Yield the uncompressed blocks of a folder."""
+        return iter_folder(self.path, folder_index, *self.folders[folder_index])
+
+    def extract_all(self):
+        """Yield (CabFile, contents) for every file, folder by folder."""
+        return self.extract()
+
+    def extract(self, names=None):
+        """Yield (CabFile, contents) for the named files (all by default); only their folders are read."""
+        wanted = None if names is None else set(names)
+        by_folder = {}
+        for entry in self.files:
+            if wanted is None or entry.name in wanted:
+                by_folder.setdefault(entry.folder, []).append(entry)
+        for folder_index in sorted(by_folder):
+            data = b''.join(self.folder_data(folder_index))
+            for entry in by_folder[folder_index]:
+                yield entry, data[entry.offset:entry.offset + entry.size]
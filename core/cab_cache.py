@@ -0,0 +1,167 @@
+"""
+Content-addressed cache of compressed cabinet folders.
+
+Most of a nightly payload is unchanged from the night before, so instead of
+recompressing it, the CFDATA records of each folder are kept on disk under a
+key derived from what determines them:
+
+    compression type and level, block size,
+    and the content hash and size of every file of the folder, in order
+
+CFDATA records do not depend on where they sit in the cabinet, so a cached
+folder is spliced into a new cabinet as is.  For keys to repeat between
+builds, folder boundaries must not move when an unrelated file changes:
+CabinetWriter.add_files_by_content() cuts folders at content-defined points.
+
+Entries live in <directory>/<key[:2]>/<key>.cfdata, written to a temporary
+file and renamed, so concurrent builds can share a cache.  The file mtime
+records the last use; when the cache grows beyond its size bound the least
+recently used entries are evicted.
+"""
+
+import os
+import struct
+import hashlib
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+_ENTRY = struct.Struct('<8sIQ')  # magic, block count, uncompressed size
+_MAGIC = b'CABFOLD1'
+_SUFFIX = '.cfdata'
+
+
+class CacheStats(object):
+    """Hits and misses of one build."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_hit = 0
+        self.bytes_stored = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return (f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%}), "
+                f"{self.bytes_hit} bytes not recompressed, {self.bytes_stored} bytes stored, "
+                f"{self.evictions} evicted")
+
+
+class CompressionCache(object):
+    """
+    Size-bounded LRU cache of compressed folders.
+
+    Args:
+        directory: Cache directory (created if needed)
+        max_size: Bytes of cached data to keep
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self.size = 0
+        # key -> entry size, least recently used first
+        self._entries = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for shard in os.scandir(directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(_SUFFIX):
+                    st = entry.stat()
+                    found.append((st.st_mtime_ns, entry.name[:-len(_SUFFIX)], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.size += size
+        logger.info(f"Compression cache {directory}: {len(self._entries)} folders, {self.size} bytes")
+
+    @staticmethod
+    def folder_key(compression, level, block_size, files):
+        """Key of a folder made of files, a list of (content hash, size)."""
+        h = hashlib.sha256(f"cab-folder {compression} {level} {block_size}\n".encode())
+        for digest, size in files:
+            h.update(f"{digest} {size}\n".encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + _SUFFIX)
+
+    def get(self, key, bytes_in):
+        """Return (CFDATA records, block count) of a folder of bytes_in bytes, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                magic, count, size = _ENTRY.unpack(f.read(_ENTRY.size))
+                data = f.read()
+            if magic != _MAGIC or size != bytes_in:
+                raise ValueError("unexpected entry header")
+            os.utime(path)
+        except FileNotFoundError:
+            # Never stored, or evicted by another build
+            self._forget(key)
+            self.stats.misses += 1
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self._remove(key)
+            self.stats.misses += 1
+            return None
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self.stats.hits += 1
+        self.stats.bytes_hit += bytes_in
+        return data, count
+
+    def put(self, key, data, count, bytes_in):
+        """Store a compressed folder, then evict to stay within max_size."""
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(_ENTRY.pack(_MAGIC, count, bytes_in))
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # A cache that cannot be written only costs speed
+            logger.warning(f"Unable to store {path} in the compression cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._forget(key)
+        self._entries[key] = _ENTRY.size + len(data)
+        self.size += _ENTRY.size + len(data)
+        self.stats.bytes_stored += len(data)
+        self.trim()
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self.size -= size
+
+    def _remove(self, key):
+        self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def trim(self):
+        """Evict least recently used entries until the cache fits in max_size."""
+        while self.size > self.max_size and self._entries:
+            key = next(iter(self._entries))
+            try:
+                self._remove(key)
+            except OSError as e:
+                logger.warning(f"Unable to evict {self._path(key)}: {e}")
+                self._forget(key)
+            self.stats.evictions += 1
@@ -0,0 +1,481 @@
+"""
+Compound File Binary (OLE structured storage) writer and reader.
+
+The container format of MSI databases.  Only what MSI needs is supported:
+version 3 files (512-byte sectors) holding streams directly under the root
+storage.
+
+Layout written by CompoundFileWriter:
+
+    header      512 bytes (counts, first sectors, the first 109 DIFAT entries)
+    streams     each stream of 4096 bytes or more in its own run of
+                contiguous sectors, written as soon as it is added
+    ministream  the streams under 4096 bytes, in 64-byte mini sectors,
+                stored as the root entry's stream
+    directory   128-byte entries; the children of the root form a
+                red-black tree ordered by name length, then upper case name
+    minifat     chains of the mini sectors
+    fat         chains of the sectors (incl. DIFAT/FAT sectors themselves)
+    difat       FAT sector numbers beyond the first 109
+
+Large streams go to disk as they are added, so a writer only holds the
+small streams and the sector bookkeeping in memory.
+
+CompoundFileReader parses the header, FAT and directory when opened and
+reads streams on demand.
+"""
+
+import os
+import sys
+import struct
+from array import array
+from itertools import compress, count, repeat
+from operator import ne, sub
+
+SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+SECTOR_SIZE = 512
+MINI_SECTOR_SIZE = 64
+MINI_STREAM_CUTOFF = 4096
+MAX_NAME_LENGTH = 31
+
+FREESECT = 0xFFFFFFFF
+ENDOFCHAIN = 0xFFFFFFFE
+FATSECT = 0xFFFFFFFD
+DIFSECT = 0xFFFFFFFC
+NOSTREAM = 0xFFFFFFFF
+
+STGTY_STORAGE = 1
+STGTY_STREAM = 2
+STGTY_ROOT = 5
+RED = 0
+BLACK = 1
+
+_HEADER = struct.Struct('<8s16sHHHHH6sIIIIIIIII')
+_ENTRY = struct.Struct('<64sHBBIII16sIQQIQ')
+_IDS_PER_SECTOR = SECTOR_SIZE // 4
+_HEADER_DIFAT = 109
+
+
+class CompoundFileError(Exception):
+    """A compound file could not be written, or is malformed."""
+
+
+def _le_array(typecode, data=b''):
+    values = array(typecode, data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def _le_bytes(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _sectors(size, sector_size=SECTOR_SIZE):
+    return (size + sector_size - 1) // sector_size
+
+
+def name_key(name):
+    """Sort key of directory entry names: length first, then upper case code units."""
+    units = name.encode('utf-16-le')
+    upper = ''.join(c.upper() if len(c.upper()) == 1 else c for c in name)
+    return len(units), upper.encode('utf-16-be')
+
+
+def _tree(ids):
+    """
+    Arrange sorted directory entry ids in a balanced binary tree.
+
+    Returns (root id, {id: (left, right, color)}).  The tree is built by
+    splitting at the middle, so all empty links sit on the last two levels;
+    nodes on the last level are red unless that level is full, the others
+    black, which satisfies the red-black rules.
+    """
+    nodes = {}
+    last_level = max(len(ids).bit_length() - 1, 0)
+    full = len(ids) == 2 ** (last_level + 1) - 1
+
+    def build(low, high, depth):
+        if low >= high:
+            return NOSTREAM
+        middle = (low + high) // 2
+        left = build(low, middle, depth + 1)
+        right = build(middle + 1, high, depth + 1)
+        nodes[ids[middle]] = (left, right, RED if depth == last_level and not full else BLACK)
+        return ids[middle]
+
+    return build(0, len(ids), 0), nodes
+
+
+class CompoundFileWriter(object):
+    """
+    Writes a compound file with streams under the root storage.
+
+    Usage:
+        writer = CompoundFileWriter(path, clsid=MSI_CLSID)
+        writer.add_stream(name, data)
+        writer.add_stream(name, chunks, size)
+        writer.close()
+
+    Args:
+        path: File to write (written as path.tmp, renamed by close())
+        clsid: 16-byte CLSID of the root storage
+        mtime: FILETIME of the root entry (0 for none)
+    """
+
+    def __init__(self, path, clsid=b'\0' * 16, mtime=0):
+        self.path = path
+        self.clsid = clsid
+        self.mtime = mtime
+        self.tmp_path = f"{path}.tmp"
+        self.file = open(self.tmp_path, 'w+b')
+        self.file.write(b'\0' * SECTOR_SIZE)
+        self.next_sector = 0
+        self.runs = []       # (first sector, sector count) of the contiguous chains
+        self.streams = {}    # name -> (start sector, size, is mini)
+        self.mini = []       # (name, data) of the small streams
+        self.closed = False
+
+    def _check_name(self, name):
+        if not name or len(name) > MAX_NAME_LENGTH or any(c in name for c in '/\\:!'):
+            raise CompoundFileError(f"invalid stream name {name!r}")
+        if name in self.streams or any(name == other for other, _ in self.mini):
+            raise CompoundFileError(f"duplicate stream {name!r}")
+
+    def add_stream(self, name, data, size=None):
+        """
+        Add a stream.
+
+        data is bytes, or an iterable of bytes-like chunks totalling size
+        bytes; chunks are written out as they come unless the stream is
+        small enough for the mini stream.
+        """
+        self._check_name(name)
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            chunks = (data,)
+            size = len(data)
+        elif size is None:
+            raise CompoundFileError(f"the size of stream {name!r} is needed when it is given in chunks")
+        else:
+            chunks = data
+        if size < MINI_STREAM_CUTOFF:
+            small = b''.join(bytes(chunk) for chunk in chunks)
+            if len(small) != size:
+                raise CompoundFileError(f"stream {name!r} has {len(small)} bytes, not {size}")
+            self.mini.append((name, small))
+            return
+        start = self.next_sector
+        self.file.seek(SECTOR_SIZE * (start + 1))
+        written = 0
+        for chunk in chunks:
+            self.file.write(chunk)
+            written += len(chunk)
+        if written != size:
+            raise CompoundFileError(f"stream {name!r} has {written} bytes, not {size}")
+        self._pad(size)
+        self.streams[name] = (start, size, False)
+
+    def add_file_stream(self, name, source, chunk_size=1024 * 1024):
+        """Add a stream copied from a file (an embedded cabinet...)."""
+        size = os.path.getsize(source)
+
+        def chunks():
+            with open(source, 'rb') as f:
+                while True:
+                    data = f.read(chunk_size)
+                    if not data:
+                        break
+                    yield data
+        self.add_stream(name, chunks(), size)
+
+    def _pad(self, size):
+        count = _sectors(size)
+        if size % SECTOR_SIZE:
+            self.file.write(b'\0' * (SECTOR_SIZE - size % SECTOR_SIZE))
+        self.runs.append((self.next_sector, count))
+        self.next_sector += count
+        return count
+
+    def _write_run(self, data):
+        start = self.next_sector
+        self.file.seek(SECTOR_SIZE * (start + 1))
+        self.file.write(data)
+        self._pad(len(data))
+        return start
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._finish()
+            self.file.close()
+            os.replace(self.tmp_path, self.path)
+        except BaseException:
+            self.file.close()
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+            raise
+
+    def abort(self):
+        """Drop the file being written."""
+        if not self.closed:
+            self.closed = True
+            self.file.close()
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _finish(self):
+        # Mini stream: the small streams in 64-byte mini sectors, one chain each
+        ministream = bytearray()
+        minifat = array('I')
+        for name, data in self.mini:
+            start = len(ministream) // MINI_SECTOR_SIZE
+            count = _sectors(len(data), MINI_SECTOR_SIZE)
+            ministream += data
+            ministream += b'\0' * (count * MINI_SECTOR_SIZE - len(data))
+            minifat.extend(range(start + 1, start + count))
+            if count:
+                minifat.append(ENDOFCHAIN)
+            self.streams[name] = (start if count else ENDOFCHAIN, len(data), True)
+        root_start = self._write_run(bytes(ministream)) if ministream else ENDOFCHAIN
+
+        # Directory: root, then the streams in tree order
+        names = sorted(self.streams, key=name_key)
+        ids = {name: index + 1 for index, name in enumerate(names)}
+        tree_root, nodes = _tree([ids[name] for name in names])
+        entries = [_ENTRY.pack(_entry_name('Root Entry'), _name_size('Root Entry'), STGTY_ROOT, BLACK,
+                               NOSTREAM, NOSTREAM, tree_root, self.clsid, 0, 0, self.mtime,
+                               root_start, len(ministream))]
+        for name in names:
+            start, size, _ = self.streams[name]
+            left, right, color = nodes[ids[name]]
+            entries.append(_ENTRY.pack(_entry_name(name), _name_size(name), STGTY_STREAM, color, left, right,
+                                       NOSTREAM, b'\0' * 16, 0, 0, 0, start if size else ENDOFCHAIN, size))
+        while len(entries) % (SECTOR_SIZE // _ENTRY.size):
+            entries.append(_ENTRY.pack(b'', 0, 0, RED, NOSTREAM, NOSTREAM, NOSTREAM, b'\0' * 16, 0, 0, 0, 0, 0))
+        directory_start = self._write_run(b''.join(entries))
+
+        minifat_start = ENDOFCHAIN
+        minifat_sectors = 0
+        if minifat:
+            while len(minifat) % _IDS_PER_SECTOR:
+                minifat.append(FREESECT)
+            minifat_sectors = len(minifat) // _IDS_PER_SECTOR
+            minifat_start = self._write_run(_le_bytes(minifat))
+
+        # FAT and DIFAT sectors go last; they must also describe themselves
+        data_sectors = self.next_sector
+        fat_sectors = difat_sectors = 0
+        while True:
+            needed_fat = _sectors(data_sectors + fat_sectors + difat_sectors, _IDS_PER_SECTOR)
+            needed_difat = _sectors(max(0, needed_fat - _HEADER_DIFAT), _IDS_PER_SECTOR - 1)
+            if (needed_fat, needed_difat) == (fat_sectors, difat_sectors):
+                break
+            fat_sectors, difat_sectors = needed_fat, needed_difat
+        fat = array('I', [FREESECT]) * (fat_sectors * _IDS_PER_SECTOR)
+        for start, count in self.runs:
+            fat[start:start + count - 1] = array('I', range(start + 1, start + count))
+            fat[start + count - 1] = ENDOFCHAIN
+        fat_start = data_sectors
+        fat[fat_start:fat_start + fat_sectors] = array('I', [FATSECT]) * fat_sectors
+        difat_start = fat_start + fat_sectors
+        fat[difat_start:difat_start + difat_sectors] = array('I', [DIFSECT]) * difat_sectors
+        self.file.seek(SECTOR_SIZE * (fat_start + 1))
+        self.file.write(_le_bytes(fat))
+
+        fat_ids = list(range(fat_start, fat_start + fat_sectors))
+        header_difat = array('I', fat_ids[:_HEADER_DIFAT])
+        header_difat.extend([FREESECT] * (_HEADER_DIFAT - len(header_difat)))
+        rest = fat_ids[_HEADER_DIFAT:]
+        for index in range(difat_sectors):
+            ids_in_sector = rest[index * (_IDS_PER_SECTOR - 1):(index + 1) * (_IDS_PER_SECTOR - 1)]
+            sector = array('I', ids_in_sector + [FREESECT] * (_IDS_PER_SECTOR - 1 - len(ids_in_sector)))
+            sector.append(difat_start + index + 1 if index + 1 < difat_sectors else ENDOFCHAIN)
+            self.file.write(_le_bytes(sector))
+
+        header = _HEADER.pack(SIGNATURE, b'\0' * 16, 0x003E, 0x0003, 0xFFFE, 9, 6, b'\0' * 6, 0, fat_sectors,
+                              directory_start, 0, MINI_STREAM_CUTOFF, minifat_start, minifat_sectors,
+                              difat_start if difat_sectors else ENDOFCHAIN, difat_sectors)
+        self.file.seek(0)
+        self.file.write(header + _le_bytes(header_difat))
+
+
+def _entry_name(name):
+    return (name + '\0').encode('utf-16-le')
+
+
+def _name_size(name):
+    return len(_entry_name(name))
+
+
+class CompoundFileReader(object):
+    """
+    Reads the streams of a compound file.
+
+    The header, FAT and directory are read when opening; stream contents
+    only by read().  Streams in sub-storages are named 'storage/stream'.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self._load()
+        except BaseException:
+            self.file.close()
+            raise
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _load(self):
+        header = self.file.read(_HEADER.size + 4 * _HEADER_DIFAT)
+        if len(header) < _HEADER.size + 4 * _HEADER_DIFAT or header[:8] != SIGNATURE:
+            raise CompoundFileError(f"{self.path} is not a compound file")
+        (_, _, _, major, _, sector_shift, mini_shift, _, _, fat_sectors, directory_start, _, self.mini_cutoff,
+         minifat_start, _, difat_start, difat_sectors) = _HEADER.unpack_from(header)
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_shift
+        if major not in (3, 4) or self.sector_size not in (512, 4096):
+            raise CompoundFileError(f"{self.path}: unsupported compound file version {major}")
+        self.file.seek(0, os.SEEK_END)
+        self.size = self.file.tell()
+
+        fat_ids = list(_le_array('I', header[_HEADER.size:]))
+        sector = difat_start
+        ids_per_sector = self.sector_size // 4
+        for _ in range(difat_sectors):
+            if sector >= DIFSECT:
+                break
+            ids = _le_array('I', self._sector(sector))
+            fat_ids.extend(ids[:-1])
+            sector = ids[-1]
+        fat_ids = [i for i in fat_ids[:fat_sectors] if i < DIFSECT]
+        self.fat = _le_array('I', self._read_runs(fat_ids))
+        if len(self.fat) < ids_per_sector * len(fat_ids):
+            raise CompoundFileError(f"{self.path} is truncated")
+
+        directory = self._read_chain(directory_start)
+        self.entries = [_ENTRY.unpack_from(directory, offset)
+                        for offset in range(0, len(directory) - _ENTRY.size + 1, _ENTRY.size)]
+        if not self.entries or self.entries[0][2] != STGTY_ROOT:
+            raise CompoundFileError(f"{self.path}: no root storage")
+        root = self.entries[0]
+        self.clsid = root[7]
+        self.minifat = _le_array('I', self._read_chain(minifat_start)) if minifat_start < DIFSECT else array('I')
+        self._ministream = None
+        self._ministream_start = root[11]
+        self._ministream_size = root[12]
+        self.streams = {}
+        self._chains = {}
+        self._collect(root[6], '')
+
+    def _collect(self, entry_id, prefix):
+        # Iterative walk of a sibling tree, descending into storages
+        stack = [entry_id]
+        seen = set()
+        while stack:
+            entry_id = stack.pop()
+            if entry_id == NOSTREAM or entry_id in seen:
+                continue
+            if entry_id >= len(self.entries):
+                raise CompoundFileError(f"{self.path}: directory entry {entry_id} out of range")
+            seen.add(entry_id)
+            raw_name, name_size, kind, _, left, right, child, _, _, _, _, start, size = self.entries[entry_id]
+            name = raw_name[:max(0, name_size - 2)].decode('utf-16-le', 'surrogatepass')
+            stack.extend((left, right))
+            if kind == STGTY_STREAM:
+                self.streams[prefix + name] = (start, size)
+            elif kind == STGTY_STORAGE:
+                self._collect(child, f"{prefix}{name}/")
+
+    def _sector(self, sector):
+        self.file.seek(self.sector_size * (sector + 1))
+        return self.file.read(self.sector_size)
+
+    def _chain(self, start, table):
+        sector = start
+        for _ in range(len(table) + 1):
+            if sector >= DIFSECT:
+                return
+            if sector >= len(table):
+                raise CompoundFileError(f"{self.path}: sector chain points past the end")
+            yield sector
+            sector = table[sector]
+        raise CompoundFileError(f"{self.path}: sector chain loops")
+
+    def _read_runs(self, sectors, skip=0, size=None):
+        # Runs of contiguous sectors are read in one go; a run ends where the
+        # next sector is not the one after it
+        sectors = sectors if isinstance(sectors, array) else array('I', sectors)
+        if not sectors:
+            return b''
+        ends = list(compress(count(1), map(ne, map(sub, sectors[1:], sectors), repeat(1))))
+        if not ends:
+            # One run: only the range is read
+            self.file.seek(self.sector_size * (sectors[0] + 1) + skip)
+            return self.file.read(self.sector_size * len(sectors) - skip if size is None else size)
+        out = bytearray()
+        for begin, end in zip([0] + ends, ends + [len(sectors)]):
+            self.file.seek(self.sector_size * (sectors[begin] + 1))
+            out += self.file.read(self.sector_size * (end - begin))
+        return bytes(out[skip:] if size is None else out[skip:skip + size])
+
+    def _stream_chain(self, start, length):
+        # Streams written in one piece are contiguous: checked at once instead of walked
+        sectors = -(-length // self.sector_size)
+        contiguous = array('I', range(start + 1, start + sectors))
+        if start + sectors <= len(self.fat) and self.fat[start:start + sectors - 1] == contiguous \
+                and self.fat[start + sectors - 1] == ENDOFCHAIN:
+            return array('I', range(start, start + sectors))
+        return array('I', self._chain(start, self.fat))
+
+    def _read_chain(self, start, size=None):
+        return self._read_runs(self._chain(start, self.fat), size=size)
+
+    def read(self, name, offset=0, size=None):
+        """The contents of a stream, or size bytes of it from offset."""
+        try:
+            start, length = self.streams[name]
+        except KeyError:
+            raise CompoundFileError(f"{self.path}: no stream {name!r}") from None
+        end = length if size is None else min(length, offset + size)
+        if end <= offset:
+            return b''
+        if length < self.mini_cutoff:
+            if self._ministream is None:
+                self._ministream = self._read_chain(self._ministream_start, self._ministream_size)
+            out = bytearray()
+            for sector in self._chain(start, self.minifat):
+                position = sector * self.mini_sector_size
+                out += self._ministream[position:position + self.mini_sector_size]
+            data = bytes(out[:length])[offset:end]
+        else:
+            # Only the sectors holding the range are read; the chain is walked once per stream
+            chain = self._chains.get(name)
+            if chain is None:
+                chain = self._chains[name] = self._stream_chain(start, length)
+            first = offset // self.sector_size
+            last = (end - 1) // self.sector_size + 1
+            data = self._read_runs(chain[first:last], offset - first * self.sector_size, end - offset)
+        if len(data) != end - offset:
+            raise CompoundFileError(f"{self.path}: stream {name!r} is truncated")
+        return data
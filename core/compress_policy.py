@@ -0,0 +1,135 @@
+"""
+Per-file compression decisions: skip files that will not compress.
+
+Payloads carry plenty of already compressed files (.zip, .jpg, .cab, .msi,
+.7z...).  Compressing them again burns CPU for a ratio of about 100%, or a
+little worse.  CompressionPolicy decides per file whether it goes to a
+compressed or a stored folder:
+
+* small files are always compressed (probing would cost more than it saves)
+* other files are probed: a sample from the start and one from the middle
+  are compressed at the writer's level, and the file is stored if the
+  samples do not shrink below a threshold
+
+The decision depends on the file's content only, never on earlier builds,
+so the same inputs always give the same cabinets.  The per-extension
+history (files probed, files found incompressible, and the sample bytes,
+compressed bytes and seconds) is kept between builds by the caller for
+reporting, see db.build_records.load_extension_stats().
+"""
+
+import os
+import time
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 32 * 1024        # Bytes per sample (one from the start, one from the middle)
+MIN_PROBE_SIZE = 4 * 1024      # Smaller files are compressed without probing
+STORE_THRESHOLD = 0.97         # Compressed/raw ratio above which a sample is incompressible
+
+
+class ExtensionStats(object):
+    """What probing files of one extension found."""
+    __slots__ = ('files', 'incompressible', 'sample_bytes', 'sample_compressed', 'sample_seconds')
+
+    def __init__(self, files=0, incompressible=0, sample_bytes=0, sample_compressed=0, sample_seconds=0.0):
+        self.files = files
+        self.incompressible = incompressible
+        self.sample_bytes = sample_bytes
+        self.sample_compressed = sample_compressed
+        self.sample_seconds = sample_seconds
+
+    @property
+    def ratio(self):
+        return self.sample_compressed / self.sample_bytes if self.sample_bytes else 1.0
+
+    @property
+    def seconds_per_byte(self):
+        return self.sample_seconds / self.sample_bytes if self.sample_bytes else 0.0
+
+
+class PolicyReport(object):
+    """What the decisions of one build are estimated to have saved and cost."""
+
+    def __init__(self):
+        self.files_probed = 0
+        self.files_stored = 0
+        self.bytes_total = 0
+        self.bytes_stored = 0
+        self.probe_seconds = 0.0
+        self.cpu_seconds_saved = 0.0
+        self.bytes_lost = 0.0
+
+    @property
+    def ratio_lost(self):
+        """Growth of the cabinet from storing, as a share of the payload."""
+        return self.bytes_lost / self.bytes_total if self.bytes_total else 0.0
+
+    def __str__(self):
+        return (f"{self.files_stored} files ({self.bytes_stored} bytes) stored uncompressed, "
+                f"{self.files_probed} probed in {self.probe_seconds:.2f}s; "
+                f"~{self.cpu_seconds_saved:.2f} CPU s saved for ~{self.bytes_lost:.0f} bytes "
+                f"({self.ratio_lost:.2%}) of ratio lost")
+
+
+def extension_of(path):
+    return os.path.splitext(path)[1].lower()
+
+
+class CompressionPolicy(object):
+    """
+    Decides, file by file, whether compressing is worth it.
+
+    Args:
+        level: zlib level the writer compresses with (probes use it too)
+        history: dict of extension -> ExtensionStats from earlier builds;
+            updated in place with this build's probes (not read for decisions)
+    """
+
+    def __init__(self, level=6, history=None):
+        self.level = level
+        self.history = history if history is not None else {}
+        self.report = PolicyReport()
+
+    def _probe(self, path, size):
+        samples = []
+        with open(path, 'rb') as f:
+            samples.append(f.read(SAMPLE_SIZE))
+            if size > 2 * SAMPLE_SIZE:
+                f.seek(size // 2)
+                samples.append(f.read(SAMPLE_SIZE))
+        raw = sum(len(s) for s in samples)
+        start = time.perf_counter()
+        compressed = sum(len(zlib.compress(s, self.level)) for s in samples)
+        return raw, compressed, time.perf_counter() - start
+
+    def should_store(self, path, size):
+        """True if the file should go to a stored (uncompressed) folder."""
+        report = self.report
+        report.bytes_total += size
+        if size < MIN_PROBE_SIZE:
+            return False
+        try:
+            raw, compressed, seconds = self._probe(path, size)
+        except OSError as e:
+            logger.warning(f"Unable to probe {path}: {e}")
+            return False
+        report.files_probed += 1
+        report.probe_seconds += seconds
+        ratio = compressed / raw if raw else 1.0
+        store = ratio > STORE_THRESHOLD
+        stats = self.history.setdefault(extension_of(path), ExtensionStats())
+        stats.files += 1
+        if store:
+            stats.incompressible += 1
+        stats.sample_bytes += raw
+        stats.sample_compressed += compressed
+        stats.sample_seconds += seconds
+        if store:
+            report.files_stored += 1
+            report.bytes_stored += size
+            report.cpu_seconds_saved += size * (seconds / raw if raw else 0.0)
+            report.bytes_lost += size * (1 - ratio)
+        return store
@@ -0,0 +1,199 @@
+"""
+Binary deltas between two versions of a file.
+
+make_delta() looks both files up by their anchor blocks: the blocks of
+BLOCK_SIZE bytes whose rolling checksum (the sum of their bytes, each put
+through a fixed permutation, modulo 256) is below 256 / ANCHOR_SPACING.
+Whether a block is an anchor depends on its bytes only, so a region the
+two files share has the same anchors in both, wherever it moved.  The
+checksums of all the blocks of a chunk are computed at once, as 16-bit
+lanes of one integer, so the scan does not step through the file a byte at
+a time in Python and unrelated input costs about as much as similar input.
+The old file's anchor blocks are indexed and the new file's looked up; a
+match is extended backwards over equal bytes and forwards window by window
+for as long as at least half of the bytes of a window are equal, so a
+region of code that only moved, or whose embedded addresses changed, stays
+one match.  Like bsdiff, the delta keeps three streams:
+
+    ops     (old offset, diff length, extra length) per match
+    diff    new XOR old over each match: zero wherever the bytes agree
+    extra   the new bytes between matches
+
+The delta is not compressed itself; the mostly zero diff stream is what the
+patch package's compression shrinks.
+
+File layout (little endian):
+    header  '<4sHQQI' magic, version, old size, new size, op count
+    ops     '<QQQ' per op
+    diff    sum of the diff lengths
+    extra   sum of the extra lengths
+"""
+
+import re
+import struct
+import hashlib
+from itertools import compress
+
+MAGIC = b'PDLT'
+VERSION = 1
+BLOCK_SIZE = 16         # Bytes per anchor block (at most 256, the lane sums are 16 bits)
+ANCHOR_SPACING = 16     # One block in this many is an anchor, on average
+WINDOW = 64             # Bytes compared at a time when extending a match
+CHUNK_SIZE = 1 << 20    # Blocks whose checksums are computed at once
+_HEADER = struct.Struct('<4sHQQI')
+_OP = struct.Struct('<QQQ')
+# Spreads the byte values, so that the sums of text or code are not all alike
+_PERMUTATION = bytes(sorted(range(256), key=lambda value: hashlib.sha256(bytes([value])).digest()))
+# Checksum -> 1 for the anchors, found as the 1s of the translated checksums
+_ANCHORS = bytes(1 if value < 256 // ANCHOR_SPACING else 0 for value in range(256))
+_MARK = re.compile(b'\x01')
+
+
+class DeltaError(Exception):
+    """A delta is malformed or does not apply to the given file."""
+
+
+def _xor(a, b):
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+
+def _extend(old, old_start, new, new_start):
+    """Length of the approximate match starting at old_start/new_start."""
+    limit = min(len(old) - old_start, len(new) - new_start)
+    length = 0
+    while length < limit:
+        size = min(WINDOW, limit - length)
+        x = _xor(old[old_start + length:old_start + length + size],
+                 new[new_start + length:new_start + length + size])
+        equal = x.count(0)
+        if equal * 2 < size:
+            # Keep the equal prefix of the window that ends the match
+            length += size - len(x.lstrip(b'\0'))
+            break
+        length += size
+        if equal == size:
+            # Equal windows come in long runs, compared WINDOW at a time
+            size = min(WINDOW * WINDOW, limit - length)
+            if old[old_start + length:old_start + length + size] == new[new_start + length:new_start + length + size]:
+                length += size
+    return length
+
+
+def _extend_back(old, old_end, new, new_end, limit):
+    """Length of the equal bytes that end at old_end/new_end, at most limit."""
+    length = 0
+    while length < limit:
+        size = min(WINDOW, limit - length)
+        x = _xor(old[old_end - length - size:old_end - length], new[new_end - length - size:new_end - length])
+        equal = size - len(x.rstrip(b'\0'))
+        length += equal
+        if equal < size:
+            break
+    return length
+
+
+def _anchors(data, start, stop, block_size):
+    """Offsets of the anchor blocks that start in data[start:stop]."""
+    lanes = bytearray(2 * (stop - start + block_size - 1))
+    lanes[0::2] = data[start:stop + block_size - 1].translate(_PERMUTATION)
+    # Lane i of power holds the sum of the width bytes from i; those of the
+    # powers of two in block_size are added up, one after the other
+    power = int.from_bytes(lanes, 'little')
+    sums = 0
+    summed = 0
+    width = 1
+    while width <= block_size:
+        if block_size & width:
+            sums += power >> (16 * summed)
+            summed += width
+        power += power >> (16 * width)
+        width *= 2
+    marks = sums.to_bytes(len(lanes), 'little')[0:2 * (stop - start):2].translate(_ANCHORS)
+    return [start + match.start() for match in _MARK.finditer(marks)]
+
+
+def _matches(old, new, block_size):
+    """Yield (old offset, new offset, length) of the matches, in new file order."""
+    index = {}
+    # Blocks repeated in the old file keep their first offset
+    old_blocks = len(old) - block_size + 1
+    for start in reversed(range(0, old_blocks, CHUNK_SIZE)):
+        anchors = _anchors(old, start, min(start + CHUNK_SIZE, old_blocks), block_size)
+        index.update(zip(reversed([old[offset:offset + block_size] for offset in anchors]), reversed(anchors)))
+    if not index:
+        return
+    covered = 0
+    new_blocks = len(new) - block_size + 1
+    while covered < new_blocks:
+        # The anchors of the next chunk that no match covers yet
+        stop = min(covered + CHUNK_SIZE, new_blocks)
+        anchors = _anchors(new, covered, stop, block_size)
+        blocks = [new[position:position + block_size] for position in anchors]
+        for position, offset in compress(zip(anchors, map(index.get, blocks)), map(index.__contains__, blocks)):
+            if position < covered:
+                continue
+            back = _extend_back(old, offset, new, position, min(position - covered, offset))
+            length = back + block_size + _extend(old, offset + block_size, new, position + block_size)
+            yield offset - back, position - back, length
+            covered = position - back + length
+        covered = max(covered, stop)
+
+
+def make_delta(old, new, block_size=BLOCK_SIZE):
+    """The delta that turns old into new (both bytes)."""
+    ops = []
+    diff = bytearray()
+    extra = bytearray()
+    new_view = memoryview(new)
+    old_view = memoryview(old)
+    ops_extra_from = 0
+    pending = None
+    for old_offset, new_offset, length in _matches(old, new, block_size):
+        if pending is None:
+            # New bytes before the first match
+            ops.append((0, 0, new_offset))
+        else:
+            ops.append((pending[0], pending[1], new_offset - ops_extra_from))
+        extra += new_view[ops_extra_from:new_offset]
+        diff += _xor(old_view[old_offset:old_offset + length], new_view[new_offset:new_offset + length])
+        pending = (old_offset, length)
+        ops_extra_from = new_offset + length
+    if pending is None:
+        ops.append((0, 0, len(new)))
+    else:
+        ops.append((pending[0], pending[1], len(new) - ops_extra_from))
+    extra += new_view[ops_extra_from:]
+    return b''.join([_HEADER.pack(MAGIC, VERSION, len(old), len(new), len(ops)),
+                     b''.join(_OP.pack(*op) for op in ops), diff, extra])
+
+
+def apply_delta(old, delta):
+    """Rebuild the new file from old and the delta made by make_delta()."""
+    if len(delta) < _HEADER.size:
+        raise DeltaError("truncated delta")
+    magic, version, old_size, new_size, op_count = _HEADER.unpack_from(delta)
+    if magic != MAGIC or version != VERSION:
+        raise DeltaError("not a delta, or an unsupported version")
+    if len(old) != old_size:
+        raise DeltaError(f"the delta applies to a file of {old_size} bytes, not {len(old)}")
+    if len(delta) < _HEADER.size + op_count * _OP.size:
+        raise DeltaError("truncated delta")
+    ops = list(_OP.iter_unpack(delta[_HEADER.size:_HEADER.size + op_count * _OP.size]))
+    delta_view = memoryview(delta)
+    old_view = memoryview(old)
+    diff_position = _HEADER.size + op_count * _OP.size
+    extra_position = diff_position + sum(op[1] for op in ops)
+    if extra_position + sum(op[2] for op in ops) != len(delta):
+        raise DeltaError("the delta's streams do not match its ops")
+    new = bytearray()
+    for old_offset, diff_length, extra_length in ops:
+        if old_offset + diff_length > old_size:
+            raise DeltaError("the delta reads past the end of the old file")
+        new += _xor(old_view[old_offset:old_offset + diff_length],
+                    delta_view[diff_position:diff_position + diff_length])
+        new += delta_view[extra_position:extra_position + extra_length]
+        diff_position += diff_length
+        extra_position += extra_length
+    if len(new) != new_size:
+        raise DeltaError(f"the delta produced {len(new)} bytes, expected {new_size}")
+    return bytes(new)
@@ -0,0 +1,135 @@
+"""
+Fingerprint of everything a build's outputs are made from, so that a build
+whose inputs have not changed can reuse the outputs of the last one.
+
+BuildFingerprint is a SHA-256 over labelled parts, added in a fixed order:
+
+    product     product and feature info, the product graph (features,
+                components, directories, registry values) and the
+                ComponentIds recorded for the product
+    files       per file of the manifest: id, path, size, version,
+                attributes, sequence, component and content hash, plus the
+                size and mtime of the source on disk now (a file edited
+                since the last scan changes the fingerprint)
+    code        the bytes of the modules that write the outputs
+                (code_version())
+    options     every option that can change an output (option_values())
+
+Outputs are recorded with their size and mtime (describe_outputs()); they
+are intact while every one of them still exists with both unchanged.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Packages whose code writes the outputs
+CODE_PACKAGES = ('actions', 'core', 'db')
+
+# Options that do not change what is written (how fast, or what runs after)
+NEUTRAL_OPTIONS = frozenset(['cab_workers', 'skipgoals', 'debugbuild', 'local', 'patch_baseline',
+                             'force_rebuild', 'incremental', 'stage_dir'])
+
+
+def _json(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def code_version(root, packages=CODE_PACKAGES):
+    """SHA-256 over the non-test modules of the packages below root."""
+    digest = hashlib.sha256()
+    for package in packages:
+        directory = os.path.join(root, package)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.py') or name.startswith('test_'):
+                continue
+            digest.update(f"{package}/{name}\0".encode('utf-8'))
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(f.read())
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def option_values(options):
+    """The public, plain-valued options that can change an output, by name."""
+    values = {}
+    for name in dir(options):
+        if name.startswith('_') or name in NEUTRAL_OPTIONS:
+            continue
+        value = getattr(options, name)
+        if value is None or isinstance(value, (str, int, float, bool, list, tuple)):
+            values[name] = value
+    return values
+
+
+class BuildFingerprint(object):
+    """
+    Accumulates the inputs of a build.
+
+    Usage:
+        fingerprint = BuildFingerprint()
+        fingerprint.add('product', product_info)
+        fingerprint.add_rows('features', graph.features.values())
+        fingerprint.add_files(root_path, files)
+        fingerprint.hexdigest()
+    """
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.parts = 0
+
+    def add(self, label, value):
+        """Add a JSON-serializable value."""
+        self.digest.update(_json([label, value]) + b'\n')
+        self.parts += 1
+
+    def add_rows(self, label, rows):
+        """Add a sequence of rows (tuples of plain values), in their order."""
+        self.digest.update(_json(label) + b'\n')
+        count = 0
+        for row in rows:
+            self.digest.update(_json(list(row)) + b'\n')
+            count += 1
+        self.digest.update(_json(['end', label, count]) + b'\n')
+        self.parts += 1
+
+    def add_files(self, root, files):
+        """Add the FileRecords of the manifest and the current size and mtime of their sources."""
+        def rows():
+            for f in files:
+                try:
+                    st = os.stat(os.path.join(root, f.path))
+                    source = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    source = None
+                yield tuple(f) + (source,)
+        self.add_rows('files', rows())
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def describe_outputs(paths):
+    """path -> [size, mtime_ns] of the outputs of a build."""
+    outputs = {}
+    for path in paths:
+        st = os.stat(path)
+        outputs[os.path.abspath(path)] = [st.st_size, st.st_mtime_ns]
+    return outputs
+
+
+def changed_outputs(outputs):
+    """The outputs of describe_outputs() that are gone or no longer have their size and mtime."""
+    changed = []
+    for path, (size, mtime_ns) in sorted(outputs.items()):
+        try:
+            st = os.stat(path)
+        except OSError:
+            changed.append(path)
+            continue
+        if st.st_size != size or st.st_mtime_ns != mtime_ns:
+            changed.append(path)
+    return changed
@@ -0,0 +1,115 @@
+"""
+Referential checks of an MSI database, in the spirit of the ICE validators
+(ICE03 foreign keys, ICE21 components without a feature, ICE02 key paths):
+every File belongs to a Component, every Component to a Directory and,
+through FeatureComponents, to a Feature.
+
+The checks run on stored values (core/msi_reader.py): strings are interned
+in the pool, so a foreign key matches a primary key exactly when their
+string ids are equal.  Each referenced table gets one hash set of its keys
+and each referencing column one pass, so the cost is linear in the rows
+read, and only the tables the checks name are read at all.  Values are
+decoded for the problems found only.
+"""
+
+# (table, column, referenced table): the column holds a primary key of the referenced table
+REFERENCES = [
+    ('File', 'Component_', 'Component'),
+    ('Component', 'Directory_', 'Directory'),
+    ('Directory', 'Directory_Parent', 'Directory'),
+    ('FeatureComponents', 'Feature_', 'Feature'),
+    ('FeatureComponents', 'Component_', 'Component'),
+    ('Feature', 'Feature_Parent', 'Feature'),
+    ('Feature', 'Directory_', 'Directory'),
+    ('DuplicateFile', 'Component_', 'Component'),
+    ('DuplicateFile', 'File_', 'File'),
+    ('Registry', 'Component_', 'Component'),
+]
+
+# Component.Attributes bit of a key path in the Registry table
+REGISTRY_KEY_PATH = 0x0004
+
+
+def _keys(reader, name):
+    """Stored primary keys of a table (empty for a missing table)."""
+    if name not in reader.schema:
+        return {}
+    return reader.index(name)
+
+
+def _has_column(reader, name, column):
+    return name in reader.schema and any(column_name == column for column_name, _ in reader.columns(name))
+
+
+def _key_text(reader, name, row):
+    key = reader.row(name, row)[:reader.key_count(name)]
+    return '/'.join('' if value is None else str(value) for value in key)
+
+
+def check_references(reader, tables=None):
+    """
+    Problems with the references between the tables of a database, as messages.
+
+    Args:
+        reader: MsiReader of the database
+        tables: Only check the references from these tables (default all)
+    """
+    problems = []
+    for name, column, target in REFERENCES:
+        if (tables is not None and name not in tables) or not _has_column(reader, name, column):
+            continue
+        keys = _keys(reader, target)
+        values = reader.stored_column(name, column)
+        for row in (row for row, value in enumerate(values) if value and value not in keys):
+            problems.append(f"{name} {_key_text(reader, name, row)}: {column} references "
+                            f"{reader.string(values[row])!r}, which is not in {target}")
+
+    if tables is None or 'Component' in tables:
+        problems.extend(_check_components(reader))
+    if tables is None or 'File' in tables:
+        problems.extend(_check_sequences(reader))
+    return problems
+
+
+def _check_components(reader):
+    """Components without a feature (ICE21) and key paths that are not the component's own file or value."""
+    if not _has_column(reader, 'Component', 'KeyPath'):
+        return []
+    problems = []
+    featured = set()
+    if _has_column(reader, 'FeatureComponents', 'Component_'):
+        featured = set(reader.stored_column('FeatureComponents', 'Component_'))
+    components = reader.stored_column('Component', 0)
+    for row in (row for row, value in enumerate(components) if value not in featured):
+        problems.append(f"Component {reader.string(components[row])} belongs to no feature")
+
+    key_paths = reader.stored_column('Component', 'KeyPath')
+    attributes = reader.column('Component', 'Attributes')
+    for row, key_path in enumerate(key_paths):
+        if not key_path:
+            continue
+        target = 'Registry' if (attributes[row] or 0) & REGISTRY_KEY_PATH else 'File'
+        found = _keys(reader, target).get(key_path)
+        if found is None:
+            problems.append(f"Component {reader.string(components[row])}: KeyPath "
+                            f"{reader.string(key_path)!r} is not in {target}")
+        elif reader.stored_column(target, 'Component_')[found] != components[row]:
+            problems.append(f"Component {reader.string(components[row])}: KeyPath "
+                            f"{reader.string(key_path)!r} belongs to another component")
+    return problems
+
+
+def _check_sequences(reader):
+    """Files whose sequence no Media row covers."""
+    if not _has_column(reader, 'File', 'Sequence') or not reader.row_count('File'):
+        return []
+    last = [value for value in reader.column('Media', 'LastSequence') if value is not None] \
+        if _has_column(reader, 'Media', 'LastSequence') else []
+    if not last:
+        return ["File rows exist but no Media row covers their sequences"]
+    covered = max(last)
+    sequences = reader.column('File', 'Sequence')
+    files = reader.stored_column('File', 0)
+    return [f"File {reader.string(files[row])}: Sequence {sequences[row]} is beyond the last Media "
+            f"row's LastSequence {covered}"
+            for row, sequence in enumerate(sequences) if sequence is not None and sequence > covered]
@@ -0,0 +1,494 @@
+"""
+MSI database reader: the string pool, table schemas and table streams of a
+database, as written by core/msidb.py (see there for the layout).
+
+Opening a database reads the compound file directory, the string pool and
+the two system tables, nothing else.  Table streams are column-major, so
+one column of a table is a single byte range of its stream: a column is
+read and widened when it is first used, and only then; decoding it into
+Python values (strings looked up in the pool) is a second, cached step.
+Checking one table of a large database reads that table's columns only.
+
+Values come in two forms:
+
+    stored      as the tables hold them: string ids, integers with their
+                bias, 0 for NULL; one array('I') per column
+                (stored_column(), stored_values()).  Strings are interned,
+                so equal strings have equal ids and keys can be compared
+                without decoding.
+    decoded     Python values, None for NULL (column(), rows(), row())
+
+index() builds a hash index on a table's primary key, or on any columns
+(a foreign key), the first time it is asked for; find() and references()
+use them for lookups by key.
+
+Inspect a database from the command line:
+
+    python -m core.msi_reader tables Product.msi
+    python -m core.msi_reader rows Product.msi File --where Component_=MainComponent
+    python -m core.msi_reader check Product.msi
+"""
+
+import os
+import sys
+import struct
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from core.cfb import CompoundFileReader, CompoundFileError
+from core.msidb import MsiError, encode_stream_name, is_string, TYPE_KEY, LONG_STRING_REFS, SUMMARY_STREAM
+
+SYSTEM_STREAMS = ('_StringPool', '_StringData', '_Tables', '_Columns')
+
+# Strings per block of the pool's offset index
+_BLOCK = 4096
+
+
+def _widen(raw, width, count):
+    """The values of a stored column, 2, 3 or 4 bytes each, as array('I')."""
+    if width == 4:
+        values = array('I', raw[:4 * count])
+    else:
+        out = bytearray(4 * count)
+        for byte in range(width):
+            out[byte::4] = raw[byte:width * count:width]
+        values = array('I', bytes(out))
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class _StoredCells(object):
+    """A column's stored values read cell by cell, for bisecting a column that was not read."""
+
+    def __init__(self, reader, name, number):
+        self.reader, self.name, self.number = reader, name, number
+
+    def __len__(self):
+        return self.reader.row_count(self.name)
+
+    def __getitem__(self, row):
+        return self.reader.stored_cell(self.name, self.number, row)
+
+
+class MsiReader(object):
+    """
+    An MSI database opened for reading.
+
+    Usage:
+        with MsiReader(path) as reader:
+            for row in reader.rows('File'):
+                ...
+            component = reader.find('Component', 'MainComponent')
+
+    Attributes:
+        codepage: Codepage of the strings
+        refs: Reference count of each string id, as stored (saturated at 0xFFFF)
+        ref_width: Bytes per string id in the table streams (2 or 3)
+        tables: Table names, as listed in _Tables
+        schema: Table name -> [(column name, type bits)]
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.cfb = CompoundFileReader(path)
+        self._strings = None   # all strings, once decoded together
+        self._string_ids = {}  # string -> id, of the strings looked up
+        try:
+            self._load_pool()
+            self._load_schema()
+        except BaseException:
+            self.cfb.close()
+            raise
+        self._stored = {}      # (table, column number) -> array('I')
+        self._decoded = {}     # (table, column number) -> list
+        self._indexes = {}     # (table, column numbers) -> dict
+
+    def close(self):
+        self.cfb.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stream(self, name, table=False):
+        """A stream's bytes (b'' for a table without rows)."""
+        encoded = encode_stream_name(name, table)
+        if encoded not in self.cfb.streams:
+            if table:
+                return b''
+            raise MsiError(f"{self.path}: no stream {name!r}")
+        return self.cfb.read(encoded)
+
+    def other_streams(self):
+        """Compound file names of the streams that are neither tables nor the summary (Binary.*...)."""
+        tables = {encode_stream_name(name, table=True) for name in list(self.tables) + list(SYSTEM_STREAMS)}
+        return [name for name in sorted(self.cfb.streams) if name not in tables and name != SUMMARY_STREAM]
+
+    # String pool
+
+    def _load_pool(self):
+        pool = self.stream('_StringPool', table=True)
+        data = self.stream('_StringData', table=True)
+        if len(pool) < 4:
+            raise MsiError(f"{self.path}: no string pool")
+        codepage, = struct.unpack_from('<I', pool)
+        self.ref_width = 3 if codepage & LONG_STRING_REFS else 2
+        self.codepage = codepage & ~LONG_STRING_REFS
+        self.encoding = 'utf-8' if self.codepage == 65001 else f"cp{self.codepage}" if self.codepage else 'ascii'
+        entries = array('H', pool[4:4 + (len(pool) - 4) // 4 * 4])
+        if sys.byteorder != 'little':
+            entries.byteswap()
+        lengths = entries[0::2]
+        counts = entries[1::2]
+        # A zero length with a count starts a long string, whose length is in the next entry
+        if self._has_long_strings(pool):
+            lengths, counts = self._long_entries(entries)
+        # Where each block of strings starts in the data: a string's offset is its block's
+        # plus the lengths before it in the block, so nothing is summed for the whole pool
+        block_starts = array('Q', [0])
+        block_starts.extend(accumulate(sum(lengths[start:start + _BLOCK]) for start in range(0, len(lengths), _BLOCK)))
+        if block_starts[-1] != len(data):
+            raise MsiError(f"{self.path}: the string pool does not match the string data")
+        self.refs = array('H', [0]) + counts
+        self._data = data
+        self._lengths = lengths
+        self._block_starts = block_starts
+
+    def _has_long_strings(self, pool):
+        # Zero lengths are rare (freed and long strings), so their bytes are searched for
+        position = pool.find(b'\0\0', 4)
+        while position >= 0:
+            if position % 4 == 0 and position + 4 <= len(pool) and pool[position + 2:position + 4] != b'\0\0':
+                return True
+            position = pool.find(b'\0\0', position + 1)
+        return False
+
+    def _long_entries(self, entries):
+        lengths = array('I')
+        counts = array('H')
+        index = 0
+        while index + 1 < len(entries):
+            length, count = entries[index], entries[index + 1]
+            index += 2
+            if length == 0 and count:
+                length = entries[index] | entries[index + 1] << 16
+                index += 2
+            lengths.append(length)
+            counts.append(count)
+        return lengths, counts
+
+    def _offset(self, index):
+        # Start of the string at a pool index (string id - 1)
+        block = index // _BLOCK
+        return self._block_starts[block] + sum(self._lengths[block * _BLOCK:index])
+
+    def string(self, string_id):
+        """The string of an id (None for 0; freed entries are '')."""
+        if not string_id:
+            return None
+        if self._strings is not None:
+            return self._strings[string_id]
+        start = self._offset(string_id - 1)
+        return self._data[start:start + self._lengths[string_id - 1]].decode(self.encoding)
+
+    @property
+    def strings(self):
+        """String ids -> strings, all of them (strings[0] is None)."""
+        if self._strings is None:
+            offsets = list(accumulate(self._lengths, initial=0))
+            text = self._data.decode(self.encoding)
+            if len(text) == len(self._data):
+                # One byte per character: slices of the data decoded at once
+                self._strings = [None] + [text[start:end] for start, end in zip(offsets, offsets[1:])]
+            else:
+                data = self._data
+                self._strings = [None] + [data[start:end].decode(self.encoding)
+                                          for start, end in zip(offsets, offsets[1:])]
+        return self._strings
+
+    def string_id(self, value):
+        """The id of a string in the pool (None if no value stores it)."""
+        if value in self._string_ids:
+            return self._string_ids[value]
+        # Search the string data rather than mapping the whole pool for one lookup
+        try:
+            encoded = value.encode(self.encoding)
+        except UnicodeEncodeError:
+            encoded = b''
+        string_id = None
+        position = self._data.find(encoded) if encoded else -1
+        while position >= 0:
+            block = bisect_right(self._block_starts, position) - 1
+            index = block * _BLOCK
+            offset = self._block_starts[block]
+            while offset < position and index < len(self._lengths):
+                offset += self._lengths[index]
+                index += 1
+            if offset == position and index < len(self._lengths) and self._lengths[index] == len(encoded) \
+                    and self.refs[index + 1]:
+                string_id = index + 1
+                break
+            position = self._data.find(encoded, position + 1)
+        self._string_ids[value] = string_id
+        return string_id
+
+    # Schema
+
+    def _load_schema(self):
+        raw = self.stream('_Tables', table=True)
+        self.tables = [self.string(value) for value in _widen(raw, self.ref_width, len(raw) // self.ref_width)]
+        raw = self.stream('_Columns', table=True)
+        count = len(raw) // (2 * self.ref_width + 4)
+        columns = []
+        offset = 0
+        for width in (self.ref_width, 2, self.ref_width, 2):
+            columns.append(_widen(raw[offset:offset + width * count], width, count))
+            offset += width * count
+        self.schema = {name: [] for name in self.tables}
+        for table, number, column, bits in sorted(zip(*columns), key=lambda row: (row[0], row[1])):
+            name = self.string(table)
+            if name not in self.schema:
+                raise MsiError(f"{self.path}: _Columns describes the unknown table {name!r}")
+            self.schema[name].append((self.string(column), bits - 0x8000))
+
+    def columns(self, name):
+        """(column name, type bits) of a table."""
+        try:
+            return self.schema[name]
+        except KeyError:
+            raise MsiError(f"{self.path}: no table {name!r}") from None
+
+    def column_number(self, name, column):
+        """Position of a column (given by name or position) in its table."""
+        columns = self.columns(name)
+        if isinstance(column, int):
+            if not 0 <= column < len(columns):
+                raise MsiError(f"{self.path}: table {name} has no column {column}")
+            return column
+        for number, (column_name, _) in enumerate(columns):
+            if column_name == column:
+                return number
+        raise MsiError(f"{self.path}: table {name} has no column {column!r}")
+
+    def key_count(self, name):
+        return sum(1 for _, bits in self.columns(name) if bits & TYPE_KEY)
+
+    def width(self, bits):
+        if is_string(bits):
+            return self.ref_width
+        return 2 if bits & 0xFF == 2 else 4
+
+    def row_count(self, name):
+        """Rows of a table, from the size of its stream: nothing is read."""
+        row_width = sum(self.width(bits) for _, bits in self.columns(name))
+        entry = self.cfb.streams.get(encode_stream_name(name, table=True))
+        return entry[1] // row_width if entry else 0
+
+    # Values
+
+    def _column_range(self, name, number):
+        # Columns are stored one after another: (offset of the column, bytes per value)
+        columns = self.columns(name)
+        return (sum(self.width(bits) for _, bits in columns[:number]) * self.row_count(name),
+                self.width(columns[number][1]))
+
+    def stored_column(self, name, column):
+        """The stored values of one column, in stored (key) order; only that column's bytes are read."""
+        number = self.column_number(name, column)
+        values = self._stored.get((name, number))
+        if values is None:
+            count = self.row_count(name)
+            offset, width = self._column_range(name, number)
+            raw = self.cfb.read(encode_stream_name(name, table=True), offset, width * count) if count else b''
+            values = self._stored[(name, number)] = _widen(raw, width, count)
+        return values
+
+    def stored_cell(self, name, column, row):
+        """One stored value, from its column if that was read, else from its bytes alone."""
+        number = self.column_number(name, column)
+        values = self._stored.get((name, number))
+        if values is not None:
+            return values[row]
+        offset, width = self._column_range(name, number)
+        raw = self.cfb.read(encode_stream_name(name, table=True), offset + width * row, width)
+        return int.from_bytes(raw, 'little')
+
+    def stored_values(self, name):
+        """The stored values of a table, one array('I') per column."""
+        return [self.stored_column(name, number) for number in range(len(self.columns(name)))]
+
+    def decode(self, bits, value):
+        """A stored value as a Python value."""
+        if is_string(bits):
+            return self.string(value)
+        if not value:
+            return None
+        return value - 0x8000 if bits & 0xFF == 2 else value - 0x80000000
+
+    def stored(self, bits, value):
+        """A Python value as stored in a column of that type (None for a string not in the pool)."""
+        if value is None or value == '':
+            return 0
+        if is_string(bits):
+            return self.string_id(str(value))
+        return (value + (0x8000 if bits & 0xFF == 2 else 0x80000000)) & 0xFFFFFFFF
+
+    def column(self, name, column):
+        """The decoded values of one column, in stored order."""
+        number = self.column_number(name, column)
+        values = self._decoded.get((name, number))
+        if values is None:
+            bits = self.columns(name)[number][1]
+            stored = self.stored_column(name, number)
+            if is_string(bits):
+                # A large column is decoded through the whole pool, a small one string by string
+                string = self.strings.__getitem__ if len(stored) * 64 > len(self._lengths) else self.string
+                values = list(map(string, stored))
+            else:
+                bias = 0x8000 if bits & 0xFF == 2 else 0x80000000
+                values = [value - bias if value else None for value in stored]
+            self._decoded[(name, number)] = values
+        return values
+
+    def rows(self, name):
+        """The rows of a table as tuples of Python values (None for NULL)."""
+        return list(zip(*(self.column(name, number) for number in range(len(self.columns(name))))))
+
+    def row(self, name, number):
+        """One row by its position; only the cells of that row are read and decoded."""
+        return tuple(self.decode(bits, self.stored_cell(name, column, number))
+                     for column, (_, bits) in enumerate(self.columns(name)))
+
+    # Indexes
+
+    def index(self, name, columns=None):
+        """
+        Hash index of a table: stored key -> row number for the primary key
+        (the default), stored value(s) -> [row numbers] for other columns.
+        Keys of one column are plain stored values, of several tuples.
+        """
+        key_count = self.key_count(name)
+        if columns is None:
+            numbers = tuple(range(key_count))
+        else:
+            numbers = tuple(self.column_number(name, column) for column in
+                            ((columns,) if isinstance(columns, (str, int)) else columns))
+        index = self._indexes.get((name, numbers))
+        if index is None:
+            values = [self.stored_column(name, number) for number in numbers]
+            keys = values[0] if len(values) == 1 else zip(*values)
+            if numbers == tuple(range(key_count)):
+                index = dict(zip(keys, range(self.row_count(name))))
+            else:
+                index = {}
+                for row, key in enumerate(keys):
+                    index.setdefault(key, []).append(row)
+            self._indexes[(name, numbers)] = index
+        return index
+
+    def _stored_key(self, name, numbers, key):
+        columns = self.columns(name)
+        key = key if isinstance(key, tuple) else (key,)
+        if len(key) != len(numbers):
+            raise MsiError(f"{self.path}: a key of {name} has {len(numbers)} values, got {len(key)}")
+        stored = tuple(self.stored(columns[number][1], value) for number, value in zip(numbers, key))
+        if None in stored:
+            return None
+        return stored[0] if len(stored) == 1 else stored
+
+    def _find_row(self, name, stored):
+        # Rows are sorted by their stored key, so without an index the first key
+        # column is bisected and the rows sharing its value compared
+        numbers = tuple(range(self.key_count(name)))
+        if (name, numbers) in self._indexes:
+            return self._indexes[(name, numbers)].get(stored)
+        key = stored if isinstance(stored, tuple) else (stored,)
+        first = self._stored.get((name, 0)) or _StoredCells(self, name, 0)
+        start = bisect_left(first, key[0])
+        end = bisect_right(first, key[0], start)
+        for row in range(start, end):
+            if all(self.stored_cell(name, number, row) == value for number, value in enumerate(key[1:], 1)):
+                return row
+        return None
+
+    def find(self, name, key):
+        """The decoded row with a primary key (a value, or a tuple for several key columns), or None."""
+        stored = self._stored_key(name, tuple(range(self.key_count(name))), key)
+        row = None if stored is None else self._find_row(name, stored)
+        return None if row is None else self.row(name, row)
+
+    def references(self, name, column, value):
+        """The decoded rows whose column holds a value (e.g. the File rows of a component)."""
+        number = self.column_number(name, column)
+        stored = self._stored_key(name, (number,), value)
+        rows = [] if stored is None else self.index(name, number).get(stored, [])
+        if not isinstance(rows, list):
+            # The column is the primary key: its index is unique
+            rows = [rows]
+        return [self.row(name, row) for row in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect an MSI database')
+    sub = parser.add_subparsers(dest='command', required=True)
+    tables_parser = sub.add_parser('tables', help='List the tables with their row counts and columns')
+    tables_parser.add_argument('msi')
+    rows_parser = sub.add_parser('rows', help='Print the rows of a table')
+    rows_parser.add_argument('msi')
+    rows_parser.add_argument('table')
+    rows_parser.add_argument('--where', metavar='COLUMN=VALUE', help='Only the rows with that value')
+    rows_parser.add_argument('--limit', type=int, help='Print at most this many rows')
+    check_parser = sub.add_parser('check', help='Check the references between the tables')
+    check_parser.add_argument('msi')
+    args = parser.parse_args(argv)
+
+    try:
+        return _inspect(args)
+    except BrokenPipeError:
+        # The reader of the output went away (| head): stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except (MsiError, CompoundFileError, OSError) as e:
+        print(f"Unable to inspect the database: {e}", file=sys.stderr)
+        return 1
+
+
+def _inspect(args):
+    with MsiReader(args.msi) as reader:
+        if args.command == 'tables':
+            for name in reader.tables:
+                columns = ', '.join(column for column, _ in reader.columns(name))
+                print(f"{name:<24} {reader.row_count(name):>9}  {columns}")
+        elif args.command == 'rows':
+            if args.where:
+                column, _, value = args.where.partition('=')
+                bits = reader.columns(args.table)[reader.column_number(args.table, column)][1]
+                if not is_string(bits):
+                    try:
+                        value = int(value)
+                    except ValueError:
+                        raise MsiError(f"{reader.path}: {args.table}.{column} holds integers, not {value!r}") from None
+                rows = reader.references(args.table, column, value)
+            else:
+                rows = reader.rows(args.table)
+            print('\t'.join(column for column, _ in reader.columns(args.table)))
+            for row in rows[:args.limit]:
+                print('\t'.join('' if value is None else str(value) for value in row))
+        else:
+            from core.msi_checks import check_references
+
+            problems = check_references(reader)
+            for message in problems:
+                print(message)
+            print(f"{len(problems)} problems")
+            return 1 if problems else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Columns of the MSI tables the build writes, and the standard action sequences.
+
+Column types use the core/msidb.py notation (s72, L255, i2, I4...); they follow
+the Windows Installer SDK, with File.Sequence and Media.LastSequence as
+4-byte integers so a product can hold more than 32767 files.
+"""
+
+import re
+
+# name -> ([(column, type)], number of primary key columns)
+TABLES = {
+    'Property': ([('Property', 's72'), ('Value', 'l0')], 1),
+    'Directory': ([('Directory', 's72'), ('Directory_Parent', 'S72'), ('DefaultDir', 'l255')], 1),
+    'Component': ([('Component', 's72'), ('ComponentId', 'S38'), ('Directory_', 's72'), ('Attributes', 'i2'),
+                   ('Condition', 'S255'), ('KeyPath', 'S72')], 1),
+    'Feature': ([('Feature', 's38'), ('Feature_Parent', 'S38'), ('Title', 'L64'), ('Description', 'L255'),
+                 ('Display', 'I2'), ('Level', 'i2'), ('Directory_', 'S72'), ('Attributes', 'i2')], 1),
+    'FeatureComponents': ([('Feature_', 's38'), ('Component_', 's72')], 2),
+    'File': ([('File', 's72'), ('Component_', 's72'), ('FileName', 'l255'), ('FileSize', 'i4'),
+              ('Version', 'S72'), ('Language', 'S20'), ('Attributes', 'I2'), ('Sequence', 'i4')], 1),
+    'Media': ([('DiskId', 'i2'), ('LastSequence', 'i4'), ('DiskPrompt', 'L64'), ('Cabinet', 'S255'),
+               ('VolumeLabel', 'S32'), ('Source', 'S72')], 1),
+    'DuplicateFile': ([('FileKey', 's72'), ('Component_', 's72'), ('File_', 's72'), ('DestName', 'L255'),
+                       ('DestFolder', 'S72')], 1),
+    'Registry': ([('Registry', 's72'), ('Root', 'i2'), ('Key', 'l255'), ('Name', 'L255'), ('Value', 'L0'),
+                  ('Component_', 's72')], 1),
+}
+
+_SEQUENCE_COLUMNS = ([('Action', 's72'), ('Condition', 'S255'), ('Sequence', 'I2')], 1)
+
+# Standard actions, enough for a per-machine install of files and registry values
+SEQUENCES = {
+    'InstallUISequence': [
+        ('FindRelatedProducts', None, 25), ('AppSearch', None, 50), ('LaunchConditions', None, 100),
+        ('ValidateProductID', None, 700), ('CostInitialize', None, 800), ('FileCost', None, 900),
+        ('CostFinalize', None, 1000), ('MigrateFeatureStates', None, 1200), ('ExecuteAction', None, 1300),
+    ],
+    'InstallExecuteSequence': [
+        ('FindRelatedProducts', None, 25), ('AppSearch', None, 50), ('LaunchConditions', None, 100),
+        ('ValidateProductID', None, 700), ('CostInitialize', None, 800), ('FileCost', None, 900),
+        ('CostFinalize', None, 1000), ('MigrateFeatureStates', None, 1200), ('InstallValidate', None, 1400),
+        ('InstallInitialize', None, 1500), ('ProcessComponents', None, 1600), ('UnpublishFeatures', None, 1800),
+        ('RemoveRegistryValues', None, 2600), ('RemoveShortcuts', None, 3200), ('RemoveFiles', None, 3500),
+        ('InstallFiles', None, 4000), ('DuplicateFiles', None, 4210), ('CreateShortcuts', None, 4500),
+        ('WriteRegistryValues', None, 5000), ('RegisterUser', None, 6000), ('RegisterProduct', None, 6100),
+        ('PublishFeatures', None, 6300), ('PublishProduct', None, 6400), ('InstallFinalize', None, 6600),
+    ],
+    'AdminUISequence': [
+        ('CostInitialize', None, 800), ('FileCost', None, 900), ('CostFinalize', None, 1000),
+        ('ExecuteAction', None, 1300),
+    ],
+    'AdminExecuteSequence': [
+        ('CostInitialize', None, 800), ('FileCost', None, 900), ('CostFinalize', None, 1000),
+        ('InstallValidate', None, 1400), ('InstallInitialize', None, 1500), ('InstallAdminPackage', None, 3900),
+        ('InstallFiles', None, 4000), ('InstallFinalize', None, 6600),
+    ],
+    'AdvtExecuteSequence': [
+        ('CostInitialize', None, 800), ('CostFinalize', None, 1000), ('InstallValidate', None, 1400),
+        ('InstallInitialize', None, 1500), ('CreateShortcuts', None, 4500), ('PublishFeatures', None, 6300),
+        ('PublishProduct', None, 6400), ('InstallFinalize', None, 6600),
+    ],
+}
+
+_SHORT_INVALID = re.compile(r'[^A-Z0-9!#$%&\'()\-@^_`{}~]')
+_SHORT_VALID = re.compile(r'^[A-Z0-9!#$%&\'()\-@^_`{}~]{1,8}(\.[A-Z0-9!#$%&\'()\-@^_`{}~]{1,3})?$')
+
+
+def create_table(writer, name):
+    """Create one of TABLES in an MsiWriter."""
+    columns, keys = TABLES[name]
+    return writer.table(name, columns, keys)
+
+
+def add_sequences(writer):
+    """Write the standard action sequence tables."""
+    for name, rows in SEQUENCES.items():
+        table = writer.table(name, *_SEQUENCE_COLUMNS)
+        table.extend(rows)
+        table.finish()
+
+
+class ShortNames(object):
+    """
+    8.3 names of the entries of one directory.
+
+    name() returns the 'SHORT~1.EXT|long name' form of a FileName or
+    DefaultDir column, or the name alone when it is already a valid,
+    unused short name.
+    """
+
+    def __init__(self):
+        self.taken = set()
+        self.next_number = {}  # (first 6 characters, extension) -> next ~N to try
+
+    def name(self, long_name):
+        upper = long_name.upper()
+        if _SHORT_VALID.match(upper) and upper not in self.taken:
+            self.taken.add(upper)
+            return long_name
+        base, dot, extension = upper.rpartition('.')
+        if not dot or not base:
+            base, extension = upper, ''
+        base = _SHORT_INVALID.sub('', base.replace(' ', '').replace('.', '')) or '_'
+        extension = _SHORT_INVALID.sub('', extension)[:3]
+        suffix = f".{extension}" if extension else ''
+        # Names sharing a prefix number on from the last one given, instead of probing from ~1
+        stem = (base[:6], suffix)
+        number = self.next_number.get(stem, 1)
+        while True:
+            tail = f"~{number}"
+            short = f"{base[:8 - len(tail)]}{tail}{suffix}"
+            number += 1
+            if short not in self.taken:
+                self.taken.add(short)
+                self.next_number[stem] = number
+                return f"{short}|{long_name}"
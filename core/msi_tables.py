@@ -0,0 +1,302 @@
+"""
+Rows of the Directory, Component, Feature, FeatureComponents, File,
+DuplicateFile and Registry tables, generated from the product graph
+(db/product_graph.py) and the build's FileManifest.
+
+Each table is produced as a stream of row batches and written straight
+into an MsiWriter table, so the rows never exist as one list.  Keys are
+derived from database ids: D<id> for directories (the roots of the scanned
+trees are INSTALLDIR), C<id> for components, F<id> for files (the cabinet
+names), R<id> for registry values.  Directory keys and 8.3 names are
+memoized per directory, so generation is linear in the number of files.
+
+Files are installed in the directory of their component, under the name
+they have in the source tree; two files that would land on the same target
+path are an error rather than a silently dropped file.
+
+Given a GUID namespace (product_namespace(): the product's UpgradeCode),
+ComponentIds do not come from the Component rows, whose default is random,
+but from the component's identity: its target directory and the name of its
+key path file (component_identity()).  An identity seen before keeps the
+GUID recorded for it in the database; a new one gets uuid5(namespace,
+identity).  The same component thus keeps its GUID across rescans and
+rebuilds, as the component rules require.
+"""
+
+import uuid
+import logging
+
+from core.msi_schema import create_table, ShortNames
+from db.file_manifest import file_key
+from db.product_graph import ProductGraphError
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+INSTALLDIR = 'INSTALLDIR'
+MAX_FEATURE_KEY = 38
+
+REGISTRY_ROOTS = {'HKCR': 0, 'HKEY_CLASSES_ROOT': 0, 'HKCU': 1, 'HKEY_CURRENT_USER': 1,
+                  'HKLM': 2, 'HKEY_LOCAL_MACHINE': 2, 'HKU': 3, 'HKEY_USERS': 3,
+                  'HKMU': -1}  # HKMU: HKLM for per-machine installs, HKCU for per-user ones
+
+
+def component_key(component_id):
+    return f"C{component_id}"
+
+
+def product_namespace(upgrade_code, name):
+    """Namespace of a product's derived GUIDs: its UpgradeCode, or one derived from its name."""
+    try:
+        return uuid.UUID(upgrade_code)
+    except (TypeError, ValueError, AttributeError):
+        return uuid.uuid5(uuid.NAMESPACE_URL, f"installer:product:{name}")
+
+
+def component_identity(directory_path, key_name, name):
+    """
+    What identifies a component across builds, in lower case: its target
+    directory (a sequence of names, from the root folder) and the file name
+    of its key path, or the component's name when it has no key file.
+    """
+    key = key_name if key_name else f"#{name}"
+    return f"{'/'.join(directory_path)}|{key}".lower()
+
+
+def _batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _guid(value):
+    if not value:
+        return None
+    try:
+        return f"{{{str(uuid.UUID(value)).upper()}}}"
+    except ValueError:
+        raise ProductGraphError(f"invalid component GUID {value!r}") from None
+
+
+class MsiTables(object):
+    """
+    Generates the product tables of one build.
+
+    Args:
+        graph: ProductGraph of the product
+        files: FileManifest of the build
+        sequences: File key -> sequence in the cabinets
+        duplicates: DuplicateIndex of the files (None if there are none)
+        install_dir_name: DefaultDir of INSTALLDIR
+        program_files: Directory key INSTALLDIR is created in
+        default_feature_id: Feature of components not attached to one in the graph
+        guid_namespace: UUID the ComponentIds are derived in (None: the Component rows' GUIDs)
+        guids: Identity -> GUID recorded by earlier builds
+
+    After write(), new_guids holds the identities seen for the first time and
+    changed_guids the component ids whose GUID differs from their row.
+    """
+
+    def __init__(self, graph, files, sequences, duplicates=None, install_dir_name='Product',
+                 program_files='ProgramFilesFolder', default_feature_id=None, guid_namespace=None, guids=None):
+        self.graph = graph
+        self.files = files
+        self.sequences = sequences
+        self.duplicates = duplicates
+        self.install_dir_name = install_dir_name
+        self.program_files = program_files
+        self.default_feature_id = default_feature_id
+        self.guid_namespace = guid_namespace
+        self.guids = dict(guids or {})
+        self.new_guids = {}
+        self.changed_guids = {}
+        self.counts = {}
+        self.skipped = 0
+        self._directory_keys = {}
+        self._short_names = {}
+        self._key_paths = {}      # component id -> File key of its key path
+        self._key_names = {}      # component id -> target name of its key path
+        self._identities = set()
+        self._used = set()        # Components with File, DuplicateFile or Registry rows
+        self._targets = set()     # (directory key, lower case name) of the files placed so far
+
+    def directory_key(self, directory_id):
+        """Directory key of a database directory (INSTALLDIR for a root or no directory)."""
+        key = self._directory_keys.get(directory_id)
+        if key is None:
+            node = self.graph.directories.get(directory_id)
+            if node is None and directory_id is not None:
+                raise ProductGraphError(f"directory {directory_id} is referenced but does not exist")
+            key = INSTALLDIR if node is None or node.parent_id is None else f"D{directory_id}"
+            self._directory_keys[directory_id] = key
+        return key
+
+    def _names(self, directory):
+        names = self._short_names.get(directory)
+        if names is None:
+            names = self._short_names[directory] = ShortNames()
+        return names
+
+    def _component(self, component_id, path):
+        component = self.graph.components.get(component_id)
+        if component is None:
+            raise ProductGraphError(f"{path} references missing component {component_id}")
+        return component
+
+    def directory_rows(self):
+        yield [('TARGETDIR', None, 'SourceDir'),
+               (self.program_files, 'TARGETDIR', 'PFiles'),
+               (INSTALLDIR, self.program_files, self._names(self.program_files).name(self.install_dir_name))]
+        rows = []
+        for directory_id in sorted(self.graph.directories):
+            node = self.graph.directories[directory_id]
+            # Resolving the path checks the parent chain once per directory (memoized)
+            self.graph.directory_path(directory_id)
+            if node.parent_id is None:
+                continue
+            parent = self.directory_key(node.parent_id)
+            rows.append((self.directory_key(directory_id), parent,
+                         self._names(parent).name(node.default_dir or node.name)))
+            if len(rows) >= BATCH_SIZE:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def file_rows(self):
+        for f in self.files:
+            if self.duplicates and self.duplicates.is_duplicate(f):
+                continue
+            key = file_key(f)
+            sequence = self.sequences.get(key)
+            if sequence is None:
+                logger.warning(f"{f.path} is not in the cabinets and will be skipped")
+                self.skipped += 1
+                continue
+            component = self._component(f.component_id, f.path)
+            directory = self.directory_key(component.directory_id)
+            name = self._target_name(f, directory)
+            if component.key_path and component.key_path.replace('\\', '/') == f.path.replace('\\', '/'):
+                self._key_paths[component.id] = key
+                self._key_names[component.id] = name
+            self._used.add(component.id)
+            yield (key, component_key(component.id), self._names(directory).name(name), f.size, f.version,
+                   None, f.attributes or None, sequence)
+
+    def _target_name(self, f, directory):
+        name = f.path.replace('\\', '/').rsplit('/', 1)[-1]
+        target = (directory, name.lower())
+        if target in self._targets:
+            component = self.graph.components[f.component_id]
+            path = '/'.join(self.graph.directory_path(component.directory_id) + (name,)) \
+                if component.directory_id is not None else name
+            raise ProductGraphError(f"{f.path} would overwrite another file installed as {path}")
+        self._targets.add(target)
+        return name
+
+    def duplicate_rows(self):
+        if not self.duplicates:
+            return
+        for f in self.files:
+            if not self.duplicates.is_duplicate(f):
+                continue
+            canonical = self.duplicates.canonical(f)
+            component = self._component(f.component_id, f.path)
+            original = self._component(canonical.component_id, canonical.path)
+            directory = self.directory_key(component.directory_id)
+            name = self._target_name(f, directory)
+            self._used.add(component.id)
+            destination = directory if directory != self.directory_key(original.directory_id) else None
+            yield (file_key(f), component_key(component.id), file_key(canonical),
+                   self._names(directory).name(name), destination)
+
+    def registry_rows(self):
+        for value in self.graph.registry:
+            root = REGISTRY_ROOTS.get((value.root or '').strip().upper())
+            if root is None:
+                raise ProductGraphError(f"registry value {value.id} has an unknown root {value.root!r}")
+            self._used.add(value.component_id)
+            yield (f"R{value.id}", root, value.key, value.name or None, value.value,
+                   component_key(value.component_id))
+
+    def component_rows(self):
+        # After the File, DuplicateFile and Registry rows: only components with content are written
+        missing_guids = 0
+        for component_id in sorted(self._used):
+            component = self.graph.components[component_id]
+            guid = _guid(component.guid) if self.guid_namespace is None else self._component_guid(component)
+            missing_guids += guid is None
+            yield (component_key(component_id), guid, self.directory_key(component.directory_id), 0, None,
+                   self._key_paths.get(component_id))
+        if missing_guids:
+            logger.warning(f"{missing_guids} components have no ComponentId and will not be registered")
+
+    def _component_guid(self, component):
+        path = (self.program_files, self.install_dir_name)
+        if component.directory_id is not None:
+            path += self.graph.directory_path(component.directory_id)
+        base = identity = component_identity(path, self._key_names.get(component.id), component.name)
+        # Components of one directory without a key file and with the same name: numbered in id order
+        number = 1
+        while identity in self._identities:
+            number += 1
+            identity = f"{base}#{number}"
+        self._identities.add(identity)
+        guid = self.guids.get(identity)
+        if guid is None:
+            guid = self.guids[identity] = self.new_guids[identity] = \
+                str(uuid.uuid5(self.guid_namespace, identity)).upper()
+        if guid != (component.guid or '').strip('{}').upper():
+            self.changed_guids[component.id] = guid
+        return _guid(guid)
+
+    def _feature_keys(self):
+        keys = {}
+        used = set()
+        for feature_id in sorted(self.graph.features):
+            name = self.graph.features[feature_id].name or ''
+            key = name if name.isidentifier() and len(name) <= MAX_FEATURE_KEY and name not in used \
+                else f"Feature{feature_id}"
+            used.add(key)
+            keys[feature_id] = key
+        return keys
+
+    def feature_rows(self):
+        keys = self._feature_keys()
+        for feature_id in sorted(self.graph.features):
+            f = self.graph.features[feature_id]
+            yield (keys[feature_id], keys.get(f.parent_id), (f.title or f.name)[:64], (f.description or '')[:255],
+                   1 if f.display is None else f.display, 1 if f.level is None else f.level, INSTALLDIR, 0)
+
+    def feature_component_rows(self):
+        keys = self._feature_keys()
+        for component_id in sorted(self._used):
+            feature_id = self.graph.components[component_id].feature_id
+            if feature_id not in keys:
+                feature_id = self.default_feature_id
+            if feature_id not in keys:
+                raise ProductGraphError(f"component {component_id} belongs to no feature of the product")
+            yield (keys[feature_id], component_key(component_id))
+
+    def write(self, writer):
+        """Write the tables into an MsiWriter; returns the row count per table."""
+        streams = (('Directory', self.directory_rows()),
+                   ('File', _batches(self.file_rows())),
+                   ('DuplicateFile', _batches(self.duplicate_rows())),
+                   ('Registry', _batches(self.registry_rows())),
+                   # The tables below depend on what the ones above used
+                   ('Component', _batches(self.component_rows())),
+                   ('Feature', _batches(self.feature_rows())),
+                   ('FeatureComponents', _batches(self.feature_component_rows())))
+        for name, batches in streams:
+            table = create_table(writer, name)
+            for batch in batches:
+                table.extend(batch)
+            self.counts[name] = len(table)
+            table.finish()
+        return self.counts
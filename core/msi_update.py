@@ -0,0 +1,247 @@
+"""
+Incremental update of an MSI database written by core/msidb.py: a new
+database is written from the previous one, rewriting only the tables that
+were replaced or edited and copying every other stream as it was.
+
+The previous string pool is loaded with its reference counts, so string
+ids stay valid in the copied table streams.  Strings the new rows add are
+appended to the pool; strings the replaced values no longer reference are
+written as free entries (length and count 0), as the Windows Installer
+leaves them after a row is deleted.  The pool therefore only grows until
+the next full build, and an update that would take it past 65535 strings
+(3-byte string ids in every table) fails with MsiError so the caller can
+rebuild in full.
+
+    table(name, ...)    replaces a whole table (Property, Media)
+    edit(name)          returns the previous rows for replace(): only the
+                        changed cells are stored, and the table is not
+                        sorted again unless rows were appended
+
+The table set and the schemas stay those of the previous database.
+"""
+
+import os
+from array import array
+
+from core.msidb import MsiWriter, MsiError, Table, encode_stream_name, is_string
+from core.msi_reader import MsiReader
+
+# A saturated 16-bit count: the real count is unknown, the string must never be freed
+_SATURATED_REFS = 0x7FFFFFFF
+
+
+def _converter(bits, pool_ids):
+    """Python value -> stored value of a column, without referencing strings (-1 for one not in the pool)."""
+    if is_string(bits):
+        return lambda value: 0 if value is None or value == '' else pool_ids.get(str(value), -1)
+    bias = 0x8000 if bits & 0xFF == 2 else 0x80000000
+    return lambda value: 0 if value is None else (value + bias) & 0xFFFFFFFF
+
+
+class EditedTable(Table):
+    """
+    The rows of a previous table, edited in place.
+
+    Created by MsiUpdate.edit(); get() reads a row by its primary key,
+    replace() stores a row over the one with the same key (or appends it).
+    """
+
+    def __init__(self, writer, name, columns, keys, values):
+        self.writer = writer
+        self.name = name
+        self.columns = columns
+        self.keys = keys
+        self.values = values
+        self.finished = False
+        self._converters = [_converter(bits, writer.pool.ids) for _, bits in columns]
+        self.changed = 0
+        self.appended = False
+        self._index = None
+
+    def _stored_key(self, key):
+        # -1 for a string that is not in the pool: no row has that key
+        if self.keys == 1:
+            return self._converters[0](key)
+        return tuple(convert(value) for convert, value in zip(self._converters, key))
+
+    def _row_index(self, stored_key):
+        if self._index is None:
+            keys = self.values[0] if self.keys == 1 else zip(*self.values[:self.keys])
+            self._index = dict(zip(keys, range(len(self))))
+        return self._index.get(stored_key)
+
+    def get(self, key):
+        """The row with a primary key (a value, or a tuple for several key columns), or None."""
+        row = self._row_index(self._stored_key(key))
+        if row is None:
+            return None
+        strings = self.writer.pool.strings
+        decoded = []
+        for (_, bits), values in zip(self.columns, self.values):
+            value = values[row]
+            if is_string(bits):
+                decoded.append(strings[value - 1] if value else None)
+            elif not value:
+                decoded.append(None)
+            else:
+                decoded.append(value - 0x8000 if bits & 0xFF == 2 else value - 0x80000000)
+        return tuple(decoded)
+
+    def diff(self, rows, columns):
+        """
+        Compare rows with the stored ones without decoding them: rows are
+        (key, values) pairs, values one per column index in columns.  Returns
+        the (key, values) pairs that differ and the keys that have no row.
+        """
+        if not rows:
+            return [], []
+        self._row_index(None)
+        index = self._index
+        keys = [key for key, _ in rows]
+        positions = [index.get(stored) for stored in map(self._stored_key, keys)]
+        missing = [key for key, position in zip(keys, positions) if position is None]
+        if missing:
+            rows = [row for row, position in zip(rows, positions) if position is not None]
+            positions = [position for position in positions if position is not None]
+        # Column by column: the new stored values against the current ones
+        differing = set()
+        for column, values in zip(columns, zip(*(values for _, values in rows))):
+            current = self.values[column]
+            old = [current[position] for position in positions]
+            new = list(map(self._converters[column], values))
+            if new != old:
+                differing.update(number for number, (value, previous) in enumerate(zip(new, old))
+                                 if value != previous)
+        return [rows[number] for number in sorted(differing)], missing
+
+    def replace(self, row):
+        """Store a row over the row with its primary key, or append it; returns True if it replaced one."""
+        if self.finished:
+            raise MsiError(f"table {self.name} is already written")
+        stored = self._stored(row)
+        stored_key = stored[0] if self.keys == 1 else tuple(stored[:self.keys])
+        index = self._row_index(stored_key)
+        release = self.writer.pool.release
+        self.changed += 1
+        if index is None:
+            for values, value in zip(self.values, stored):
+                values.append(value)
+            self._index[stored_key] = len(self) - 1
+            self.appended = True
+            return False
+        for (_, bits), values, value in zip(self.columns, self.values, stored):
+            if is_string(bits):
+                # The new value's reference is taken first: a string kept in place is never freed
+                release(values[index])
+            values[index] = value
+        return True
+
+    add = replace
+
+    def _sorted(self):
+        if self.appended:
+            return Table._sorted(self)
+        return self.values
+
+
+class MsiUpdate(MsiWriter):
+    """
+    Writes an MSI database as a copy of a previous one with some tables changed.
+
+    Usage:
+        update = MsiUpdate(path, previous_path)
+        files = update.edit('File')
+        files.replace(('F1', 'MainComponent', 'app.exe', 2048, '1.0.0.1', None, None, 1))
+        create_table(update, 'Property').extend(properties)
+        update.summary(...)
+        update.close()
+
+    Args:
+        path: Database to write (not the previous one, which is read while writing)
+        previous: Database to start from
+    """
+
+    def __init__(self, path, previous):
+        if os.path.abspath(path) == os.path.abspath(previous):
+            raise MsiError(f"{path}: an update cannot overwrite the database it reads")
+        reader = MsiReader(previous)
+        try:
+            MsiWriter.__init__(self, path, reader.codepage)
+        except BaseException:
+            reader.close()
+            raise
+        self.reader = reader
+        pool = self.pool
+        pool.strings = reader.strings[1:]
+        pool.refs = array('I', (_SATURATED_REFS if refs == 0xFFFF else refs for refs in reader.refs[1:]))
+        pool.ids = {string: string_id for string_id, string in enumerate(pool.strings, 1) if string}
+
+    def _previous_columns(self, name):
+        if name not in self.reader.schema:
+            raise MsiError(f"{self.reader.path} has no table {name}: rebuild the database in full")
+        return self.reader.columns(name)
+
+    def table(self, name, columns, keys=1):
+        """Replace a table of the previous database with new rows (same columns)."""
+        previous = self._previous_columns(name)
+        table = MsiWriter.table(self, name, columns, keys)
+        if table.columns != previous:
+            del self.tables[name]
+            raise MsiError(f"table {name} changed columns since {self.reader.path}: rebuild the database in full")
+        for (_, bits), values in zip(previous, self.reader.stored_values(name)):
+            if is_string(bits):
+                for value in values:
+                    self.pool.release(value)
+        return table
+
+    def edit(self, name):
+        """The rows of a table of the previous database, to replace or add rows in."""
+        if name in self.tables:
+            raise MsiError(f"table {name} is already replaced")
+        columns = self._previous_columns(name)
+        values = [array('I', column) for column in self.reader.stored_values(name)]
+        table = self.tables[name] = EditedTable(self, name, columns, self.reader.key_count(name), values)
+        return table
+
+    def _spool(self, table):
+        if isinstance(table, EditedTable) and not table.changed:
+            # Copied as it was
+            table.finished = True
+            return
+        MsiWriter._spool(self, table)
+
+    def _prepare(self):
+        # The system tables are copied: every table and column name is already pooled and referenced
+        pass
+
+    def _ref_width(self):
+        ref_width = MsiWriter._ref_width(self)
+        if ref_width != self.reader.ref_width:
+            raise MsiError(f"{len(self.pool.strings)} strings need {ref_width}-byte string ids: "
+                           f"rebuild the database in full")
+        return ref_width
+
+    def _cleanup(self):
+        MsiWriter._cleanup(self)
+        self.reader.close()
+
+    def _write_tables(self, add, ref_width):
+        for name in ('_Tables', '_Columns'):
+            add(encode_stream_name(name, table=True), self.reader.stream(name, table=True))
+        spooled = {table.name: (table, offset, count) for table, offset, count in self.spooled}
+        for name in self.reader.tables:
+            stream = encode_stream_name(name, table=True)
+            if name in spooled:
+                table, offset, count = spooled[name]
+                if count:
+                    add(stream, self._table_chunks(table, offset, count, ref_width),
+                        sum(self._width(bits, ref_width) for _, bits in table.columns) * count)
+            else:
+                data = self.reader.stream(name, table=True)
+                if data:
+                    add(stream, data)
+        # Binary and other streams not added again
+        added = {name for name, _ in self.streams}
+        for stream in self.reader.other_streams():
+            if stream not in added:
+                add(stream, self.reader.cfb.read(stream))
@@ -0,0 +1,564 @@
+"""
+MSI database writer: tables, string pool and summary information written
+straight into a compound file (core/cfb.py), without msilib.
+
+An MSI database is a compound file whose streams are:
+
+    _StringPool     codepage, then (length, refcount) per string id; ids
+                    start at 1, 0 is NULL
+    _StringData     the strings, concatenated, in the codepage
+    _Tables         the table names (string ids)
+    _Columns        (table, number, name, type) per column
+    <table>         one stream per non-empty table, column by column: all
+                    rows' values of the first column, then of the second...
+    SummaryInformation
+                    an OLE property set: title, template, package code...
+
+Table values are stored as integers: strings as string ids (2 bytes, or 3
+when the pool holds more than 65535 strings), 2-byte integers as value +
+0x8000, 4-byte integers as value + 0x80000000, NULL as 0.  Rows are sorted by
+their stored primary key values.  Table and system stream names are
+compressed into the CJK range (encode_stream_name) so they fit the 31
+characters of a compound file name.
+
+The width of string ids is only known once every string is in the pool,
+so a finished table is spooled to a temporary file with 4 bytes per
+value, and narrowed to its final widths when the database is closed; the
+writer holds the rows of the tables still being filled, the string pool
+and one column at a time, however large the database.
+
+The package code (the summary's revision number) defaults to a GUID derived
+from everything written: the streams, the other summary properties and
+whatever the caller mixed in with add_package_input() (the payload that
+lives outside the database).  The same content gives the same package
+code, and the same bytes when no dates are set.
+
+Column types use the msilib/Orca notation: s72 (string of up to 72
+characters), l255 (localizable string), i2, i4; an upper case letter makes
+the column nullable.  The first `keys` columns of a table are its primary key.
+"""
+
+import os
+import sys
+import uuid
+import struct
+import hashlib
+import tempfile
+from array import array
+
+from core.cfb import CompoundFileWriter
+
+MSI_CLSID = uuid.UUID('000C1084-0000-0000-C000-000000000046').bytes_le
+SUMMARY_FMTID = uuid.UUID('F29F85E0-4FF9-1068-AB91-08002B27B3D9').bytes_le
+SUMMARY_STREAM = '\x05SummaryInformation'
+
+# Column type bits, as stored in _Columns
+TYPE_VALID = 0x0100
+TYPE_LOCALIZABLE = 0x0200
+TYPE_STRING = 0x0800
+TYPE_NULLABLE = 0x1000
+TYPE_KEY = 0x2000
+TYPE_NOT_BINARY = 0x0400   # Set for character strings and 2-byte integers
+
+LONG_STRING_REFS = 0x80000000  # Codepage flag of a pool with 3-byte string ids
+MAX_SHORT_STRING_ID = 0xFFFF
+
+# Summary information property ids
+PID_CODEPAGE = 1
+PID_TITLE = 2
+PID_SUBJECT = 3
+PID_AUTHOR = 4
+PID_KEYWORDS = 5
+PID_COMMENTS = 6
+PID_TEMPLATE = 7
+PID_LASTAUTHOR = 8
+PID_REVNUMBER = 9
+PID_LASTPRINTED = 11
+PID_CREATE_DTM = 12
+PID_LASTSAVE_DTM = 13
+PID_PAGECOUNT = 14
+PID_WORDCOUNT = 15
+PID_CHARCOUNT = 16
+PID_APPNAME = 18
+PID_SECURITY = 19
+
+VT_I2 = 2
+VT_I4 = 3
+VT_LPSTR = 30
+VT_FILETIME = 64
+_PROPERTY_TYPES = {PID_CODEPAGE: VT_I2, PID_LASTPRINTED: VT_FILETIME, PID_CREATE_DTM: VT_FILETIME,
+                   PID_LASTSAVE_DTM: VT_FILETIME, PID_PAGECOUNT: VT_I4, PID_WORDCOUNT: VT_I4,
+                   PID_CHARCOUNT: VT_I4, PID_SECURITY: VT_I4}
+
+_TABLE_PREFIX = '\u4840'
+_FILETIME_EPOCH = 116444736000000000  # 1601-01-01 to 1970-01-01 in 100 ns units
+
+
+class MsiError(Exception):
+    """A database could not be written."""
+
+
+def _mime(c):
+    if '0' <= c <= '9':
+        return ord(c) - ord('0')
+    if 'A' <= c <= 'Z':
+        return ord(c) - ord('A') + 10
+    if 'a' <= c <= 'z':
+        return ord(c) - ord('a') + 36
+    if c == '.':
+        return 62
+    if c == '_':
+        return 63
+    return -1
+
+
+def encode_stream_name(name, table=False):
+    """The compound file name of an MSI stream: pairs of [0-9A-Za-z._] folded into one character."""
+    out = [_TABLE_PREFIX] if table else []
+    index = 0
+    while index < len(name):
+        first = _mime(name[index])
+        if first < 0:
+            out.append(name[index])
+            index += 1
+            continue
+        second = _mime(name[index + 1]) if index + 1 < len(name) else -1
+        if second >= 0:
+            out.append(chr(0x3800 + first + (second << 6)))
+            index += 2
+        else:
+            out.append(chr(0x4800 + first))
+            index += 1
+    return ''.join(out)
+
+
+def decode_stream_name(name):
+    """Inverse of encode_stream_name(); returns (name, is a table)."""
+    alphabet = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz._'
+    table = name.startswith(_TABLE_PREFIX)
+    out = []
+    for c in name[1:] if table else name:
+        code = ord(c)
+        if 0x3800 <= code < 0x4800:
+            code -= 0x3800
+            out.append(alphabet[code & 0x3F])
+            out.append(alphabet[code >> 6])
+        elif 0x4800 <= code < 0x4840:
+            out.append(alphabet[code - 0x4800])
+        else:
+            out.append(c)
+    return ''.join(out), table
+
+
+def column_type(spec, key=False):
+    """The _Columns type of a column spec such as 's72', 'L255', 'i2' or 'I4'."""
+    kind = spec[0]
+    size = int(spec[1:] or 0)
+    flags = TYPE_VALID
+    if kind.isupper():
+        flags |= TYPE_NULLABLE
+    if key:
+        flags |= TYPE_KEY
+    kind = kind.lower()
+    if kind in ('s', 'l'):
+        if not 0 <= size <= 255:
+            raise MsiError(f"invalid string length in column type {spec!r}")
+        flags |= TYPE_STRING | TYPE_NOT_BINARY | size
+        if kind == 'l':
+            flags |= TYPE_LOCALIZABLE
+    elif kind == 'i' and size == 2:
+        flags |= TYPE_NOT_BINARY | 2
+    elif kind == 'i' and size == 4:
+        flags |= 4
+    else:
+        raise MsiError(f"unsupported column type {spec!r}")
+    return flags
+
+
+def is_string(column_type_bits):
+    return bool(column_type_bits & TYPE_STRING)
+
+
+def _hashed(chunks, digest):
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+def _file_chunks(path, chunk_size=1024 * 1024):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+
+def filetime(timestamp):
+    """FILETIME (100 ns since 1601) of a Unix timestamp."""
+    return int(timestamp * 10 ** 7) + _FILETIME_EPOCH
+
+
+class StringPool(object):
+    """Interned strings with their reference counts."""
+
+    def __init__(self, codepage):
+        self.codepage = codepage
+        self.encoding = 'utf-8' if codepage == 65001 else f"cp{codepage}" if codepage else 'ascii'
+        self.ids = {}
+        self.strings = []
+        self.refs = array('I')
+
+    def add(self, value):
+        """Reference a string; returns its id (0 for None and '')."""
+        if value is None or value == '':
+            return 0
+        string_id = self.ids.get(value)
+        if string_id is None:
+            try:
+                value.encode(self.encoding)
+            except UnicodeEncodeError:
+                raise MsiError(f"{value!r} cannot be stored in codepage {self.codepage}") from None
+            self.strings.append(value)
+            self.refs.append(0)
+            string_id = self.ids[value] = len(self.strings)
+        self.refs[string_id - 1] += 1
+        return string_id
+
+    def release(self, string_id):
+        """Drop a reference taken by add(); a string nothing references is written as a free entry."""
+        if string_id and self.refs[string_id - 1]:
+            self.refs[string_id - 1] -= 1
+
+    @property
+    def long_refs(self):
+        return len(self.strings) > MAX_SHORT_STRING_ID
+
+    def streams(self):
+        """The _StringPool and _StringData streams."""
+        live = [string if refs else '' for string, refs in zip(self.strings, self.refs)]
+        text = ''.join(live)
+        data = text.encode(self.encoding)
+        if len(data) == len(text):
+            # One byte per character: the lengths are those of the strings
+            lengths = list(map(len, live))
+        else:
+            lengths = [len(string.encode(self.encoding)) for string in live]
+        # Counts are 16 bits; a saturated count only keeps the string from being freed
+        counts = [min(refs, 0xFFFF) for refs in self.refs]
+        if not lengths or max(lengths) <= 0xFFFF:
+            entries = [0] * (2 * len(lengths))
+            entries[0::2] = lengths
+            entries[1::2] = counts
+            pool = array('H', entries)
+        else:
+            pool = array('H')
+            for length, refs in zip(lengths, counts):
+                if length > 0xFFFF:
+                    # Long strings take two entries: (0, refcount), then the length's low and high words
+                    pool.extend((0, refs, length & 0xFFFF, length >> 16))
+                else:
+                    pool.extend((length, refs))
+        if sys.byteorder != 'little':
+            pool.byteswap()
+        codepage = self.codepage | (LONG_STRING_REFS if self.long_refs else 0)
+        return struct.pack('<I', codepage) + pool.tobytes(), data
+
+
+class Table(object):
+    """
+    A table being filled: rows are kept as stored values, one array per column.
+
+    Created by MsiWriter.table(); rows are added with add() and the table
+    is spooled by MsiWriter when finish() is called (or at close).
+    """
+
+    def __init__(self, writer, name, columns, keys):
+        if not columns or not 1 <= keys <= len(columns):
+            raise MsiError(f"table {name} needs columns and 1 to {len(columns)} key columns")
+        self.writer = writer
+        self.name = name
+        self.columns = [(column, column_type(spec, index < keys)) for index, (column, spec) in enumerate(columns)]
+        self.keys = keys
+        self.values = [array('I') for _ in columns]
+        self.finished = False
+
+    def __len__(self):
+        return len(self.values[0])
+
+    def add(self, row):
+        """Append a row: a sequence of one value per column (None for NULL)."""
+        if self.finished:
+            raise MsiError(f"table {self.name} is already written")
+        for values, value in zip(self.values, self._stored(row)):
+            values.append(value)
+
+    def _stored(self, row):
+        """The stored values of a row; its strings are referenced in the pool."""
+        if len(row) != len(self.columns):
+            raise MsiError(f"table {self.name} has {len(self.columns)} columns, got a row of {len(row)}")
+        add_string = self.writer.pool.add
+        stored = []
+        for (column, bits), value in zip(self.columns, row):
+            if value is None or value == '':
+                if not bits & TYPE_NULLABLE:
+                    raise MsiError(f"{self.name}.{column} cannot be NULL")
+                stored.append(0)
+            elif bits & TYPE_STRING:
+                stored.append(add_string(str(value)))
+            elif bits & 0xFF == 2:
+                if not -0x7FFF <= value <= 0x7FFF:
+                    raise MsiError(f"{self.name}.{column}: {value} does not fit in 2 bytes")
+                stored.append(value + 0x8000)
+            else:
+                if not -0x7FFFFFFF <= value <= 0x7FFFFFFF:
+                    raise MsiError(f"{self.name}.{column}: {value} does not fit in 4 bytes")
+                stored.append((value + 0x80000000) & 0xFFFFFFFF)
+        return stored
+
+    def extend(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def finish(self):
+        """Spool the table; no more rows can be added."""
+        self.writer._spool(self)
+
+    def _sorted(self):
+        """The columns in primary key order; duplicate keys are an error."""
+        count = len(self)
+        key_columns = self.values[:self.keys]
+        if self.keys == 1:
+            order = sorted(range(count), key=key_columns[0].__getitem__)
+        else:
+            order = sorted(range(count), key=lambda row: tuple(values[row] for values in key_columns))
+        for previous, row in zip(order, order[1:]):
+            if all(values[previous] == values[row] for values in key_columns):
+                raise MsiError(f"duplicate primary key in table {self.name}")
+        return [array('I', (values[row] for row in order)) for values in self.values]
+
+
+class MsiWriter(object):
+    """
+    Writes an MSI database.
+
+    Usage:
+        writer = MsiWriter(path)
+        files = writer.table('File', [('File', 's72'), ('Component_', 's72'), ...], keys=1)
+        files.add(('F1', 'MainComponent', ...))
+        files.finish()
+        writer.summary(title='Installation Database', template='Intel;1033', revision=package_code)
+        writer.close()
+
+    Args:
+        path: Database to write
+        codepage: Codepage of the strings (1252, 65001, 0 for neutral ASCII)
+    """
+
+    def __init__(self, path, codepage=1252):
+        self.path = path
+        self.pool = StringPool(codepage)
+        self.tables = {}
+        self.streams = []
+        self.properties = {PID_CODEPAGE: codepage}
+        self.spool = tempfile.TemporaryFile(prefix='msi_tables_', dir=os.path.dirname(os.path.abspath(path)))
+        self.spooled = []   # (table, spool offset, row count)
+        self.package_inputs = hashlib.sha256()
+        self.package_code = None
+        self.closed = False
+
+    def table(self, name, columns, keys=1):
+        """Create a table; columns are (name, type spec) pairs."""
+        if name in self.tables:
+            raise MsiError(f"table {name} already exists")
+        if len(encode_stream_name(name, table=True)) > 31:
+            raise MsiError(f"table name {name} is too long")
+        table = self.tables[name] = Table(self, name, columns, keys)
+        return table
+
+    def add_stream(self, name, data):
+        """Add a stream such as 'Binary.Logo' (bytes, or a path to copy)."""
+        self.streams.append((encode_stream_name(name), data))
+
+    def add_package_input(self, data):
+        """Mix bytes the database does not hold (e.g. payload file hashes) into the derived package code."""
+        self.package_inputs.update(data)
+
+    def summary(self, title=None, subject=None, author=None, keywords=None, comments=None, template=None,
+                last_author=None, revision=None, created=None, saved=None, page_count=200, word_count=2,
+                app_name=None, security=2):
+        """
+        Set the summary information.
+
+        template is the platform and languages ('Intel;1033', 'x64;1033'),
+        revision the package code GUID (derived from the content when None).
+        word_count 2 means compressed files with long names; created and
+        saved are Unix timestamps.
+        """
+        values = {PID_TITLE: title, PID_SUBJECT: subject, PID_AUTHOR: author, PID_KEYWORDS: keywords,
+                  PID_COMMENTS: comments, PID_TEMPLATE: template, PID_LASTAUTHOR: last_author,
+                  PID_REVNUMBER: revision, PID_PAGECOUNT: page_count, PID_WORDCOUNT: word_count,
+                  PID_APPNAME: app_name, PID_SECURITY: security,
+                  PID_CREATE_DTM: None if created is None else filetime(created),
+                  PID_LASTSAVE_DTM: None if saved is None else filetime(saved)}
+        self.properties.update((pid, value) for pid, value in values.items() if value is not None)
+
+    def _spool(self, table):
+        if table.finished:
+            return
+        table.finished = True
+        offset = self.spool.seek(0, os.SEEK_END)
+        count = len(table)
+        if count:
+            for values in table._sorted():
+                self.spool.write(values.tobytes())
+        self.spooled.append((table, offset, count))
+        table.values = None
+
+    def _system_tables(self):
+        # Each name below is one reference from _Tables, each column row one more to its table's name
+        names = array('I', sorted(self.pool.add(name) for name in self.tables))
+        column_rows = []
+        for table in self.tables.values():
+            for number, (column, bits) in enumerate(table.columns, 1):
+                column_rows.append((self.pool.add(table.name), number + 0x8000, self.pool.add(column), bits + 0x8000))
+        column_rows.sort()
+        columns = [array('I', (row[index] for row in column_rows)) for index in range(4)]
+        return names, columns
+
+    def _narrow(self, values, bits, ref_width):
+        """The stored bytes of one column: 2, 3 or 4 bytes per value."""
+        if bits & TYPE_STRING:
+            width = ref_width
+        else:
+            width = 2 if bits & 0xFF == 2 else 4
+        if sys.byteorder != 'little':
+            values = array('I', values)
+            values.byteswap()
+        raw = values.tobytes()
+        if width == 4:
+            return raw
+        out = bytearray(width * len(values))
+        for byte in range(width):
+            out[byte::width] = raw[byte::4]
+        return bytes(out)
+
+    def close(self):
+        """Write the database."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            for table in list(self.tables.values()):
+                self._spool(table)
+            self._prepare()
+            ref_width = self._ref_width()
+            pool_stream, data_stream = self.pool.streams()
+            digest = hashlib.sha256(self.package_inputs.digest())
+            with CompoundFileWriter(self.path, clsid=MSI_CLSID,
+                                    mtime=self.properties.get(PID_LASTSAVE_DTM, 0)) as cfb:
+
+                def add(name, data, size=None):
+                    # Every stream goes through the digest the package code is derived from
+                    digest.update(name.encode('utf-16-le') + b'\0\0')
+                    if isinstance(data, (bytes, bytearray)):
+                        digest.update(data)
+                        cfb.add_stream(name, data)
+                    else:
+                        cfb.add_stream(name, _hashed(data, digest), size)
+
+                add(encode_stream_name('_StringPool', table=True), pool_stream)
+                add(encode_stream_name('_StringData', table=True), data_stream)
+                self._write_tables(add, ref_width)
+                for name, data in self.streams:
+                    if isinstance(data, (bytes, bytearray)):
+                        add(name, data)
+                    else:
+                        add(name, _file_chunks(data), os.path.getsize(data))
+                if PID_REVNUMBER not in self.properties:
+                    digest.update(self._summary_stream())
+                    code = uuid.UUID(bytes=digest.digest()[:16], version=5)
+                    self.properties[PID_REVNUMBER] = f"{{{str(code).upper()}}}"
+                self.package_code = self.properties[PID_REVNUMBER]
+                cfb.add_stream(SUMMARY_STREAM, self._summary_stream())
+        finally:
+            self._cleanup()
+
+    def _prepare(self):
+        # The system tables reference the table and column names: pool them before it is written
+        self._system = self._system_tables()
+
+    def _ref_width(self):
+        return 3 if self.pool.long_refs else 2
+
+    def _cleanup(self):
+        self.spool.close()
+
+    def _write_tables(self, add, ref_width):
+        """Add the _Tables and _Columns streams and one stream per table with rows."""
+        names, columns = self._system
+        add(encode_stream_name('_Tables', table=True), self._narrow(names, TYPE_STRING, ref_width))
+        column_bits = (TYPE_STRING, 2, TYPE_STRING, 2)
+        add(encode_stream_name('_Columns', table=True),
+            b''.join(self._narrow(values, bits, ref_width) for values, bits in zip(columns, column_bits)))
+        for table, offset, count in self.spooled:
+            if count:
+                add(encode_stream_name(table.name, table=True), self._table_chunks(table, offset, count, ref_width),
+                    sum(self._width(bits, ref_width) for _, bits in table.columns) * count)
+
+    def _width(self, bits, ref_width):
+        if bits & TYPE_STRING:
+            return ref_width
+        return 2 if bits & 0xFF == 2 else 4
+
+    def _table_chunks(self, table, offset, count, ref_width):
+        # One column at a time from the spool
+        for index, (_, bits) in enumerate(table.columns):
+            self.spool.seek(offset + index * 4 * count)
+            values = array('I')
+            values.frombytes(self.spool.read(4 * count))
+            yield self._narrow(values, bits, ref_width)
+
+    def _summary_stream(self):
+        encoding = self.pool.encoding
+        values = []
+        for pid in sorted(self.properties):
+            value = self.properties[pid]
+            kind = _PROPERTY_TYPES.get(pid, VT_LPSTR)
+            if kind == VT_I2:
+                data = struct.pack('<Ihxx', kind, value if value < 0x8000 else value - 0x10000)
+            elif kind == VT_I4:
+                data = struct.pack('<Ii', kind, value)
+            elif kind == VT_FILETIME:
+                data = struct.pack('<IQ', kind, value)
+            else:
+                encoded = str(value).encode(encoding) + b'\0'
+                encoded += b'\0' * (-len(encoded) % 4)
+                data = struct.pack('<II', kind, len(encoded)) + encoded
+            values.append((pid, data))
+        header_size = 8 + 8 * len(values)
+        offsets = []
+        position = header_size
+        for _, data in values:
+            offsets.append(position)
+            position += len(data)
+        section = (struct.pack('<II', position, len(values))
+                   + b''.join(struct.pack('<II', pid, offset) for (pid, _), offset in zip(values, offsets))
+                   + b''.join(data for _, data in values))
+        return (struct.pack('<HHI16sI', 0xFFFE, 0, 0x00020006, b'\0' * 16, 1)
+                + SUMMARY_FMTID + struct.pack('<I', 48) + section)
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self._cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
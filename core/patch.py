@@ -0,0 +1,331 @@
+"""
+Patch packages: what changed between two builds of a product.
+
+Every build writes a build manifest next to its cabinets,
+'<project>.build.json': per installed file its path, size, content hash
+(from the database scan) and where its payload is stored (cabinet and name
+in the cabinet).  A patch compares the manifest of an earlier build, the
+baseline, with the current one by hash only, so unchanged files are never
+opened:
+
+    changed     old payload read from the baseline's cabinets, new file
+                from the source tree, shipped as a binary delta
+                (core.delta) unless the delta would not be smaller
+    added       shipped in full
+    removed     listed
+
+The patch is a core.sfx package holding 'patch.json' (the list above with
+the old and new hashes) and one entry per shipped delta or file, so it is
+compressed and verified like the self-extracting installer.  apply_patch()
+checks every file it is about to change against its old hash before
+writing anything, and every result against its new hash:
+
+    python -m core.patch apply Product.patch INSTALLDIR
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from core.cab import CabinetReader
+from core.delta import make_delta, apply_delta
+from core.sfx import SfxWriter, SfxReader
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+PATCH_VERSION = 1
+BUILD_MANIFEST_SUFFIX = '.build.json'
+PATCH_INDEX = 'patch.json'
+
+
+class PatchError(Exception):
+    """A patch could not be built, or does not apply to a directory."""
+
+
+class PatchStats(object):
+    """What a patch holds, against a full reinstall."""
+
+    def __init__(self):
+        self.unchanged = 0
+        self.changed = 0
+        self.deltas = 0
+        self.added = 0
+        self.removed = 0
+        self.bytes_new = 0       # Size of the changed and added files
+        self.bytes_shipped = 0   # Deltas and full files before the package's compression
+        self.package_size = 0
+        self.seconds = 0.0
+
+    def __str__(self):
+        return (f"{self.changed} changed ({self.deltas} as deltas), {self.added} added, {self.removed} removed, "
+                f"{self.unchanged} unchanged; {self.bytes_new} bytes of new content shipped as "
+                f"{self.bytes_shipped} bytes, {self.package_size} bytes packed, in {self.seconds:.2f}s")
+
+
+def write_build_manifest(path, product, version, files):
+    """Write a build manifest; files are dicts with path, size, hash, cabinet and name."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'product': product, 'product_version': version,
+                   'files': sorted(files, key=lambda record: record['path'])}, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def load_build_manifest(path):
+    """Read a build manifest as a dict with a 'files' dict of path -> record."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise PatchError(f"Unable to read build manifest {path}: {e}") from None
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise PatchError(f"{path}: unsupported build manifest version {manifest.get('version')}")
+    manifest['files'] = {record['path']: record for record in manifest['files']}
+    return manifest
+
+
+def _digest(algorithm_and_hash, data):
+    algorithm = algorithm_and_hash.partition(':')[0] or 'sha256'
+    return f"{algorithm}:{hashlib.new(algorithm, data).hexdigest()}"
+
+
+def delta_or_full(old, new_path, work_path):
+    """Write the delta from old to new_path at work_path, or the new file if the delta is not smaller.
+
+    Returns ('delta' or 'full', bytes written).  Module level so it can
+    run in a worker process.
+    """
+    with open(new_path, 'rb') as f:
+        new = f.read()
+    delta = make_delta(old, new)
+    # Compare what the package's compression will make of both
+    if len(zlib.compress(delta, 1)) < len(zlib.compress(new, 1)):
+        kind, data = 'delta', delta
+    else:
+        kind, data = 'full', new
+    with open(work_path, 'wb') as f:
+        f.write(data)
+    return kind, len(data)
+
+
+def _read_baseline(baseline_dir, records):
+    """Yield (record, old contents) for baseline records, one pass per cabinet."""
+    by_cabinet = {}
+    for record in records:
+        by_cabinet.setdefault(record['cabinet'], []).append(record)
+    for cabinet, cabinet_records in by_cabinet.items():
+        by_name = {}
+        for record in cabinet_records:
+            by_name.setdefault(record['name'], []).append(record)
+        reader = CabinetReader(os.path.join(baseline_dir, cabinet))
+        found = set()
+        for cab_file, data in reader.extract(by_name):
+            found.add(cab_file.name)
+            for record in by_name[cab_file.name]:
+                yield record, data
+        missing = set(by_name) - found
+        if missing:
+            raise PatchError(f"{cabinet} in {baseline_dir} lacks {', '.join(sorted(missing))}")
+
+
+def create_patch(out_path, baseline_dir, baseline, current, root, workers=1, method='lzma', timestamp=None):
+    """
+    Build the patch from the baseline build to the current one.
+
+    Args:
+        out_path: Patch package to write
+        baseline_dir: Output directory of the baseline build (its cabinets)
+        baseline: The baseline's manifest, from load_build_manifest()
+        current: The current manifest, same form
+        root: Source tree of the current build
+        workers: Processes computing deltas (and compressing the package)
+        method: Compression of the package (see core.sfx)
+        timestamp: Modification time recorded for the package entries (None for the files' own)
+
+    Returns:
+        PatchStats
+    """
+    started = time.perf_counter()
+    stats = PatchStats()
+    old_files = baseline['files']
+    new_files = current['files']
+    changed = []
+    added = []
+    for path, record in sorted(new_files.items()):
+        old = old_files.get(path)
+        if old is None:
+            added.append(record)
+        elif record['hash'] and record['hash'] == old['hash']:
+            stats.unchanged += 1
+        else:
+            changed.append(record)
+    removed = [old_files[path] for path in sorted(set(old_files) - set(new_files))]
+
+    work_dir = tempfile.mkdtemp(prefix='patch_', dir=os.path.dirname(os.path.abspath(out_path)))
+    pool = ProcessPoolExecutor(workers) if workers > 1 and len(changed) > 1 else None
+    try:
+        entries = []
+        pending = []
+        for number, (old, data) in enumerate(_read_baseline(baseline_dir, [old_files[r['path']] for r in changed])):
+            record = new_files[old['path']]
+            work_path = os.path.join(work_dir, str(number))
+            source = os.path.join(root, record['path'])
+            if pool is not None:
+                future = pool.submit(delta_or_full, data, source, work_path)
+            else:
+                future = Future()
+                future.set_result(delta_or_full(data, source, work_path))
+            pending.append((future, old, record, work_path))
+        for future, old, record, work_path in pending:
+            kind, size = future.result()
+            entry = f"{kind}/{len(entries)}"
+            entries.append(({'path': record['path'], 'action': kind, 'entry': entry, 'old_hash': old['hash'],
+                             'hash': record['hash'], 'size': record['size']}, work_path))
+            stats.changed += 1
+            stats.deltas += kind == 'delta'
+            stats.bytes_new += record['size']
+            stats.bytes_shipped += size
+        for record in added:
+            entry = f"full/{len(entries)}"
+            entries.append(({'path': record['path'], 'action': 'full', 'entry': entry, 'old_hash': None,
+                             'hash': record['hash'], 'size': record['size']}, os.path.join(root, record['path'])))
+            stats.added += 1
+            stats.bytes_new += record['size']
+            stats.bytes_shipped += record['size']
+        stats.removed = len(removed)
+
+        index_path = os.path.join(work_dir, PATCH_INDEX)
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': PATCH_VERSION, 'product': current.get('product'),
+                       'from': baseline.get('product_version'), 'to': current.get('product_version'),
+                       'files': [info for info, _ in entries],
+                       'removed': [{'path': r['path'], 'old_hash': r['hash']} for r in removed]}, f, indent=1)
+        writer = SfxWriter(out_path, method=method, workers=workers, timestamp=timestamp)
+        writer.add(index_path, PATCH_INDEX)
+        for info, source in entries:
+            writer.add(source, info['entry'])
+        stats.package_size = writer.close().bytes_out
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    stats.seconds = time.perf_counter() - started
+    return stats
+
+
+def _file_hash(path, like):
+    from db.hashing import hash_file
+    try:
+        return hash_file(path, like.partition(':')[0] or 'sha256')
+    except FileNotFoundError:
+        return None
+
+
+def apply_patch(patch_path, target_dir):
+    """
+    Apply a patch to an installed copy of the baseline build.
+
+    Nothing is written unless every file to change still has its baseline
+    content; files already at their new content are left alone, so an
+    interrupted patch can be applied again.
+
+    Returns:
+        dict of 'patched', 'added', 'removed' and 'skipped' counts
+    """
+    counts = dict(patched=0, added=0, removed=0, skipped=0)
+    with SfxReader(patch_path) as reader:
+        info = json.loads(reader.read(PATCH_INDEX))
+        if info.get('version') != PATCH_VERSION:
+            raise PatchError(f"{patch_path}: unsupported patch version {info.get('version')}")
+
+        # Check everything before touching anything
+        todo = []
+        for record in info['files']:
+            path = os.path.join(target_dir, *record['path'].split('/'))
+            current = _file_hash(path, record['hash'] or 'sha256')
+            if record['hash'] and current == record['hash']:
+                counts['skipped'] += 1
+            elif record['old_hash'] is None or current == record['old_hash']:
+                todo.append((record, path))
+            else:
+                raise PatchError(f"{record['path']} does not have the content the patch expects "
+                                 f"({current or 'missing'})")
+        removals = []
+        for record in info['removed']:
+            path = os.path.join(target_dir, *record['path'].split('/'))
+            current = _file_hash(path, record['old_hash'] or 'sha256')
+            if current is None:
+                counts['skipped'] += 1
+            elif record['old_hash'] is None or current == record['old_hash']:
+                removals.append(path)
+            else:
+                raise PatchError(f"{record['path']} was modified, not removing it")
+
+        # New contents go to temporary files first, then replace the originals
+        staged = []
+        try:
+            for record, path in todo:
+                data = reader.read(record['entry'])
+                if record['action'] == 'delta':
+                    with open(path, 'rb') as f:
+                        data = apply_delta(f.read(), data)
+                if record['hash'] and _digest(record['hash'], data) != record['hash']:
+                    raise PatchError(f"{record['path']}: patched content does not match {record['hash']}")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.patch-tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                staged.append((tmp_path, path, record))
+        except BaseException:
+            for tmp_path, _, _ in staged:
+                os.remove(tmp_path)
+            raise
+    for tmp_path, path, record in staged:
+        os.replace(tmp_path, path)
+        counts['patched' if record['old_hash'] else 'added'] += 1
+    for path in removals:
+        os.remove(path)
+        counts['removed'] += 1
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect or apply a patch package')
+    sub = parser.add_subparsers(dest='command', required=True)
+    list_parser = sub.add_parser('list', help='List what the patch changes')
+    list_parser.add_argument('patch')
+    apply_parser = sub.add_parser('apply', help='Apply the patch to an installed copy of the baseline')
+    apply_parser.add_argument('patch')
+    apply_parser.add_argument('target')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        with SfxReader(args.patch) as reader:
+            info = json.loads(reader.read(PATCH_INDEX))
+            sizes = {entry.name: entry.size for entry in reader.entries}
+        print(f"{info.get('product')} {info.get('from')} -> {info.get('to')}")
+        for record in info['files']:
+            print(f"{record['action']:>6} {sizes[record['entry']]:>12} {record['path']}")
+        for record in info['removed']:
+            print(f"{'remove':>6} {'':>12} {record['path']}")
+    else:
+        try:
+            counts = apply_patch(args.patch, args.target)
+        except PatchError as e:
+            print(f"Patch not applied: {e}", file=sys.stderr)
+            return 1
+        print(', '.join(f"{count} {what}" for what, count in counts.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,381 @@
+"""
+Self-extracting package container (make_pfw).
+
+An extractor stub (any executable that understands this format) followed
+by the payload and an index:
+
+    stub          optional, copied as is
+    chunks        every entry cut into chunks of chunk_size bytes, each
+                  compressed on its own (deflate, lzma or stored)
+    index         zlib-compressed JSON: per entry its name, size, mtime,
+                  content hash and method, and per chunk its offset,
+                  compressed size, size and sha256
+    footer        64 bytes: magic, payload offset, index offset, index size,
+                  sha256 of the index
+
+Because chunks are independent, packing compresses them on a process pool,
+and extraction can seek straight to one entry (or one chunk of it) and
+decompress on several threads; zlib and lzma release the GIL.  Offsets in
+the index are relative to the end of the stub, so a stub can be prepended
+or replaced without rewriting the index.
+
+This module only needs the standard library, so it also serves as the
+reference extractor:
+
+    python -m core.sfx list Product_setup.exe
+    python -m core.sfx extract Product_setup.exe DEST [--entry NAME] [--workers N]
+"""
+
+import os
+import sys
+import json
+import lzma
+import time
+import zlib
+import struct
+import hashlib
+import logging
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PFWPACK1'
+FORMAT_VERSION = 1
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+METHODS = ('deflate', 'lzma', 'store')
+_FOOTER = struct.Struct('<8sQQQ32s')
+
+
+class SfxError(Exception):
+    """A package could not be written, or is malformed or corrupted."""
+
+
+SfxEntry = namedtuple('SfxEntry', ['name', 'size', 'mtime', 'hash', 'method', 'chunks'])
+SfxChunk = namedtuple('SfxChunk', ['offset', 'compressed_size', 'size', 'sha256'])
+
+
+class SfxStats(object):
+    """What packing or extracting took."""
+
+    def __init__(self):
+        self.entries = 0
+        self.chunks = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    @property
+    def mb_per_s(self):
+        return max(self.bytes_in, self.bytes_out) / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.entries} entries, {self.chunks} chunks, {self.bytes_in} -> {self.bytes_out} bytes "
+                f"in {self.seconds:.2f}s, {self.mb_per_s:.1f} MB/s")
+
+
+def _compress(data, method, level):
+    if method == 'deflate':
+        c = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return c.compress(data) + c.flush()
+    if method == 'lzma':
+        return lzma.compress(data, preset=min(level, 9))
+    return data
+
+
+def _decompress(data, method):
+    if method == 'deflate':
+        return zlib.decompress(data, -15)
+    if method == 'lzma':
+        return lzma.decompress(data)
+    if method == 'store':
+        return data
+    raise SfxError(f"unsupported method '{method}'")
+
+
+def compress_chunk(source, offset, size, method, level):
+    """Read and compress one chunk; return (compressed data, sha256 of the chunk).
+
+    Module level so it can run in a worker process.
+    """
+    with open(source, 'rb') as f:
+        f.seek(offset)
+        data = f.read(size)
+    if len(data) != size:
+        raise SfxError(f"{source} changed while it was being packed")
+    return _compress(data, method, level), hashlib.sha256(data).hexdigest()
+
+
+class SfxWriter(object):
+    """
+    Builds one package.
+
+    Usage:
+        writer = SfxWriter(path, stub=stub_path, workers=8)
+        writer.add(source, 'Product.msi')
+        stats = writer.close()
+
+    Args:
+        path: Package to write
+        stub: Extractor executable to put in front (None for none)
+        method: 'deflate', 'lzma' or 'store'
+        level: Compression level
+        chunk_size: Uncompressed bytes per chunk
+        workers: Processes compressing chunks
+        policy: CompressionPolicy; entries it judges incompressible are stored
+        metadata: JSON-serializable dict stored in the index (e.g. what to run)
+        timestamp: Modification time recorded for every entry (None for the sources' own)
+    """
+
+    def __init__(self, path, stub=None, method='deflate', level=6, chunk_size=DEFAULT_CHUNK_SIZE, workers=1,
+                 policy=None, metadata=None, timestamp=None):
+        if method not in METHODS:
+            raise SfxError(f"unknown method '{method}' (supported: {', '.join(METHODS)})")
+        self.path = path
+        self.stub = stub
+        self.method = method
+        self.level = level
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers or 1)
+        self.policy = policy
+        self.metadata = metadata or {}
+        self.timestamp = timestamp
+        self.sources = []
+
+    def add(self, source, name=None):
+        """Queue a file, stored under name (its base name by default)."""
+        name = (name or os.path.basename(source)).replace('\\', '/')
+        if name.startswith('/') or '..' in name.split('/'):
+            raise SfxError(f"invalid entry name '{name}'")
+        self.sources.append((source, name))
+
+    def _jobs(self):
+        # (entry index, source, offset, size, method) for every chunk, in file order
+        entries = []
+        jobs = []
+        for index, (source, name) in enumerate(self.sources):
+            st = os.stat(source)
+            method = self.method
+            if method != 'store' and self.policy is not None and self.policy.should_store(source, st.st_size):
+                method = 'store'
+            mtime = st.st_mtime if self.timestamp is None else self.timestamp
+            entries.append({'name': name, 'size': st.st_size, 'mtime': mtime, 'method': method,
+                            'chunks': []})
+            for offset in range(0, st.st_size, self.chunk_size):
+                jobs.append((index, source, offset, min(self.chunk_size, st.st_size - offset), method))
+        return entries, jobs
+
+    def close(self):
+        """Write the package and return its SfxStats."""
+        from db.hashing import hash_files
+
+        started = time.perf_counter()
+        stats = SfxStats()
+        entries, jobs = self._jobs()
+        digests = hash_files([source for source, _ in self.sources], workers=self.workers)
+        tmp_path = f"{self.path}.tmp"
+        pool = ProcessPoolExecutor(self.workers) if self.workers > 1 and len(jobs) > 1 else None
+        try:
+            with open(tmp_path, 'wb') as out:
+                if self.stub:
+                    with open(self.stub, 'rb') as stub:
+                        while True:
+                            data = stub.read(1024 * 1024)
+                            if not data:
+                                break
+                            out.write(data)
+                payload_offset = out.tell()
+                queued = iter(jobs)
+                pending = []
+
+                def submit():
+                    job = next(queued, None)
+                    if job is None:
+                        return
+                    index, source, offset, size, method = job
+                    if pool is not None:
+                        future = pool.submit(compress_chunk, source, offset, size, method, self.level)
+                    else:
+                        future = Future()
+                        future.set_result(compress_chunk(source, offset, size, method, self.level))
+                    pending.append((future, index, size))
+
+                # Finished chunks wait in memory for their turn, the window bounds how many
+                for _ in range(2 * self.workers):
+                    submit()
+                while pending:
+                    future, index, size = pending.pop(0)
+                    data, digest = future.result()
+                    entries[index]['chunks'].append([out.tell() - payload_offset, len(data), size, digest])
+                    out.write(data)
+                    stats.chunks += 1
+                    stats.bytes_in += size
+                    submit()
+
+                for entry, (source, _) in zip(entries, self.sources):
+                    if digests.get(source) is None:
+                        raise SfxError(f"unable to read {source}")
+                    entry['hash'] = digests[source]
+                index = zlib.compress(json.dumps({'version': FORMAT_VERSION, 'metadata': self.metadata,
+                                                  'entries': entries}).encode('utf-8'), 9)
+                index_offset = out.tell()
+                out.write(index)
+                out.write(_FOOTER.pack(MAGIC, payload_offset, index_offset, len(index),
+                                       hashlib.sha256(index).digest()))
+                stats.bytes_out = out.tell()
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        stats.entries = len(entries)
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+
+class SfxReader(object):
+    """
+    Reads a package: the index at open, entry data on demand.
+
+    Reads use os.pread, so one reader can serve several threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            size = os.fstat(self.fd).st_size
+            if size < _FOOTER.size:
+                raise SfxError(f"{path} is not a package")
+            magic, self.payload_offset, index_offset, index_size, index_digest = _FOOTER.unpack(
+                os.pread(self.fd, _FOOTER.size, size - _FOOTER.size))
+            if magic != MAGIC:
+                raise SfxError(f"{path} is not a package")
+            index = os.pread(self.fd, index_size, index_offset)
+            if hashlib.sha256(index).digest() != index_digest:
+                raise SfxError(f"{path}: the index is corrupted")
+            data = json.loads(zlib.decompress(index))
+        except BaseException:
+            os.close(self.fd)
+            raise
+        if data.get('version') != FORMAT_VERSION:
+            self.close()
+            raise SfxError(f"{path}: unsupported format version {data.get('version')}")
+        self.metadata = data.get('metadata', {})
+        self.entries = [SfxEntry(e['name'], e['size'], e['mtime'], e['hash'], e['method'],
+                                 [SfxChunk(*chunk) for chunk in e['chunks']]) for e in data['entries']]
+        self._by_name = {entry.name: entry for entry in self.entries}
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def entry(self, name):
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise SfxError(f"{self.path}: no entry '{name}'") from None
+
+    def read_chunk(self, entry, chunk):
+        """Decompress and verify one chunk of an entry."""
+        try:
+            data = _decompress(os.pread(self.fd, chunk.compressed_size, self.payload_offset + chunk.offset),
+                               entry.method)
+        except (zlib.error, lzma.LZMAError):
+            data = None
+        if data is None or len(data) != chunk.size or hashlib.sha256(data).hexdigest() != chunk.sha256:
+            raise SfxError(f"{self.path}: corrupted chunk at {chunk.offset} in '{entry.name}'")
+        return data
+
+    def read(self, name):
+        """The contents of one entry."""
+        entry = self.entry(name)
+        return b''.join(self.read_chunk(entry, chunk) for chunk in entry.chunks)
+
+    def _target(self, dest_dir, entry):
+        path = os.path.normpath(os.path.join(dest_dir, *entry.name.split('/')))
+        if os.path.commonpath([os.path.abspath(dest_dir), os.path.abspath(path)]) != os.path.abspath(dest_dir):
+            raise SfxError(f"{self.path}: entry '{entry.name}' points outside the destination")
+        return path
+
+    def extract(self, dest_dir, names=None, workers=None):
+        """Extract entries (all by default) below dest_dir, chunks decompressed on a thread pool."""
+        started = time.perf_counter()
+        stats = SfxStats()
+        entries = self.entries if names is None else [self.entry(name) for name in names]
+        outputs = []
+        try:
+            jobs = []
+            for entry in entries:
+                path = self._target(dest_dir, entry)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o644)
+                outputs.append((fd, path, entry))
+                os.ftruncate(fd, entry.size)
+                position = 0
+                for chunk in entry.chunks:
+                    jobs.append((fd, position, entry, chunk))
+                    position += chunk.size
+
+            def run(job):
+                fd, position, entry, chunk = job
+                data = self.read_chunk(entry, chunk)
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(fd, view, position)
+                    view = view[written:]
+                    position += written
+                return chunk.compressed_size, chunk.size
+
+            with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4)) as pool:
+                for compressed_size, size in pool.map(run, jobs):
+                    stats.chunks += 1
+                    stats.bytes_in += compressed_size
+                    stats.bytes_out += size
+        finally:
+            for fd, path, entry in outputs:
+                os.close(fd)
+        for fd, path, entry in outputs:
+            os.utime(path, (entry.mtime, entry.mtime))
+        stats.entries = len(entries)
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='List or extract a self-extracting package')
+    sub = parser.add_subparsers(dest='command', required=True)
+    list_parser = sub.add_parser('list', help='List the entries')
+    list_parser.add_argument('package')
+    extract_parser = sub.add_parser('extract', help='Extract entries')
+    extract_parser.add_argument('package')
+    extract_parser.add_argument('dest')
+    extract_parser.add_argument('--entry', action='append', help='Entry to extract (repeatable, default all)')
+    extract_parser.add_argument('--workers', type=int, help='Decompression threads')
+    args = parser.parse_args(argv)
+
+    with SfxReader(args.package) as reader:
+        if args.command == 'list':
+            for entry in reader.entries:
+                print(f"{entry.size:>12} {entry.method:>8} {entry.hash} {entry.name}")
+            if reader.metadata:
+                print(json.dumps(reader.metadata))
+        else:
+            stats = reader.extract(args.dest, args.entry, args.workers)
+            print(f"Extracted {stats}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
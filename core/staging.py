@@ -0,0 +1,145 @@
+"""
+Staging files into a build directory without copying their bytes.
+
+Strategies, cheapest first:
+
+reflink
+    FICLONE ioctl (Linux btrfs, XFS, bcachefs...): the staged file shares
+    the source's extents copy-on-write.  No data is written.
+hardlink
+    A second name for the source file.  No data is written; the staged file
+    must be treated as read-only since it is the source.
+copy_file_range
+    In-kernel copy (sendfile where copy_file_range is missing): the data
+    does not go through user space, and some file systems (NFS 4.2, CIFS)
+    copy on the server.
+copy
+    shutil.copy2.
+
+A strategy that fails because the file system or platform does not support
+it is not tried again for the same pair of devices.  Every staged file gets
+the source's timestamps and mode, as with copy2.
+"""
+
+import os
+import sys
+import errno
+import shutil
+import logging
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('reflink', 'hardlink', 'copy_file_range', 'copy')
+FICLONE = 0x40049409
+
+# Errors that mean "not possible here", as opposed to a real I/O failure
+_UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EPERM,
+                errno.EMLINK}
+
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+
+
+def _copy_file_range(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copy = getattr(os, 'copy_file_range', None)
+        offset = 0
+        while offset < size:
+            if copy is not None:
+                n = copy(fsrc.fileno(), fdst.fileno(), size - offset)
+            else:
+                n = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+            if n == 0:
+                break
+            offset += n
+
+
+def _copy(src, dst):
+    shutil.copy2(src, dst)
+
+
+_FUNCTIONS = {
+    'reflink': _reflink,
+    'hardlink': _hardlink,
+    'copy_file_range': _copy_file_range,
+    'copy': _copy,
+}
+
+
+def _available(strategy):
+    if strategy == 'reflink':
+        return sys.platform.startswith('linux')
+    if strategy == 'copy_file_range':
+        return hasattr(os, 'copy_file_range') or (hasattr(os, 'sendfile') and sys.platform.startswith('linux'))
+    if strategy == 'hardlink':
+        return hasattr(os, 'link')
+    return True
+
+
+class StagingStats(object):
+    """Files and bytes staged per strategy."""
+
+    def __init__(self):
+        self.files = dict.fromkeys(STRATEGIES, 0)
+        self.bytes = dict.fromkeys(STRATEGIES, 0)
+
+    @property
+    def bytes_avoided(self):
+        """Bytes that were not written at all (shared extents or links)."""
+        return self.bytes['reflink'] + self.bytes['hardlink']
+
+    def __str__(self):
+        used = ', '.join(f"{self.files[s]} by {s}" for s in STRATEGIES if self.files[s])
+        return f"{sum(self.files.values())} files staged ({used or 'none'}), {self.bytes_avoided} bytes not copied"
+
+
+class Stager(object):
+    """
+    Stages files with the cheapest strategy that works.
+
+    Args:
+        strategies: Strategies to try, in order (a subset of STRATEGIES)
+    """
+
+    def __init__(self, strategies=STRATEGIES):
+        unknown = set(strategies) - set(STRATEGIES)
+        if unknown:
+            raise ValueError(f"unknown staging strategies: {', '.join(sorted(unknown))}")
+        self.strategies = [s for s in strategies if _available(s)]
+        self.stats = StagingStats()
+        # (strategy, source device, destination device) known not to work
+        self._unsupported = set()
+
+    def stage(self, src, dst):
+        """Make dst a copy of src; return the strategy used."""
+        st = os.stat(src)
+        dst_dev = os.stat(os.path.dirname(os.path.abspath(dst))).st_dev
+        if os.path.lexists(dst):
+            os.remove(dst)
+        for strategy in self.strategies:
+            if (strategy, st.st_dev, dst_dev) in self._unsupported:
+                continue
+            try:
+                _FUNCTIONS[strategy](src, dst)
+            except OSError as e:
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                if strategy == 'copy' or e.errno not in _UNSUPPORTED:
+                    raise
+                logger.debug(f"{strategy} unavailable from {src} to {dst}: {e}")
+                self._unsupported.add((strategy, st.st_dev, dst_dev))
+                continue
+            if strategy in ('reflink', 'copy_file_range'):
+                shutil.copystat(src, dst)
+            self.stats.files[strategy] += 1
+            self.stats.bytes[strategy] += st.st_size
+            return strategy
+        raise OSError(errno.ENOTSUP, f"no staging strategy could copy {src} to {dst}")
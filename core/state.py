@@ -59,6 +59,9 @@ class InstallerState(object):
         # TODO: should probably move the skipgoal check into the InstallerAction class.
         if hasattr(self.library.options, 'skipgoals') and self.library.options.skipgoals and self._goal in self.library.options.skipgoals:
             logging.warning(f"SKIPPING GOAL: {self._goal}")
+        elif self._goal in (getattr(self.library, 'up_to_date_goals', None) or ()):
+            # Set by the fingerprint goal when the outputs of the last build can be reused
+            logging.warning(f"SKIPPING GOAL: {self._goal} (outputs up to date)")
         else:
             self._action.run(self)
 
@@ -0,0 +1,148 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+from core.cab import (CabinetWriter, CabinetReader, CabEntry, CabinetError, checksum, plan_cabinets,
+                      stored_size, cabinet_name, folder_size_for, COMPRESS_MSZIP, COMPRESS_NONE, BLOCK_SIZE)
+
+def reference_checksum(data, seed=0):
+    # Straight transcription of the algorithm in the cabinet format specification
+    csum = seed
+    end = len(data) & ~3
+    for offset in range(0, end, 4):
+        csum ^= struct.unpack_from('<I', data, offset)[0]
+    tail = 0
+    for byte in data[end:]:
+        tail = (tail << 8) | byte
+    return csum ^ tail
+
+class TestCab(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='cab_test_')
+        self.contents = {
+            'a.txt': b'hello cabinet\n' * 5000,
+            'bin/app.exe': os.urandom(BLOCK_SIZE + 123),
+            'bin/empty.dat': b'',
+            'docs/résumé.txt': b'z' * (3 * BLOCK_SIZE),
+        }
+        for rel_path, data in self.contents.items():
+            path = os.path.join(self.tree, *rel_path.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def entries(self, names):
+        return [CabEntry(os.path.join(self.tree, *name.split('/')), name) for name in names]
+
+    def test_checksum(self):
+        for size in (0, 1, 2, 3, 4, 5, 7, 8, 1001, BLOCK_SIZE):
+            data = os.urandom(size)
+            self.assertEqual(checksum(data, 0x12345678), reference_checksum(data, 0x12345678), size)
+
+    def test_round_trip(self):
+        path = os.path.join(self.tree, 'out.cab')
+        writer = CabinetWriter(path)
+        writer.add_folder(self.entries(['a.txt', 'bin/app.exe', 'bin/empty.dat']))
+        writer.add_folder(self.entries(['docs/résumé.txt']), compression=COMPRESS_NONE)
+        stats = writer.close()
+        self.assertEqual((stats.files, stats.folders), (4, 2))
+        self.assertEqual(stats.bytes_in, sum(len(data) for data in self.contents.values()))
+        self.assertEqual(stats.bytes_out, os.path.getsize(path))
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+        reader = CabinetReader(path)
+        self.assertEqual(reader.size, stats.bytes_out)
+        self.assertEqual([folder[2] for folder in reader.folders], [COMPRESS_MSZIP, COMPRESS_NONE])
+        extracted = {entry.name: data for entry, data in reader.extract_all()}
+        self.assertEqual(extracted, {name.replace('/', '\\'): data for name, data in self.contents.items()})
+        # The repetitive text compresses, the random executable does not grow much
+        self.assertLess(stats.bytes_out, len(self.contents['docs/résumé.txt']) + BLOCK_SIZE * 1.1)
+
+    def test_parallel_folders(self):
+        names = ['a.txt', 'bin/app.exe', 'bin/empty.dat', 'docs/résumé.txt']
+        cabs = []
+        for workers in (1, 3):
+            path = os.path.join(self.tree, f"out{workers}.cab")
+            writer = CabinetWriter(path, workers=workers)
+            writer.add_files(self.entries(names), folder_size=BLOCK_SIZE)
+            stats = writer.close()
+            self.assertEqual(stats.folders, 3)
+            cabs.append(path)
+        reader = CabinetReader(cabs[1])
+        self.assertEqual([entry.folder for entry in reader.files], [0, 1, 2, 2])
+        extracted = {entry.name: data for entry, data in reader.extract_all()}
+        self.assertEqual(extracted, {name.replace('/', '\\'): data for name, data in self.contents.items()})
+        with open(cabs[0], 'rb') as sequential, open(cabs[1], 'rb') as parallel:
+            self.assertEqual(sequential.read(), parallel.read())
+
+    def test_timestamp(self):
+        names = ['a.txt', 'bin/app.exe']
+        outputs = []
+        for mtime in (1000000000, 1500000000):
+            for name in names:
+                os.utime(os.path.join(self.tree, *name.split('/')), (mtime, mtime))
+            path = os.path.join(self.tree, f"out{mtime}.cab")
+            writer = CabinetWriter(path, timestamp=1700000000)
+            writer.add_files(self.entries(names))
+            writer.close()
+            with open(path, 'rb') as f:
+                outputs.append(f.read())
+        # The sources' dates no longer show: 2023-11-14 22:13:20 UTC for every file
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual({(entry.date, entry.time) for entry in CabinetReader(path).files},
+                         {((43 << 9) | (11 << 5) | 14, (22 << 11) | (13 << 5) | 10)})
+        self.assertIsNone(folder_size_for(1024 * 1024))
+        self.assertEqual(folder_size_for(256 * 1024 * 1024), 8 * 1024 * 1024)
+
+    def test_compression_runs(self):
+        names = ['a.txt', 'bin/app.exe', 'bin/empty.dat', 'docs/résumé.txt']
+        path = os.path.join(self.tree, 'runs.cab')
+        writer = CabinetWriter(path)
+        writer.add_files(self.entries(names), compression_for=lambda e: COMPRESS_NONE if e.name.startswith('bin/') else None)
+        writer.close()
+        reader = CabinetReader(path)
+        self.assertEqual([folder[2] for folder in reader.folders], [COMPRESS_MSZIP, COMPRESS_NONE, COMPRESS_MSZIP])
+        self.assertEqual([entry.folder for entry in reader.files], [0, 1, 1, 2])
+        self.assertEqual(len(list(reader.extract_all())), 4)
+
+    def test_spanning(self):
+        names = ['a.txt', 'bin/app.exe', 'bin/empty.dat', 'docs/résumé.txt']
+        items = [(entry, os.path.getsize(entry.source)) for entry in self.entries(names)]
+        max_size = 2 * BLOCK_SIZE + 1000
+        cabinets = plan_cabinets(items, max_size)
+        self.assertEqual([[entry.name for entry in cabinet] for cabinet in cabinets],
+                         [['a.txt'], ['bin/app.exe', 'bin/empty.dat'], ['docs/résumé.txt']])
+        self.assertEqual([cabinet_name('Product', disk) for disk in (1, 2)], ['Product.cab', 'Product2.cab'])
+        for index, entries in enumerate(cabinets):
+            path = os.path.join(self.tree, f"span{index}.cab")
+            writer = CabinetWriter(path, index=index)
+            writer.add_folder(entries)
+            writer.close()
+            # The estimate is an upper bound, even for the random executable
+            size = os.path.getsize(path)
+            self.assertLessEqual(size, 36 + sum(stored_size(e.name, os.path.getsize(e.source)) for e in entries))
+            if index < 2:
+                self.assertLessEqual(size, max_size)
+            self.assertEqual(CabinetReader(path).index, index)
+
+    def test_changed_file(self):
+        path = os.path.join(self.tree, 'out.cab')
+        writer = CabinetWriter(path)
+        writer.add_folder(self.entries(['a.txt']))
+        folders, files = writer._layout()
+        with open(os.path.join(self.tree, 'a.txt'), 'ab') as f:
+            f.write(b'more')
+        writer._layout = lambda: (folders, files)
+        with self.assertRaises(CabinetError):
+            writer.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + '.tmp'))
+        with self.assertRaises(CabinetError):
+            CabinetWriter(path, compression='lzx')
+
+if __name__ == '__main__':
+    unittest.main()
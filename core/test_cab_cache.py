@@ -0,0 +1,77 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.cab import CabinetWriter, CabinetReader, CabEntry, BLOCK_SIZE
+from core.cab_cache import CompressionCache
+from db.hashing import hash_file
+
+class TestCompressionCache(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='cab_cache_test_')
+        self.cache_dir = os.path.join(self.tree, 'cache')
+        self.names = [f"file{i}.txt" for i in range(12)]
+        for i, name in enumerate(self.names):
+            self.write(name, f"contents of file {i}\n".encode() * (i * 700))
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def write(self, name, data):
+        with open(os.path.join(self.tree, name), 'wb') as f:
+            f.write(data)
+
+    def build(self, cache, path='out.cab'):
+        path = os.path.join(self.tree, path)
+        entries = [CabEntry(os.path.join(self.tree, name), name, hash_file(os.path.join(self.tree, name)))
+                   for name in self.names]
+        writer = CabinetWriter(path, cache=cache)
+        writer.add_files_by_content(entries, target_size=BLOCK_SIZE)
+        stats = writer.close()
+        return path, stats
+
+    def test_reuse(self):
+        cache = CompressionCache(self.cache_dir)
+        first, stats = self.build(cache, 'first.cab')
+        self.assertGreater(stats.folders, 2)
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (0, stats.folders))
+
+        # A new build (new cache object) splices every folder in
+        cache = CompressionCache(self.cache_dir)
+        second, _ = self.build(cache, 'second.cab')
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (stats.folders, 0))
+        with open(first, 'rb') as a, open(second, 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+        # Changing one file only misses its own folder (which may now take in the next file)
+        self.write('file7.txt', b'changed\n' * 3000)
+        cache = CompressionCache(self.cache_dir)
+        path, _ = self.build(cache, 'third.cab')
+        self.assertEqual(cache.stats.misses, 1)
+        self.assertGreaterEqual(cache.stats.hits, stats.folders - 2)
+        extracted = dict(CabinetReader(path).extract_all())
+        self.assertEqual({entry.name: data for entry, data in extracted.items()}['file7.txt'],
+                         b'changed\n' * 3000)
+
+    def test_eviction(self):
+        cache = CompressionCache(self.cache_dir, max_size=1000)
+        keys = [f"{i:02x}" * 32 for i in range(3)]
+        for key in keys:
+            cache.put(key, b'x' * 300, 1, 600)
+        self.assertEqual(cache.stats.evictions, 0)
+        # The oldest entry was used last, so the next oldest goes
+        self.assertEqual(cache.get(keys[0], 600), (b'x' * 300, 1))
+        self.assertIsNone(cache.get(keys[0], 601))
+        self.assertEqual(cache.stats.misses, 1)
+        cache.put(keys[0], b'x' * 300, 1, 600)
+        cache.put('ff' * 32, b'y' * 300, 1, 600)
+        self.assertEqual(cache.stats.evictions, 1)
+        self.assertFalse(os.path.exists(cache._path(keys[1])))
+        self.assertEqual(sorted(cache._entries), sorted([keys[0], keys[2], 'ff' * 32]))
+        self.assertLessEqual(cache.size, 1000)
+        # The on-disk state is what the next build sees
+        reopened = CompressionCache(self.cache_dir, max_size=1000)
+        self.assertEqual((len(reopened._entries), reopened.size), (3, cache.size))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+import os
+import shutil
+import tempfile
+import subprocess
+from core.cfb import (CompoundFileWriter, CompoundFileReader, CompoundFileError, name_key, _tree,
+                      NOSTREAM, RED)
+
+class TestCompoundFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='cfb_test_')
+        self.path = os.path.join(self.tmpdir, 'test.cfb')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        streams = {'empty': b'', 'small': b'mini stream data', 'cutoff': b'x' * 4095, 'large': os.urandom(4096),
+                   'larger': os.urandom(100000)}
+        # Enough entries for a directory of several sectors and a deep tree
+        streams.update((f"stream {number}", os.urandom(number * 37)) for number in range(300))
+        clsid = bytes(range(16))
+        with CompoundFileWriter(self.path, clsid=clsid) as writer:
+            for name, data in streams.items():
+                if name == 'larger':
+                    chunks = (data[offset:offset + 7000] for offset in range(0, len(data), 7000))
+                    writer.add_stream(name, chunks, len(data))
+                else:
+                    writer.add_stream(name, data)
+        with CompoundFileReader(self.path) as reader:
+            self.assertEqual(reader.clsid, clsid)
+            self.assertEqual(set(reader.streams), set(streams))
+            for name, data in streams.items():
+                self.assertEqual(reader.read(name), data)
+        self.assertFalse(os.path.exists(f"{self.path}.tmp"))
+        if shutil.which('file'):
+            output = subprocess.run(['file', self.path], capture_output=True, text=True).stdout
+            self.assertIn('Composite Document File', output)
+
+    def test_difat(self):
+        # More than 109 FAT sectors (7 MB of sectors) need DIFAT sectors
+        data = os.urandom(64 * 1024) * 130
+        with CompoundFileWriter(self.path) as writer:
+            writer.add_stream('big', data)
+            writer.add_stream('small', b'after')
+        with CompoundFileReader(self.path) as reader:
+            self.assertEqual(reader.read('big'), data)
+            self.assertEqual(reader.read('small'), b'after')
+
+    def test_tree(self):
+        for count in range(100):
+            ids = list(range(1, count + 1))
+            root, nodes = _tree(ids)
+            self.assertEqual(set(nodes), set(ids))
+
+            def black_height(node, parent_red=False):
+                if node == NOSTREAM:
+                    return 1
+                left, right, color = nodes[node]
+                self.assertFalse(parent_red and color == RED)
+                self.assertTrue(left == NOSTREAM or left < node < (right if right != NOSTREAM else count + 1))
+                heights = {black_height(left, color == RED), black_height(right, color == RED)}
+                self.assertEqual(len(heights), 1)
+                return heights.pop() + (color != RED)
+            black_height(root)
+        self.assertLess(name_key('zz'), name_key('AAA'))
+        self.assertEqual(name_key('abc'), name_key('ABC'))
+
+    def test_errors(self):
+        writer = CompoundFileWriter(self.path)
+        writer.add_stream('name', b'data')
+        for name in ('name', '', 'x' * 32, 'a/b'):
+            with self.assertRaises(CompoundFileError):
+                writer.add_stream(name, b'data')
+        with self.assertRaises(CompoundFileError):
+            writer.add_stream('short', iter([b'12345']), 10000)
+        writer.abort()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        with open(self.path, 'wb') as f:
+            f.write(b'not a compound file' * 100)
+        with self.assertRaises(CompoundFileError):
+            CompoundFileReader(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
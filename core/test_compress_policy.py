@@ -0,0 +1,77 @@
+import unittest
+import os
+import shutil
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db.models import Base
+from db.build_records import load_extension_stats, save_extension_stats
+from core.cab import CabinetWriter, CabEntry, COMPRESS_NONE
+from core.compress_policy import CompressionPolicy, ExtensionStats
+
+class TestCompressionPolicy(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='policy_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def write(self, name, data):
+        path = os.path.join(self.tree, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path, len(data)
+
+    def test_probe(self):
+        policy = CompressionPolicy()
+        self.assertTrue(policy.should_store(*self.write('photo.JPG', os.urandom(200000))))
+        self.assertFalse(policy.should_store(*self.write('readme.txt', b'plain text\n' * 20000)))
+        self.assertFalse(policy.should_store(*self.write('tiny.zip', os.urandom(100))))
+        report = policy.report
+        self.assertEqual((report.files_probed, report.files_stored, report.bytes_stored), (2, 1, 200000))
+        self.assertGreater(report.cpu_seconds_saved, 0)
+        # Random data does not shrink, storing it costs (almost) nothing
+        self.assertLess(report.ratio_lost, 0.01)
+        self.assertEqual(policy.history['.jpg'].incompressible, 1)
+        self.assertIn('1 files (200000 bytes) stored', str(report))
+
+    def test_history(self):
+        history = {'.bin': ExtensionStats(100, 100, 65536 * 100, 65600 * 100, 0.01)}
+        policy = CompressionPolicy(history=history)
+        # History is only reported: a compressible file is compressed whatever its extension usually does
+        self.assertFalse(policy.should_store(*self.write('text.bin', b'plain text\n' * 20000)))
+        self.assertTrue(policy.should_store(*self.write('a.bin', os.urandom(10000))))
+        self.assertEqual(policy.report.files_probed, 2)
+        self.assertEqual((history['.bin'].files, history['.bin'].incompressible), (102, 101))
+
+        engine = create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        save_extension_stats(session, policy.history)
+        loaded = load_extension_stats(session)
+        self.assertEqual(sorted(loaded), ['.bin'])
+        self.assertEqual((loaded['.bin'].files, loaded['.bin'].incompressible), (102, 101))
+        session.close()
+
+    def test_reproducible(self):
+        sources = [self.write(f"{number}.bin", os.urandom(20000)) for number in range(10)]
+        sources.append(self.write('text.bin', b'plain text\n' * 20000))
+        history = {}
+
+        def build(name):
+            # Each build updates the history the next one starts from
+            policy = CompressionPolicy(history=history)
+            stored = {path for path, size in sources if policy.should_store(path, size)}
+            path = os.path.join(self.tree, name)
+            writer = CabinetWriter(path, timestamp=0)
+            writer.add_files([CabEntry(source, os.path.basename(source)) for source, _ in sources],
+                             compression_for=lambda entry: COMPRESS_NONE if entry.source in stored else None)
+            writer.close()
+            with open(path, 'rb') as f:
+                return f.read()
+
+        self.assertEqual(build('first.cab'), build('second.cab'))
+        self.assertEqual(history['.bin'].files, 22)
+
+if __name__ == '__main__':
+    unittest.main()
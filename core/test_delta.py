@@ -0,0 +1,52 @@
+import unittest
+import os
+import random
+from core.delta import make_delta, apply_delta, DeltaError
+
+class TestDelta(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(42)
+        self.old = bytes(rng.randrange(256) for _ in range(200000))
+
+    def round_trip(self, old, new):
+        delta = make_delta(old, new)
+        self.assertEqual(apply_delta(old, delta), new)
+        return delta
+
+    def test_edges(self):
+        for old, new in ((b'', b''), (b'', b'new'), (b'old' * 100, b''), (b'short', b'shorter'),
+                         (self.old, self.old), (os.urandom(5000), os.urandom(5000))):
+            self.round_trip(old, new)
+
+    def test_small_changes(self):
+        new = bytearray(self.old)
+        # An insertion shifts everything after it, a few bytes change like relocated addresses
+        new[1000:1000] = b'inserted code' * 10
+        for position in range(5000, len(new), 9000):
+            new[position] ^= 0x55
+        del new[150000:150500]
+        delta = self.round_trip(self.old, bytes(new))
+        # Every new byte is in the diff or the extra stream, next to a short op table;
+        # apart from the insertion and the changed bytes, it is all zeros
+        self.assertLess(len(delta) - len(new), 500)
+        self.assertLess(len(delta) - delta.count(0), 1000)
+
+    def test_moved_and_unrelated(self):
+        # Anchors depend on the bytes only, so swapped halves are found at any offset
+        new = self.old[100003:] + self.old[:100003]
+        delta = self.round_trip(self.old, new)
+        self.assertLess(len(delta) - delta.count(0), 200)
+        unrelated = random.Random(7).randbytes(len(self.old))
+        self.assertLess(len(self.round_trip(self.old, unrelated)), len(unrelated) + 100)
+
+    def test_errors(self):
+        delta = make_delta(self.old, self.old[:1000] + b'x')
+        with self.assertRaises(DeltaError):
+            apply_delta(self.old[:-1], delta)
+        with self.assertRaises(DeltaError):
+            apply_delta(self.old, delta[:-1])
+        with self.assertRaises(DeltaError):
+            apply_delta(self.old, b'not a delta' * 5)
+
+if __name__ == '__main__':
+    unittest.main()
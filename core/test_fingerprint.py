@@ -0,0 +1,77 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.fingerprint import BuildFingerprint, code_version, option_values, describe_outputs, changed_outputs
+from db.file_manifest import FileManifest, FileRecord
+
+class Options:
+    cab_workers = 8
+    cab_compression = 'mszip'
+    output_dir = '/tmp/out'
+    skipgoals = []
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='fingerprint_test_')
+        for name, data in (('a.txt', b'alpha'), ('b.dll', b'beta' * 100)):
+            with open(os.path.join(self.tree, name), 'wb') as f:
+                f.write(data)
+        self.files = FileManifest.from_records([FileRecord(1, 'a.txt', 5, None, 0, 1, 10, 'sha256:aa'),
+                                                FileRecord(2, 'b.dll', 400, '1.0.0.0', 0, 2, 10, 'sha256:bb')])
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def fingerprint(self, options=Options(), files=None):
+        fingerprint = BuildFingerprint()
+        fingerprint.add('product', {'id': 1, 'name': 'Example', 'version': '1.0'})
+        fingerprint.add_rows('components', [(10, 'GUID', 'comp', None, 1, 5)])
+        fingerprint.add_files(self.tree, files if files is not None else self.files)
+        fingerprint.add('options', option_values(options))
+        return fingerprint.hexdigest()
+
+    def test_inputs(self):
+        first = self.fingerprint()
+        self.assertEqual(self.fingerprint(), first)
+        # Options that only change how fast the build runs do not count
+        fast = Options()
+        fast.cab_workers = 1
+        fast.skipgoals = ['make_patch']
+        self.assertEqual(self.fingerprint(fast), first)
+        stored = Options()
+        stored.cab_compression = 'none'
+        self.assertNotEqual(self.fingerprint(stored), first)
+        # A source touched since the scan, a changed hash in the database
+        os.utime(os.path.join(self.tree, 'a.txt'), ns=(1, 1))
+        touched = self.fingerprint()
+        self.assertNotEqual(touched, first)
+        rehashed = FileManifest.from_records([f._replace(hash='sha256:cc') if f.id == 2 else f for f in self.files])
+        self.assertNotIn(self.fingerprint(files=rehashed), (first, touched))
+
+    def test_code_version(self):
+        package = os.path.join(self.tree, 'core')
+        os.makedirs(package)
+        for name in ('cab.py', 'test_cab.py'):
+            with open(os.path.join(package, name), 'w') as f:
+                f.write('X = 1\n')
+        version = code_version(self.tree, ('core',))
+        with open(os.path.join(package, 'test_cab.py'), 'a') as f:
+            f.write('Y = 2\n')
+        self.assertEqual(code_version(self.tree, ('core',)), version)
+        with open(os.path.join(package, 'cab.py'), 'a') as f:
+            f.write('Y = 2\n')
+        self.assertNotEqual(code_version(self.tree, ('core',)), version)
+
+    def test_outputs(self):
+        paths = [os.path.join(self.tree, name) for name in ('a.txt', 'b.dll')]
+        outputs = describe_outputs(paths)
+        self.assertEqual(outputs[paths[0]][0], 5)
+        self.assertEqual(changed_outputs(outputs), [])
+        with open(paths[1], 'ab') as f:
+            f.write(b'!')
+        os.remove(paths[0])
+        self.assertEqual(changed_outputs(outputs), paths)
+
+if __name__ == '__main__':
+    unittest.main()
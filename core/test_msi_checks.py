@@ -0,0 +1,45 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.msi_reader import MsiReader
+from core.msi_checks import check_references
+from core.test_msi_reader import write_product
+
+class TestMsiChecks(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='msi_checks_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, tables=None, **kwargs):
+        path = os.path.join(self.tmpdir, 'test.msi')
+        write_product(path, **kwargs)
+        with MsiReader(path) as reader:
+            return check_references(reader, tables)
+
+    def test_valid(self):
+        self.assertEqual(self.check(), [])
+
+    def test_problems(self):
+        problems = self.check(
+            files=[('FileA', 'Main', 'a.txt', 10, None, None, None, 1),
+                   ('FileB', 'Gone', 'b.dll', 20, None, None, None, 4)],
+            components=[('Main', '{11111111-1111-1111-1111-111111111111}', 'INSTALLDIR', 0, None, 'FileB'),
+                        ('Other', '{22222222-2222-2222-2222-222222222222}', 'NODIR', 0, None, 'FileX')],
+            feature_components=[('Main', 'Main')])
+        self.assertEqual(problems, [
+            "File FileB: Component_ references 'Gone', which is not in Component",
+            "Component Other: Directory_ references 'NODIR', which is not in Directory",
+            "Component Other belongs to no feature",
+            "Component Main: KeyPath 'FileB' belongs to another component",
+            "Component Other: KeyPath 'FileX' is not in File",
+            "File FileB: Sequence 4 is beyond the last Media row's LastSequence 3",
+        ])
+        # Only the references from the File table
+        self.assertEqual(len(self.check(tables=['File'], files=[('FileA', 'Gone', 'a.txt', 1, None, None, None, 1)])),
+                         1)
+
+if __name__ == '__main__':
+    unittest.main()
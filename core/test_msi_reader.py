@@ -0,0 +1,96 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout, redirect_stderr
+from core.msidb import MsiWriter, MsiError
+from core.msi_reader import MsiReader, main
+from core.msi_schema import create_table
+
+def write_product(path, files=(), components=None, feature_components=None, media=((1, 3, None, 'a.cab', None, None),)):
+    """A small product: a directory, two components in one feature and their files."""
+    with MsiWriter(path) as writer:
+        create_table(writer, 'Directory').extend([('TARGETDIR', None, 'SourceDir'), ('INSTALLDIR', 'TARGETDIR', 'App')])
+        create_table(writer, 'Feature').add(('Main', None, 'Main', None, 1, 1, 'INSTALLDIR', 0))
+        create_table(writer, 'Component').extend(components or [
+            ('Main', '{11111111-1111-1111-1111-111111111111}', 'INSTALLDIR', 0, None, 'FileA'),
+            ('Other', '{22222222-2222-2222-2222-222222222222}', 'INSTALLDIR', 0, None, None)])
+        create_table(writer, 'FeatureComponents').extend(feature_components or [('Main', 'Main'), ('Main', 'Other')])
+        create_table(writer, 'File').extend(files or [
+            ('FileA', 'Main', 'a.txt', 10, None, None, None, 1),
+            ('FileB', 'Main', 'b.dll', 20, '1.0.0.0', None, None, 2),
+            ('FileC', 'Other', 'c.dll', 30, '1.0.0.0', None, None, 3)])
+        create_table(writer, 'Media').extend(media)
+        create_table(writer, 'Registry')
+
+class TestMsiReader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='msi_reader_test_')
+        self.path = os.path.join(self.tmpdir, 'test.msi')
+        write_product(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lazy_columns(self):
+        with MsiReader(self.path) as reader:
+            self.assertEqual(reader.row_count('File'), 3)
+            self.assertEqual(reader.row_count('Registry'), 0)
+            # Counting rows reads nothing; a column reads that column only
+            self.assertEqual(reader._stored, {})
+            self.assertEqual(reader.column('File', 'Sequence'), [1, 2, 3])
+            self.assertEqual(list(reader._stored), [('File', 7)])
+            self.assertEqual(reader.column('File', 'Version'), [None, '1.0.0.0', '1.0.0.0'])
+            self.assertEqual(reader.row('File', 1), ('FileB', 'Main', 'b.dll', 20, '1.0.0.0', None, None, 2))
+            self.assertEqual(reader.rows('Registry'), [])
+            with self.assertRaises(MsiError):
+                reader.column('File', 'Nope')
+
+    def test_indexes(self):
+        with MsiReader(self.path) as reader:
+            self.assertEqual(reader.find('File', 'FileC')[1], 'Other')
+            self.assertIsNone(reader.find('File', 'FileZ'))
+            self.assertEqual(reader.find('FeatureComponents', ('Main', 'Other')), ('Main', 'Other'))
+            self.assertEqual([row[0] for row in reader.references('File', 'Component_', 'Main')], ['FileA', 'FileB'])
+            self.assertEqual(reader.references('File', 'Sequence', 3)[0][0], 'FileC')
+            self.assertEqual(reader.references('File', 'Component_', 'Nobody'), [])
+            # Built once, on stored values: equal strings have equal ids
+            self.assertIs(reader.index('File', 'Component_'), reader.index('File', 'Component_'))
+            self.assertEqual(set(reader.index('File', 'Component_')), set(reader.stored_column('Component', 0)))
+
+    def test_long_strings(self):
+        path = os.path.join(self.tmpdir, 'long.msi')
+        with MsiWriter(path) as writer:
+            create_table(writer, 'Property').extend((f"P{number}", 'x' * (70000 if number == 5 else 1) + str(number))
+                                                    for number in range(70000))
+        with MsiReader(path) as reader:
+            self.assertEqual(reader.ref_width, 3)
+            self.assertEqual(len(reader.find('Property', 'P5')[1]), 70001)
+            self.assertEqual(reader.find('Property', 'P69999'), ('P69999', 'x69999'))
+
+    def test_cli(self):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(main(['tables', self.path]), 0)
+            self.assertEqual(main(['rows', self.path, 'File', '--where', 'Component_=Other']), 0)
+            self.assertEqual(main(['check', self.path]), 0)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(any(line.startswith('File ') and ' 3 ' in line for line in lines))
+        self.assertIn('FileC\tOther\tc.dll\t30\t1.0.0.0\t\t\t3', lines)
+        self.assertEqual(lines[-1], '0 problems')
+
+        # Unreadable input is one line on stderr, not a traceback
+        not_msi = os.path.join(self.tmpdir, 'not.msi')
+        with open(not_msi, 'wb') as f:
+            f.write(b'plain text')
+        errors = io.StringIO()
+        with redirect_stdout(io.StringIO()), redirect_stderr(errors):
+            self.assertEqual(main(['tables', os.path.join(self.tmpdir, 'missing.msi')]), 1)
+            self.assertEqual(main(['tables', not_msi]), 1)
+            self.assertEqual(main(['rows', self.path, 'Nope']), 1)
+            self.assertEqual(main(['rows', self.path, 'File', '--where', 'Sequence=x']), 1)
+        self.assertEqual(len(errors.getvalue().splitlines()), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+import os
+import uuid
+from core.msi_tables import MsiTables, product_namespace, component_identity
+from db.file_manifest import FileManifest, FileRecord
+from db.hashing import DuplicateIndex
+from db.product_graph import (ProductGraph, ProductGraphError, FeatureNode, ComponentNode, DirectoryNode,
+                              RegistryNode)
+
+GUID = '6f1e2d3c-4b5a-4978-8695-a4b3c2d1e0f9'
+
+class RecordingTable(list):
+    def finish(self):
+        pass
+
+class RecordingWriter(object):
+    """Collects the rows MsiTables writes, in place of an MsiWriter."""
+
+    def __init__(self):
+        self.tables = {}
+
+    def table(self, name, columns, keys=1):
+        table = self.tables[name] = RecordingTable()
+        return table
+
+class TestMsiTables(unittest.TestCase):
+    def setUp(self):
+        self.graph = ProductGraph(
+            features=[FeatureNode(1, 'MainFeature', 'Main', None, 1, 1, None),
+                      FeatureNode(2, 'Main Feature', None, 'Optional', 1, 3, 1)],
+            directories=[DirectoryNode(10, 'root', 'root', None), DirectoryNode(11, 'bin', 'bin', 10),
+                         DirectoryNode(12, 'bin', 'bin', 11), DirectoryNode(13, 'Program Files', None, 10)],
+            components=[ComponentNode(100, GUID, 'comp_root', 'readme.txt', 1, 10),
+                        ComponentNode(101, GUID.replace('6f', '7f'), 'comp_bin', os.path.join('bin', 'app.dll'), 1, 11),
+                        ComponentNode(102, None, 'comp_bin', None, 2, 12),
+                        ComponentNode(103, GUID.replace('6f', '8f'), 'comp_registry', None, 2, 13)],
+            registry=[RegistryNode(1, 'HKLM', r'Software\Example', 'Path', '[INSTALLDIR]', 103),
+                      RegistryNode(2, 'hkcu', r'Software\Example', '', 'default', 103)])
+        records = [FileRecord(1, 'readme.txt', 10, None, 0, 1, 100, 'sha256:aa'),
+                   FileRecord(2, os.path.join('bin', 'app.dll'), 2000, '1.0.0.0', 0, 2, 101, 'sha256:bb'),
+                   # Same name as bin/app.dll in another directory: both are installed
+                   FileRecord(3, os.path.join('bin', 'bin', 'app.dll'), 2000, '1.0.0.0', 0, 3, 102, 'sha256:cc'),
+                   FileRecord(4, os.path.join('bin', 'bin', 'copy of readme.txt'), 10, None, 0, 4, 102, 'sha256:aa')]
+        self.files = FileManifest.from_records(records)
+        self.sequences = {'F1': 1, 'F2': 2, 'F3': 3}
+
+    def write(self, files=None, graph=None, **kwargs):
+        files = files if files is not None else self.files
+        writer = RecordingWriter()
+        tables = MsiTables(graph or self.graph, files, self.sequences, DuplicateIndex(files),
+                           install_dir_name='Example App', default_feature_id=1, **kwargs)
+        tables.write(writer)
+        self.tables = tables
+        return writer.tables
+
+    def test_tables(self):
+        tables = self.write()
+        self.assertEqual(tables['Directory'], [
+            ('TARGETDIR', None, 'SourceDir'), ('ProgramFilesFolder', 'TARGETDIR', 'PFiles'),
+            ('INSTALLDIR', 'ProgramFilesFolder', 'EXAMPL~1|Example App'),
+            ('D11', 'INSTALLDIR', 'bin'), ('D12', 'D11', 'bin'), ('D13', 'INSTALLDIR', 'PROGRA~1|Program Files')])
+        self.assertEqual(tables['File'], [
+            ('F1', 'C100', 'readme.txt', 10, None, None, None, 1),
+            ('F2', 'C101', 'app.dll', 2000, '1.0.0.0', None, None, 2),
+            ('F3', 'C102', 'app.dll', 2000, '1.0.0.0', None, None, 3)])
+        self.assertEqual(tables['DuplicateFile'], [('F4', 'C102', 'F1', 'COPYOF~1.TXT|copy of readme.txt', 'D12')])
+        self.assertEqual(tables['Registry'], [('R1', 2, r'Software\Example', 'Path', '[INSTALLDIR]', 'C103'),
+                                              ('R2', 1, r'Software\Example', None, 'default', 'C103')])
+        self.assertEqual(tables['Component'], [
+            ('C100', '{' + GUID.upper() + '}', 'INSTALLDIR', 0, None, 'F1'),
+            ('C101', '{' + GUID.replace('6f', '7f').upper() + '}', 'D11', 0, None, 'F2'),
+            ('C102', None, 'D12', 0, None, None),
+            ('C103', '{' + GUID.replace('6f', '8f').upper() + '}', 'D13', 0, None, None)])
+        self.assertEqual(tables['Feature'], [('MainFeature', None, 'Main', '', 1, 1, 'INSTALLDIR', 0),
+                                             ('Feature2', 'MainFeature', 'Main Feature', 'Optional', 1, 3,
+                                              'INSTALLDIR', 0)])
+        self.assertEqual(tables['FeatureComponents'], [('MainFeature', 'C100'), ('MainFeature', 'C101'),
+                                                       ('Feature2', 'C102'), ('Feature2', 'C103')])
+        self.assertEqual(self.graph.directory_path(12), ('bin', 'bin'))
+        self.assertEqual(self.graph.directory_path(10), ())
+
+    def test_component_guids(self):
+        namespace = product_namespace(GUID, 'Example App')
+        self.assertEqual(product_namespace(None, 'Example App'), product_namespace('', 'Example App'))
+        first = self.write(guid_namespace=namespace)['Component']
+        identity = component_identity(('ProgramFilesFolder', 'Example App', 'bin'), 'app.dll', 'comp_bin')
+        self.assertEqual(identity, 'programfilesfolder/example app/bin|app.dll')
+        self.assertEqual(first[1], ('C101', '{' + str(uuid.uuid5(namespace, identity)).upper() + '}', 'D11', 0,
+                                    None, 'F2'))
+        self.assertIsNotNone(first[2][1])
+        self.assertEqual(len(self.tables.new_guids), 4)
+        self.assertEqual(set(self.tables.changed_guids), {100, 101, 102, 103})
+        recorded = self.tables.guids
+
+        # A rescan: new component ids and random GUIDs in the rows, same targets
+        renumbered = ProductGraph(
+            features=self.graph.features.values(), directories=self.graph.directories.values(),
+            components=[c._replace(id=c.id + 100, guid=str(uuid.uuid4())) for c in self.graph.components.values()],
+            registry=[r._replace(component_id=r.component_id + 100) for r in self.graph.registry])
+        files = FileManifest.from_records([f._replace(component_id=f.component_id + 100) for f in self.files])
+        second = self.write(files, renumbered, guid_namespace=namespace, guids=recorded)['Component']
+        self.assertEqual([row[1] for row in second], [row[1] for row in first])
+        self.assertEqual(self.tables.new_guids, {})
+        # An identity recorded by an earlier build keeps its GUID, whatever it was derived from
+        recorded[identity] = GUID.upper()
+        third = self.write(guid_namespace=namespace, guids=recorded)['Component']
+        self.assertEqual(third[1][1], '{' + GUID.upper() + '}')
+        self.assertEqual(self.tables.changed_guids[101], GUID.upper())
+
+    def test_errors(self):
+        # Another README.TXT in the root component's directory
+        clash = FileManifest.from_records(list(self.files) + [FileRecord(5, 'README.TXT', 1, None, 0, 5, 100, None)])
+        self.sequences['F5'] = 5
+        with self.assertRaises(ProductGraphError):
+            self.write(clash)
+        orphan = FileManifest.from_records([FileRecord(6, 'x.txt', 1, None, 0, 1, 999, None)])
+        self.sequences['F6'] = 1
+        with self.assertRaises(ProductGraphError):
+            self.write(orphan)
+        loop = ProductGraph(directories=[DirectoryNode(1, 'a', 'a', 2), DirectoryNode(2, 'b', 'b', 1)])
+        with self.assertRaises(ProductGraphError):
+            loop.directory_path(1)
+
+if __name__ == '__main__':
+    unittest.main()
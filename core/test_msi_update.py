@@ -0,0 +1,80 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.msidb import MsiWriter, MsiError
+from core.msi_reader import MsiReader
+from core.msi_update import MsiUpdate
+from core.msi_schema import create_table, add_sequences
+from core.test_msidb import read_database
+
+FILES = [('FileA', 'Main', 'a.txt', 10, None, None, None, 1),
+         ('FileB', 'Main', 'b.dll', 20, '1.0.0.0', None, None, 2),
+         ('FileC', 'Other', 'c.dll', 30, '1.0.0.0', None, None, 3)]
+
+class TestMsiUpdate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='msi_update_test_')
+        self.previous = os.path.join(self.tmpdir, 'previous.msi')
+        self.path = os.path.join(self.tmpdir, 'updated.msi')
+        with MsiWriter(self.previous) as writer:
+            create_table(writer, 'File').extend(FILES)
+            create_table(writer, 'Property').add(('ProductVersion', '1.0'))
+            add_sequences(writer)
+            writer.summary(title='Installation Database', template='Intel;1033', created=0, saved=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reader(self):
+        with MsiReader(self.previous) as reader:
+            self.assertEqual(reader.rows('File'), FILES)
+            self.assertEqual(reader.key_count('File'), 1)
+            self.assertEqual(reader.row_count('Property'), 1)
+            self.assertEqual(reader.ref_width, 2)
+            self.assertIn(('Sequence', 0x0104), reader.columns('File'))
+
+    def test_edit(self):
+        with MsiUpdate(self.path, self.previous) as update:
+            files = update.edit('File')
+            self.assertEqual(files.get('FileB'), FILES[1])
+            self.assertIsNone(files.get('FileZ'))
+            self.assertTrue(files.replace(('FileB', 'Main', 'b.dll', 25, '1.0.0.1', None, None, 2)))
+            create_table(update, 'Property').add(('ProductVersion', '1.1'))
+            update.summary(title='Installation Database', template='Intel;1033', created=0, saved=0)
+        tables, refs, _, _ = read_database(self.path)
+        self.assertEqual(tables['File'], [FILES[0], ('FileB', 'Main', 'b.dll', 25, '1.0.0.1', None, None, 2),
+                                          FILES[2]])
+        self.assertEqual(tables['Property'], [('ProductVersion', '1.1')])
+        self.assertEqual(tables['InstallExecuteSequence'], read_database(self.previous)[0]['InstallExecuteSequence'])
+        # The old value is still referenced by FileC, the old version number by nothing
+        self.assertEqual(refs['1.0.0.0'], 1)
+        self.assertEqual(refs['1.0.0.1'], 1)
+        self.assertNotIn('1.0', refs)
+        with MsiReader(self.path) as reader:
+            self.assertEqual(reader.strings.count(''), 1)
+        # Unchanged tables are copied byte for byte
+        with MsiReader(self.previous) as previous, MsiReader(self.path) as updated:
+            self.assertEqual(updated.stream('InstallExecuteSequence', table=True),
+                             previous.stream('InstallExecuteSequence', table=True))
+
+    def test_append(self):
+        with MsiUpdate(self.path, self.previous) as update:
+            files = update.edit('File')
+            self.assertFalse(files.replace(('FileAA', 'Main', 'aa.txt', 5, None, None, None, 4)))
+        self.assertEqual([row[0] for row in read_database(self.path)[0]['File']],
+                         ['FileA', 'FileB', 'FileC', 'FileAA'])
+
+    def test_errors(self):
+        with self.assertRaises(MsiError):
+            MsiUpdate(self.previous, self.previous)
+        update = MsiUpdate(self.path, self.previous)
+        with self.assertRaises(MsiError):
+            update.table('Property', [('Property', 's72'), ('Value', 'l0'), ('Extra', 'S72')])
+        with self.assertRaises(MsiError):
+            create_table(update, 'Media')
+        update.abort()
+        self.assertFalse(os.path.exists(self.path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+from core.cfb import CompoundFileReader
+from core.msidb import (MsiWriter, MsiError, encode_stream_name, decode_stream_name, column_type,
+                        SUMMARY_STREAM, MSI_CLSID, TYPE_STRING)
+from core.msi_schema import create_table, add_sequences, ShortNames
+
+def read_database(path):
+    """Decode every table of a database: {table: [row tuples in stored order]}, and the string refcounts."""
+    with CompoundFileReader(path) as reader:
+        def stream(name):
+            return reader.read(encode_stream_name(name, table=True))
+        pool = stream('_StringPool')
+        data = stream('_StringData')
+        codepage, = struct.unpack_from('<I', pool)
+        strings, refs = [None], [0]
+        position = 0
+        entries = struct.unpack(f"<{(len(pool) - 4) // 2}H", pool[4:])
+        index = 0
+        while index < len(entries):
+            length, count = entries[index:index + 2]
+            index += 2
+            if length == 0 and count:
+                length = entries[index] | entries[index + 1] << 16
+                index += 2
+            strings.append(data[position:position + length].decode('cp1252'))
+            refs.append(count)
+            position += length
+        width = 3 if codepage & 0x80000000 else 2
+
+        def column(raw, offset, count, size):
+            return [int.from_bytes(raw[offset + row * size:offset + (row + 1) * size], 'little')
+                    for row in range(count)]
+
+        def decode(raw, types):
+            sizes = [width if bits & TYPE_STRING else (2 if bits & 0xFF == 2 else 4) for bits in types]
+            count = len(raw) // sum(sizes)
+            columns, offset = [], 0
+            for bits, size in zip(types, sizes):
+                values = column(raw, offset, count, size)
+                offset += size * count
+                if bits & TYPE_STRING:
+                    columns.append([strings[v] for v in values])
+                else:
+                    bias = 0x8000 if size == 2 else 0x80000000
+                    columns.append([v - bias if v else None for v in values])
+            return list(zip(*columns))
+
+        s, i2 = TYPE_STRING, 2
+        names = [row[0] for row in decode(stream('_Tables'), [s])]
+        schema = {}
+        for table, number, name, bits in decode(stream('_Columns'), [s, i2, s, i2]):
+            schema.setdefault(table, []).append(bits & 0xFFFF)
+        tables = {}
+        for name in names:
+            raw = stream(name) if encode_stream_name(name, table=True) in reader.streams else b''
+            tables[name] = decode(raw, schema[name])
+        return tables, dict(zip(strings[1:], refs[1:])), codepage, reader.clsid
+
+class TestMsiDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='msidb_test_')
+        self.path = os.path.join(self.tmpdir, 'test.msi')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stream_names(self):
+        for name in ('_StringPool', 'File', 'InstallExecuteSequence', 'Binary.Logo', 'x-y z'):
+            for table in (False, True):
+                self.assertEqual(decode_stream_name(encode_stream_name(name, table)), (name, table))
+        self.assertEqual(len(encode_stream_name('InstallExecuteSequence', table=True)), 12)
+        self.assertEqual(column_type('s72', key=True), 0x2D48)
+        self.assertEqual(column_type('S255'), 0x1DFF)
+        self.assertEqual(column_type('l0'), 0x0F00)
+        self.assertEqual((column_type('i2'), column_type('I4')), (0x0502, 0x1104))
+
+    def test_tables(self):
+        with MsiWriter(self.path) as writer:
+            files = create_table(writer, 'File')
+            # Added out of key order, keys are sorted by their string ids
+            files.add(('FileB', 'Main', 'b.txt', 10, None, None, None, 2))
+            files.add(('FileA', 'Main', 'SHORT~1.TXT|a long name.txt', 70000, '1.2.3.4', '1033', 512, 1))
+            features = create_table(writer, 'FeatureComponents')
+            features.extend([('Default', 'Main'), ('Default', 'Other')])
+            create_table(writer, 'Registry')
+            add_sequences(writer)
+            writer.summary(title='Installation Database', template='Intel;1033', revision='{GUID}',
+                           created=0, saved=0)
+        tables, refs, codepage, clsid = read_database(self.path)
+        self.assertEqual((codepage, clsid), (1252, MSI_CLSID))
+        self.assertEqual(tables['File'], [('FileB', 'Main', 'b.txt', 10, None, None, None, 2),
+                                          ('FileA', 'Main', 'SHORT~1.TXT|a long name.txt', 70000, '1.2.3.4',
+                                           '1033', 512, 1)])
+        self.assertEqual(tables['FeatureComponents'], [('Default', 'Main'), ('Default', 'Other')])
+        self.assertEqual(tables['Registry'], [])
+        self.assertIn(('InstallFiles', None, 4000), tables['InstallExecuteSequence'])
+        # Every stored reference is counted: rows, _Tables and _Columns
+        self.assertEqual(refs['Main'], 3)
+        # _Tables, the table of its 8 columns, and the name of its first column
+        self.assertEqual(refs['File'], 1 + 8 + 1)
+        self.assertEqual(refs['Component_'], 3)  # Columns of File, FeatureComponents and Registry
+        with CompoundFileReader(self.path) as reader:
+            summary = reader.read(SUMMARY_STREAM)
+        self.assertEqual(summary[:2], b'\xfe\xff')
+        self.assertIn(b'Intel;1033\0', summary)
+
+    def test_package_code(self):
+        def build(name, payload, value='1'):
+            path = os.path.join(self.tmpdir, name)
+            with MsiWriter(path) as writer:
+                create_table(writer, 'Property').add(('ProductVersion', value))
+                writer.add_package_input(payload)
+                writer.summary(title='Installation Database', template='Intel;1033', created=0, saved=0)
+            with open(path, 'rb') as f:
+                return writer.package_code, f.read()
+        code, data = build('a.msi', b'F1 sha256:aa')
+        self.assertRegex(code, r'^\{[0-9A-F]{8}-[0-9A-F]{4}-5[0-9A-F]{3}-[89AB][0-9A-F]{3}-[0-9A-F]{12}\}$')
+        self.assertIn(code.encode('cp1252'), data)
+        # Same content, same bytes; other tables or another payload, another package code
+        self.assertEqual(build('b.msi', b'F1 sha256:aa'), (code, data))
+        self.assertNotEqual(build('c.msi', b'F1 sha256:bb')[0], code)
+        self.assertNotEqual(build('d.msi', b'F1 sha256:aa', '2')[0], code)
+
+    def test_long_string_refs(self):
+        count = 70000
+        with MsiWriter(self.path) as writer:
+            properties = create_table(writer, 'Property')
+            properties.extend((f"P{number}", 'x' * (70000 if number == 5 else 1) + str(number))
+                              for number in range(count))
+        tables, refs, codepage, _ = read_database(self.path)
+        self.assertTrue(codepage & 0x80000000)
+        rows = dict(tables['Property'])
+        self.assertEqual(len(rows), count)
+        self.assertEqual(rows['P69999'], 'x69999')
+        self.assertEqual(len(rows['P5']), 70001)
+
+    def test_errors(self):
+        writer = MsiWriter(self.path)
+        files = create_table(writer, 'File')
+        with self.assertRaises(MsiError):
+            files.add(('F1', None, 'a.txt', 1, None, None, None, 1))
+        with self.assertRaises(MsiError):
+            files.add(('F1', 'C', 'a.txt', 1, None, None, 0x10000, 1))
+        with self.assertRaises(MsiError):
+            files.add(('F1', 'C'))
+        with self.assertRaises(MsiError):
+            create_table(writer, 'File')
+        with self.assertRaises(MsiError):
+            writer.table('Binary', [('Name', 's72'), ('Data', 'v0')])
+        files.add(('F1', 'C', 'a.txt', 1, None, None, None, 1))
+        files.add(('F1', 'C', 'b.txt', 1, None, None, None, 2))
+        with self.assertRaises(MsiError):
+            writer.close()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        with self.assertRaises(MsiError):
+            MsiWriter(self.path, codepage=1252).pool.add('中')
+
+    def test_short_names(self):
+        names = ShortNames()
+        self.assertEqual(names.name('setup.exe'), 'setup.exe')
+        self.assertEqual(names.name('SETUP.EXE'), 'SETUP~1.EXE|SETUP.EXE')
+        self.assertEqual(names.name('a long file name.txt'), 'ALONGF~1.TXT|a long file name.txt')
+        self.assertEqual(names.name('a long file name.text'), 'ALONGF~1.TEX|a long file name.text')
+        self.assertEqual(names.name('archive.tar.gz'), 'ARCHIV~1.GZ|archive.tar.gz')
+        for number in range(3, 15):
+            names.name(f"a long file name {number}.txt")
+        self.assertEqual(names.name('a long file name.txt2'), 'ALONG~14.TXT|a long file name.txt2')
+        self.assertEqual(len(names.taken), 18)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from core.cab import CabinetWriter, CabEntry
+from core.patch import (write_build_manifest, load_build_manifest, create_patch, apply_patch, main, PatchError,
+                        BUILD_MANIFEST_SUFFIX)
+from db.hashing import hash_file
+
+class TestPatch(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='patch_test_')
+        program = os.urandom(100000)
+        self.old_files = {
+            'bin/app.exe': program,
+            'bin/same.dll': b'unchanged library' * 1000,
+            'docs/old.txt': b'going away',
+        }
+        self.new_files = {
+            'bin/app.exe': program[:50000] + b'new function' * 20 + program[50000:],
+            'bin/same.dll': b'unchanged library' * 1000,
+            'docs/new.txt': b'brand new',
+        }
+        self.baseline_dir = self.write_build('baseline', self.old_files)
+        self.root = os.path.join(self.tree, 'src')
+        self.write_tree(self.root, self.new_files)
+        self.install = os.path.join(self.tree, 'install')
+        self.write_tree(self.install, self.old_files)
+        self.patch = os.path.join(self.tree, 'Product.patch')
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def write_tree(self, root, files):
+        for path, data in files.items():
+            full = os.path.join(root, *path.split('/'))
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            with open(full, 'wb') as f:
+                f.write(data)
+
+    def manifest(self, root, files):
+        return {'product': 'Product', 'product_version': '1.0', 'files': {
+            path: {'path': path, 'size': len(data), 'hash': hash_file(os.path.join(root, path)),
+                   'cabinet': 'Product.cab', 'name': f"F{number}"}
+            for number, (path, data) in enumerate(sorted(files.items()))}}
+
+    def write_build(self, name, files):
+        out = os.path.join(self.tree, name)
+        source = os.path.join(self.tree, f"{name}_src")
+        self.write_tree(source, files)
+        manifest = self.manifest(source, files)
+        os.makedirs(out)
+        writer = CabinetWriter(os.path.join(out, 'Product.cab'))
+        writer.add_files(CabEntry(os.path.join(source, path), record['name'])
+                         for path, record in manifest['files'].items())
+        writer.close()
+        write_build_manifest(os.path.join(out, f"Product{BUILD_MANIFEST_SUFFIX}"), 'Product', '1.0',
+                             list(manifest['files'].values()))
+        return out
+
+    def make_patch(self):
+        baseline = load_build_manifest(os.path.join(self.baseline_dir, f"Product{BUILD_MANIFEST_SUFFIX}"))
+        return create_patch(self.patch, self.baseline_dir, baseline, self.manifest(self.root, self.new_files),
+                            self.root)
+
+    def test_create_and_apply(self):
+        stats = self.make_patch()
+        self.assertEqual((stats.unchanged, stats.changed, stats.deltas, stats.added, stats.removed),
+                         (1, 1, 1, 1, 1))
+        self.assertLess(stats.package_size, 5000)
+        self.assertEqual(apply_patch(self.patch, self.install),
+                         dict(patched=1, added=1, removed=1, skipped=0))
+        for path, data in self.new_files.items():
+            with open(os.path.join(self.install, path), 'rb') as f:
+                self.assertEqual(f.read(), data)
+        self.assertFalse(os.path.exists(os.path.join(self.install, 'docs', 'old.txt')))
+        # Applying again changes nothing
+        self.assertEqual(apply_patch(self.patch, self.install)['skipped'], 3)
+
+    def test_modified_target(self):
+        self.make_patch()
+        with open(os.path.join(self.install, 'bin', 'app.exe'), 'ab') as f:
+            f.write(b'local change')
+        with self.assertRaises(PatchError):
+            apply_patch(self.patch, self.install)
+        # Nothing was touched
+        self.assertTrue(os.path.exists(os.path.join(self.install, 'docs', 'old.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.install, 'docs', 'new.txt')))
+        self.assertEqual(main(['apply', self.patch, self.install]), 1)
+
+    def test_manifest(self):
+        path = os.path.join(self.baseline_dir, f"Product{BUILD_MANIFEST_SUFFIX}")
+        self.assertEqual(sorted(load_build_manifest(path)['files']), sorted(self.old_files))
+        with open(path, 'w') as f:
+            json.dump({'version': 99}, f)
+        with self.assertRaises(PatchError):
+            load_build_manifest(path)
+
+if __name__ == '__main__':
+    unittest.main()
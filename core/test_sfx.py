@@ -0,0 +1,103 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.sfx import SfxWriter, SfxReader, SfxError, main
+from core.compress_policy import CompressionPolicy
+
+class TestSfx(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='sfx_test_')
+        self.files = {
+            'Product.msi': b'msi tables ' * 50000,
+            'Product.cab': os.urandom(300000),
+            'docs/readme.txt': b'read me\n' * 1000,
+            'empty.txt': b'',
+        }
+        for name, data in self.files.items():
+            path = os.path.join(self.tree, 'src', name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        self.stub = os.path.join(self.tree, 'stub.exe')
+        with open(self.stub, 'wb') as f:
+            f.write(b'MZ' + b'\0' * 1000)
+        self.package = os.path.join(self.tree, 'setup.exe')
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def pack(self, **kwargs):
+        writer = SfxWriter(self.package, stub=self.stub, chunk_size=64 * 1024, **kwargs)
+        for name in self.files:
+            writer.add(os.path.join(self.tree, 'src', name), name)
+        return writer.close()
+
+    def check_extracted(self, dest):
+        for name, data in self.files.items():
+            with open(os.path.join(dest, name), 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+    def test_round_trip(self):
+        for method in ('deflate', 'lzma', 'store'):
+            stats = self.pack(method=method, metadata={'run': 'Product.msi'})
+            self.assertEqual(stats.entries, 4)
+            with open(self.package, 'rb') as f:
+                self.assertEqual(f.read(2), b'MZ')
+            with SfxReader(self.package) as reader:
+                self.assertEqual([e.name for e in reader.entries], list(self.files))
+                self.assertEqual(reader.metadata, {'run': 'Product.msi'})
+                self.assertTrue(reader.entry('Product.msi').hash.startswith('sha256:'))
+                # Random access to one entry
+                self.assertEqual(reader.read('docs/readme.txt'), self.files['docs/readme.txt'])
+                dest = os.path.join(self.tree, method)
+                reader.extract(dest, workers=4)
+            self.check_extracted(dest)
+
+    def test_parallel_pack(self):
+        self.pack(workers=1)
+        with open(self.package, 'rb') as f:
+            serial = f.read()
+        self.pack(workers=2)
+        with open(self.package, 'rb') as f:
+            self.assertEqual(f.read(), serial)
+
+    def test_policy(self):
+        self.pack(policy=CompressionPolicy())
+        with SfxReader(self.package) as reader:
+            self.assertEqual(reader.entry('Product.cab').method, 'store')
+            self.assertEqual(reader.entry('Product.msi').method, 'deflate')
+            self.assertEqual(reader.read('Product.cab'), self.files['Product.cab'])
+
+    def test_corruption(self):
+        self.pack()
+        with SfxReader(self.package) as reader:
+            chunk = reader.entry('Product.msi').chunks[1]
+            offset = reader.payload_offset + chunk.offset + 10
+        with open(self.package, 'r+b') as f:
+            f.seek(offset)
+            byte = f.read(1)
+            f.seek(offset)
+            f.write(bytes([byte[0] ^ 0xFF]))
+        with SfxReader(self.package) as reader:
+            # Other entries are still readable, the damaged one is detected
+            self.assertEqual(reader.read('docs/readme.txt'), self.files['docs/readme.txt'])
+            with self.assertRaises(SfxError):
+                reader.read('Product.msi')
+        with self.assertRaises(SfxError):
+            SfxReader(self.stub)
+
+    def test_names(self):
+        writer = SfxWriter(self.package)
+        for name in ('../evil.txt', '/etc/passwd', 'a/../../b'):
+            with self.assertRaises(SfxError):
+                writer.add(self.stub, name)
+
+    def test_command_line(self):
+        self.pack()
+        dest = os.path.join(self.tree, 'cli')
+        self.assertEqual(main(['extract', self.package, dest, '--entry', 'Product.msi']), 0)
+        self.assertEqual(os.listdir(dest), ['Product.msi'])
+
+if __name__ == '__main__':
+    unittest.main()
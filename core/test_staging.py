@@ -0,0 +1,75 @@
+import unittest
+import os
+import errno
+import shutil
+import tempfile
+from core import staging
+from core.staging import Stager
+
+class TestStaging(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='staging_test_')
+        self.src = os.path.join(self.tree, 'app.dll')
+        with open(self.src, 'wb') as f:
+            f.write(b'payload' * 1000)
+        os.utime(self.src, (1000000000, 1000000000))
+        self.stage_dir = os.path.join(self.tree, 'stage')
+        os.makedirs(self.stage_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def check(self, dst):
+        with open(dst, 'rb') as f:
+            self.assertEqual(f.read(), b'payload' * 1000)
+        self.assertEqual(os.stat(dst).st_mtime, 1000000000)
+
+    def test_each_strategy(self):
+        for strategy in staging.STRATEGIES:
+            stager = Stager([strategy])
+            if strategy not in stager.strategies:
+                continue
+            dst = os.path.join(self.stage_dir, f"{strategy}.dll")
+            try:
+                self.assertEqual(stager.stage(self.src, dst), strategy)
+            except OSError:
+                # Not supported by this file system (reflink on tmpfs...)
+                self.assertNotEqual(strategy, 'copy')
+                self.assertFalse(os.path.exists(dst))
+                continue
+            self.check(dst)
+            self.assertEqual(stager.stats.files[strategy], 1)
+            self.assertEqual(stager.stats.bytes_avoided, 7000 if strategy in ('reflink', 'hardlink') else 0)
+
+    def test_fallback(self):
+        calls = []
+
+        def unsupported(src, dst):
+            calls.append(src)
+            raise OSError(errno.EXDEV, 'cross-device link')
+
+        stager = Stager()
+        saved = dict(staging._FUNCTIONS)
+        staging._FUNCTIONS.update(reflink=unsupported, hardlink=unsupported)
+        try:
+            first = stager.stage(self.src, os.path.join(self.stage_dir, 'a.dll'))
+            self.assertIn(first, ('copy_file_range', 'copy'))
+            self.check(os.path.join(self.stage_dir, 'a.dll'))
+            tried = len(calls)
+            # Failed strategies are not retried for the same devices
+            stager.stage(self.src, os.path.join(self.stage_dir, 'b.dll'))
+            self.assertEqual(len(calls), tried)
+        finally:
+            staging._FUNCTIONS.update(saved)
+        self.assertEqual(stager.stats.bytes_avoided, 0)
+        self.assertIn('2 files staged', str(stager.stats))
+
+    def test_real_errors(self):
+        stager = Stager()
+        with self.assertRaises(FileNotFoundError):
+            stager.stage(os.path.join(self.tree, 'missing.dll'), os.path.join(self.stage_dir, 'm.dll'))
+        with self.assertRaises(ValueError):
+            Stager(['teleport'])
+
+if __name__ == '__main__':
+    unittest.main()
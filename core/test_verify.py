@@ -0,0 +1,75 @@
+import unittest
+import os
+import shutil
+import tempfile
+from core.cab import CabinetWriter, CabEntry
+from core.verify import Expected, verify_cabinets, check_media, check_components
+from db.file_manifest import FileRecord
+from db.hashing import hash_file
+
+class TestVerify(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='verify_test_')
+        self.expected = {}
+        sources = []
+        for number in range(1, 41):
+            path = os.path.join(self.tree, f"file{number}.txt")
+            with open(path, 'wb') as f:
+                # Several files per 32 KB block, and files spanning blocks
+                f.write(f"contents of file {number}\n".encode() * (number * 100))
+            name = f"F{number}"
+            self.expected[name] = Expected(name, f"file{number}.txt", os.path.getsize(path), hash_file(path))
+            sources.append(CabEntry(path, name))
+        self.cabs = [os.path.join(self.tree, 'Product.cab'), os.path.join(self.tree, 'Product2.cab')]
+        for cab, entries in zip(self.cabs, (sources[:25], sources[25:])):
+            writer = CabinetWriter(cab, workers=1)
+            writer.add_files(entries, folder_size=100000)
+            writer.close()
+        self.sequences = {f"F{number}": number for number in range(1, 41)}
+
+    def tearDown(self):
+        shutil.rmtree(self.tree)
+
+    def test_clean(self):
+        for workers in (1, 2):
+            report = verify_cabinets(self.cabs, self.expected, workers)
+            self.assertEqual(report.problems, [])
+            self.assertEqual((report.cabinets, report.files), (2, 40))
+            self.assertGreater(report.folders, 2)
+        check_media(report, [(1, 25, 'Product.cab'), (2, 40, 'Product2.cab')], self.sequences)
+        self.assertTrue(report.ok)
+
+    def test_payload_problems(self):
+        expected = dict(self.expected)
+        expected['F3'] = expected['F3']._replace(hash='sha256:' + '0' * 64)
+        expected['F4'] = expected['F4']._replace(hash=None)
+        expected['F99'] = Expected('F99', 'missing.txt', 10, None)
+        del expected['F5']
+        report = verify_cabinets(self.cabs, expected)
+        self.assertEqual(len(report.problems), 3, report.problems)
+        self.assertEqual(report.unhashed, 1)
+        self.assertTrue(any('file3.txt' in p and 'hash' in p for p in report.problems))
+
+    def test_corrupted_cabinet(self):
+        with open(self.cabs[1], 'r+b') as f:
+            f.truncate(os.path.getsize(self.cabs[1]) - 100)
+        report = verify_cabinets(self.cabs, self.expected)
+        self.assertFalse(report.ok)
+        self.assertTrue(all('Product2.cab' in p for p in report.problems), report.problems)
+
+    def test_rows(self):
+        report = verify_cabinets(self.cabs, self.expected)
+        # A wrong disk id, a file outside its disk's range, a cabinet without a row
+        check_media(report, [(1, 25, 'Product.cab'), (3, 40, 'Product2.cab')], dict(self.sequences, F30=3))
+        check_media(report, [(1, 25, 'Product.cab')], self.sequences)
+        self.assertEqual(len(report.problems), 3, report.problems)
+
+        report.problems = []
+        files = [FileRecord(1, 'a.txt', 1, None, 0, 1, 1, None), FileRecord(2, 'b.txt', 1, None, 0, 2, 2, None),
+                 FileRecord(3, 'c.txt', 1, None, 0, 3, 9, None)]
+        guid = '6F9619FF-8B86-D011-B42D-00C04FC964FF'
+        check_components(report, files, {1: (guid, 'one', 'a.txt'), 2: (guid, 'two', 'gone.txt')})
+        self.assertEqual(len(report.problems), 3, report.problems)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,262 @@
+"""
+Verification of a build's cabinets against the database manifest.
+
+verify_cabinets() reads the file tables of the cabinets, then decompresses
+their folders on a process pool.  A worker streams one folder block by
+block and feeds each block to the hashes of the files it overlaps, so
+memory stays at a block plus one hash object per file of the folder,
+whatever the payload size.  Each file is checked against the size and
+hash the database holds for it; files missing from the cabinets, files the
+manifest does not know and files stored twice are reported too.
+
+check_media() and check_components() then compare the database rows the
+MSI tables are made from: Media rows must cover contiguous, increasing
+File.Sequence ranges matching where each file was actually stored, and
+every file must belong to a Component with a valid, unique GUID whose key
+path (if any) is one of its files.
+
+Problems are collected in a VerifyReport rather than raised one by one, so
+a single run lists everything wrong with a build.
+"""
+
+import uuid
+import time
+import hashlib
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from core.cab import CabinetReader, CabinetError, iter_folder
+
+logger = logging.getLogger(__name__)
+
+# A file the manifest expects in the cabinets, under its cabinet name
+Expected = namedtuple('Expected', ['name', 'path', 'size', 'hash'])
+
+
+class VerificationError(Exception):
+    """A build failed verification."""
+
+
+class VerifyReport(object):
+    """What verification read, and the problems it found."""
+
+    def __init__(self):
+        self.cabinets = 0
+        self.folders = 0
+        self.files = 0
+        self.bytes = 0
+        self.unhashed = 0      # Files the manifest has no hash for: only their size was checked
+        self.seconds = 0.0
+        self.locations = {}    # Cabinet name of a file -> cabinet file name
+        self.problems = []
+
+    @property
+    def ok(self):
+        return not self.problems
+
+    def problem(self, message):
+        self.problems.append(message)
+
+    def __str__(self):
+        rate = self.bytes / (1024 * 1024) / self.seconds if self.seconds else 0.0
+        return (f"{self.files} files ({self.bytes} bytes) in {self.folders} folders of {self.cabinets} cabinets "
+                f"verified in {self.seconds:.2f}s ({rate:.1f} MB/s), {self.unhashed} without a hash, "
+                f"{len(self.problems)} problems")
+
+
+def hash_members(path, folder_index, folder, members):
+    """
+    Stream one folder and hash the files stored in it.
+
+    Args:
+        folder: The folder's (start, count, compression) CFFOLDER entry
+        members: (name, offset, size, algorithm) of the folder's files
+
+    Returns:
+        (name, bytes found, '<algorithm>:<hexdigest>' or None) per member;
+        bytes found is short of the size if the folder ends early.
+    """
+    members = sorted(members, key=lambda m: m[1])
+    hashers = [hashlib.new(algorithm) if algorithm else None for _, _, _, algorithm in members]
+    found = [0] * len(members)
+    first = 0
+    position = 0
+    for block in iter_folder(path, folder_index, *folder):
+        end = position + len(block)
+        view = memoryview(block)
+        index = first
+        while index < len(members) and members[index][1] < end:
+            _, offset, size, _ = members[index]
+            low = max(offset, position)
+            high = min(offset + size, end)
+            if high > low:
+                if hashers[index] is not None:
+                    hashers[index].update(view[low - position:high - position])
+                found[index] += high - low
+            index += 1
+        while first < len(members) and members[first][1] + members[first][2] <= end:
+            first += 1
+        position = end
+    return [(name, found[index], f"{algorithm}:{hashers[index].hexdigest()}" if algorithm else None)
+            for index, (name, _, _, algorithm) in enumerate(members)]
+
+
+def verify_cabinets(paths, expected, workers=1):
+    """
+    Check the payload of cabinets against the manifest.
+
+    Args:
+        paths: The cabinets of the build, in disk order
+        expected: dict of cabinet name -> Expected
+        workers: Processes decompressing folders
+
+    Returns:
+        VerifyReport
+    """
+    started = time.perf_counter()
+    report = VerifyReport()
+    jobs = []
+    for path in paths:
+        try:
+            reader = CabinetReader(path)
+        except (OSError, CabinetError) as e:
+            report.problem(f"Unable to read cabinet {path}: {e}")
+            continue
+        report.cabinets += 1
+        cabinet = path.replace('\\', '/').rsplit('/', 1)[-1]
+        by_folder = {}
+        for entry in reader.files:
+            if entry.name in report.locations:
+                report.problem(f"{entry.name} is stored in both {report.locations[entry.name]} and {cabinet}")
+                continue
+            report.locations[entry.name] = cabinet
+            record = expected.get(entry.name)
+            if record is None:
+                report.problem(f"{cabinet} holds {entry.name}, which is not in the manifest")
+                continue
+            if entry.size != record.size:
+                report.problem(f"{record.path} ({entry.name}) is stored with {entry.size} bytes, "
+                               f"the manifest has {record.size}")
+            algorithm = record.hash.partition(':')[0] if record.hash else None
+            if algorithm is None:
+                report.unhashed += 1
+            by_folder.setdefault(entry.folder, []).append((entry.name, entry.offset, entry.size, algorithm))
+        for folder_index, members in sorted(by_folder.items()):
+            if folder_index >= len(reader.folders):
+                report.problem(f"{cabinet}: files reference missing folder {folder_index}")
+                continue
+            jobs.append((path, folder_index, reader.folders[folder_index], members))
+    for name in sorted(set(expected) - set(report.locations)):
+        report.problem(f"{expected[name].path} ({name}) is missing from the cabinets")
+
+    pool = ProcessPoolExecutor(workers) if workers > 1 and len(jobs) > 1 else None
+    try:
+        queued = iter(jobs)
+        pending = []
+
+        def submit():
+            job = next(queued, None)
+            if job is None:
+                return
+            if pool is not None:
+                future = pool.submit(hash_members, *job)
+            else:
+                future = Future()
+                try:
+                    future.set_result(hash_members(*job))
+                except (OSError, CabinetError) as e:
+                    future.set_exception(e)
+            pending.append((future, job))
+
+        for _ in range(2 * max(1, workers)):
+            submit()
+        while pending:
+            future, (path, folder_index, _, members) = pending.pop(0)
+            submit()
+            try:
+                results = future.result()
+            except (OSError, CabinetError) as e:
+                report.problem(f"Folder {folder_index} of {path} is unreadable ({e}), "
+                               f"{len(members)} files not verified")
+                continue
+            report.folders += 1
+            stored_sizes = {member[0]: member[2] for member in members}
+            for name, size, digest in results:
+                record = expected[name]
+                report.files += 1
+                report.bytes += size
+                if size != stored_sizes[name]:
+                    report.problem(f"{record.path} ({name}) is truncated: {size} of {stored_sizes[name]} bytes")
+                # A size that differs from the manifest was reported with the file table
+                elif size == record.size and digest is not None and digest != record.hash:
+                    report.problem(f"{record.path} ({name}) does not match its hash {record.hash}")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def check_media(report, media, sequences):
+    """
+    Compare Media rows with where the files were stored.
+
+    Args:
+        media: (disk_id, last_sequence, cabinet) rows
+        sequences: cabinet name of a file -> its File.Sequence
+    """
+    media = sorted(media)
+    ranges = {}
+    previous = 0
+    for expected_disk, (disk_id, last_sequence, cabinet) in enumerate(media, 1):
+        if disk_id != expected_disk:
+            report.problem(f"Media disk ids are not 1..{len(media)}: found {disk_id} at position {expected_disk}")
+        if last_sequence is None or last_sequence <= previous:
+            report.problem(f"Media row {disk_id} ({cabinet}) has LastSequence {last_sequence}, "
+                           f"not above the previous disk's {previous}")
+            # Its files cannot be checked against a range
+            ranges[cabinet] = None
+            continue
+        ranges[cabinet] = (previous, last_sequence)
+        previous = last_sequence
+    for cabinet in sorted(set(report.locations.values()) - set(ranges)):
+        report.problem(f"{cabinet} has no Media row")
+    for name, cabinet in report.locations.items():
+        sequence = sequences.get(name)
+        if sequence is None:
+            report.problem(f"{name} is stored in {cabinet} but has no File.Sequence")
+        elif ranges.get(cabinet) is None:
+            continue
+        elif not ranges[cabinet][0] < sequence <= ranges[cabinet][1]:
+            report.problem(f"{name} is stored in {cabinet} but its sequence {sequence} is outside "
+                           f"the disk's range {ranges[cabinet][0] + 1}..{ranges[cabinet][1]}")
+
+
+def check_components(report, files, components):
+    """
+    Compare File rows with their Component rows.
+
+    Args:
+        files: FileRecords of the build
+        components: Component id -> (GUID, name, key path)
+    """
+    paths = {}
+    for f in files:
+        if f.component_id not in components:
+            report.problem(f"{f.path} references missing component {f.component_id}")
+            continue
+        paths.setdefault(f.component_id, set()).add(f.path)
+    guids = {}
+    for component_id in sorted(paths):
+        guid, name, key_path = components[component_id]
+        try:
+            normalized = str(uuid.UUID(guid or ''))
+        except ValueError:
+            report.problem(f"Component {name} has an invalid ComponentId {guid!r}")
+            continue
+        if normalized in guids:
+            report.problem(f"Components {guids[normalized]} and {name} share the ComponentId {guid}")
+        guids[normalized] = name
+        if key_path and key_path not in paths[component_id]:
+            report.problem(f"Component {name} has the key path {key_path}, which is not one of its files")
@@ -0,0 +1,110 @@
+"""
+What a build records in the database for the next builds and for the MSI
+tables: the Media rows of the cabinets it wrote, the ComponentIds it
+assigned, the per-extension history of the compression policy and the
+fingerprint of its inputs with the outputs made from them (an InstallerMeta
+row holding JSON).  Also the rows verification compares with the cabinets.
+"""
+
+import json
+import datetime
+
+from sqlalchemy import update
+
+from db.models import Media, Component, ComponentGuid, ExtensionCompression, InstallerMeta
+
+
+def replace_media(session, product_id, rows):
+    """Replace the Media rows of a product with (disk_id, last_sequence, cabinet) tuples."""
+    session.query(Media).filter_by(product_id=product_id).delete()
+    session.add_all(Media(product_id=product_id, disk_id=disk_id, last_sequence=last_sequence, cabinet=cabinet)
+                    for disk_id, last_sequence, cabinet in rows)
+    session.commit()
+
+
+def load_media(session, product_id):
+    """The Media rows of a product as (disk_id, last_sequence, cabinet) tuples."""
+    return [tuple(row) for row in session.query(Media.disk_id, Media.last_sequence, Media.cabinet)
+            .filter_by(product_id=product_id).order_by(Media.disk_id)]
+
+
+def load_components(session, ids):
+    """Component id -> (ComponentId GUID, name, key path) for the given ids."""
+    ids = list(ids)
+    components = {}
+    # Bounded IN lists, SQLite limits the number of bound parameters
+    for start in range(0, len(ids), 500):
+        for row in session.query(Component.id, Component.component_id, Component.name, Component.key_path) \
+                .filter(Component.id.in_(ids[start:start + 500])):
+            components[row.id] = (row.component_id, row.name, row.key_path)
+    return components
+
+
+def load_component_guids(session, product_id):
+    """Component identity -> ComponentId GUID of everything the product has shipped."""
+    return dict(session.query(ComponentGuid.identity, ComponentGuid.guid).filter_by(product_id=product_id))
+
+
+def save_component_guids(session, product_id, new_guids, component_guids):
+    """
+    Record the ComponentIds a build assigned.
+
+    Args:
+        new_guids: Identity -> GUID of the identities seen for the first time
+        component_guids: Component id -> GUID of the Component rows whose
+            component_id differs from what the build used
+    """
+    session.add_all(ComponentGuid(product_id=product_id, identity=identity, guid=guid)
+                    for identity, guid in sorted(new_guids.items()))
+    if component_guids:
+        session.execute(update(Component), [{'id': component_id, 'component_id': guid}
+                                            for component_id, guid in sorted(component_guids.items())])
+    session.commit()
+
+
+def load_extension_stats(session):
+    """Per-extension compression history as a dict of extension -> ExtensionStats."""
+    from core.compress_policy import ExtensionStats
+    return {row.extension: ExtensionStats(row.files or 0, row.incompressible or 0, row.sample_bytes or 0,
+                                          row.sample_compressed or 0, row.sample_seconds or 0.0)
+            for row in session.query(ExtensionCompression)}
+
+
+def save_extension_stats(session, history):
+    """Store the ExtensionStats of a build's compression policy."""
+    rows = {row.extension: row for row in session.query(ExtensionCompression)}
+    for extension, stats in history.items():
+        if not stats.files:
+            continue
+        row = rows.get(extension)
+        if row is None:
+            row = ExtensionCompression(extension=extension)
+            session.add(row)
+        row.files = stats.files
+        row.incompressible = stats.incompressible
+        row.sample_bytes = stats.sample_bytes
+        row.sample_compressed = stats.sample_compressed
+        row.sample_seconds = stats.sample_seconds
+    session.commit()
+
+
+def load_build_record(session, key):
+    """The JSON value stored under an InstallerMeta key, or None."""
+    row = session.query(InstallerMeta).filter_by(key=key).first()
+    if row is None or not row.value:
+        return None
+    try:
+        return json.loads(row.value)
+    except ValueError:
+        return None
+
+
+def save_build_record(session, key, value):
+    """Store a JSON-serializable value under an InstallerMeta key, replacing the previous one."""
+    row = session.query(InstallerMeta).filter_by(key=key).first()
+    if row is None:
+        row = InstallerMeta(key=key)
+        session.add(row)
+    row.value = json.dumps(value, sort_keys=True)
+    row.timestamp = datetime.datetime.utcnow()
+    session.commit()
@@ -0,0 +1,154 @@
+"""
+Bulk insert support for populating large products.
+
+The ORM path adds one Directory/Component at a time and flushes after each
+one to obtain its primary key.  BulkWriter instead hands out primary keys in
+memory, keeps the pending rows as plain tuples and writes them with
+executemany-style Core inserts, one chunk per transaction.
+
+Ids are allocated from the current maximum of each table, so a BulkWriter
+assumes it is the only writer of those tables while it is active (which is
+the case for the scanner against the SQLite database).
+
+A BulkWriter can also write through a connection owned by the caller (for
+example a Session's connection); its chunks then become part of the caller's
+transaction instead of being committed one by one.
+
+SessionWriter has the same interface but adds ORM objects to a Session, for
+scans that are not in bulk mode: everything stays in the session's
+transaction and ids come from flushing each directory and component.
+"""
+
+import logging
+from contextlib import contextmanager
+from sqlalchemy import func, select
+
+from db.models import Directory, Component, File
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Insert order matters for foreign keys: parents first.
+_TABLES = [
+    (Directory.__table__, ('id', 'name', 'source_path', 'target_path', 'default_dir', 'parent_id',
+                           'product_id', 'size', 'mtime_ns', 'inode')),
+    (Component.__table__, ('id', 'name', 'key_path', 'feature_id', 'directory_id')),
+    (File.__table__, ('id', 'path', 'install_path', 'version', 'size', 'attributes',
+                      'sequence', 'component_id', 'feature_id', 'mtime_ns', 'inode', 'hash')),
+]
+
+
+class BulkWriter(object):
+    """Collects directory, component and file rows and writes them in chunks."""
+
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, connection=None):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.connection = connection
+        self.rows_written = 0
+        self._pending = {table.name: [] for table, _ in _TABLES}
+        self._next_id = {}
+        self._first_id = {}
+        with self._begin() as conn:
+            for table, _ in _TABLES:
+                max_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+                self._next_id[table.name] = max_id + 1
+                self._first_id[table.name] = max_id + 1
+
+    @contextmanager
+    def _begin(self):
+        if self.connection is not None:
+            yield self.connection
+        else:
+            with self.engine.begin() as conn:
+                yield conn
+
+    def _add(self, table_name, row):
+        row_id = self._next_id[table_name]
+        self._next_id[table_name] = row_id + 1
+        self._pending[table_name].append((row_id,) + row)
+        if sum(len(rows) for rows in self._pending.values()) >= self.batch_size:
+            self.flush()
+        return row_id
+
+    def add_directory(self, name, source_path, target_path, default_dir, parent_id=None,
+                      product_id=None, size=None, mtime_ns=None, inode=None):
+        return self._add('directories', (name, source_path, target_path, default_dir, parent_id,
+                                         product_id, size, mtime_ns, inode))
+
+    def add_component(self, name, feature_id, directory_id, key_path=None):
+        return self._add('components', (name, key_path, feature_id, directory_id))
+
+    def add_file(self, path, install_path, version, size, attributes, sequence, component_id, feature_id,
+                 mtime_ns=None, inode=None, hash=None):
+        return self._add('files', (path, install_path, version, size, attributes,
+                                   sequence, component_id, feature_id, mtime_ns, inode, hash))
+
+    def flush(self):
+        """Write all pending rows in a single transaction (or the caller's)."""
+        if not any(self._pending.values()):
+            return
+        with self._begin() as conn:
+            for table, columns in _TABLES:
+                rows = self._pending[table.name]
+                if rows:
+                    conn.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+                    self.rows_written += len(rows)
+                    self._pending[table.name] = []
+
+    def discard(self):
+        """Drop pending rows and delete every row this writer already committed."""
+        for rows in self._pending.values():
+            del rows[:]
+        with self._begin() as conn:
+            for table, _ in reversed(_TABLES):
+                conn.execute(table.delete().where(table.c.id >= self._first_id[table.name],
+                                                  table.c.id < self._next_id[table.name]))
+        self.rows_written = 0
+
+
+class SessionWriter(object):
+    """Adds directory, component and file rows to a Session (the ORM path of the scanner)."""
+
+    def __init__(self, session):
+        self.session = session
+        self.rows_written = 0
+        self._pending = 0
+
+    def _add(self, obj, flush):
+        self.session.add(obj)
+        self._pending += 1
+        if flush:
+            # The caller needs the primary key of this row
+            self.flush()
+        return obj.id
+
+    def add_directory(self, name, source_path, target_path, default_dir, parent_id=None,
+                      product_id=None, size=None, mtime_ns=None, inode=None):
+        return self._add(Directory(name=name, source_path=source_path, target_path=target_path,
+                                   default_dir=default_dir, parent_id=parent_id, product_id=product_id,
+                                   size=size, mtime_ns=mtime_ns, inode=inode), flush=True)
+
+    def add_component(self, name, feature_id, directory_id, key_path=None):
+        return self._add(Component(name=name, key_path=key_path, feature_id=feature_id,
+                                   directory_id=directory_id), flush=True)
+
+    def add_file(self, path, install_path, version, size, attributes, sequence, component_id, feature_id,
+                 mtime_ns=None, inode=None, hash=None):
+        return self._add(File(path=path, install_path=install_path, version=version, size=size,
+                              attributes=attributes, sequence=sequence, component_id=component_id,
+                              feature_id=feature_id, mtime_ns=mtime_ns, inode=inode, hash=hash), flush=False)
+
+    def flush(self):
+        """Flush the pending objects into the session's transaction."""
+        if self._pending:
+            self.session.flush()
+            self.rows_written += self._pending
+            self._pending = 0
+
+    def discard(self):
+        """Nothing was committed: rolling back the session undoes the rows."""
+        self.session.rollback()
+        self._pending = 0
+        self.rows_written = 0
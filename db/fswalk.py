@@ -0,0 +1,228 @@
+"""
+Single-pass filesystem walker for the directory scanner.
+
+The walker lists every directory exactly once with os.scandir and keeps the
+stat information of each entry, so the scanner can build directory, component
+and file records (and the total payload size) without walking the tree again
+or stat'ing files a second time.  Directory listings are spread over a thread
+pool; listing is dominated by filesystem latency (especially over NFS), so
+threads overlap nicely despite the GIL.
+"""
+
+import os
+import logging
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ScannedFile(object):
+    """A regular file found during the walk."""
+    __slots__ = ('name', 'path', 'rel_path', 'size', 'mode', 'mtime_ns', 'inode', 'hash', 'version')
+
+    def __init__(self, name, path, rel_path, st):
+        self.name = name
+        self.path = path
+        self.rel_path = rel_path
+        self.size = st.st_size
+        self.mode = st.st_mode
+        self.mtime_ns = st.st_mtime_ns
+        self.inode = st.st_ino
+        # Filled in by the hash and version stages of the scan pipeline
+        self.hash = None
+        self.version = None
+
+
+class ScannedDirectory(object):
+    """
+    A directory found during the walk, with its files and subdirectories.
+
+    The parent is referred to by its path only, so a streamed directory does
+    not keep the tree above it alive.  subdirs is emptied once the walk has
+    queued the children (unless it builds a tree, see scan_tree());
+    subdir_count keeps their number.
+    """
+    __slots__ = ('name', 'path', 'rel_path', 'parent_path', 'files', 'subdirs', 'subdir_count',
+                 'mtime_ns', 'inode', 'pruned')
+
+    def __init__(self, name, path, rel_path, parent_path=None, st=None):
+        self.name = name
+        self.path = path
+        self.rel_path = rel_path
+        self.parent_path = parent_path
+        self.files = []
+        self.subdirs = []
+        self.subdir_count = 0
+        self.mtime_ns = st.st_mtime_ns if st is not None else None
+        self.inode = st.st_ino if st is not None else None
+        # True when the directory was not listed because the manifest says it is unchanged
+        self.pruned = False
+
+    @property
+    def size(self):
+        """Bytes of the files directly in this directory."""
+        return sum(f.size for f in self.files)
+
+
+class ScanResult(object):
+    """The outcome of a walk: the directory tree plus aggregate totals."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def iter_directories(self):
+        """Yield every directory, parents before children, in name order."""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.subdirs))
+
+    def iter_files(self):
+        """Yield every file in the same order the directories are visited."""
+        for node in self.iter_directories():
+            yield from node.files
+
+    @property
+    def total_size(self):
+        return sum(f.size for f in self.iter_files())
+
+    @property
+    def file_count(self):
+        return sum(len(node.files) for node in self.iter_directories())
+
+    @property
+    def directory_count(self):
+        return sum(1 for _ in self.iter_directories())
+
+    @property
+    def pruned_count(self):
+        return sum(1 for node in self.iter_directories() if node.pruned)
+
+
+def _stat_known_subdirectories(node, manifest):
+    """Fill in the subdirectories of an unchanged directory without listing it."""
+    node.pruned = True
+    for name in manifest.subdirectories(node.rel_path):
+        path = os.path.join(node.path, name)
+        rel_path = name if node.rel_path == '.' else os.path.join(node.rel_path, name)
+        try:
+            st = os.stat(path, follow_symlinks=False)
+        except OSError as e:
+            logger.warning(f"Unable to stat {path}: {e}")
+            continue
+        node.subdirs.append(ScannedDirectory(name, path, rel_path, node.path, st))
+    return node.subdirs
+
+
+def _list_directory(node, manifest=None, rules=None, stat=True):
+    """List a single directory, filling in its subdirectories.
+
+    With stat=True the files are stat'ed into node.files right away and an
+    empty list is returned; otherwise the DirEntry objects of the files are
+    returned for stat_files() to process later.
+    """
+    if manifest is not None and manifest.unchanged(node.rel_path, node.mtime_ns):
+        _stat_known_subdirectories(node, manifest)
+        return []
+
+    try:
+        with os.scandir(node.path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        logger.warning(f"Unable to list directory {node.path}: {e}")
+        return []
+
+    file_entries = []
+    for entry in entries:
+        rel_path = entry.name if node.rel_path == '.' else os.path.join(node.rel_path, entry.name)
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if rules is not None and rules.excludes_directory(rel_path, entry.name):
+                    continue
+                node.subdirs.append(ScannedDirectory(entry.name, entry.path, rel_path, node.path,
+                                                     entry.stat(follow_symlinks=False)))
+            elif entry.is_file():
+                if rules is not None and not rules.includes_file(rel_path, entry.name):
+                    continue
+                file_entries.append(entry)
+        except OSError as e:
+            logger.warning(f"Unable to stat {entry.path}: {e}")
+    if stat:
+        stat_files(node, file_entries)
+        return []
+    return file_entries
+
+
+def stat_files(node, file_entries):
+    """Fill in node.files from the DirEntry objects of its files."""
+    for entry in file_entries:
+        rel_path = entry.name if node.rel_path == '.' else os.path.join(node.rel_path, entry.name)
+        try:
+            node.files.append(ScannedFile(entry.name, entry.path, rel_path, entry.stat()))
+        except OSError as e:
+            logger.warning(f"Unable to stat {entry.path}: {e}")
+    return node
+
+
+def walk_directories(base_dir, workers=None, manifest=None, rules=None, stat=True, max_pending=None,
+                     keep_tree=False):
+    """Yield (directory, file entries) as directories are listed.
+
+    Directories are yielded depth-first in name order (every directory comes
+    before its subdirectories), the order ScanResult.iter_directories() uses.
+    The directories next in line are listed ahead on a thread pool, at most
+    max_pending at once (default: four per worker).  The walk holds the
+    unvisited siblings along the current path plus those listings, not a
+    whole level of the tree, and yields nothing more until the consumer asks.
+
+    Args:
+        base_dir: The directory to scan
+        workers: Number of listing threads (None uses the executor default)
+        manifest: DirectoryManifest of the previous scan; directories whose
+            mtime is unchanged are not listed (their files are left empty
+            and they are flagged as pruned)
+        rules: ScanRules; excluded directories are not descended into and
+            excluded files are not stat'ed
+        stat: Stat files on the listing threads (the file entries yielded
+            are then always empty)
+        keep_tree: Leave every directory's subdirs in place (scan_tree())
+    """
+    base_dir = os.path.abspath(base_dir)
+    root = ScannedDirectory(os.path.basename(base_dir), base_dir, '.', None, os.stat(base_dir))
+
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    if max_pending is None:
+        max_pending = workers * 4
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # The next directory is on top of the stack; listings are submitted for
+        # the top max_pending entries, so the output order never depends on them
+        stack = [root]
+        listings = {}
+        while stack:
+            for node in islice(reversed(stack), max_pending):
+                if node.path not in listings:
+                    listings[node.path] = pool.submit(_list_directory, node, manifest, rules, stat)
+            node = stack.pop()
+            entries = listings.pop(node.path).result()
+            node.subdir_count = len(node.subdirs)
+            stack.extend(reversed(node.subdirs))
+            if not keep_tree:
+                node.subdirs = []
+            yield node, entries
+
+
+def scan_tree(base_dir, workers=None, manifest=None, rules=None):
+    """Walk base_dir once and return a ScanResult.
+
+    Takes the same arguments as walk_directories() and keeps the whole tree
+    in memory; see db.pipeline for the streaming equivalent.
+    """
+    root = None
+    for node, _ in walk_directories(base_dir, workers, manifest, rules, keep_tree=True):
+        if root is None:
+            root = node
+    return ScanResult(root)
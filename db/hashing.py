@@ -0,0 +1,103 @@
+"""
+Content hashing and duplicate detection for scanned files.
+
+Digests are stored as '<algorithm>:<hexdigest>' so hashes produced with
+different algorithms never compare equal.  Files are read in large chunks
+into a reused buffer, or memory-mapped when they are big; hashlib releases
+the GIL while digesting large buffers, so hashing scales across a thread pool.
+"""
+
+import os
+import mmap
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALGORITHM = 'sha256'
+CHUNK_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+
+def hash_file(path, algorithm=DEFAULT_ALGORITHM, chunk_size=CHUNK_SIZE, mmap_threshold=MMAP_THRESHOLD):
+    """Return the '<algorithm>:<hexdigest>' content hash of a file."""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if mmap_threshold is not None and size >= mmap_threshold:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, chunk_size):
+                        digest.update(view[offset:offset + chunk_size])
+                finally:
+                    view.release()
+        else:
+            buf = bytearray(chunk_size)
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                digest.update(view[:n])
+    return f"{algorithm}:{digest.hexdigest()}"
+
+
+def hash_files(paths, algorithm=DEFAULT_ALGORITHM, workers=None):
+    """Hash many files on a thread pool.
+
+    Returns a dict of path -> digest; files that cannot be read map to None.
+    """
+    hashlib.new(algorithm)  # Fail early on an unknown algorithm
+
+    def _hash(path):
+        try:
+            return hash_file(path, algorithm)
+        except OSError as e:
+            logger.warning(f"Unable to hash {path}: {e}")
+            return None
+
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(zip(paths, pool.map(_hash, paths)))
+
+
+class DuplicateIndex(object):
+    """Groups files with identical content hashes.
+
+    The first file of each group (lowest sequence, then path) is the canonical
+    copy; it is the only one whose payload needs to be stored in a cabinet,
+    the others can be installed as duplicates of it.
+    """
+
+    def __init__(self, files):
+        groups = {}
+        for f in files:
+            if getattr(f, 'hash', None):
+                groups.setdefault(f.hash, []).append(f)
+        self._canonical = {}
+        self.groups = {}
+        for digest, members in groups.items():
+            if len(members) < 2:
+                continue
+            members.sort(key=lambda f: (f.sequence if f.sequence is not None else 0, f.path))
+            self.groups[digest] = members
+            for f in members[1:]:
+                self._canonical[f.path] = members[0]
+
+    def canonical(self, f):
+        """The file whose payload f shares (f itself if it is not a duplicate)."""
+        return self._canonical.get(f.path, f)
+
+    def is_duplicate(self, f):
+        return f.path in self._canonical
+
+    @property
+    def duplicate_count(self):
+        return len(self._canonical)
+
+    @property
+    def saved_bytes(self):
+        """Payload bytes that no longer need to be stored."""
+        return sum(f.size or 0 for members in self.groups.values() for f in members[1:])
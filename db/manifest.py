@@ -0,0 +1,150 @@
+"""
+On-disk manifest of the directories seen by the last scan.
+
+For every directory of a product the manifest records its path relative to
+the scan root, its mtime_ns and its number of children (files plus
+subdirectories).  A directory's mtime only changes when entries are added,
+removed or renamed in it, so during a rescan a directory whose mtime matches
+the manifest does not have to be listed again: the walker only stats its
+known subdirectories and keeps the stored file rows as they are.
+
+Note that rewriting an existing file in place does not touch the mtime of
+its directory; trees whose files are modified that way need a rescan without
+the manifest to pick up those changes.
+
+The manifest also records the scanner's include/exclude rules; it is only
+used by a rescan with the same rules.
+
+File layout (little endian):
+    header  '<4sHHII' magic, version, root path length, rules length,
+                      record count
+    root    root path (utf-8)
+    rules   ScanRules.key (utf-8)
+    records '<HqI'    path length, mtime_ns, child count, followed by the
+                      path (utf-8, '/' separated), sorted by path
+"""
+
+import os
+import re
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MKDM'
+VERSION = 3
+_HEADER = struct.Struct('<4sHHII')
+_RECORD = struct.Struct('<HqI')
+
+
+def manifest_path(db_path, product_name):
+    """Location of a product's manifest, next to the database file."""
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', product_name)
+    return f"{os.path.splitext(db_path)[0]}_{slug}.dirs"
+
+
+def directory_key(rel_path):
+    """Manifest key of a directory: its '/' separated path relative to the root ('' for the root)."""
+    return '' if rel_path == '.' else rel_path.replace(os.sep, '/')
+
+
+def directory_path(root, key):
+    """Inverse of directory_key: the path of a directory under root."""
+    return os.path.join(root, *key.split('/')) if key else root
+
+
+class DirectoryManifest(object):
+    """Directory path -> (mtime_ns, child_count) for one scan root."""
+
+    def __init__(self, root, entries=None, rules_key=''):
+        self.root = root
+        self.rules_key = rules_key
+        self.entries = dict(entries or {})
+        self._children = None
+
+    @classmethod
+    def from_scan(cls, scan, previous=None, rules_key=''):
+        """Build a manifest from a ScanResult.
+
+        Directories the walk pruned were not listed, so their entries are
+        carried over from the previous manifest.
+        """
+        manifest = cls(scan.root.path, rules_key=rules_key)
+        for node in scan.iter_directories():
+            manifest.record(node, previous)
+        return manifest
+
+    def record(self, node, previous=None):
+        """Add the entry of one ScannedDirectory, e.g. while it streams through the scan pipeline."""
+        key = directory_key(node.rel_path)
+        if node.pruned and previous is not None and key in previous.entries:
+            self.entries[key] = previous.entries[key]
+        else:
+            self.entries[key] = (node.mtime_ns, len(node.files) + node.subdir_count)
+        self._children = None
+
+    @classmethod
+    def load(cls, path, root, rules_key=''):
+        """Load a manifest, or return None if it is missing, unreadable or for another root or rules."""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, version, root_len, rules_len, count = _HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                logger.warning(f"Ignoring manifest {path}: unsupported format")
+                return None
+            offset = _HEADER.size
+            stored_root = data[offset:offset + root_len].decode('utf-8')
+            offset += root_len
+            if stored_root != root:
+                logger.info(f"Ignoring manifest {path}: it was written for {stored_root}")
+                return None
+            stored_rules = data[offset:offset + rules_len].decode('utf-8')
+            offset += rules_len
+            if stored_rules != rules_key:
+                logger.info(f"Ignoring manifest {path}: it was written with different scan rules")
+                return None
+            entries = {}
+            for _ in range(count):
+                path_len, mtime_ns, child_count = _RECORD.unpack_from(data, offset)
+                offset += _RECORD.size
+                entries[data[offset:offset + path_len].decode('utf-8')] = (mtime_ns, child_count)
+                offset += path_len
+        except FileNotFoundError:
+            return None
+        except (OSError, struct.error, UnicodeDecodeError) as e:
+            logger.warning(f"Ignoring unreadable manifest {path}: {e}")
+            return None
+        return cls(root, entries, rules_key)
+
+    def save(self, path):
+        """Write the manifest atomically."""
+        root = self.root.encode('utf-8')
+        rules = self.rules_key.encode('utf-8')
+        parts = [_HEADER.pack(MAGIC, VERSION, len(root), len(rules), len(self.entries)), root, rules]
+        for key in sorted(self.entries):
+            encoded = key.encode('utf-8')
+            mtime_ns, child_count = self.entries[key]
+            parts.append(_RECORD.pack(len(encoded), mtime_ns, child_count))
+            parts.append(encoded)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(tmp_path, path)
+
+    def unchanged(self, rel_path, mtime_ns):
+        """True if the directory's mtime matches the last scan."""
+        entry = self.entries.get(directory_key(rel_path))
+        return entry is not None and mtime_ns is not None and entry[0] == mtime_ns
+
+    def subdirectories(self, rel_path):
+        """Names of the subdirectories recorded for a directory."""
+        if self._children is None:
+            self._children = {}
+            for key in self.entries:
+                if key:
+                    parent, _, name = key.rpartition('/')
+                    self._children.setdefault(parent, []).append(name)
+            for names in self._children.values():
+                names.sort()
+        return self._children.get(directory_key(rel_path), [])
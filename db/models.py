@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Text, Boolean, DateTime, Float
+from sqlalchemy import (create_engine, Column, Integer, BigInteger, String, ForeignKey, Text, Boolean, DateTime, Float,
+                        UniqueConstraint)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker, backref
 import uuid
@@ -59,6 +60,9 @@ class File(Base):
     size = Column(Integer)                 # File size in bytes
     attributes = Column(Integer, default=0)  # File attributes
     sequence = Column(Integer)             # Sequence for ordering
+    mtime_ns = Column(BigInteger)          # Source modification time (ns) at last scan
+    inode = Column(BigInteger)             # Source inode at last scan
+    hash = Column(String, index=True)      # Content hash as '<algorithm>:<hexdigest>'
     component_id = Column(Integer, ForeignKey('components.id'))
     component = relationship('Component', back_populates='files')
     feature_id = Column(Integer, ForeignKey('features.id'))
@@ -73,6 +77,10 @@ class Directory(Base):
     default_dir = Column(String)  # DefaultDir for MSI
     parent_id = Column(Integer, ForeignKey('directories.id'), nullable=True)
     parent = relationship('Directory', remote_side=[id], backref='children')
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=True)  # Product that scanned it
+    size = Column(BigInteger)     # Bytes of the files directly in the directory at last scan
+    mtime_ns = Column(BigInteger) # Source modification time (ns) at last scan
+    inode = Column(BigInteger)    # Source inode at last scan
     components = relationship('Component', back_populates='directory')
 
 class Shortcut(Base):
@@ -122,6 +130,7 @@ class Media(Base):
     __tablename__ = 'media'
     id = Column(Integer, primary_key=True)
     disk_id = Column(Integer, nullable=False)
+    last_sequence = Column(Integer)  # Highest File.Sequence stored on this disk
     cabinet = Column(String)
     volume_label = Column(String)
     product_id = Column(Integer, ForeignKey('products.id'))
@@ -134,6 +143,28 @@ class InstallerMeta(Base):
     value = Column(Text)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
 
+class ExtensionCompression(Base):
+    """What compression probes found for files of one extension (see core/compress_policy.py)."""
+    __tablename__ = 'extension_compression'
+    id = Column(Integer, primary_key=True)
+    extension = Column(String, unique=True, nullable=False)  # Lowercase, with the dot ('' for none)
+    files = Column(Integer, default=0)                # Files probed
+    incompressible = Column(Integer, default=0)       # Files found not worth compressing
+    sample_bytes = Column(BigInteger, default=0)      # Bytes compressed by the probes
+    sample_compressed = Column(BigInteger, default=0)
+    sample_seconds = Column(Float, default=0.0)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class ComponentGuid(Base):
+    """ComponentId a product shipped for a component identity (see core/msi_tables.py), kept across builds."""
+    __tablename__ = 'component_guids'
+    __table_args__ = (UniqueConstraint('product_id', 'identity'),)
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    identity = Column(String, nullable=False)  # Lower case target directory and key path
+    guid = Column(String, nullable=False)      # Upper case, without braces
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+
 # --- Usage Example ---
 # engine = create_engine('sqlite:///installer.db')
 # Base.metadata.create_all(engine)
@@ -0,0 +1,203 @@
+"""
+File versions from the VS_FIXEDFILEINFO resource of PE (EXE/DLL) files.
+
+Windows Installer compares the Version column of the File table to decide
+whether to overwrite an installed file, so the version has to come from the
+binary itself.  This is a small pure-Python PE/COFF reader that works on any
+build host:
+
+    DOS header -> PE header -> optional header -> resource data directory
+    -> section table (RVA to file offset) -> resource tree RT_VERSION/*/*
+    -> VS_VERSIONINFO -> VS_FIXEDFILEINFO
+
+The file is memory-mapped and only the pages holding those structures are
+touched (a few KB, whatever the size of the binary).  Results are cached by
+(path, size, mtime_ns), so a file is only parsed again after it changes.
+"""
+
+import os
+import mmap
+import struct
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Extensions worth opening; everything else is an unversioned file
+PE_EXTENSIONS = frozenset([
+    '.exe', '.dll', '.sys', '.ocx', '.cpl', '.scr', '.drv', '.efi', '.mui', '.ax', '.tlb', '.pyd',
+])
+CACHE_SIZE = 65536
+
+RT_VERSION = 16
+_FIXEDFILEINFO_SIGNATURE = 0xFEEF04BD
+_PE32 = 0x10B
+_PE32_PLUS = 0x20B
+_RESOURCE_DIRECTORY = 2
+_MAX_SECTIONS = 96
+
+
+class PEFormatError(ValueError):
+    """The file is not a well-formed PE image."""
+
+
+class _Image(object):
+    """Bounds-checked access to a mapped file that counts the bytes it reads."""
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.bytes_read = 0
+
+    def unpack(self, fmt, offset):
+        size = struct.calcsize(fmt)
+        if offset < 0 or offset + size > self.size:
+            raise PEFormatError(f"structure at {offset:#x} runs past the end of the file")
+        self.bytes_read += size
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def read(self, offset, size):
+        if offset < 0 or offset + size > self.size:
+            raise PEFormatError(f"{size} bytes at {offset:#x} run past the end of the file")
+        self.bytes_read += size
+        return self.data[offset:offset + size]
+
+
+def _sections(image, pe_offset):
+    """Return (optional header magic, resource RVA, [(rva, virtual size, raw offset, raw size)])."""
+    if image.read(pe_offset, 4) != b'PE\0\0':
+        raise PEFormatError("missing PE signature")
+    _, section_count, _, _, _, optional_size, _ = image.unpack('<HHIIIHH', pe_offset + 4)
+    optional = pe_offset + 24
+    magic, = image.unpack('<H', optional)
+    if magic == _PE32:
+        count_offset = 92
+    elif magic == _PE32_PLUS:
+        count_offset = 108
+    else:
+        raise PEFormatError(f"unknown optional header magic {magic:#x}")
+    directory_count, = image.unpack('<I', optional + count_offset)
+    if directory_count <= _RESOURCE_DIRECTORY:
+        return magic, 0, []
+    resource_rva, _ = image.unpack('<II', optional + count_offset + 4 + 8 * _RESOURCE_DIRECTORY)
+    table = optional + optional_size
+    sections = []
+    for index in range(min(section_count, _MAX_SECTIONS)):
+        virtual_size, rva, raw_size, raw_offset = image.unpack('<IIII', table + 40 * index + 8)
+        sections.append((rva, virtual_size, raw_offset, raw_size))
+    return magic, resource_rva, sections
+
+
+def _rva_to_offset(sections, rva):
+    for section_rva, virtual_size, raw_offset, raw_size in sections:
+        if section_rva <= rva < section_rva + max(virtual_size, raw_size):
+            return raw_offset + (rva - section_rva)
+    raise PEFormatError(f"RVA {rva:#x} is outside every section")
+
+
+def _first_entry(image, base, directory, wanted_id=None):
+    """Offset field of the first (or the wanted id's) entry of a resource directory."""
+    named, ids = image.unpack('<HH', base + directory + 12)
+    entries = base + directory + 16
+    for index in range(named + ids):
+        name, offset = image.unpack('<II', entries + 8 * index)
+        if wanted_id is None or (not name & 0x80000000 and name == wanted_id):
+            return offset
+    return None
+
+
+def _version_resource(image, sections, resource_rva):
+    """Return (file offset, size) of the first RT_VERSION resource, or None."""
+    base = _rva_to_offset(sections, resource_rva)
+    offset = _first_entry(image, base, 0, RT_VERSION)
+    # type -> name -> language -> data entry
+    for _ in range(2):
+        if offset is None or not offset & 0x80000000:
+            return None
+        offset = _first_entry(image, base, offset & 0x7FFFFFFF)
+    if offset is None or offset & 0x80000000:
+        return None
+    data_rva, size, _, _ = image.unpack('<IIII', base + offset)
+    return _rva_to_offset(sections, data_rva), size
+
+
+def _fixed_file_info(image, offset, size):
+    """Parse VS_VERSIONINFO at offset and return (file version MS, LS), or None."""
+    length, value_length, _ = image.unpack('<HHH', offset)
+    if value_length < 52 or length > size:
+        return None
+    key = image.read(offset + 6, 32)
+    if key != 'VS_VERSION_INFO\0'.encode('utf-16-le'):
+        return None
+    value = (offset + 6 + 32 + 3) & ~3
+    signature, _, file_ms, file_ls = image.unpack('<IIII', value)
+    if signature != _FIXEDFILEINFO_SIGNATURE:
+        return None
+    return file_ms, file_ls
+
+
+def read_pe_version(path, stats=None):
+    """
+    Return the file version of a PE image as 'major.minor.build.revision'.
+
+    Returns None for files without a version resource.  Raises PEFormatError
+    for files that are not PE images and OSError if the file can't be read.
+    If stats is a dict, stats['bytes_read'] is set to the number of bytes of
+    the file that were examined.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < 64:
+            raise PEFormatError("file too small")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            image = _Image(mapped)
+            try:
+                if image.read(0, 2) != b'MZ':
+                    raise PEFormatError("missing MZ signature")
+                pe_offset, = image.unpack('<I', 0x3C)
+                _, resource_rva, sections = _sections(image, pe_offset)
+                if not resource_rva:
+                    return None
+                resource = _version_resource(image, sections, resource_rva)
+                if resource is None:
+                    return None
+                version = _fixed_file_info(image, *resource)
+            finally:
+                if stats is not None:
+                    stats['bytes_read'] = image.bytes_read
+    if version is None:
+        return None
+    file_ms, file_ls = version
+    return f"{file_ms >> 16}.{file_ms & 0xFFFF}.{file_ls >> 16}.{file_ls & 0xFFFF}"
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _cached_version(path, size, mtime_ns):
+    try:
+        return read_pe_version(path)
+    except PEFormatError as e:
+        logger.debug(f"No version resource in {path}: {e}")
+        return None
+
+
+def get_pe_version(path, size=None, mtime_ns=None):
+    """
+    Cached version lookup for a file, None if it has no version resource.
+
+    size and mtime_ns (e.g. from the scanner's stat) form the cache key
+    together with the path; they are stat'ed when not given.
+    """
+    if os.path.splitext(path)[1].lower() not in PE_EXTENSIONS:
+        return None
+    try:
+        if size is None or mtime_ns is None:
+            st = os.stat(path)
+            size, mtime_ns = st.st_size, st.st_mtime_ns
+        return _cached_version(path, size, mtime_ns)
+    except OSError as e:
+        logger.warning(f"Unable to read version of {path}: {e}")
+        return None
+
+
+def cache_info():
+    """Hit/miss statistics of the version cache."""
+    return _cached_version.cache_info()
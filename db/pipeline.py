@@ -0,0 +1,164 @@
+"""
+Streaming scan pipeline.
+
+A scan is a chain of generator stages:
+
+    walk -> stat -> hash -> version -> database writer
+
+Each stage runs in its own thread and hands directories to the next one
+through a bounded queue, so a slow stage (hashing, or the database) applies
+back-pressure instead of letting the tree pile up in memory.  The unit that
+flows through the pipeline is a ScannedDirectory carrying its ScannedFile
+records (compact __slots__ objects); once the writer has consumed a
+directory its file records can be dropped.
+
+Directories come out of the pipeline in the walk's depth-first order, so
+a parent is always written before its children.
+"""
+
+import queue
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from db.fswalk import walk_directories, stat_files
+from db.hashing import hash_file
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 64   # Directories buffered between two stages
+DEFAULT_WINDOW = 1024     # Files in flight in the hash and version stages
+
+_DONE = object()
+
+
+class _Failure(object):
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def bounded(iterable, maxsize=DEFAULT_QUEUE_SIZE):
+    """Run iterable in a background thread and yield its items through a bounded queue.
+
+    Exceptions raised by the producer are re-raised in the consumer.  If the
+    consumer stops early the producer thread stops at its next item.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(q, item, stop):
+                    return
+        except BaseException as e:
+            _put(q, _Failure(e), stop)
+            return
+        _put(q, _DONE, stop)
+
+    thread = threading.Thread(target=produce, name='scan-stage', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+
+def stat_stage(listings, workers=None, window=DEFAULT_QUEUE_SIZE):
+    """Stat the files of each listed directory on a thread pool, keeping the order."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for node, entries in listings:
+            in_flight.append(pool.submit(stat_files, node, entries))
+            if len(in_flight) >= window:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def file_stage(nodes, fn, select=None, workers=None, window=DEFAULT_WINDOW):
+    """Call fn on every (selected) file of each directory on a thread pool.
+
+    Directories are yielded in their input order once all of their files
+    have been processed; at most `window` files are in flight.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        outstanding = 0
+        for node in nodes:
+            futures = [pool.submit(fn, f) for f in node.files if select is None or select(f)]
+            in_flight.append((node, futures))
+            outstanding += len(futures)
+            while in_flight and (outstanding >= window or len(in_flight) > DEFAULT_QUEUE_SIZE):
+                done_node, done_futures = in_flight.popleft()
+                for future in done_futures:
+                    future.result()
+                outstanding -= len(done_futures)
+                yield done_node
+        while in_flight:
+            done_node, done_futures = in_flight.popleft()
+            for future in done_futures:
+                future.result()
+            yield done_node
+
+
+def _hasher(algorithm):
+    def _hash(f):
+        try:
+            f.hash = hash_file(f.path, algorithm)
+        except OSError as e:
+            logger.warning(f"Unable to hash {f.path}: {e}")
+    return _hash
+
+
+def _versioner(get_version):
+    def _version(f):
+        f.version = get_version(f.path, f.size, f.mtime_ns)
+    return _version
+
+
+def scan_pipeline(base_dir, workers=None, manifest=None, rules=None, hash_algorithm=None,
+                  get_version=None, select=None, queue_size=DEFAULT_QUEUE_SIZE):
+    """
+    Stream the directories of base_dir with their file records filled in.
+
+    Args:
+        base_dir: The directory to scan
+        workers: Threads per stage (None uses the executor default)
+        manifest: DirectoryManifest used to skip unchanged directories
+        rules: ScanRules applied during the walk
+        hash_algorithm: Set ScannedFile.hash with this algorithm (None skips hashing)
+        get_version: Callable(path, size, mtime_ns) returning ScannedFile.version (None skips it)
+        select: Predicate choosing the files that are hashed and versioned
+            (None selects every file)
+        queue_size: Directories buffered between stages
+    """
+    if hash_algorithm:
+        hashlib.new(hash_algorithm)  # Fail early on an unknown algorithm
+    stream = bounded(walk_directories(base_dir, workers, manifest, rules, stat=False), queue_size)
+    stream = bounded(stat_stage(stream, workers), queue_size)
+    if hash_algorithm:
+        stream = bounded(file_stage(stream, _hasher(hash_algorithm), select, workers), queue_size)
+    if get_version:
+        stream = bounded(file_stage(stream, _versioner(get_version), select, workers), queue_size)
+    return stream
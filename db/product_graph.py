@@ -0,0 +1,140 @@
+"""
+The product graph behind the MSI tables: features, components, directories
+and registry values of a product.
+
+load_product_graph() reads each of them with one column-projected query
+(directories referenced from outside the product's own rows are fetched in
+bounded IN batches), so the number of round trips does not depend on the
+size of the product.  No ORM objects are created.  Files are not part of the
+graph: the build already holds them in a FileManifest.
+
+ProductGraph.directory_path() resolves the target path of a directory by
+walking up its parents, memoizing every directory it passes, so resolving
+all directories of a tree costs one step per directory.
+"""
+
+import logging
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from db.models import Feature, Component, Directory, Registry
+
+logger = logging.getLogger(__name__)
+
+FeatureNode = namedtuple('FeatureNode', ['id', 'name', 'title', 'description', 'display', 'level', 'parent_id'])
+ComponentNode = namedtuple('ComponentNode', ['id', 'guid', 'name', 'key_path', 'feature_id', 'directory_id'])
+DirectoryNode = namedtuple('DirectoryNode', ['id', 'name', 'default_dir', 'parent_id'])
+RegistryNode = namedtuple('RegistryNode', ['id', 'root', 'key', 'name', 'value', 'component_id'])
+
+# Bound parameters per IN list, SQLite limits their number
+_IN_BATCH = 500
+_FETCH_SIZE = 10000
+
+
+class ProductGraphError(Exception):
+    """The product's rows do not form a valid tree."""
+
+
+class ProductGraph(object):
+    """
+    The rows of a product, by id.
+
+    Attributes:
+        features, components, directories: dicts of id -> node
+        registry: RegistryNodes ordered by id
+    """
+
+    def __init__(self, features=(), components=(), directories=(), registry=()):
+        self.features = {f.id: f for f in features}
+        self.components = {c.id: c for c in components}
+        self.directories = {d.id: d for d in directories}
+        self.registry = list(registry)
+        self._paths = {}
+
+    def directory_path(self, directory_id):
+        """
+        Target path of a directory relative to the install root, as a tuple of names.
+
+        Directories without a parent are the install root (an empty path).
+        """
+        path = self._paths.get(directory_id)
+        if path is not None:
+            return path
+        # Walk up to the first directory with a known path, then resolve back down
+        chain = []
+        current = directory_id
+        while current is not None and current not in self._paths:
+            node = self.directories.get(current)
+            if node is None:
+                raise ProductGraphError(f"directory {current} is referenced but does not exist")
+            if len(chain) > len(self.directories):
+                raise ProductGraphError(f"directory {directory_id} is its own ancestor")
+            chain.append(node)
+            current = node.parent_id
+        path = () if current is None else self._paths[current]
+        for node in reversed(chain):
+            path = path + (node.default_dir or node.name,) if node.parent_id is not None else ()
+            self._paths[node.id] = path
+        return path
+
+    def root_directories(self):
+        return [d for d in self.directories.values() if d.parent_id is None]
+
+
+def _stream(connection, query):
+    result = connection.execution_options(stream_results=True).execute(query)
+    for rows in result.partitions(_FETCH_SIZE):
+        yield from rows
+
+
+def load_product_graph(connection, product_id, component_ids=()):
+    """
+    Load the graph of a product.
+
+    Args:
+        connection: SQLAlchemy connection
+        product_id: Product whose features, and their components, are loaded
+        component_ids: Further components to load (those of the build's files,
+            when some are not attached to a feature of the product)
+    """
+    features = [FeatureNode(*row) for row in _stream(connection, select(
+        Feature.id, Feature.name, Feature.title, Feature.description, Feature.display, Feature.level,
+        Feature.parent_id).where(Feature.product_id == product_id).order_by(Feature.id))]
+
+    component_columns = (Component.id, Component.component_id, Component.name, Component.key_path,
+                         Component.feature_id, Component.directory_id)
+    components = {row[0]: ComponentNode(*row) for row in _stream(connection, select(*component_columns)
+                  .join(Feature, Component.feature_id == Feature.id)
+                  .where(Feature.product_id == product_id).order_by(Component.id))}
+    missing = sorted(set(component_ids) - set(components) - {None})
+    for start in range(0, len(missing), _IN_BATCH):
+        for row in connection.execute(select(*component_columns)
+                                      .where(Component.id.in_(missing[start:start + _IN_BATCH]))):
+            components[row[0]] = ComponentNode(*row)
+
+    directory_columns = (Directory.id, Directory.name, Directory.default_dir, Directory.parent_id)
+    directories = {row[0]: DirectoryNode(*row) for row in _stream(connection, select(*directory_columns)
+                   .where(Directory.product_id == product_id).order_by(Directory.id))}
+    # Directories from scans that did not record the product, and their parents, level by level
+    wanted = {c.directory_id for c in components.values()} - set(directories) - {None}
+    while wanted:
+        wanted = sorted(wanted)
+        found = {}
+        for start in range(0, len(wanted), _IN_BATCH):
+            for row in connection.execute(select(*directory_columns)
+                                          .where(Directory.id.in_(wanted[start:start + _IN_BATCH]))):
+                found[row[0]] = DirectoryNode(*row)
+        directories.update(found)
+        wanted = {d.parent_id for d in found.values()} - set(directories) - {None}
+
+    registry = [RegistryNode(*row) for row in _stream(connection, select(
+        Registry.id, Registry.root, Registry.key, Registry.name, Registry.value, Registry.component_id)
+        .where(Registry.component_id.in_(select(Component.id).join(Feature, Component.feature_id == Feature.id)
+                                         .where(Feature.product_id == product_id)))
+        .order_by(Registry.id))]
+
+    graph = ProductGraph(features, components.values(), directories.values(), registry)
+    logger.info(f"Loaded product graph: {len(graph.features)} features, {len(graph.components)} components, "
+                f"{len(graph.directories)} directories, {len(graph.registry)} registry values")
+    return graph
@@ -0,0 +1,289 @@
+"""
+Incremental rescan of a previously scanned product.
+
+A rescan diffs the directories streamed by the scan pipeline against the
+rows already stored for the product and only inserts, updates or deletes
+what changed.  Files are compared on (size, mtime_ns, inode); unchanged rows
+are never touched, so ids, sequences and component GUIDs stay stable across
+rescans.
+
+Existing rows are loaded up front with column-projected queries (no ORM
+objects).  needs_content() tells the pipeline which files are new or changed,
+so only those are hashed and versioned.  Directories are then applied one at
+a time as they come out of the pipeline: new directories and components are
+inserted immediately (their children need the ids), file rows are written
+with chunked bulk insert/update statements, and deletions run at the end.
+"""
+
+import os
+import logging
+from sqlalchemy import select, insert, update, delete, func
+
+from db.models import Directory, Component, File
+
+logger = logging.getLogger(__name__)
+
+# Stay well below SQLite's bound-parameter limit for IN (...) clauses
+_DELETE_CHUNK = 500
+# File rows buffered before they are written
+_WRITE_CHUNK = 5000
+
+
+class RescanStats(object):
+    """Counts of what a rescan changed."""
+
+    def __init__(self):
+        self.files_added = 0
+        self.files_updated = 0
+        self.files_removed = 0
+        self.files_unchanged = 0
+        self.directories_added = 0
+        self.directories_removed = 0
+        self.components_added = 0
+        self.components_removed = 0
+
+    @property
+    def changed(self):
+        return bool(self.files_added or self.files_updated or self.files_removed
+                    or self.directories_added or self.directories_removed)
+
+    def __str__(self):
+        return (f"files +{self.files_added} ~{self.files_updated} -{self.files_removed} "
+                f"={self.files_unchanged}, directories +{self.directories_added} "
+                f"-{self.directories_removed}, components +{self.components_added} "
+                f"-{self.components_removed}")
+
+
+def _delete_ids(session, model, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), _DELETE_CHUNK):
+        session.execute(delete(model).where(model.id.in_(ids[start:start + _DELETE_CHUNK])))
+
+
+def _directory_key(rel_path):
+    return '' if rel_path == '.' else rel_path
+
+
+def _stat_changed(row, scanned_file):
+    return (row.size, row.mtime_ns, row.inode) != (scanned_file.size, scanned_file.mtime_ns, scanned_file.inode)
+
+
+class IncrementalRescan(object):
+    """
+    Applies a stream of scanned directories to the stored rows of a product.
+
+    Usage:
+        rescan = IncrementalRescan(session, product, feature, target_dir, get_attributes)
+        for node in scan_pipeline(..., select=rescan.needs_content):
+            rescan.apply(node)
+        stats = rescan.finish()
+
+    The caller commits the session.
+
+    When directories (a set of source paths) is given, only the file rows of
+    those directories are loaded; the walk must not list any other directory
+    that already has stored rows (the watch mode prunes everything else).
+    """
+
+    def __init__(self, session, product, feature, target_base_dir, get_attributes, hash_algorithm=None,
+                 directories=None):
+        self.session = session
+        self.product = product
+        self.feature = feature
+        self.target_base_dir = target_base_dir
+        self.get_attributes = get_attributes
+        self.hash_prefix = f"{hash_algorithm}:" if hash_algorithm else None
+        self.stats = RescanStats()
+
+        # --- Load what the previous scan stored ---
+        self.stored_dirs = {}
+        for row in session.execute(
+                select(Directory.id, Directory.source_path, Directory.size, Directory.mtime_ns, Directory.inode)
+                .where(Directory.product_id == product.id)):
+            self.stored_dirs[row.source_path] = row
+        if not self.stored_dirs:
+            raise ValueError(f"Product '{product.name}' has no scanned directories to rescan; "
+                             f"delete it and run a full scan")
+
+        self.stored_components = {}
+        for row in session.execute(
+                select(Component.id, Component.directory_id, Component.key_path)
+                .where(Component.feature_id == feature.id)):
+            self.stored_components[row.directory_id] = row
+
+        # Grouped by directory so each streamed directory only looks at its own rows
+        self.stored_files = {}
+        query = select(File.id, File.path, File.size, File.mtime_ns, File.inode, File.hash)
+        if directories is None:
+            queries = [query.where(File.feature_id == feature.id)]
+        else:
+            component_ids = [self.stored_components[self.stored_dirs[path].id].id for path in directories
+                             if path in self.stored_dirs and self.stored_dirs[path].id in self.stored_components]
+            queries = [query.where(File.component_id.in_(component_ids[start:start + _DELETE_CHUNK]))
+                       for start in range(0, len(component_ids), _DELETE_CHUNK)]
+        for q in queries:
+            for row in session.execute(q):
+                self.stored_files.setdefault(os.path.dirname(row.path), {})[row.path] = row
+        self.next_sequence = (session.execute(select(func.max(File.sequence))
+                                              .where(File.feature_id == feature.id)).scalar() or 0) + 1
+
+        self.directory_ids = {}
+        self._seen_file_dirs = set()
+        self._kept_components = set()
+        self._removed_files = []
+        self._file_inserts = []
+        self._file_updates = []
+        self._directory_updates = []
+        self._component_updates = []
+
+    def needs_content(self, scanned_file):
+        """True if the file must be hashed/versioned: it is new, changed, or lacks a current hash.
+
+        Called from the pipeline's worker threads; it only reads the stored rows.
+        """
+        row = self.stored_files.get(os.path.dirname(scanned_file.rel_path), {}).get(scanned_file.rel_path)
+        if row is None or _stat_changed(row, scanned_file):
+            return True
+        return bool(self.hash_prefix and not (row.hash or '').startswith(self.hash_prefix))
+
+    def _insert(self, model, values):
+        return self.session.execute(insert(model).values(**values)).inserted_primary_key[0]
+
+    def apply(self, node):
+        """Diff one ScannedDirectory (its parent must have been applied already)."""
+        stats = self.stats
+        row = self.stored_dirs.get(node.path)
+        if row is None:
+            directory_id = self._insert(Directory, {
+                'name': node.name,
+                'source_path': node.path,
+                'target_path': self.target_base_dir if node.parent_path is None else
+                os.path.join(self.target_base_dir or '', node.rel_path),
+                'default_dir': node.name,
+                'parent_id': self.directory_ids[node.parent_path] if node.parent_path is not None else None,
+                'product_id': self.product.id,
+                'size': node.size,
+                'mtime_ns': node.mtime_ns,
+                'inode': node.inode,
+            })
+            stats.directories_added += 1
+        else:
+            directory_id = row.id
+            if not node.pruned and (row.size, row.mtime_ns, row.inode) != (node.size, node.mtime_ns, node.inode):
+                self._directory_updates.append({'id': row.id, 'size': node.size,
+                                                'mtime_ns': node.mtime_ns, 'inode': node.inode})
+        self.directory_ids[node.path] = directory_id
+
+        key = _directory_key(node.rel_path)
+        self._seen_file_dirs.add(key)
+        stored = self.stored_files.get(key, {})
+        component = self.stored_components.get(directory_id)
+
+        if node.pruned:
+            # Not listed: its files and component are kept as they are
+            stats.files_unchanged += len(stored)
+            if component is not None:
+                self._kept_components.add(component.id)
+            return
+
+        component_id = None
+        if node.files:
+            key_path = node.files[0].rel_path
+            if component is None:
+                component_id = self._insert(Component, {
+                    'name': f"comp_{node.name}",
+                    'feature_id': self.feature.id,
+                    'directory_id': directory_id,
+                    'key_path': key_path,
+                })
+                stats.components_added += 1
+            else:
+                component_id = component.id
+                if component.key_path != key_path:
+                    self._component_updates.append({'id': component.id, 'key_path': key_path})
+            self._kept_components.add(component_id)
+
+        scanned_paths = set()
+        for scanned_file in node.files:
+            scanned_paths.add(scanned_file.rel_path)
+            row = stored.get(scanned_file.rel_path)
+            if row is None:
+                self._file_inserts.append({
+                    'path': scanned_file.rel_path,
+                    'install_path': scanned_file.name,
+                    'version': scanned_file.version,
+                    'size': scanned_file.size,
+                    'attributes': self.get_attributes(scanned_file.mode),
+                    'sequence': self.next_sequence,
+                    'mtime_ns': scanned_file.mtime_ns,
+                    'inode': scanned_file.inode,
+                    'hash': scanned_file.hash,
+                    'component_id': component_id,
+                    'feature_id': self.feature.id,
+                })
+                self.next_sequence += 1
+                stats.files_added += 1
+            elif _stat_changed(row, scanned_file):
+                self._file_updates.append({
+                    'id': row.id,
+                    'version': scanned_file.version,
+                    'size': scanned_file.size,
+                    'attributes': self.get_attributes(scanned_file.mode),
+                    'mtime_ns': scanned_file.mtime_ns,
+                    'inode': scanned_file.inode,
+                    'hash': scanned_file.hash,
+                })
+                stats.files_updated += 1
+            else:
+                stats.files_unchanged += 1
+                if self.hash_prefix and not (row.hash or '').startswith(self.hash_prefix) and scanned_file.hash:
+                    self._file_updates.append({'id': row.id, 'hash': scanned_file.hash})
+        self._removed_files.extend(row.id for path, row in stored.items() if path not in scanned_paths)
+
+        if len(self._file_inserts) + len(self._file_updates) >= _WRITE_CHUNK:
+            self._write_files()
+
+    def _write_files(self):
+        if self._file_inserts:
+            self.session.execute(insert(File), self._file_inserts)
+            self._file_inserts = []
+        # Rows of different shapes go in separate executemany batches
+        by_shape = {}
+        for values in self._file_updates:
+            by_shape.setdefault(tuple(values), []).append(values)
+        for rows in by_shape.values():
+            self.session.execute(update(File), rows)
+        self._file_updates = []
+
+    def finish(self):
+        """Write what is still pending, delete what disappeared and return the RescanStats."""
+        stats = self.stats
+        self._write_files()
+        if self._directory_updates:
+            self.session.execute(update(Directory), self._directory_updates)
+        if self._component_updates:
+            self.session.execute(update(Component), self._component_updates)
+
+        # --- Removals, children before parents ---
+        for key, stored in self.stored_files.items():
+            if key not in self._seen_file_dirs:
+                self._removed_files.extend(row.id for row in stored.values())
+        _delete_ids(self.session, File, self._removed_files)
+        stats.files_removed = len(self._removed_files)
+
+        removed_components = [row.id for row in self.stored_components.values()
+                              if row.id not in self._kept_components]
+        # Files of removed directories whose rows were not loaded
+        for start in range(0, len(removed_components), _DELETE_CHUNK):
+            result = self.session.execute(
+                delete(File).where(File.component_id.in_(removed_components[start:start + _DELETE_CHUNK])))
+            stats.files_removed += result.rowcount
+        _delete_ids(self.session, Component, removed_components)
+        stats.components_removed = len(removed_components)
+
+        removed_dirs = {path: row.id for path, row in self.stored_dirs.items() if path not in self.directory_ids}
+        # Deepest paths first so no directory outlives its parent
+        _delete_ids(self.session, Directory,
+                    [removed_dirs[path] for path in sorted(removed_dirs, key=len, reverse=True)])
+        stats.directories_removed = len(removed_dirs)
+        return stats
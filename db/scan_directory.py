@@ -14,21 +14,24 @@ import os
 import sys
 import argparse
 import configparser
-import uuid
-import datetime
 import logging
-import re
 import stat
-from pathlib import Path
 
 # Add parent directory to path to import our modules
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
-from db.session import Session, init_db
-from db.models import (
-    Product, Feature, Component, File, Directory, 
-    Property, Registry, CustomAction, Media, Shortcut
-)
+from sqlalchemy import func
+from db.session import Session, init_db, engine, DB_PATH
+from db.fswalk import scan_tree
+from db.pipeline import scan_pipeline
+from db.bulk import BulkWriter, SessionWriter, DEFAULT_BATCH_SIZE
+from db.rescan import IncrementalRescan
+from db.hashing import DEFAULT_ALGORITHM
+from db.peversion import get_pe_version
+from db.manifest import DirectoryManifest, manifest_path, directory_path
+from db.watch import watch as watch_directory, DirtyManifest, DEFAULT_INTERVAL
+from db.scan_rules import ScanRules, split_patterns
+from db.models import Product, Feature, Component, File, Property, Registry, Shortcut
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -54,141 +57,182 @@ def load_config(config_path):
         result.update(dict(config['Product']))
     if 'Installation' in config:
         result.update(dict(config['Installation']))
+    if 'Scanner' in config:
+        # include / exclude glob lists and default_excludes
+        result.update(dict(config['Scanner']))
         
     return result
 
-def estimate_directory_size(directory_path):
+def build_scan_rules(config_values):
+    """Compile the include/exclude rules of a scanner configuration."""
+    default_excludes = str(config_values.get('default_excludes', 'yes')).lower() not in ('0', 'no', 'false', 'off')
+    return ScanRules(
+        include=config_values.get('include'),
+        exclude=config_values.get('exclude'),
+        default_excludes=default_excludes
+    )
+
+def estimate_directory_size(directory_path, scan=None):
     """Estimate the total size of files in a directory in KB."""
-    total_size = 0
-    for dirpath, _, filenames in os.walk(directory_path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            if os.path.isfile(fp):
-                total_size += os.path.getsize(fp)
-    return total_size // 1024  # Convert to KB
+    if scan is None:
+        scan = scan_tree(directory_path)
+    return scan.total_size // 1024  # Convert to KB
 
-def get_file_version(file_path):
-    """Try to extract version information from a file."""
-    # Simple version extraction from filename patterns like name-1.2.3.ext
-    filename = os.path.basename(file_path)
-    match = re.search(r'[-_](\d+\.\d+(\.\d+)?(\.\d+)?)', filename)
-    if match:
-        return match.group(1)
-    return None
+def get_file_version(file_path, size=None, mtime_ns=None):
+    """Return the file version from a PE file's version resource (None for unversioned files)."""
+    return get_pe_version(file_path, size, mtime_ns)
 
-def create_directory_structure(session, base_dir, target_base_dir, parent_dir=None):
-    """Create directory entries in the database based on the scanned directory structure."""
-    base_dir_obj = None
+def get_file_attributes(mode):
+    """Map a stat mode to MSI file attributes."""
+    file_attributes = 0
     
-    if parent_dir is None:
-        # Create the root directory
-        base_name = os.path.basename(base_dir)
-        base_dir_obj = Directory(
-            name=base_name,
-            source_path=base_dir,
-            target_path=target_base_dir,
-            default_dir=base_name
-        )
-        session.add(base_dir_obj)
-        session.flush()  # Ensure ID is generated
-        logger.info(f"Created root directory: {base_name}")
-    else:
-        base_dir_obj = parent_dir
+    # Check if file is readonly, hidden, system, etc.
+    if mode & stat.S_IRUSR and not (mode & stat.S_IWUSR):
+        file_attributes |= 1  # Read-only
+    return file_attributes
+
+def populate_directories(writer, directories, target_base_dir, feature_id, product_id=None, on_directory=None):
+    """
+    Write directory, component and file rows for a stream of scanned directories.
     
-    directories = {}
-    directories[base_dir] = base_dir_obj
+    Each directory with files gets one component, keyed by its first file,
+    and files are numbered in stream order.  Parent and foreign-key ids are
+    resolved in memory and the rows handed to writer, a BulkWriter or a
+    SessionWriter.  Parents must come before their children, which both
+    ScanResult.iter_directories() and scan_pipeline() guarantee.  File
+    versions and hashes are taken from the ScannedFile records.
     
-    # Walk the directory tree
-    for dirpath, dirnames, _ in os.walk(base_dir):
-        parent_obj = directories.get(dirpath)
-        
-        for dirname in dirnames:
-            dir_full_path = os.path.join(dirpath, dirname)
-            rel_path = os.path.relpath(dir_full_path, base_dir)
-            target_path = os.path.join(target_base_dir, rel_path)
-            
-            dir_obj = Directory(
-                name=dirname,
-                source_path=dir_full_path,
-                target_path=target_path,
-                default_dir=dirname,
-                parent=parent_obj
-            )
-            session.add(dir_obj)
-            session.flush()
-            directories[dir_full_path] = dir_obj
-            logger.info(f"Created directory: {rel_path}")
+    on_directory is called with each directory once its rows are queued.
     
-    return directories
-
-def process_files(session, base_dir, directories, feature):
-    """Process files and create component/file entries."""
+    Returns the file count and the total file size.
+    """
+    directory_ids = {}
     sequence = 1
     file_count = 0
+    total_size = 0
     
-    # Walk the directory tree
-    for dirpath, _, filenames in os.walk(base_dir):
-        if not filenames:
-            continue
-            
-        dir_obj = directories.get(dirpath)
-        if not dir_obj:
-            logger.warning(f"Directory object not found for {dirpath}")
-            continue
-        
-        # Create a component for this directory
-        component_name = f"comp_{os.path.basename(dirpath)}"
-        component = Component(
-            name=component_name,
-            feature=feature,
-            directory=dir_obj
+    for scanned in directories:
+        if scanned.parent_path is None:
+            target_path = target_base_dir
+        else:
+            target_path = os.path.join(target_base_dir or '', scanned.rel_path)
+        directory_size = scanned.size
+        directory_id = writer.add_directory(
+            scanned.name, scanned.path, target_path, scanned.name,
+            directory_ids.get(scanned.parent_path),
+            product_id=product_id, size=directory_size,
+            mtime_ns=scanned.mtime_ns, inode=scanned.inode
         )
-        session.add(component)
-        session.flush()
+        directory_ids[scanned.path] = directory_id
+        total_size += directory_size
         
-        # Add files to the component
-        for filename in filenames:
-            file_path = os.path.join(dirpath, filename)
-            rel_path = os.path.relpath(file_path, base_dir)
-            
-            # Get file attributes
-            file_size = os.path.getsize(file_path)
-            file_version = get_file_version(file_path)
-            file_attributes = 0
-            
-            # Check if file is readonly, hidden, system, etc.
-            file_stat = os.stat(file_path)
-            if file_stat.st_mode & stat.S_IRUSR and not (file_stat.st_mode & stat.S_IWUSR):
-                file_attributes |= 1  # Read-only
-                
-            # Create file entry
-            file_obj = File(
-                path=rel_path,
-                install_path=filename,  # Default to just the filename in the target directory
-                version=file_version,
-                size=file_size,
-                attributes=file_attributes,
-                sequence=sequence,
-                component=component,
-                feature=feature
+        if scanned.files:
+            # The first file is the key path, so the component needs no later update
+            component_id = writer.add_component(
+                f"comp_{scanned.name}", feature_id, directory_id,
+                key_path=scanned.files[0].rel_path
             )
-            session.add(file_obj)
-            
-            # Set the first file as the key path for the component
-            if component.key_path is None:
-                component.key_path = rel_path
-                session.flush()
+            for scanned_file in scanned.files:
+                writer.add_file(
+                    scanned_file.rel_path, scanned_file.name,
+                    scanned_file.version, scanned_file.size,
+                    get_file_attributes(scanned_file.mode), sequence,
+                    component_id, feature_id,
+                    mtime_ns=scanned_file.mtime_ns, inode=scanned_file.inode,
+                    hash=scanned_file.hash
+                )
+                sequence += 1
+                file_count += 1
                 
-            sequence += 1
-            file_count += 1
-            
-            if file_count % 100 == 0:
+            if file_count % 10000 < len(scanned.files):
                 logger.info(f"Processed {file_count} files...")
                 
-    logger.info(f"Total files processed: {file_count}")
-    return file_count
+        if on_directory is not None:
+            on_directory(scanned)
+            
+    writer.flush()
+    logger.info(f"Total files processed: {file_count} ({writer.rows_written} rows written)")
+    return file_count, total_size
+
+def rescan_directory(session, product, source_dir, target_dir, config_values, rules=None, manifest=None,
+                     hash_algorithm=None, workers=None, on_directory=None, directories=None):
+    """
+    Incrementally update an existing product from a fresh scan of source_dir.
+    
+    Only the files, directories and components that changed since the last
+    scan are written; ids and component GUIDs of everything else are kept.
+    Only new and changed files are hashed and versioned.  on_directory is
+    called with each streamed directory after it has been applied.
+    directories limits the stored file rows that are loaded (see
+    IncrementalRescan).
+    """
+    feature = session.query(Feature).filter_by(product=product).order_by(Feature.id).first()
+    if not feature:
+        raise Exception(f"No feature found for product '{product.name}'")
+        
+    for attr in ('version', 'description', 'manufacturer'):
+        if config_values.get(attr):
+            setattr(product, attr, config_values[attr])
+    if target_dir:
+        product.installation_location = target_dir
+    
+    rescan = IncrementalRescan(session, product, feature, target_dir or product.installation_location,
+                               get_file_attributes, hash_algorithm=hash_algorithm, directories=directories)
+    for scanned in scan_pipeline(source_dir, workers=workers, manifest=manifest, rules=rules,
+                                 hash_algorithm=hash_algorithm, get_version=get_file_version,
+                                 select=rescan.needs_content):
+        rescan.apply(scanned)
+        if on_directory is not None:
+            on_directory(scanned)
+    stats = rescan.finish()
+    # Pruned directories were not listed, so total the stored sizes instead of the scan
+    total_size = session.query(func.sum(File.size)).filter(File.feature_id == feature.id).scalar() or 0
+    product.estimated_size = total_size // 1024
+    logger.info(f"Rescanned {product.name}: {stats}")
+    return stats
+
+def watch_product(source_dir, product_name, rules, manifest_file, hash_algorithm=None, workers=None,
+                  use_inotify=True, interval=DEFAULT_INTERVAL, stop=None):
+    """
+    Keep a scanned product in sync with source_dir until interrupted.
+    
+    Every batch of changes is applied as an incremental rescan of just the
+    dirty directories, in its own transaction.
+    """
+    source_root = os.path.abspath(source_dir)
+    manifest = DirectoryManifest.load(manifest_file, source_root, rules.key)
+    if manifest is None:
+        raise Exception(f"No scan manifest for '{product_name}' at {manifest_file}; run a scan first")
+    
+    def apply_batch(dirty, manifest):
+        new_manifest = DirectoryManifest(source_root, rules_key=rules.key)
+        directories = None
+        view = None
+        if dirty is not None:
+            view = DirtyManifest(manifest, dirty)
+            directories = {directory_path(source_root, key) for key in dirty}
+        session = Session()
+        try:
+            product = session.query(Product).filter_by(name=product_name).one()
+            rescan_directory(session, product, source_root, None, {}, rules=rules, manifest=view,
+                             hash_algorithm=hash_algorithm, workers=workers, directories=directories,
+                             on_directory=lambda node: new_manifest.record(node, manifest))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        new_manifest.save(manifest_file)
+        return new_manifest
+    
+    logger.info(f"Watching {source_root} for changes to {product_name} (Ctrl+C to stop)")
+    watch_directory(source_root, manifest, apply_batch, rules, use_inotify=use_inotify, interval=interval,
+                    stop=stop)
 
-def scan_directory_to_db(source_dir, config=None, config_file=None, interactive=True):
+def scan_directory_to_db(source_dir, config=None, config_file=None, interactive=True, workers=None,
+                         bulk=False, batch_size=DEFAULT_BATCH_SIZE, rescan=False, hash_algorithm=None,
+                         prune=False, watch=False, use_inotify=True, poll_interval=DEFAULT_INTERVAL):
     """
     Scan a directory and populate the database with its contents.
     
@@ -197,6 +241,15 @@ def scan_directory_to_db(source_dir, config=None, config_file=None, interactive=
         config: Dictionary of configuration values
         config_file: Path to a config file
         interactive: Whether to prompt for missing values
+        workers: Number of threads per scan pipeline stage
+        bulk: Write directories, components and files with chunked bulk inserts
+        batch_size: Rows per transaction in bulk mode
+        rescan: Incrementally update the product if it already exists
+        hash_algorithm: Store a content hash of every file using this hashlib algorithm
+        prune: On rescan, skip listing directories whose mtime matches the last scan's manifest
+        watch: After the scan, keep the product in sync with source_dir until interrupted
+        use_inotify: In watch mode, use inotify when available instead of polling
+        poll_interval: In watch mode, seconds between polls
     """
     if not os.path.isdir(source_dir):
         logger.error(f"Source directory does not exist: {source_dir}")
@@ -207,9 +260,14 @@ def scan_directory_to_db(source_dir, config=None, config_file=None, interactive=
     if config_file and os.path.exists(config_file):
         config_values = load_config(config_file)
         
-    # Override with any explicitly provided config
+    # Override with any explicitly provided config (scan rules add to the file's)
     if config:
+        config = dict(config)
+        for key in ('include', 'exclude'):
+            if config.get(key) and config_values.get(key):
+                config[key] = split_patterns(config_values[key]) + split_patterns(config[key])
         config_values.update(config)
+    rules = build_scan_rules(config_values)
         
     # Ensure we have a database
     try:
@@ -246,106 +304,155 @@ def scan_directory_to_db(source_dir, config=None, config_file=None, interactive=
         
     # Create a session
     session = Session()
+    writer = None
+    product = None
+    existing = session.query(Product).filter_by(name=product_name).first() if rescan or watch else None
+    
+    # The manifest of the last scan lets an incremental rescan skip unchanged directories
+    source_root = os.path.abspath(source_dir)
+    manifest_file = manifest_path(DB_PATH, product_name)
+    previous_manifest = None
+    if existing and prune:
+        previous_manifest = DirectoryManifest.load(manifest_file, source_root, rules.key)
+    new_manifest = DirectoryManifest(source_root, rules_key=rules.key)
     
     try:
-        # Create the product
-        product = Product(
-            name=product_name,
-            version=product_version,
-            description=product_description,
-            manufacturer=product_manufacturer,
-            installation_location=target_dir,
-            estimated_size=estimate_directory_size(source_dir)
-        )
-        session.add(product)
-        session.flush()
-        logger.info(f"Created product: {product_name} {product_version}")
+        if existing:
+            rescan_directory(session, existing, source_dir, target_dir, config_values, rules=rules,
+                             manifest=previous_manifest, hash_algorithm=hash_algorithm, workers=workers,
+                             on_directory=lambda node: new_manifest.record(node, previous_manifest))
+            session.commit()
+            new_manifest.save(manifest_file)
+        else:
+            if rescan:
+                logger.info(f"Product {product_name} not found, performing a full scan")
+            
+            # Create the product; its size is known once the scan has streamed through
+            product = Product(
+                name=product_name,
+                version=product_version,
+                description=product_description,
+                manufacturer=product_manufacturer,
+                installation_location=target_dir,
+                estimated_size=0
+            )
+            session.add(product)
+            session.flush()
+            logger.info(f"Created product: {product_name} {product_version}")
         
-        # Create standard properties
-        properties = [
-            ("Manufacturer", product_manufacturer),
-            ("ProductName", product_name),
-            ("ProductVersion", product_version),
-            ("ProductLanguage", "1033"),
-            ("ARPCONTACT", config_values.get('contact', '')),
-            ("ARPURLINFOABOUT", config_values.get('url', '')),
-            ("ARPHELPLINK", config_values.get('help_url', '')),
-        ]
+            # Create standard properties
+            properties = [
+                ("Manufacturer", product_manufacturer),
+                ("ProductName", product_name),
+                ("ProductVersion", product_version),
+                ("ProductLanguage", "1033"),
+                ("ARPCONTACT", config_values.get('contact', '')),
+                ("ARPURLINFOABOUT", config_values.get('url', '')),
+                ("ARPHELPLINK", config_values.get('help_url', '')),
+            ]
         
-        for name, value in properties:
-            if value:
-                prop = Property(name=name, value=value, product=product)
-                session.add(prop)
+            for name, value in properties:
+                if value:
+                    prop = Property(name=name, value=value, product=product)
+                    session.add(prop)
         
-        # Create a main feature
-        main_feature = Feature(
-            name="MainFeature",
-            title=f"{product_name} Program Files",
-            description=f"The main files for {product_name}",
-            product=product
-        )
-        session.add(main_feature)
-        session.flush()
-        logger.info("Created main feature")
+            # Create a main feature
+            main_feature = Feature(
+                name="MainFeature",
+                title=f"{product_name} Program Files",
+                description=f"The main files for {product_name}",
+                product=product
+            )
+            session.add(main_feature)
+            session.flush()
+            logger.info("Created main feature")
         
-        # Create directory structure
-        directories = create_directory_structure(session, source_dir, target_dir)
+            if bulk:
+                # Release the write lock so the bulk writer's connection can insert
+                session.commit()
+                writer = BulkWriter(engine, batch_size=batch_size)
+            else:
+                # Everything goes into the session's transaction
+                writer = SessionWriter(session)
         
-        # Process files
-        file_count = process_files(session, source_dir, directories, main_feature)
+            def written(node):
+                # The rows are queued, so the directory's file records can go
+                new_manifest.record(node)
+                node.files = []
         
-        # Create shortcuts if specified
-        shortcuts_config = config_values.get('shortcuts', '')
-        if shortcuts_config:
-            # Parse shortcuts in format: name:target,name2:target2
-            shortcuts = [s.strip() for s in shortcuts_config.split(',')]
-            for shortcut_def in shortcuts:
-                if ':' in shortcut_def:
-                    name, target = shortcut_def.split(':', 1)
-                    shortcut = Shortcut(
-                        name=name.strip(),
-                        target=target.strip(),
-                        feature=main_feature
-                    )
-                    session.add(shortcut)
-                    logger.info(f"Created shortcut: {name}")
+            # Walk, stat, hash and version the tree in a streaming pipeline
+            directories = scan_pipeline(source_dir, workers=workers, rules=rules, hash_algorithm=hash_algorithm,
+                                        get_version=get_file_version)
+            file_count, total_size = populate_directories(writer, directories, target_dir, main_feature.id,
+                                                          product_id=product.id, on_directory=written)
+            product.estimated_size = total_size // 1024
+            logger.info(f"Scanned {file_count} files in {len(new_manifest.entries)} directories")
         
-        # Create registry entries if specified
-        registry_config = config_values.get('registry', '')
-        if registry_config:
-            # Parse registry in format: root:key:name=value,root:key:name=value
-            registry_entries = [r.strip() for r in registry_config.split(',')]
-            for reg_def in registry_entries:
-                parts = reg_def.split(':', 2)
-                if len(parts) >= 3:
-                    root, key, name_value = parts
-                    if '=' in name_value:
-                        name, value = name_value.split('=', 1)
-                    else:
-                        name, value = name_value, ""
-                        
-                    # Find a component to associate with
-                    component = session.query(Component).first()
-                    if component:
-                        reg = Registry(
-                            root=root.strip(),
-                            key=key.strip(),
+            # Create shortcuts if specified
+            shortcuts_config = config_values.get('shortcuts', '')
+            if shortcuts_config:
+                # Parse shortcuts in format: name:target,name2:target2
+                shortcuts = [s.strip() for s in shortcuts_config.split(',')]
+                for shortcut_def in shortcuts:
+                    if ':' in shortcut_def:
+                        name, target = shortcut_def.split(':', 1)
+                        shortcut = Shortcut(
                             name=name.strip(),
-                            value=value.strip(),
-                            component=component
+                            target=target.strip(),
+                            feature=main_feature
                         )
-                        session.add(reg)
-                        logger.info(f"Created registry entry: {root}\\{key}\\{name}")
+                        session.add(shortcut)
+                        logger.info(f"Created shortcut: {name}")
         
-        # Commit all changes
-        session.commit()
-        logger.info(f"Successfully populated database with {file_count} files")
-        return True
+            # Create registry entries if specified
+            registry_config = config_values.get('registry', '')
+            if registry_config:
+                # Parse registry in format: root:key:name=value,root:key:name=value
+                registry_entries = [r.strip() for r in registry_config.split(',')]
+                for reg_def in registry_entries:
+                    parts = reg_def.split(':', 2)
+                    if len(parts) >= 3:
+                        root, key, name_value = parts
+                        if '=' in name_value:
+                            name, value = name_value.split('=', 1)
+                        else:
+                            name, value = name_value, ""
+                        
+                        # Find a component to associate with
+                        component = session.query(Component).first()
+                        if component:
+                            reg = Registry(
+                                root=root.strip(),
+                                key=key.strip(),
+                                name=name.strip(),
+                                value=value.strip(),
+                                component=component
+                            )
+                            session.add(reg)
+                            logger.info(f"Created registry entry: {root}\\{key}\\{name}")
+        
+            # Commit all changes
+            session.commit()
+            new_manifest.save(manifest_file)
+            logger.info(f"Successfully populated database with {file_count} files")
         
     except Exception as e:
         session.rollback()
+        if bulk and product is not None and product.id is not None:
+            # Bulk mode commits in chunks, so undo what already reached the database
+            if writer is not None:
+                writer.discard()
+            session.delete(product)
+            session.commit()
         logger.error(f"Error populating database: {e}")
         return False
+    finally:
+        session.close()
+    
+    if watch:
+        watch_product(source_dir, product_name, rules, manifest_file, hash_algorithm=hash_algorithm,
+                      workers=workers, use_inotify=use_inotify, interval=poll_interval)
+    return True
         
 def main():
     parser = argparse.ArgumentParser(description='Scan a directory and populate the installer database')
@@ -357,6 +464,27 @@ def main():
     parser.add_argument('--manufacturer', help='Manufacturer name')
     parser.add_argument('--description', help='Product description')
     parser.add_argument('--target-dir', help='Target installation directory')
+    parser.add_argument('--workers', '-j', type=int,
+                        help='Threads per scan pipeline stage: listing directories ahead of the single-pass '
+                             'depth-first walk, stat, hashing and version extraction')
+    parser.add_argument('--bulk', action='store_true', help='Insert rows with chunked bulk inserts instead of the ORM')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows per transaction in bulk mode')
+    parser.add_argument('--rescan', action='store_true', help='Only apply changes if the product was scanned before')
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                        help='Only scan files matching this pattern (repeatable)')
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                        help='Skip files and directories matching this pattern (repeatable)')
+    parser.add_argument('--no-default-excludes', action='store_true',
+                        help='Also scan build intermediates (*.pdb, *.obj, ...) and VCS directories')
+    parser.add_argument('--prune', action='store_true',
+                        help='With --rescan, do not list directories whose mtime is unchanged since the last scan')
+    parser.add_argument('--watch', action='store_true',
+                        help='After the scan, keep the database in sync with the directory until interrupted')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_INTERVAL,
+                        help='Seconds between polls in --watch mode without inotify')
+    parser.add_argument('--no-inotify', action='store_true', help='Poll directory mtimes in --watch mode')
+    parser.add_argument('--hash', nargs='?', const=DEFAULT_ALGORITHM, metavar='ALGORITHM',
+                        help=f'Store a content hash of every file (default algorithm: {DEFAULT_ALGORITHM})')
     
     args = parser.parse_args()
     
@@ -372,12 +500,27 @@ def main():
         config['description'] = args.description
     if args.target_dir:
         config['target_dir'] = args.target_dir
+    if args.include:
+        config['include'] = args.include
+    if args.exclude:
+        config['exclude'] = args.exclude
+    if args.no_default_excludes:
+        config['default_excludes'] = 'no'
     
     success = scan_directory_to_db(
         args.source_dir,
         config=config,
         config_file=args.config,
-        interactive=not args.non_interactive
+        interactive=not args.non_interactive,
+        workers=args.workers,
+        bulk=args.bulk,
+        batch_size=args.batch_size,
+        rescan=args.rescan,
+        hash_algorithm=args.hash,
+        prune=args.prune,
+        watch=args.watch,
+        use_inotify=not args.no_inotify,
+        poll_interval=args.poll_interval
     )
     
     return 0 if success else 1
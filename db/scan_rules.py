@@ -0,0 +1,111 @@
+"""
+Include/exclude rules for the directory scanner.
+
+Patterns are globs.  A pattern without a '/' is matched against the entry
+name (so '*.pdb' or '.git' match at any depth); a pattern with a '/' is
+matched against the path relative to the scan root ('bin/*.lib',
+'**/obj/**').  '*' and '?' do not cross '/', '**' does.  Matching is case
+insensitive, like the Windows file systems the installers target.
+
+All patterns of a rule set are compiled into one regular expression, so
+checking an entry costs a single match no matter how many rules there are.
+Excluded directories are pruned from the walk, their contents are never
+listed.  When include patterns are given, only files matching one of them
+are kept (directories are still walked, unless excluded).
+"""
+
+import re
+
+# Build intermediates and VCS metadata that never belong in an installer
+DEFAULT_EXCLUDES = [
+    '.git', '.svn', '.hg', 'CVS',
+    '*.pdb', '*.obj', '*.ilk', '*.ipdb', '*.iobj', '*.exp', '*.idb', '*.tlog',
+]
+
+
+def _translate(pattern):
+    """Translate a glob into a regex matching a whole relative path or name."""
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i):
+                i += 2
+                if pattern.startswith('/', i):
+                    i += 1
+                    out.append('(?:.*/)?')
+                else:
+                    out.append('.*')
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f'[{body}]')
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+
+def _compile(patterns):
+    """Compile patterns into (name regex, path regex); either may be None."""
+    names = [_translate(p) for p in patterns if '/' not in p]
+    paths = [_translate(p.lstrip('/')) for p in patterns if '/' in p]
+    name_re = re.compile('(?:' + '|'.join(names) + r')\Z', re.IGNORECASE) if names else None
+    path_re = re.compile('(?:' + '|'.join(paths) + r')\Z', re.IGNORECASE) if paths else None
+    return name_re, path_re
+
+
+def split_patterns(value):
+    """Split a config value (comma and/or newline separated) into patterns."""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [p for v in value for p in split_patterns(v)]
+    return [p.strip() for p in re.split(r'[,\n]', value) if p.strip()]
+
+
+class ScanRules(object):
+    """Compiled include/exclude rules."""
+
+    def __init__(self, include=None, exclude=None, default_excludes=True):
+        self.include = split_patterns(include)
+        self.exclude = (list(DEFAULT_EXCLUDES) if default_excludes else []) + split_patterns(exclude)
+        self._exclude_name, self._exclude_path = _compile(self.exclude)
+        self._include_name, self._include_path = _compile(self.include)
+
+    @property
+    def key(self):
+        """A string identifying the rules, stored with scan manifests."""
+        return '\n'.join(['+' + p for p in self.include] + ['-' + p for p in self.exclude])
+
+    def _excluded(self, rel_path, name):
+        return bool((self._exclude_name and self._exclude_name.match(name)) or
+                    (self._exclude_path and self._exclude_path.match(rel_path)))
+
+    def excludes_directory(self, rel_path, name):
+        """True if the directory (and everything below it) is skipped."""
+        rel_path = rel_path.replace('\\', '/')
+        # The trailing '/' lets 'build/**' style patterns prune 'build' itself
+        return self._excluded(rel_path, name) or bool(self._exclude_path and
+                                                      self._exclude_path.match(rel_path + '/'))
+
+    def includes_file(self, rel_path, name):
+        """True if the file is part of the scan."""
+        rel_path = rel_path.replace('\\', '/')
+        if self._excluded(rel_path, name):
+            return False
+        if not self.include:
+            return True
+        return bool((self._include_name and self._include_name.match(name)) or
+                    (self._include_path and self._include_path.match(rel_path)))
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker
 from .models import Base
 
@@ -7,8 +7,34 @@ DB_PATH = 'installer.db'
 engine = create_engine(f'sqlite:///{DB_PATH}')
 Session = sessionmaker(bind=engine)
 
+def upgrade_schema(bind):
+    """Add columns introduced after a database was created.
+
+    create_all() only creates missing tables, so databases created by older
+    versions are brought up to date here with ALTER TABLE ADD COLUMN (new
+    columns are always nullable).
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def ensure_schema(bind):
+    """Create the missing tables and columns of a database (idempotent)."""
+    Base.metadata.create_all(bind)
+    upgrade_schema(bind)
+
 def init_db():
-    Base.metadata.create_all(engine)
+    ensure_schema(engine)
 
 # Usage:
 # from db.session import init_db, Session
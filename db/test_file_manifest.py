@@ -0,0 +1,76 @@
+import unittest
+import os
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db.models import Base, Product, Feature
+from db.bulk import BulkWriter
+from db.file_manifest import FileManifest, FileRecord, load_file_manifest
+
+SHA = 'sha256:' + 'ab' * 32
+
+class TestFileManifest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        feature = Feature(name='MainFeature', product=Product(name='ManifestTest'))
+        session.add(feature)
+        session.commit()
+        self.feature_id = feature.id
+        session.close()
+        writer = BulkWriter(self.engine)
+        directory_id = writer.add_directory('root', '/src', 'TARGET', 'root')
+        component_id = writer.add_component('comp_root', self.feature_id, directory_id)
+        for sequence, (path, size, version, digest) in enumerate([
+            ('b.dll', 300, '1.2.3.4', SHA),
+            ('a.txt', 10, None, None),
+            (os.path.join('sub', 'c.exe'), 2000, None, 'md5:' + '0f' * 16),
+        ], 1):
+            writer.add_file(path, os.path.basename(path), version, size, 0, sequence, component_id,
+                            self.feature_id, hash=digest)
+        writer.flush()
+
+    def test_load_and_lookup(self):
+        with self.engine.connect() as conn:
+            files = load_file_manifest(conn, self.feature_id)
+        self.assertEqual(len(files), 3)
+        self.assertEqual([f.sequence for f in files], [1, 2, 3])
+        first = files[0]
+        self.assertIsInstance(first, FileRecord)
+        self.assertEqual((first.path, first.size, first.version, first.hash), ('b.dll', 300, '1.2.3.4', SHA))
+        self.assertEqual(files.get(os.path.join('sub', 'c.exe')).hash, 'md5:' + '0f' * 16)
+        self.assertIsNone(files.get('a.txt').hash)
+        self.assertIsNone(files.get('missing.txt'))
+        self.assertIn('a.txt', files)
+        self.assertEqual(files[-1].path, os.path.join('sub', 'c.exe'))
+        self.assertEqual(files.total_size, 2310)
+        with self.assertRaises(AttributeError):
+            first.size = 1
+        with self.assertRaises(AttributeError):
+            files.extra = 1
+
+    def test_views(self):
+        with self.engine.connect() as conn:
+            files = load_file_manifest(conn, self.feature_id, keep=lambda f: f.size > 100)
+        self.assertEqual([f.path for f in files], ['b.dll', os.path.join('sub', 'c.exe')])
+        with self.engine.connect() as conn:
+            files = load_file_manifest(conn, self.feature_id)
+        by_size = files.sorted('size', reverse=True)
+        self.assertEqual([f.size for f in by_size], [2000, 300, 10])
+        self.assertEqual([f.path for f in files.sorted()], sorted(f.path for f in files))
+        self.assertEqual([f.sequence for f in files.sorted(key=lambda f: -f.sequence)], [3, 2, 1])
+        small = by_size.filter(lambda f: f.size < 1000)
+        self.assertEqual([f.size for f in small], [300, 10])
+        self.assertEqual(small.get('a.txt').size, 10)
+        self.assertIsNone(small.get(os.path.join('sub', 'c.exe')))
+        self.assertEqual([f.size for f in by_size[1:]], [300, 10])
+
+    def test_compact(self):
+        records = [FileRecord(i, f"bin/lib{i:06}.dll", 4096, None, 0, i, 1, SHA) for i in range(1, 10001)]
+        files = FileManifest.from_records(records)
+        self.assertEqual(files.get('bin/lib000500.dll').id, 500)
+        # 17 bytes of path + 32 of digest + a few fixed-width columns
+        self.assertLess(files.nbytes / len(files), 120)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import os
+import hashlib
+import shutil
+import tempfile
+from types import SimpleNamespace
+from db.hashing import hash_file, hash_files, DuplicateIndex
+
+class TestHashing(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='hash_test_')
+        self.data = os.urandom(300000)
+        self.path = os.path.join(self.tmp, 'payload.bin')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_chunked_and_mmap_agree(self):
+        expected = 'sha256:' + hashlib.sha256(self.data).hexdigest()
+        self.assertEqual(hash_file(self.path, chunk_size=4096, mmap_threshold=None), expected)
+        self.assertEqual(hash_file(self.path, chunk_size=4096, mmap_threshold=1), expected)
+        self.assertTrue(hash_file(self.path, 'md5').startswith('md5:'))
+
+    def test_hash_files_pool(self):
+        missing = os.path.join(self.tmp, 'missing.bin')
+        hashes = hash_files([self.path, missing], 'sha1', workers=2)
+        self.assertEqual(hashes[self.path], 'sha1:' + hashlib.sha1(self.data).hexdigest())
+        self.assertIsNone(hashes[missing])
+
+    def test_duplicate_index(self):
+        files = [
+            SimpleNamespace(path='b/runtime.dll', hash='sha256:aa', size=10, sequence=3),
+            SimpleNamespace(path='a/runtime.dll', hash='sha256:aa', size=10, sequence=1),
+            SimpleNamespace(path='c/runtime.dll', hash='sha256:aa', size=10, sequence=2),
+            SimpleNamespace(path='app.exe', hash='sha256:bb', size=5, sequence=4),
+            SimpleNamespace(path='unhashed.txt', hash=None, size=5, sequence=5),
+        ]
+        index = DuplicateIndex(files)
+        self.assertEqual(index.duplicate_count, 2)
+        self.assertEqual(index.saved_bytes, 20)
+        self.assertFalse(index.is_duplicate(files[1]))
+        self.assertTrue(index.is_duplicate(files[0]))
+        self.assertIs(index.canonical(files[0]), files[1])
+        self.assertIs(index.canonical(files[3]), files[3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+from db.peversion import read_pe_version, get_pe_version, cache_info, PEFormatError
+
+def build_pe(path, version=(1, 2, 3, 4), padding=0, pe32=False, resource=True):
+    """Write a minimal PE image whose .rsrc section (at the end, after `padding` sparse bytes) holds a version."""
+    optional_size = 224 if pe32 else 240
+    count_offset = 92 if pe32 else 108
+    section_rva = 0x1000
+    raw_offset = (0x40 + 24 + optional_size + 40 + 0x1FF) // 0x200 * 0x200 + padding
+
+    fixed = struct.pack('<13I', 0xFEEF04BD, 0x10000,
+                        (version[0] << 16) | version[1], (version[2] << 16) | version[3],
+                        (version[0] << 16) | version[1], (version[2] << 16) | version[3],
+                        0x3F, 0, 0x40004, 1, 0, 0, 0)
+    key = 'VS_VERSION_INFO\0'.encode('utf-16-le')
+    info = struct.pack('<HHH', 6 + len(key) + 2 + len(fixed), len(fixed), 0) + key + b'\0\0' + fixed
+
+    def directory(entry_id, offset):
+        return struct.pack('<IIHHHH', 0, 0, 0, 0, 0, 1) + struct.pack('<II', entry_id, offset)
+    rsrc = (directory(16, 0x80000000 | 0x18) + directory(1, 0x80000000 | 0x30) + directory(1033, 0x48)
+            + struct.pack('<IIII', section_rva + 0x58, len(info), 0, 0) + info)
+
+    optional = bytearray(optional_size)
+    struct.pack_into('<H', optional, 0, 0x10B if pe32 else 0x20B)
+    struct.pack_into('<I', optional, count_offset, 16)
+    if resource:
+        struct.pack_into('<II', optional, count_offset + 4 + 16, section_rva, len(rsrc))
+    header = bytearray(0x40)
+    header[0:2] = b'MZ'
+    struct.pack_into('<I', header, 0x3C, 0x40)
+    header += b'PE\0\0' + struct.pack('<HHIIIHH', 0x14C if pe32 else 0x8664, 1, 0, 0, 0, optional_size, 0x22)
+    header += optional
+    header += b'.rsrc\0\0\0' + struct.pack('<IIIIIIHHI', len(rsrc), section_rva, len(rsrc), raw_offset,
+                                           0, 0, 0, 0, 0x40000040)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.seek(raw_offset)
+        f.write(rsrc)
+
+class TestPEVersion(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='pe_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_reads_fixed_file_info(self):
+        path = os.path.join(self.tmp, 'app.exe')
+        build_pe(path, (10, 0, 19041, 1))
+        self.assertEqual(read_pe_version(path), '10.0.19041.1')
+        build_pe(path, (2, 5, 0, 7), pe32=True)
+        self.assertEqual(read_pe_version(path), '2.5.0.7')
+        build_pe(path, resource=False)
+        self.assertIsNone(read_pe_version(path))
+
+    def test_rejects_non_pe_files(self):
+        path = os.path.join(self.tmp, 'fake.dll')
+        with open(path, 'wb') as f:
+            f.write(b'MZ' + b'\0' * 200)
+        with self.assertRaises(PEFormatError):
+            read_pe_version(path)
+        self.assertIsNone(get_pe_version(path))
+        self.assertIsNone(get_pe_version(os.path.join(self.tmp, 'missing.dll')))
+
+    def test_large_file_reads_headers_only(self):
+        path = os.path.join(self.tmp, 'big.dll')
+        build_pe(path, (1, 2, 3, 4), padding=256 * 1024 * 1024)
+        stats = {}
+        self.assertEqual(read_pe_version(path, stats), '1.2.3.4')
+        self.assertLess(stats['bytes_read'], 1024)
+
+    def test_cache_keyed_on_size_and_mtime(self):
+        path = os.path.join(self.tmp, 'lib.dll')
+        build_pe(path, (1, 0, 0, 0))
+        st = os.stat(path)
+        self.assertEqual(get_pe_version(path), '1.0.0.0')
+        hits = cache_info().hits
+        self.assertEqual(get_pe_version(path, st.st_size, st.st_mtime_ns), '1.0.0.0')
+        self.assertEqual(cache_info().hits, hits + 1)
+        build_pe(path, (1, 1, 0, 0))
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        self.assertEqual(get_pe_version(path), '1.1.0.0')
+        readme = os.path.join(self.tmp, 'readme-1.2.txt')
+        open(readme, 'w').close()
+        self.assertIsNone(get_pe_version(readme))
+
+if __name__ == '__main__':
+    unittest.main()
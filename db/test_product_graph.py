@@ -0,0 +1,48 @@
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db.models import Base, Product, Feature, Component, Directory, Registry
+from db.product_graph import load_product_graph
+
+class TestProductGraph(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        session = sessionmaker(bind=self.engine)()
+        product = Product(name='GraphTest')
+        other = Product(name='Other')
+        main = Feature(name='MainFeature', product=product)
+        optional = Feature(name='Optional', product=product, parent=main)
+        # An older scan: only the plugins directory records its product
+        root = Directory(name='root', default_dir='root')
+        bin_dir = Directory(name='bin', default_dir='bin', parent=root)
+        plugins = Directory(name='plugins', default_dir='plugins', parent=bin_dir)
+        session.add_all([main, optional, root, bin_dir, plugins, Feature(name='OtherFeature', product=other)])
+        session.flush()
+        plugins.product_id = product.id
+        components = [Component(name='comp_root', feature=main, directory=root, key_path='a.txt'),
+                      Component(name='comp_plugins', feature=optional, directory=plugins)]
+        stray = Component(name='comp_stray', directory=bin_dir)
+        session.add_all(components + [stray, Registry(root='HKLM', key='Software\\GraphTest', name='Version',
+                                                      value='1', component=components[0])])
+        session.commit()
+        self.product_id = product.id
+        self.stray_id = stray.id
+        self.ids = {'root': root.id, 'bin': bin_dir.id, 'plugins': plugins.id}
+        session.close()
+
+    def test_load(self):
+        with self.engine.connect() as conn:
+            graph = load_product_graph(conn, self.product_id, component_ids={self.stray_id, None})
+        self.assertEqual(sorted(f.name for f in graph.features.values()), ['MainFeature', 'Optional'])
+        self.assertEqual(sorted(c.name for c in graph.components.values()),
+                         ['comp_plugins', 'comp_root', 'comp_stray'])
+        # Parents outside the product are fetched too
+        self.assertEqual(set(graph.directories), set(self.ids.values()))
+        self.assertEqual(graph.directory_path(self.ids['plugins']), ('bin', 'plugins'))
+        self.assertEqual(graph.directory_path(self.ids['root']), ())
+        self.assertEqual([d.id for d in graph.root_directories()], [self.ids['root']])
+        self.assertEqual([(r.root, r.name) for r in graph.registry], [('HKLM', 'Version')])
+
+if __name__ == '__main__':
+    unittest.main()
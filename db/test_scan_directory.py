@@ -0,0 +1,257 @@
+import unittest
+import os
+import shutil
+import tempfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db.models import Base, Product, Feature, Component, File, Directory
+from db.fswalk import scan_tree, walk_directories
+from db.bulk import BulkWriter, SessionWriter
+from db.pipeline import scan_pipeline
+from db.manifest import DirectoryManifest
+from db.scan_rules import ScanRules
+from db.scan_directory import estimate_directory_size, populate_directories, rescan_directory, get_file_version
+
+class TestScanDirectory(unittest.TestCase):
+    def setUp(self):
+        self.tree = tempfile.mkdtemp(prefix='scan_test_')
+        for rel_path, data in [
+            ('a.txt', b'a' * 10),
+            ('bin/app.exe', b'x' * 100),
+            ('bin/lib/core.dll', b'y' * 1000),
+            ('docs/readme.txt', b'z' * 5),
+        ]:
+            path = os.path.join(self.tree, *rel_path.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+        os.makedirs(os.path.join(self.tree, 'empty'))
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tree)
+
+    def populate(self, directories, feature, product_id=None):
+        """Rows of scanned directories through the ORM path of the scanner."""
+        writer = SessionWriter(self.session)
+        file_count, _ = populate_directories(writer, directories, 'TARGET', feature.id, product_id=product_id)
+        self.session.commit()
+        return file_count
+
+    def rows(self):
+        directories = {d.id: d.source_path for d in self.session.query(Directory)}
+        return (sorted((d.name, d.target_path, directories.get(d.parent_id)) for d in self.session.query(Directory)),
+                sorted((c.name, c.key_path, directories[c.directory_id]) for c in self.session.query(Component)),
+                sorted((f.path, f.sequence, f.size, f.component.name) for f in self.session.query(File)))
+
+    def test_scan_tree_single_pass(self):
+        scan = scan_tree(self.tree, workers=4)
+        self.assertEqual(scan.file_count, 4)
+        self.assertEqual(scan.directory_count, 5)
+        self.assertEqual(scan.total_size, 1115)
+        self.assertEqual(estimate_directory_size(self.tree, scan), 1)
+        rel_paths = [f.rel_path for f in scan.iter_files()]
+        self.assertEqual(rel_paths, ['a.txt', os.path.join('bin', 'app.exe'),
+                                     os.path.join('bin', 'lib', 'core.dll'),
+                                     os.path.join('docs', 'readme.txt')])
+
+    def test_populate_from_scan(self):
+        scan = scan_tree(self.tree)
+        feature = Feature(name='MainFeature', product=Product(name='ScanTest'))
+        self.session.add(feature)
+        self.session.flush()
+        self.assertEqual(self.populate(scan.iter_directories(), feature), 4)
+        self.assertEqual(self.session.query(Directory).count(), 5)
+        self.assertEqual(self.session.query(Component).count(), 4)
+        core = self.session.query(File).filter_by(install_path='core.dll').one()
+        self.assertEqual(core.size, 1000)
+        self.assertEqual(core.component.directory.name, 'lib')
+        self.assertEqual(core.component.directory.parent.name, 'bin')
+        self.assertEqual(core.component.key_path, os.path.join('bin', 'lib', 'core.dll'))
+        self.assertEqual(sorted(f.sequence for f in self.session.query(File)), [1, 2, 3, 4])
+
+    def test_bulk_matches_session_writer(self):
+        feature = Feature(name='MainFeature', product=Product(name='BulkTest'))
+        self.session.add(feature)
+        self.session.commit()
+        self.populate(scan_pipeline(self.tree), feature)
+        orm_rows = self.rows()
+        self.session.query(File).delete()
+        self.session.query(Component).delete()
+        self.session.query(Directory).delete()
+        self.session.commit()
+
+        writer = BulkWriter(self.engine, batch_size=3)
+        file_count, _ = populate_directories(writer, scan_pipeline(self.tree), 'TARGET', feature.id)
+        self.assertEqual(file_count, 4)
+        self.assertEqual(writer.rows_written, 5 + 4 + 4)
+        self.assertEqual(self.rows(), orm_rows)
+        core = self.session.query(File).filter_by(install_path='core.dll').one()
+        self.assertEqual(core.feature_id, feature.id)
+        self.assertTrue(core.component.component_id)
+        writer.discard()
+        self.assertEqual(self.session.query(File).count(), 0)
+        self.assertEqual(self.session.query(Directory).count(), 0)
+
+    def test_pipeline_populates_in_one_transaction(self):
+        feature = Feature(name='MainFeature', product=Product(name='PipelineTest'))
+        self.session.add(feature)
+        self.session.flush()
+        seen = []
+        directories = scan_pipeline(self.tree, workers=2, hash_algorithm='sha256', get_version=get_file_version,
+                                    queue_size=1)
+        writer = BulkWriter(self.engine, batch_size=2, connection=self.session.connection())
+        file_count, total_size = populate_directories(writer, directories, 'TARGET', feature.id,
+                                                      on_directory=lambda node: seen.append(node.rel_path))
+        self.assertEqual((file_count, total_size), (4, 1115))
+        self.assertEqual(seen, ['.', 'bin', os.path.join('bin', 'lib'), 'docs', 'empty'])
+        core = self.session.query(File).filter_by(install_path='core.dll').one()
+        self.assertTrue(core.hash.startswith('sha256:'))
+        self.assertEqual(core.component.directory.parent.name, 'bin')
+        # Nothing was committed on its own: rolling back the session undoes it all
+        self.session.rollback()
+        self.assertEqual(self.session.query(File).count(), 0)
+        self.assertEqual(self.session.query(Directory).count(), 0)
+
+    def test_walk_holds_no_tree(self):
+        orders = []
+        for workers, max_pending in ((1, 1), (4, 2), (8, 64)):
+            nodes = [node for node, _ in walk_directories(self.tree, workers, max_pending=max_pending)]
+            orders.append([node.rel_path for node in nodes])
+            # Streamed directories refer to their parent by path and let go of their children
+            self.assertTrue(all(node.subdirs == [] for node in nodes))
+            self.assertEqual([node.subdir_count for node in nodes], [3, 1, 0, 0, 0])
+            self.assertEqual(nodes[2].parent_path, nodes[1].path)
+        self.assertEqual(orders[0], [node.rel_path for node in scan_tree(self.tree).iter_directories()])
+        self.assertEqual(orders[1:], [orders[0]] * 2)
+
+    def test_pipeline_reports_stage_errors(self):
+        with self.assertRaises(ValueError):
+            list(scan_pipeline(self.tree, hash_algorithm='no-such-hash'))
+
+        def broken(path, size, mtime_ns):
+            raise RuntimeError(path)
+        with self.assertRaises(RuntimeError):
+            list(scan_pipeline(self.tree, get_version=broken))
+
+    def test_incremental_rescan(self):
+        product = Product(name='RescanTest')
+        feature = Feature(name='MainFeature', product=product)
+        self.session.add(feature)
+        self.session.flush()
+        scan = scan_tree(self.tree)
+        self.populate(scan.iter_directories(), feature, product_id=product.id)
+        before = {f.path: (f.id, f.sequence) for f in self.session.query(File)}
+        guids = {c.directory.name: c.component_id for c in self.session.query(Component)}
+
+        # Nothing changed: nothing written
+        stats = rescan_directory(self.session, product, self.tree, 'TARGET', {}, hash_algorithm='sha256')
+        self.assertFalse(stats.changed)
+        self.assertEqual(stats.files_unchanged, 4)
+
+        with open(os.path.join(self.tree, 'bin', 'app.exe'), 'ab') as f:
+            f.write(b'more')
+        os.remove(os.path.join(self.tree, 'a.txt'))
+        shutil.rmtree(os.path.join(self.tree, 'docs'))
+        os.makedirs(os.path.join(self.tree, 'new'))
+        with open(os.path.join(self.tree, 'new', 'added.txt'), 'wb') as f:
+            f.write(b'new')
+
+        stats = rescan_directory(self.session, product, self.tree, 'TARGET', {}, hash_algorithm='sha256')
+        self.session.commit()
+        self.assertEqual((stats.files_added, stats.files_updated, stats.files_removed), (1, 1, 2))
+        self.assertEqual((stats.directories_added, stats.directories_removed), (1, 1))
+        self.assertEqual((stats.components_added, stats.components_removed), (1, 2))
+
+        after = {f.path: (f.id, f.sequence, f.size) for f in self.session.query(File)}
+        app = os.path.join('bin', 'app.exe')
+        core = os.path.join('bin', 'lib', 'core.dll')
+        self.assertEqual(after[app][:2], before[app])
+        self.assertEqual(after[app][2], 104)
+        self.assertEqual(after[core][:2], before[core])
+        self.assertEqual(after[os.path.join('new', 'added.txt')][1], 5)
+        self.assertNotIn('a.txt', after)
+        components = {c.directory.name: c.component_id for c in self.session.query(Component)}
+        self.assertEqual(components['bin'], guids['bin'])
+        self.assertEqual(components['lib'], guids['lib'])
+        self.assertEqual(sorted(components), ['bin', 'lib', 'new'])
+        self.assertEqual(self.session.query(Directory).filter_by(name='docs').count(), 0)
+
+    def test_manifest_prunes_unchanged_directories(self):
+        product = Product(name='PruneTest')
+        feature = Feature(name='MainFeature', product=product)
+        self.session.add(feature)
+        self.session.flush()
+        scan = scan_tree(self.tree)
+        self.populate(scan.iter_directories(), feature, product_id=product.id)
+
+        manifest_file = os.path.join(self.tree, '..', os.path.basename(self.tree) + '.dirs')
+        DirectoryManifest.from_scan(scan).save(manifest_file)
+        manifest = DirectoryManifest.load(manifest_file, scan.root.path)
+        os.remove(manifest_file)
+        self.assertEqual(manifest.entries[''][1], 4)
+        self.assertEqual(manifest.subdirectories('.'), ['bin', 'docs', 'empty'])
+        self.assertIsNone(DirectoryManifest.load(manifest_file, scan.root.path))
+
+        # Only bin/lib gains a file, every other directory is left unlisted
+        with open(os.path.join(self.tree, 'bin', 'lib', 'extra.dll'), 'wb') as f:
+            f.write(b'extra')
+        rescan = scan_tree(self.tree, manifest=manifest)
+        self.assertEqual(rescan.pruned_count, 4)
+        self.assertEqual([f.name for f in rescan.iter_files()], ['core.dll', 'extra.dll'])
+
+        updated = DirectoryManifest(scan.root.path)
+        stats = rescan_directory(self.session, product, self.tree, 'TARGET', {}, manifest=manifest,
+                                 on_directory=lambda node: updated.record(node, manifest))
+        self.session.commit()
+        self.assertEqual((stats.files_added, stats.files_updated, stats.files_removed), (1, 0, 0))
+        self.assertEqual(stats.files_unchanged, 4)
+        self.assertEqual(stats.components_removed, 0)
+        self.assertEqual(self.session.query(File).count(), 5)
+        self.assertEqual(product.estimated_size, 1120 // 1024)
+        self.assertEqual(updated.entries['bin/lib'][1], 2)
+        self.assertEqual(updated.entries['bin'], manifest.entries['bin'])
+
+    def test_manifest_with_long_rules(self):
+        # The rules key is not bounded by the 16-bit path lengths of the records
+        scan = scan_tree(self.tree)
+        rules_key = ScanRules(exclude=[f'generated/{i:06d}/**' for i in range(5000)]).key
+        self.assertGreater(len(rules_key.encode('utf-8')), 0xffff)
+        manifest_file = os.path.join(self.tree, '..', os.path.basename(self.tree) + '.dirs')
+        manifest = DirectoryManifest.from_scan(scan, rules_key=rules_key)
+        manifest.save(manifest_file)
+        try:
+            loaded = DirectoryManifest.load(manifest_file, scan.root.path, rules_key)
+            self.assertEqual(loaded.entries, manifest.entries)
+            self.assertIsNone(DirectoryManifest.load(manifest_file, scan.root.path))
+        finally:
+            os.remove(manifest_file)
+
+    def test_scan_rules(self):
+        rules = ScanRules(exclude=['bin/lib/**', 'docs/*.txt'])
+        self.assertTrue(rules.includes_file('bin/app.exe', 'app.exe'))
+        self.assertFalse(rules.includes_file('bin/app.PDB', 'app.PDB'))
+        self.assertFalse(rules.includes_file('docs/readme.txt', 'readme.txt'))
+        self.assertTrue(rules.includes_file('docs/sub/readme.txt', 'readme.txt'))
+        self.assertTrue(rules.excludes_directory('src/.git', '.git'))
+        self.assertTrue(rules.excludes_directory('bin/lib', 'lib'))
+        self.assertFalse(rules.excludes_directory('bin', 'bin'))
+        only_dlls = ScanRules(include='*.dll, **/*.exe', default_excludes=False)
+        self.assertTrue(only_dlls.includes_file('a/b/c.DLL', 'c.DLL'))
+        self.assertTrue(only_dlls.includes_file('app.exe', 'app.exe'))
+        self.assertFalse(only_dlls.includes_file('a.txt', 'a.txt'))
+        self.assertFalse(only_dlls.includes_file('x.pdb', 'x.pdb'))
+
+    def test_scan_prunes_excluded_directories(self):
+        os.makedirs(os.path.join(self.tree, '.git', 'objects'))
+        with open(os.path.join(self.tree, 'bin', 'app.pdb'), 'wb') as f:
+            f.write(b'symbols')
+        scan = scan_tree(self.tree, rules=ScanRules(exclude=['docs']))
+        self.assertEqual([f.name for f in scan.iter_files()], ['a.txt', 'app.exe', 'core.dll'])
+        self.assertEqual(sorted(d.name for d in scan.root.subdirs), ['bin', 'empty'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+from types import SimpleNamespace
+from sqlalchemy import create_engine
+from db.session import Session, engine
+from actions.query_db import QueryDBAction
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestSchemaUpgrade(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='session_test_')
+        # The committed database predates the scanner's and the build's columns and tables
+        self.db_path = os.path.join(self.tmpdir, 'installer.db')
+        shutil.copy(os.path.join(REPO, 'installer.db'), self.db_path)
+        self.engine = create_engine(f'sqlite:///{self.db_path}')
+        Session.configure(bind=self.engine)
+
+    def tearDown(self):
+        Session.configure(bind=engine)
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def columns(self, table):
+        with sqlite3.connect(self.db_path) as conn:
+            return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+    def test_query_db_on_old_database(self):
+        self.assertNotIn('hash', self.columns('files'))
+        state = SimpleNamespace(library=SimpleNamespace(project_name='ExampleApp',
+                                                        root_path=os.path.join(REPO, 'example_project')))
+        QueryDBAction().do(state)
+        self.assertIn('hash', self.columns('files'))
+        self.assertEqual(state.library.product_info['name'], 'ExampleApp')
+        self.assertTrue(len(state.library.files))
+
+if __name__ == '__main__':
+    unittest.main()
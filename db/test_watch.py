@@ -0,0 +1,122 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db.models import Base, Product, Feature, File, Directory
+from db.bulk import BulkWriter
+from db.pipeline import scan_pipeline
+from db.manifest import DirectoryManifest, directory_path
+from db.watch import DirtyManifest, PollingWatcher, InotifyWatcher, watch
+from db.scan_directory import populate_directories, rescan_directory
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.tree = os.path.realpath(tempfile.mkdtemp(prefix='watch_test_'))
+        for rel_path, data in [
+            ('a.txt', b'a' * 10),
+            ('bin/app.exe', b'x' * 100),
+            ('bin/lib/core.dll', b'y' * 1000),
+            ('docs/readme.txt', b'z' * 5),
+        ]:
+            self.write(rel_path, data)
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.product = Product(name='WatchTest')
+        feature = Feature(name='MainFeature', product=self.product)
+        self.session.add(feature)
+        self.session.flush()
+        self.manifest = DirectoryManifest(self.tree)
+        writer = BulkWriter(self.engine, connection=self.session.connection())
+        populate_directories(writer, scan_pipeline(self.tree), 'TARGET', feature.id, product_id=self.product.id,
+                             on_directory=self.manifest.record)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tree)
+
+    def write(self, rel_path, data):
+        path = os.path.join(self.tree, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def apply(self, dirty):
+        updated = DirectoryManifest(self.tree)
+        stats = rescan_directory(self.session, self.product, self.tree, 'TARGET', {},
+                                 manifest=DirtyManifest(self.manifest, dirty),
+                                 directories={directory_path(self.tree, key) for key in dirty},
+                                 on_directory=lambda node: updated.record(node, self.manifest))
+        self.session.commit()
+        self.manifest = updated
+        return stats
+
+    def test_dirty_directories_only(self):
+        # Rewritten in place: the directory mtime does not move, but the watcher reported it
+        self.write('bin/lib/core.dll', b'w' * 2000)
+        stats = self.apply({'bin/lib'})
+        self.assertEqual((stats.files_added, stats.files_updated, stats.files_removed), (0, 1, 0))
+        self.assertEqual(self.session.query(File).filter_by(install_path='core.dll').one().size, 2000)
+        self.assertEqual(self.session.query(File).count(), 4)
+
+        shutil.rmtree(os.path.join(self.tree, 'docs'))
+        self.write('new/added.txt', b'new')
+        stats = self.apply({''})
+        self.assertEqual((stats.files_added, stats.files_removed), (1, 1))
+        self.assertEqual((stats.directories_added, stats.directories_removed), (1, 1))
+        self.assertEqual(sorted(f.install_path for f in self.session.query(File)),
+                         ['a.txt', 'added.txt', 'app.exe', 'core.dll'])
+        self.assertEqual(self.session.query(Directory).filter_by(name='docs').count(), 0)
+        self.assertIn('new', self.manifest.entries)
+
+    def test_polling_watcher(self):
+        watcher = PollingWatcher(self.tree, self.manifest)
+        self.assertEqual(watcher.poll(0), set())
+        self.write('bin/extra.dll', b'e')
+        shutil.rmtree(os.path.join(self.tree, 'docs'))
+        self.assertEqual(watcher.poll(0), {'bin', ''})
+        self.assertEqual(watcher.poll(0), set())
+
+    def test_inotify_watcher(self):
+        try:
+            watcher = InotifyWatcher(self.tree)
+        except OSError as e:
+            self.skipTest(f"inotify unavailable: {e}")
+        try:
+            self.write('bin/lib/core.dll', b'w')
+            self.assertEqual(watcher.poll(1), {'bin/lib'})
+            os.makedirs(os.path.join(self.tree, 'new', 'sub'))
+            self.assertEqual(watcher.poll(1), {''})
+            self.write('new/sub/added.txt', b'new')
+            self.assertEqual(watcher.poll(1), {'new/sub'})
+            os.rename(os.path.join(self.tree, 'new'), os.path.join(self.tree, 'bin', 'moved'))
+            self.assertEqual(watcher.poll(1), {'', 'bin'})
+            self.write('bin/moved/sub/again.txt', b'again')
+            self.assertEqual(watcher.poll(1), {'bin/moved/sub'})
+        finally:
+            watcher.close()
+
+    def test_watch_applies_batches(self):
+        stop = threading.Event()
+        batches = []
+
+        def apply_batch(dirty, manifest):
+            batches.append(dirty)
+            stop.set()
+            return manifest
+
+        thread = threading.Thread(target=watch, args=(self.tree, self.manifest, apply_batch),
+                                  kwargs={'use_inotify': False, 'interval': 0.05, 'settle': 0.05, 'stop': stop})
+        thread.start()
+        self.write('docs/more.txt', b'more')
+        thread.join(10)
+        stop.set()
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(batches, [{'docs'}])
+
+if __name__ == '__main__':
+    unittest.main()
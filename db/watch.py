@@ -0,0 +1,278 @@
+"""
+Watch mode: keep a scanned product in sync with its source tree.
+
+Watchers report dirty directories, i.e. directories whose entries or files
+changed, as manifest keys ('/' separated paths relative to the root, '' for
+the root itself):
+
+InotifyWatcher
+    Linux inotify (through ctypes), one watch per directory.  Sees every
+    change, including files rewritten in place.  A queue overflow reports
+    the whole tree as dirty.
+PollingWatcher
+    Stats every directory of the manifest each interval and reports the ones
+    whose mtime moved.  Works everywhere, but like --prune it does not see
+    files rewritten in place.
+
+watch() gathers dirty directories until the tree has been quiet for a
+moment and hands each batch to a callback that applies it in one small
+transaction: only the dirty directories are listed again (everything else is
+pruned through DirtyManifest), so a batch costs one stat per directory plus
+the work for what actually changed.
+"""
+
+import os
+import sys
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+
+from db.manifest import directory_key, directory_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 2.0   # Seconds between polls (and the idle wait with inotify)
+DEFAULT_SETTLE = 0.5     # Quiet time that closes a batch
+DEFAULT_MAX_BATCH = 1000  # Dirty directories that close a batch regardless
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_CREATE | _IN_DELETE | _IN_ONLYDIR | _IN_DONT_FOLLOW)
+_EVENT = struct.Struct('iIII')
+
+
+def _child_key(key, name):
+    return f"{key}/{name}" if key else name
+
+
+class DirtyManifest(object):
+    """Manifest view for the walk that treats every directory as unchanged except the dirty ones.
+
+    Directories the manifest does not know (new ones) are listed as well.
+    """
+
+    def __init__(self, manifest, dirty):
+        self.manifest = manifest
+        self.dirty = dirty
+
+    def unchanged(self, rel_path, mtime_ns):
+        key = directory_key(rel_path)
+        return key not in self.dirty and key in self.manifest.entries
+
+    def subdirectories(self, rel_path):
+        return self.manifest.subdirectories(rel_path)
+
+
+class PollingWatcher(object):
+    """Finds dirty directories by comparing directory mtimes with the manifest."""
+
+    def __init__(self, root, manifest, interval=DEFAULT_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.update(manifest)
+
+    def update(self, manifest):
+        """Start from the mtimes of a freshly applied manifest."""
+        self._mtimes = {key: entry[0] for key, entry in manifest.entries.items()}
+
+    def poll(self, timeout):
+        """Wait timeout seconds, then return the directories changed since the last poll."""
+        time.sleep(timeout)
+        dirty = set()
+        for key, mtime_ns in list(self._mtimes.items()):
+            try:
+                current = os.stat(directory_path(self.root, key), follow_symlinks=False).st_mtime_ns
+            except OSError:
+                # Gone: its parent changed too and will be listed again
+                del self._mtimes[key]
+                dirty.add(key.rpartition('/')[0])
+                continue
+            if current != mtime_ns:
+                self._mtimes[key] = current
+                dirty.add(key)
+        return dirty
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Finds dirty directories from inotify events.  Raises OSError where inotify is unavailable."""
+
+    def __init__(self, root, rules=None):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.root = root
+        self.rules = rules
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+        self._keys = {}
+        try:
+            self._add_tree('')
+        except OSError:
+            self.close()
+            raise
+        logger.info(f"Watching {len(self._keys)} directories with inotify")
+
+    def _add(self, key):
+        path = directory_path(self.root, key)
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return False  # Already gone again
+            if err == errno.ENOSPC:
+                raise OSError(err, "inotify watch limit reached (raise fs.inotify.max_user_watches)")
+            raise OSError(err, f"inotify_add_watch {path}: {os.strerror(err)}")
+        self._keys[wd] = key
+        return True
+
+    def _add_tree(self, key):
+        stack = [key]
+        while stack:
+            key = stack.pop()
+            if not self._add(key):
+                continue
+            try:
+                with os.scandir(directory_path(self.root, key)) as it:
+                    for entry in it:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                        child = _child_key(key, entry.name)
+                        if self.rules is None or not self.rules.excludes_directory(child, entry.name):
+                            stack.append(child)
+            except OSError as e:
+                logger.warning(f"Unable to list {key or self.root}: {e}")
+
+    def _forget(self, key):
+        # The watches stay active; if the directory moved within the tree
+        # IN_MOVED_TO re-adds it and inotify hands back the same descriptors
+        prefix = key + '/'
+        for wd, watched in list(self._keys.items()):
+            if watched == key or watched.startswith(prefix):
+                del self._keys[wd]
+
+    def update(self, manifest):
+        pass
+
+    def poll(self, timeout):
+        """Return the directories with events within timeout seconds (None after a queue overflow)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 256 * 1024)
+        dirty = set()
+        overflow = False
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0'))
+            offset += _EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & _IN_IGNORED:
+                self._keys.pop(wd, None)
+                continue
+            key = self._keys.get(wd)
+            if key is None:
+                continue
+            dirty.add(key)
+            if mask & _IN_ISDIR and name:
+                child = _child_key(key, name)
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    if self.rules is None or not self.rules.excludes_directory(child, name):
+                        self._add_tree(child)
+                elif mask & _IN_MOVED_FROM:
+                    self._forget(child)
+        if overflow:
+            logger.warning("inotify queue overflowed, rescanning the whole tree")
+            return None
+        return dirty
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def open_watcher(root, manifest, rules=None, use_inotify=True, interval=DEFAULT_INTERVAL):
+    """Return an InotifyWatcher if possible, otherwise a PollingWatcher."""
+    if use_inotify:
+        try:
+            return InotifyWatcher(root, rules)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable ({e}), polling every {interval}s instead")
+    return PollingWatcher(root, manifest, interval)
+
+
+def watch(root, manifest, apply_batch, rules=None, use_inotify=True, interval=DEFAULT_INTERVAL,
+          settle=DEFAULT_SETTLE, max_batch=DEFAULT_MAX_BATCH, stop=None):
+    """
+    Apply changes under root until stop is set (or KeyboardInterrupt).
+
+    Args:
+        root: The scanned directory
+        manifest: DirectoryManifest of the last scan of root
+        apply_batch: Callable(dirty, manifest) applying one batch and returning the
+            new manifest; dirty is a set of directory keys, or None to rescan the
+            whole tree
+        rules: ScanRules (excluded directories are not watched)
+        use_inotify: Try inotify before falling back to polling
+        interval: Polling interval in seconds
+        settle: Quiet time in seconds that closes a batch
+        max_batch: Number of dirty directories that closes a batch early
+        stop: threading.Event ending the loop
+    """
+    stop = stop or threading.Event()
+    watcher = open_watcher(root, manifest, rules, use_inotify, interval)
+    pending = set()
+    try:
+        while not stop.is_set():
+            dirty = watcher.poll(interval)
+            if dirty is not None:
+                dirty |= pending
+                if not dirty:
+                    continue
+            # Let a burst of changes settle into one batch
+            while dirty is not None and len(dirty) < max_batch and not stop.is_set():
+                more = watcher.poll(settle)
+                if more is None:
+                    dirty = None
+                elif not more:
+                    break
+                else:
+                    dirty |= more
+            try:
+                manifest = apply_batch(dirty, manifest)
+            except Exception as e:
+                # Keep the directories for the next batch
+                logger.error(f"Unable to apply changes, will retry: {e}")
+                pending = dirty if dirty is not None else set(manifest.entries)
+                stop.wait(interval)
+                continue
+            pending = set()
+            watcher.update(manifest)
+    except KeyboardInterrupt:
+        logger.info("Watch stopped")
+    finally:
+        watcher.close()
@@ -1,13 +1,17 @@
 import sys
 import os
+import argparse
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from core.state import InstallerState
 from actions.set_env import SetEnvVariables
 from actions.query_db import QueryDBAction
 from actions.msi import InstallerBuildMSIAction
+from actions.validate_msi import ValidateMSIAction
 from actions.create_cabs import CreateCabsAction
 from actions.make_pfw import InstallerMakePFWAction
+from actions.make_patch import InstallerMakePatchAction
+from actions.fingerprint import BuildFingerprintAction, RecordBuildAction
 
 # --- Options/configs setup ---
 class Options:
@@ -23,6 +27,27 @@ class Options:
     project_name = 'ExampleApp'
     # Output directory configuration
     output_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'out'))
+    # Processes compressing cabinet folders (None for one per CPU)
+    cab_workers = None
+    # Largest cabinet in bytes before the payload spans several (None for the 2 GB default)
+    cab_max_size = None
+    # Directory of the compression cache shared between builds (None to disable) and its size in bytes
+    cab_cache_dir = None
+    cab_cache_size = None
+    # Directory to snapshot the payload into before the cabinets are written (None to read root_path)
+    stage_dir = None
+    # Extractor executable put in front of the self-extracting package (None for a bare package)
+    pfw_stub = None
+    # Compression of the self-extracting package: 'deflate', 'lzma' or 'store'
+    pfw_compression = 'deflate'
+    # Output directory of an earlier build to make a patch from (None for no patch)
+    patch_baseline = None
+    # Unix time stamped into the MSI, cabinets and packages (None: SOURCE_DATE_EPOCH if set)
+    build_timestamp = None
+    # Rebuild even when the inputs match the last build's fingerprint
+    force_rebuild = False
+    # Update the previous MSI and cabinets in place when only file rows changed
+    incremental = False
     # Add more as needed for your actions
 
 # Ensure output directory exists
@@ -30,7 +55,47 @@ if not os.path.exists(Options.output_dir):
     os.makedirs(Options.output_dir)
     print(f"Created output directory: {Options.output_dir}")
 
+parser = argparse.ArgumentParser(description='Build the installer')
+parser.add_argument('--cab-workers', type=int, default=Options.cab_workers,
+                    help='Processes compressing cabinet folders (default: one per CPU)')
+parser.add_argument('--cab-max-size', type=int, metavar='MB',
+                    help='Largest cabinet before the payload spans several (default: 2 GB)')
+parser.add_argument('--cab-cache', metavar='DIR', default=Options.cab_cache_dir,
+                    help='Reuse compressed cabinet folders from this cache directory')
+parser.add_argument('--cab-cache-size', type=int, metavar='MB',
+                    help='Size bound of the compression cache (default: 10 GB)')
+parser.add_argument('--stage-dir', metavar='DIR', default=Options.stage_dir,
+                    help='Snapshot the payload into this directory (reflinks or hard links where possible) '
+                         'before writing the cabinets')
+parser.add_argument('--pfw-stub', metavar='EXE', default=Options.pfw_stub,
+                    help='Extractor executable to put in front of the self-extracting package')
+parser.add_argument('--pfw-compression', choices=('deflate', 'lzma', 'store'), default=Options.pfw_compression,
+                    help='Compression of the self-extracting package (default: deflate)')
+parser.add_argument('--patch-baseline', metavar='DIR', default=Options.patch_baseline,
+                    help='Output directory of an earlier build to make a patch package from')
+parser.add_argument('--build-timestamp', type=int, metavar='SECONDS', default=Options.build_timestamp,
+                    help='Unix time to date the build outputs with, for byte-identical rebuilds '
+                         '(default: SOURCE_DATE_EPOCH)')
+parser.add_argument('--force-rebuild', action='store_true',
+                    help='Rebuild the MSI, cabinets and package even when the inputs did not change')
+parser.add_argument('--incremental', action='store_true',
+                    help='Update the MSI and cabinets of the last build in place of rewriting them')
+cli = parser.parse_args()
+
 opts = Options()
+opts.cab_workers = cli.cab_workers
+if cli.cab_max_size:
+    opts.cab_max_size = cli.cab_max_size * 1024 * 1024
+opts.cab_cache_dir = cli.cab_cache
+if cli.cab_cache_size:
+    opts.cab_cache_size = cli.cab_cache_size * 1024 * 1024
+opts.stage_dir = cli.stage_dir
+opts.pfw_stub = cli.pfw_stub
+opts.pfw_compression = cli.pfw_compression
+opts.patch_baseline = cli.patch_baseline
+opts.build_timestamp = cli.build_timestamp
+opts.force_rebuild = cli.force_rebuild
+opts.incremental = cli.incremental
 args = []
 configs = None  # Load or set as needed
 
@@ -41,16 +106,24 @@ state = InstallerState(opts, args, configs)
 state.goals = [
     'setenv',
     'query_db',
+    'fingerprint',
     'create_cabs',
     'buildmsi',
-    'make_pfw'
+    'validate_msi',
+    'make_pfw',
+    'record_build',
+    'make_patch'
 ]
 state.goal_map = {
     'setenv': SetEnvVariables,
     'query_db': QueryDBAction,
+    'fingerprint': BuildFingerprintAction,
     'buildmsi': InstallerBuildMSIAction,
     'create_cabs': CreateCabsAction,
-    'make_pfw': InstallerMakePFWAction
+    'validate_msi': ValidateMSIAction,
+    'make_pfw': InstallerMakePFWAction,
+    'record_build': RecordBuildAction,
+    'make_patch': InstallerMakePatchAction
 }
 
 state.finalize_goals()